@@ -1 +1,7 @@
 from XSUI.detectors import au
+from XSUI.detectors.registry import (
+    detector_digest,
+    get_detector,
+    get_detector_mask,
+    precompute_detector_masks,
+)
@@ -0,0 +1,149 @@
+"""
+A process-wide registry of detector instances and their pixel masks.
+
+Constructing a `pyFAI` detector and computing its module gap mask is repeated
+on every call to `pyFAI.detectors.detector_factory`. The registry builds each
+detector once, and keeps its mask as a read-only array which is also persisted
+to disk, so that callbacks and batch jobs share the same instances.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pyFAI
+from pyFAI.detectors import Detector, detector_factory
+
+from XSUI.detectors.au import SAXS_WAXS
+
+BEAMLINE_DETECTORS: dict[str, type[Detector]] = {
+    "SAXS_WAXS": SAXS_WAXS,
+}
+"""The beamline detectors defined by XSUI, whose masks are precomputed."""
+
+MASK_CACHE_DIR = os.path.join(tempfile.gettempdir(), "XSUI_detector_masks")
+"""The directory where computed detector masks are persisted."""
+
+_detectors: dict[str, Detector] = {}
+_masks: dict[str, np.ndarray | None] = {}
+_lock = threading.RLock()
+
+
+def get_detector(name: str) -> Detector:
+    """
+    Get the shared instance of a detector.
+
+    The instance is shared between all callers, and should not be modified.
+
+    Parameters
+    ----------
+    name : str
+        The name of a beamline detector (see `BEAMLINE_DETECTORS`) or of a
+        detector known to `pyFAI.detectors.detector_factory`.
+
+    Returns
+    -------
+    Detector
+        The detector instance.
+    """
+    with _lock:
+        detector = _detectors.get(name)
+        if detector is None:
+            if name in BEAMLINE_DETECTORS:
+                detector = BEAMLINE_DETECTORS[name]()
+            else:
+                detector = detector_factory(name)
+            _detectors[name] = detector
+        return detector
+
+
+def detector_digest(detector: Detector) -> str:
+    """
+    Hash the class, shape and configuration of a detector.
+
+    Parameters
+    ----------
+    detector : Detector
+        The detector.
+
+    Returns
+    -------
+    str
+        A hex digest, changing whenever the definition of the detector changes.
+    """
+    definition = {
+        "class": f"{type(detector).__module__}.{type(detector).__qualname__}",
+        "shape": list(detector.shape) if detector.shape is not None else None,
+        "config": detector.get_config(),
+    }
+    encoded = json.dumps(definition, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+def _mask_path(name: str) -> str:
+    """The path of the persisted mask of a detector, by `pyFAI` version and digest."""
+    digest = detector_digest(get_detector(name))
+    return os.path.join(MASK_CACHE_DIR, f"{name}-pyFAI{pyFAI.version}-{digest}.npy")
+
+
+def get_detector_mask(name: str) -> np.ndarray | None:
+    """
+    Get the read-only mask of a detector.
+
+    The mask is loaded (memory mapped) from disk if it has been persisted
+    before, and otherwise computed by the detector and persisted.
+
+    Parameters
+    ----------
+    name : str
+        The name of the detector, see `get_detector`.
+
+    Returns
+    -------
+    np.ndarray | None
+        The read-only detector mask, or None if the detector defines no mask.
+    """
+    with _lock:
+        if name in _masks:
+            return _masks[name]
+        path = _mask_path(name)
+        if os.path.exists(path):
+            mask = np.load(path, mmap_mode="r")
+        else:
+            mask = get_detector(name).mask
+            if mask is not None:
+                # A copy, so the mask of the shared detector is left writeable.
+                mask = np.array(mask, order="C")
+                os.makedirs(MASK_CACHE_DIR, exist_ok=True)
+                # Write atomically so that concurrent processes never read a partial file.
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, mask, allow_pickle=False)
+                os.replace(tmp_path, path)
+                mask.flags.writeable = False
+        _masks[name] = mask
+        return mask
+
+
+def precompute_detector_masks(names: list[str] | None = None) -> dict[str, str]:
+    """
+    Compute and persist the masks of detectors ahead of use.
+
+    Parameters
+    ----------
+    names : list[str] | None, optional
+        The detector names, by default the `BEAMLINE_DETECTORS`.
+
+    Returns
+    -------
+    dict[str, str]
+        The path of the persisted mask of each detector that defines a mask.
+    """
+    paths = {}
+    for name in BEAMLINE_DETECTORS if names is None else names:
+        if get_detector_mask(name) is not None:
+            paths[name] = _mask_path(name)
+    return paths
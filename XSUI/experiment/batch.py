@@ -0,0 +1,506 @@
+"""
+Parallel reduction of every frame in an experiment directory.
+
+Files matching a glob pattern are integrated by a pool of worker processes.
+Each worker builds (and warms) a single cached integrator for the configuration
+when it starts, so the setup cost of the integration engine is paid once per
+worker rather than once per frame. Files are split into tasks of at most
+`FRAMES_PER_TASK` frames, so the frames of a multi-frame (HDF5 or CBF master)
+file are shared between the workers, and only a chunk of results is held in
+memory at once. Results are yielded in completion order and can be streamed to
+an HDF5 output file as they arrive.
+"""
+
+import glob
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+
+import h5py
+import numpy as np
+
+from XSUI.experiment.config_base import ConfigBase
+from XSUI.geometry.integrator import CachedIntegrator, get_integrator, worker_pool
+from XSUI.storage.frames import open_frames
+
+REDUCTION_DIR = os.environ.get(
+    "XSUI_REDUCTION_DIR", os.path.join(tempfile.gettempdir(), "XSUI_reductions")
+)
+"""The directory of reduction outputs served by the web application."""
+
+FRAMES_PER_TASK = 16
+"""The maximum number of frames of a file reduced by a single worker task."""
+
+FrameIndex = Callable[[str, int, int, np.ndarray, dict | None], object]
+"""
+Called with the `(path, frame, nframes, data, header)` of each frame as it is read,
+such as `XSUI.webapp.fastapi.models.FrameIndexer` to fill the image index.
+"""
+
+
+@dataclass
+class ReducedFrame:
+    """
+    The integration results of a single frame.
+
+    Attributes
+    ----------
+    path : str
+        The path of the image file.
+    frame : int
+        The index of the frame within the file.
+    radial : np.ndarray | None
+        The radial bin centres of the 1D integration.
+    intensity : np.ndarray | None
+        The 1D integrated intensity.
+    sigma : np.ndarray | None
+        The uncertainty of the 1D integrated intensity, if available.
+    radial_2d : np.ndarray | None
+        The radial bin centres of the 2D integration.
+    azimuthal : np.ndarray | None
+        The azimuthal bin centres of the 2D integration.
+    intensity_2d : np.ndarray | None
+        The 2D (azimuthal, radial) integrated intensity.
+    index_error : str | None
+        The error message if the frame failed to index (see `FrameIndex`).
+    """
+
+    path: str
+    frame: int
+    radial: np.ndarray | None = None
+    intensity: np.ndarray | None = None
+    sigma: np.ndarray | None = None
+    radial_2d: np.ndarray | None = None
+    azimuthal: np.ndarray | None = None
+    intensity_2d: np.ndarray | None = None
+    index_error: str | None = None
+
+
+@dataclass
+class BatchProgress:
+    """
+    The progress of a batch reduction.
+
+    Attributes
+    ----------
+    files_done : int
+        The number of files reduced.
+    files_total : int
+        The total number of files.
+    frames_done : int
+        The number of frames reduced.
+    elapsed : float
+        The time since the start of the reduction, in seconds.
+    errors : dict[str, str]
+        The error message of each file that failed to reduce.
+    index_errors : dict[str, str]
+        The error message of each frame (`path:frame`) that failed to index.
+    """
+
+    files_done: int = 0
+    files_total: int = 0
+    frames_done: int = 0
+    elapsed: float = 0.0
+    errors: dict[str, str] = field(default_factory=dict)
+    index_errors: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def frames_per_second(self) -> float:
+        """The throughput of the reduction."""
+        return self.frames_done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> float:
+        """The estimated time remaining, in seconds, assuming constant throughput."""
+        if self.files_done == 0:
+            return float("nan")
+        return self.elapsed * (self.files_total - self.files_done) / self.files_done
+
+    def __str__(self):
+        status = (
+            f"{self.files_done}/{self.files_total} files, {self.frames_done} frames, "
+            f"{self.frames_per_second:.1f} frames/s, ETA {self.eta:.0f} s"
+        )
+        if self.index_errors:
+            status += f", {len(self.index_errors)} frames not indexed"
+        return status
+
+
+def print_progress(progress: BatchProgress) -> None:
+    """Print the progress of a batch reduction."""
+    print(f"Batch reduction: {progress}")
+
+
+#################################################
+#### Worker processes
+#################################################
+_worker_integrator: CachedIntegrator | None = None
+"""The integrator of a worker process, created by `_init_worker`."""
+
+_worker_dims: int = 1
+_worker_index: FrameIndex | None = None
+
+
+def _init_worker(
+    config: ConfigBase, integrator_kwargs: dict, dims: int, index: FrameIndex | None
+) -> None:
+    """Build and warm the integrator of a worker process."""
+    global _worker_integrator, _worker_dims, _worker_index
+    _worker_dims = dims
+    _worker_index = index
+    _worker_integrator = get_integrator(config, **integrator_kwargs).warm(dims)
+
+
+def reduce_file(
+    integrator: CachedIntegrator,
+    path: str,
+    dims: int = 1,
+    start: int = 0,
+    stop: int | None = None,
+    index: FrameIndex | None = None,
+) -> list[ReducedFrame]:
+    """
+    Integrate the frames of an image file.
+
+    Parameters
+    ----------
+    integrator : CachedIntegrator
+        The integrator of the scattering configuration.
+    path : str
+        The path of the image file.
+    dims : int, optional
+        Integrate to 1D (`1`), 2D (`2`) or both (`3`), by default 1.
+    start : int, optional
+        The index of the first frame, by default 0.
+    stop : int | None, optional
+        The index after the last frame, by default the number of frames.
+    index : FrameIndex | None, optional
+        Called with each frame as it is read, by default None (see `FrameIndex`).
+
+    Returns
+    -------
+    list[ReducedFrame]
+        The integration results of each frame in the range.
+    """
+    return _reduce_frames(integrator, path, dims, start, stop, index)[0]
+
+
+def _reduce_frames(
+    integrator: CachedIntegrator,
+    path: str,
+    dims: int,
+    start: int,
+    stop: int | None,
+    index: FrameIndex | None = None,
+) -> tuple[list[ReducedFrame], int]:
+    """Integrate a range of frames of a file, also returning its number of frames."""
+    results = []
+    with open_frames(path, cache_size=0) as frames:
+        nframes = len(frames)
+        header = frames.header if index is not None else None
+        for i in range(start, nframes if stop is None else min(stop, nframes)):
+            frame = frames[i]
+            result = ReducedFrame(path, i)
+            if index is not None:
+                try:
+                    index(path, i, nframes, frame, header)
+                except Exception as e:
+                    # The index is secondary to the reduction, so never fails it.
+                    result.index_error = str(e)
+                    print(f"Could not index frame {i} of {path}: {e}")
+            if dims & 1:
+                res = integrator.integrate1d(frame)
+                result.radial = res.radial
+                result.intensity = res.intensity
+                result.sigma = res.sigma
+            if dims & 2:
+                res = integrator.integrate2d(frame)
+                result.radial_2d = res.radial
+                result.azimuthal = res.azimuthal
+                result.intensity_2d = res.intensity
+            results.append(result)
+    return results, nframes
+
+
+def _reduce_task(path: str, start: int, stop: int) -> tuple[list[ReducedFrame], int]:
+    """Integrate a range of frames of a file with the worker integrator."""
+    return _reduce_frames(
+        _worker_integrator, path, _worker_dims, start, stop, _worker_index
+    )
+
+
+#################################################
+#### Batch reduction
+#################################################
+class BatchReduction:
+    """
+    A parallel reduction of the image files matching a glob pattern.
+
+    Parameters
+    ----------
+    config : ConfigBase
+        The scattering configuration, defining the detector and PONI geometry.
+    pattern : str
+        The glob pattern of the image files, e.g. `".../exp2/images/*.tif"`.
+        Recursive `**` patterns are supported.
+    mask : np.ndarray | None, optional
+        The mask of invalid pixels, by default None.
+    npt : int, optional
+        The number of radial bins, by default 1000.
+    unit : str, optional
+        The radial unit, by default "q_nm^-1".
+    npt_azim : int, optional
+        The number of azimuthal bins of 2D integrations, by default 360.
+    dims : int, optional
+        Integrate to 1D (`1`), 2D (`2`) or both (`3`), by default 1.
+    workers : int | None, optional
+        The number of worker processes, by default the number of CPUs.
+    frames_per_task : int, optional
+        The maximum number of frames of a worker task, by default `FRAMES_PER_TASK`.
+    index : FrameIndex | None, optional
+        Called in the worker processes with each frame as it is read, such as a
+        `FrameIndexer` to fill the image index. Must be picklable. By default None.
+    """
+
+    def __init__(
+        self,
+        config: ConfigBase,
+        pattern: str,
+        mask: np.ndarray | None = None,
+        npt: int = 1000,
+        unit: str = "q_nm^-1",
+        npt_azim: int = 360,
+        dims: int = 1,
+        workers: int | None = None,
+        frames_per_task: int = FRAMES_PER_TASK,
+        index: FrameIndex | None = None,
+    ):
+        if dims not in (1, 2, 3):
+            raise ValueError(f"`dims` must be 1, 2 or 3, not {dims}.")
+        self.config = config
+        self.pattern = pattern
+        self.files = sorted(
+            p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p)
+        )
+        self.integrator_kwargs = {
+            "mask": mask,
+            "npt": npt,
+            "unit": unit,
+            "npt_azim": npt_azim,
+        }
+        self.dims = dims
+        self.workers = workers or os.cpu_count() or 1
+        self.frames_per_task = max(int(frames_per_task), 1)
+        self.index = index
+        self.progress = BatchProgress(files_total=len(self.files))
+
+    def __repr__(self):
+        return f"<BatchReduction pattern={self.pattern} files={len(self.files)}>"
+
+    def __iter__(self) -> Iterator[ReducedFrame]:
+        return self.results()
+
+    def results(
+        self,
+        progress: Callable[[BatchProgress], None] | None = None,
+        report_every: float = 5.0,
+    ) -> Iterator[ReducedFrame]:
+        """
+        Reduce the files, yielding the frames in completion order.
+
+        The first task of each file also counts its frames, and the remaining
+        frames are then submitted as further tasks, so the number of frames of
+        a file is never read ahead of its reduction.
+
+        Parameters
+        ----------
+        progress : Callable[[BatchProgress], None] | None, optional
+            Called with the progress of the reduction at most every `report_every`
+            seconds, and once on completion. By default no progress is reported.
+        report_every : float, optional
+            The minimum interval between progress reports, by default 5 seconds.
+
+        Yields
+        ------
+        ReducedFrame
+            The integration results of each frame.
+        """
+        self.progress = BatchProgress(files_total=len(self.files))
+        start = last_report = time.perf_counter()
+        step = self.frames_per_task
+        with worker_pool(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.config, self.integrator_kwargs, self.dims, self.index),
+        ) as pool:
+            pending = {
+                pool.submit(_reduce_task, path, 0, step): (path, 0)
+                for path in self.files
+            }
+            # The number of unfinished tasks of each file.
+            remaining = dict.fromkeys(self.files, 1)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, first = pending.pop(future)
+                    try:
+                        frames, nframes = future.result()
+                    except Exception as e:
+                        self.progress.errors[path] = str(e)
+                        frames, nframes = [], 0
+                    if first == 0:
+                        # Share the remaining frames of the file between the workers.
+                        for i in range(step, nframes, step):
+                            future = pool.submit(_reduce_task, path, i, i + step)
+                            pending[future] = (path, i)
+                            remaining[path] += 1
+                    remaining[path] -= 1
+                    if remaining[path] == 0:
+                        self.progress.files_done += 1
+                    self.progress.frames_done += len(frames)
+                    for result in frames:
+                        if result.index_error is not None:
+                            key = f"{result.path}:{result.frame}"
+                            self.progress.index_errors[key] = result.index_error
+                    now = time.perf_counter()
+                    self.progress.elapsed = now - start
+                    yield from frames
+                    if progress is not None and now - last_report >= report_every:
+                        progress(self.progress)
+                        last_report = now
+        self.progress.elapsed = time.perf_counter() - start
+        if progress is not None:
+            progress(self.progress)
+
+    def run(
+        self,
+        output: str,
+        progress: Callable[[BatchProgress], None] | None = print_progress,
+        report_every: float = 5.0,
+    ) -> BatchProgress:
+        """
+        Reduce the files, streaming the results to an HDF5 file.
+
+        Parameters
+        ----------
+        output : str
+            The path of the output HDF5 file.
+        progress : Callable[[BatchProgress], None] | None, optional
+            Called with the progress of the reduction, by default `print_progress`.
+        report_every : float, optional
+            The minimum interval between progress reports, by default 5 seconds.
+
+        Returns
+        -------
+        BatchProgress
+            The final progress, including the throughput and any file errors.
+        """
+        with ReductionWriter(output) as writer:
+            for result in self.results(progress, report_every):
+                writer.append(result)
+        return self.progress
+
+
+class ReductionWriter:
+    """
+    An HDF5 store of reduced frames, appended in completion order.
+
+    Each frame is a row of the `intensity` (1D) and/or `intensity_2d` datasets,
+    with its source file and frame index in the `source` and `frame` datasets.
+    The shared axes are written once: `radial` for the 1D intensities, and
+    `radial_2d` and `azimuthal` for the 2D intensities.
+
+    Parameters
+    ----------
+    path : str
+        The path of the output HDF5 file, which is overwritten.
+    flush_every : int, optional
+        Flush the file to disk every `flush_every` frames, by default 100.
+    """
+
+    def __init__(self, path: str, flush_every: int = 100):
+        self.path = path
+        self.flush_every = flush_every
+        self._file: h5py.File | None = None
+        self._count = 0
+
+    def __enter__(self) -> "ReductionWriter":
+        self._file = h5py.File(self.path, "w")
+        self._file.create_dataset(
+            "source", shape=(0,), maxshape=(None,), dtype=h5py.string_dtype()
+        )
+        self._file.create_dataset("frame", shape=(0,), maxshape=(None,), dtype="i8")
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._file.close()
+
+    def _append_row(self, name: str, row: np.ndarray) -> None:
+        """Append a row to a resizable dataset, creating it on first use."""
+        if name not in self._file:
+            self._file.create_dataset(
+                name,
+                shape=(0, *row.shape),
+                maxshape=(None, *row.shape),
+                dtype=row.dtype,
+                chunks=(1, *row.shape),
+            )
+        ds = self._file[name]
+        ds.resize(self._count + 1, axis=0)
+        ds[self._count] = row
+
+    def append(self, result: ReducedFrame) -> None:
+        """Append the results of a frame to the store."""
+        if "radial" not in self._file and result.radial is not None:
+            self._file["radial"] = result.radial
+        if "radial_2d" not in self._file and result.radial_2d is not None:
+            self._file["radial_2d"] = result.radial_2d
+        if "azimuthal" not in self._file and result.azimuthal is not None:
+            self._file["azimuthal"] = result.azimuthal
+        for name in ("source", "frame"):
+            self._file[name].resize(self._count + 1, axis=0)
+        self._file["source"][self._count] = result.path
+        self._file["frame"][self._count] = result.frame
+        if result.intensity is not None:
+            self._append_row("intensity", np.asarray(result.intensity))
+        if result.sigma is not None:
+            self._append_row("sigma", np.asarray(result.sigma))
+        if result.intensity_2d is not None:
+            self._append_row("intensity_2d", np.asarray(result.intensity_2d))
+        self._count += 1
+        if self._count % self.flush_every == 0:
+            self._file.flush()
+
+
+def reduce_directory(
+    config: ConfigBase,
+    pattern: str,
+    output: str,
+    progress: Callable[[BatchProgress], None] | None = print_progress,
+    **kwargs,
+) -> BatchProgress:
+    """
+    Reduce every image file matching a glob pattern to an HDF5 file.
+
+    Parameters
+    ----------
+    config : ConfigBase
+        The scattering configuration, defining the detector and PONI geometry.
+    pattern : str
+        The glob pattern of the image files.
+    output : str
+        The path of the output HDF5 file.
+    progress : Callable[[BatchProgress], None] | None, optional
+        Called with the progress of the reduction, by default `print_progress`.
+    **kwargs
+        Further arguments of `BatchReduction`, e.g. `mask`, `npt`, `dims`, `workers`.
+
+    Returns
+    -------
+    BatchProgress
+        The final progress, including the throughput and any file errors.
+    """
+    return BatchReduction(config, pattern, **kwargs).run(output, progress)
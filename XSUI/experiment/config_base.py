@@ -14,3 +14,13 @@ class ConfigBase(metaclass=ABCMeta):
     calibrant: pyFAI.calibrant.Calibrant | None = None
     detector: pyFAI.detectors.Detector | None = None
     poni: pyFAI.io.ponifile.PoniFile | None = None
+
+    def integrator(self, mask=None, npt: int = 1000, unit: str = "q_nm^-1", **kwargs):
+        """
+        Get the cached azimuthal integrator of this configuration.
+
+        See `XSUI.geometry.integrator.get_integrator` for the parameters.
+        """
+        from XSUI.geometry.integrator import get_integrator
+
+        return get_integrator(self, mask=mask, npt=npt, unit=unit, **kwargs)
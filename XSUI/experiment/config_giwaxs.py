@@ -1,2 +1,55 @@
-class ConfigGIWAXS:
-    pass
+from dataclasses import dataclass
+from XSUI.experiment.config_base import ConfigBase
+
+
+@dataclass
+class ConfigGIWAXS(ConfigBase):
+    """
+    Scattering configuration of a grazing-incidence (GIWAXS) measurement.
+
+    Extends the detector geometry of `ConfigBase` with the sample angles, as
+    stored for each `ImageGIWAXS`.
+    """
+
+    angle_incidence: float = 0.0
+    """The incidence angle of the beam on the sample, in degrees."""
+    angle_tilt: float = 0.0
+    """The tilt of the sample about the beam, in degrees."""
+    orientation: int = 1
+    """The EXIF-like orientation (1-8) of the sample on the detector."""
+
+    @classmethod
+    def from_image(cls, config: ConfigBase, image) -> "ConfigGIWAXS":
+        """
+        The configuration of a stored GIWAXS image.
+
+        Parameters
+        ----------
+        config : ConfigBase
+            The configuration defining the calibrant, detector and geometry.
+        image : XSUI.webapp.fastapi.models.ImageGIWAXS
+            The image, defining the sample angles.
+
+        Returns
+        -------
+        ConfigGIWAXS
+            The configuration of the image.
+        """
+        return cls(
+            calibrant=config.calibrant,
+            detector=config.detector,
+            poni=config.poni,
+            angle_incidence=image.angle_incidence,
+            angle_tilt=image.angle_tilt,
+            orientation=image.orientation or 1,
+        )
+
+    def remapper(self, mask=None, npt: tuple[int, int] = (500, 500), **kwargs):
+        """
+        Get the cached (q_ip, q_oop) remapper of this configuration.
+
+        See `XSUI.geometry.giwaxs.get_remapper` for the parameters.
+        """
+        from XSUI.geometry.giwaxs import get_remapper
+
+        return get_remapper(self, mask=mask, npt=npt, **kwargs)
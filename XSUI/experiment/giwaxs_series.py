@@ -0,0 +1,485 @@
+"""
+Parallel remapping of a GIWAXS series, such as an incidence angle scan.
+
+The frames of a series are grouped by their sample angles, snapped to a
+tolerance, so that frames at the same (or nearly the same) incidence and tilt
+share a single remapping matrix (see `XSUI.geometry.giwaxs`), and each group is
+remapped as a stack with one sparse matrix product. Groups are remapped by a
+pool of worker processes, each of which caches the matrices it builds, and the
+results are written to a (frame, q_oop, q_ip) dataset of an HDF5 file as they
+arrive, so the series is never held in memory at once.
+"""
+
+import dataclasses
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+
+import h5py
+import numpy as np
+
+from XSUI.experiment.config_giwaxs import ConfigGIWAXS
+from XSUI.geometry.giwaxs import q_sample
+from XSUI.geometry.integrator import integrator_cache, worker_pool
+from XSUI.storage.frames import open_frames
+
+DEFAULT_TOLERANCE = 1e-3
+"""The default tolerance of identical sample angles, in degrees."""
+
+
+@dataclass
+class SeriesFrame:
+    """
+    A frame of a GIWAXS series, and its sample angles.
+
+    The frame is read from `data`, else from the stored `image`, else from frame
+    `frame` of the file `path`.
+
+    Attributes
+    ----------
+    angle_incidence : float
+        The incidence angle, in degrees.
+    angle_tilt : float
+        The tilt of the sample about the beam, in degrees.
+    orientation : int
+        The sample orientation (1-8).
+    path : str | None
+        The path of the image file.
+    frame : int
+        The index of the frame within the file.
+    image : XSUI.webapp.fastapi.models.ImageGIWAXS | None
+        The stored image.
+    data : np.ndarray | None
+        The frame.
+    """
+
+    angle_incidence: float
+    angle_tilt: float = 0.0
+    orientation: int = 1
+    path: str | None = None
+    frame: int = 0
+    image: object | None = None
+    data: np.ndarray | None = None
+
+    @classmethod
+    def from_image(cls, image) -> "SeriesFrame":
+        """The series frame of a stored `ImageGIWAXS`."""
+        return cls(
+            image.angle_incidence,
+            image.angle_tilt,
+            image.orientation or 1,
+            path=image.filename,
+            image=image,
+        )
+
+    @property
+    def source(self) -> str:
+        """A description of the source of the frame."""
+        if self.path is None:
+            return ""
+        return f"{self.path}:{self.frame}" if self.frame else self.path
+
+    def load(self) -> np.ndarray:
+        """Read the frame."""
+        if self.data is not None:
+            return self.data
+        if self.image is not None:
+            return self.image.image
+        if self.path is None:
+            raise ValueError("The series frame has no data, image or path.")
+        with open_frames(self.path, cache_size=0) as frames:
+            return np.array(frames[self.frame])
+
+
+def snap(angle: float, tolerance: float) -> float:
+    """Round an angle to a multiple of the tolerance."""
+    if tolerance <= 0:
+        return float(angle)
+    return round(round(angle / tolerance) * tolerance, 12)
+
+
+@dataclass
+class SeriesProgress:
+    """
+    The progress of a series remapping.
+
+    Attributes
+    ----------
+    frames_done : int
+        The number of frames remapped.
+    frames_total : int
+        The total number of frames.
+    groups : int
+        The number of distinct (snapped) sample angles, i.e. remapping matrices.
+    elapsed : float
+        The time since the start of the remapping, in seconds.
+    errors : dict[str, str]
+        The error message of each frame (or batch of frames) that failed to remap.
+    """
+
+    frames_done: int = 0
+    frames_total: int = 0
+    groups: int = 0
+    elapsed: float = 0.0
+    errors: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def frames_per_second(self) -> float:
+        """The throughput of the remapping."""
+        return self.frames_done / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.frames_done}/{self.frames_total} frames, {self.groups} angles, "
+            f"{self.frames_per_second:.1f} frames/s"
+        )
+
+
+def print_progress(progress: SeriesProgress) -> None:
+    """Print the progress of a series remapping."""
+    print(f"GIWAXS series: {progress}")
+
+
+#################################################
+#### Worker processes
+#################################################
+_worker_config: ConfigGIWAXS | None = None
+_worker_kwargs: dict = {}
+
+
+def _init_worker(config: ConfigGIWAXS, remap_kwargs: dict) -> None:
+    """Set the configuration and remapping parameters of a worker process."""
+    global _worker_config, _worker_kwargs
+    _worker_config = config
+    _worker_kwargs = remap_kwargs
+
+
+def _remap_batch(
+    angles: tuple[float, float, int], frames: list[SeriesFrame]
+) -> tuple[np.ndarray, dict[str, str]]:
+    """
+    Remap a batch of frames of the same sample angles as a single stack.
+
+    Frames which cannot be read are NaN, and their errors are returned by source.
+    """
+    incidence, tilt, orientation = angles
+    config = dataclasses.replace(
+        _worker_config,
+        angle_incidence=incidence,
+        angle_tilt=tilt,
+        orientation=orientation,
+    )
+    remapper = config.remapper(**_worker_kwargs)
+    stack = np.zeros((len(frames), *remapper.shape), dtype=np.float32)
+    errors = {}
+    for i, frame in enumerate(frames):
+        try:
+            stack[i] = frame.load()
+        except Exception as e:
+            errors[frame.source] = str(e)
+    intensity = remapper.remap(stack).intensity
+    for i, frame in enumerate(frames):
+        if frame.source in errors:
+            intensity[i] = np.nan
+    return intensity, errors
+
+
+#################################################
+#### Series
+#################################################
+class GIWAXSSeries:
+    """
+    A parallel remapping of a series of GIWAXS frames onto a common q grid.
+
+    Parameters
+    ----------
+    config : ConfigGIWAXS
+        The configuration, defining the detector and PONI geometry. The sample
+        angles of the configuration are replaced by those of each frame.
+    frames : list[SeriesFrame]
+        The frames of the series.
+    mask : np.ndarray | None, optional
+        The mask of invalid pixels, by default None.
+    npt : tuple[int, int], optional
+        The number of (q_oop, q_ip) bins, by default (500, 500).
+    q_ip_range, q_oop_range : tuple[float, float] | None, optional
+        The ranges of the common grid. By default the ranges of the pixels over
+        all angles of the series.
+    split : str, optional
+        The pixel splitting method (see `GIWAXSRemapper`), by default "bilinear".
+    tolerance : float, optional
+        Frames whose angles agree within this tolerance (in degrees) share a
+        remapping, computed at the snapped angle, by default `DEFAULT_TOLERANCE`.
+    batch_size : int, optional
+        The maximum number of frames remapped as a single stack, by default 16.
+    workers : int | None, optional
+        The number of worker processes, by default the number of CPUs.
+    """
+
+    def __init__(
+        self,
+        config: ConfigGIWAXS,
+        frames: list[SeriesFrame],
+        mask: np.ndarray | None = None,
+        npt: tuple[int, int] = (500, 500),
+        q_ip_range: tuple[float, float] | None = None,
+        q_oop_range: tuple[float, float] | None = None,
+        split: str = "bilinear",
+        tolerance: float = DEFAULT_TOLERANCE,
+        batch_size: int = 16,
+        workers: int | None = None,
+    ):
+        self.config = config
+        self.tolerance = tolerance
+        # Frames are ordered by their snapped angles, the first axis of the
+        # output, so that the frames of each group are consecutive.
+        self.frames = sorted(frames, key=self.angles)
+        self.mask = mask
+        self.npt = tuple(npt)
+        self.split = split
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.q_ip_range = q_ip_range
+        self.q_oop_range = q_oop_range
+        self.progress = SeriesProgress(frames_total=len(self.frames))
+
+    def __repr__(self):
+        return (
+            f"<GIWAXSSeries frames={len(self.frames)} "
+            f"angles={len(self.groups())} npt={self.npt}>"
+        )
+
+    @classmethod
+    def from_images(cls, config: ConfigGIWAXS, images, **kwargs) -> "GIWAXSSeries":
+        """The series of stored `ImageGIWAXS` images."""
+        return cls(
+            config, [SeriesFrame.from_image(image) for image in images], **kwargs
+        )
+
+    def angles(self, frame: SeriesFrame) -> tuple[float, float, int]:
+        """The snapped (incidence, tilt, orientation) of a frame."""
+        return (
+            snap(frame.angle_incidence, self.tolerance),
+            snap(frame.angle_tilt, self.tolerance),
+            int(frame.orientation or 1),
+        )
+
+    def groups(self) -> dict[tuple[float, float, int], list[int]]:
+        """The indices of the frames of each snapped (incidence, tilt, orientation)."""
+        groups = {}
+        for i, frame in enumerate(self.frames):
+            groups.setdefault(self.angles(frame), []).append(i)
+        return groups
+
+    def grid_ranges(self) -> tuple[tuple[float, float], tuple[float, float]]:
+        """
+        The (q_ip, q_oop) ranges of the common grid of the series.
+
+        Unless given, the ranges cover the pixels at every angle of the series,
+        bounded by the pixels at the extreme incidence and tilt angles.
+
+        Returns
+        -------
+        q_ip_range, q_oop_range : tuple[float, float]
+            The ranges of the grid, in nm^-1.
+        """
+        if self.q_ip_range is not None and self.q_oop_range is not None:
+            return self.q_ip_range, self.q_oop_range
+        detector = self.config.detector or self.config.poni.detector
+        ai = integrator_cache.geometry(self.config.poni, detector)
+        valid = None if self.mask is None else ~np.asarray(self.mask, dtype=bool)
+        ip_lo = oop_lo = np.inf
+        ip_hi = oop_hi = -np.inf
+        groups = list(self.groups())
+        extremes = {
+            min(groups),
+            max(groups),
+            min(groups, key=lambda g: g[1]),
+            max(groups, key=lambda g: g[1]),
+        }
+        for angles in extremes:
+            q_ip, q_oop = q_sample(ai, *angles)
+            if valid is not None:
+                q_ip, q_oop = q_ip[valid], q_oop[valid]
+            ip_lo, ip_hi = min(ip_lo, np.nanmin(q_ip)), max(ip_hi, np.nanmax(q_ip))
+            oop_lo, oop_hi = min(oop_lo, np.nanmin(q_oop)), max(
+                oop_hi, np.nanmax(q_oop)
+            )
+        return (
+            self.q_ip_range or (float(ip_lo), float(ip_hi)),
+            self.q_oop_range or (float(oop_lo), float(oop_hi)),
+        )
+
+    def batches(self) -> list[tuple[tuple[float, float, int], list[int]]]:
+        """The batches of frame indices of the same angles, remapped as one stack."""
+        batches = []
+        for angles, indices in self.groups().items():
+            for start in range(0, len(indices), self.batch_size):
+                batches.append((angles, indices[start : start + self.batch_size]))
+        return batches
+
+    def results(
+        self,
+        progress: Callable[[SeriesProgress], None] | None = None,
+        report_every: float = 5.0,
+    ) -> Iterator[tuple[list[int], np.ndarray]]:
+        """
+        Remap the series, yielding batches of frames in completion order.
+
+        At most two batches per worker are in flight, so memory is bounded by
+        the batch size rather than by the length of the series.
+
+        Parameters
+        ----------
+        progress : Callable[[SeriesProgress], None] | None, optional
+            Called with the progress of the remapping at most every
+            `report_every` seconds, and once on completion.
+        report_every : float, optional
+            The minimum interval between progress reports, by default 5 seconds.
+
+        Yields
+        ------
+        indices : list[int]
+            The indices of the frames of the batch in `frames`.
+        intensity : np.ndarray
+            The (frames, q_oop, q_ip) intensity of the batch.
+        """
+        q_ip_range, q_oop_range = self.grid_ranges()
+        remap_kwargs = {
+            "mask": self.mask,
+            "npt": self.npt,
+            "q_ip_range": q_ip_range,
+            "q_oop_range": q_oop_range,
+            "split": self.split,
+        }
+        batches = self.batches()
+        self.progress = SeriesProgress(
+            frames_total=len(self.frames), groups=len(self.groups())
+        )
+        start = last_report = time.perf_counter()
+        with worker_pool(
+            max_workers=min(self.workers, max(len(batches), 1)),
+            initializer=_init_worker,
+            initargs=(self.config, remap_kwargs),
+        ) as pool:
+            pending = {}
+            queued = iter(batches)
+            while True:
+                for angles, indices in queued:
+                    frames = [self.frames[i] for i in indices]
+                    future = pool.submit(_remap_batch, angles, frames)
+                    pending[future] = (angles, indices)
+                    if len(pending) >= 2 * self.workers:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    angles, indices = pending.pop(future)
+                    try:
+                        intensity, errors = future.result()
+                    except Exception as e:
+                        self.progress.errors[str(angles)] = str(e)
+                        continue
+                    self.progress.errors.update(errors)
+                    self.progress.frames_done += len(indices) - len(errors)
+                    yield indices, intensity
+                now = time.perf_counter()
+                self.progress.elapsed = now - start
+                if progress is not None and now - last_report >= report_every:
+                    progress(self.progress)
+                    last_report = now
+        self.progress.elapsed = time.perf_counter() - start
+        if progress is not None:
+            progress(self.progress)
+
+    def run(
+        self,
+        output: str,
+        progress: Callable[[SeriesProgress], None] | None = print_progress,
+        report_every: float = 5.0,
+    ) -> SeriesProgress:
+        """
+        Remap the series, writing the stack to an HDF5 file as batches complete.
+
+        The file holds the (frame, q_oop, q_ip) `intensity`, i.e. (angle, q_z,
+        q_xy), the `q_ip` and `q_oop` bin centres, and the `angle_incidence`,
+        `angle_tilt` and `source` of each frame. Frames which failed to remap
+        are NaN.
+
+        Parameters
+        ----------
+        output : str
+            The path of the output HDF5 file, which is overwritten.
+        progress : Callable[[SeriesProgress], None] | None, optional
+            Called with the progress of the remapping, by default `print_progress`.
+        report_every : float, optional
+            The minimum interval between progress reports, by default 5 seconds.
+
+        Returns
+        -------
+        SeriesProgress
+            The final progress, including the throughput and any errors.
+        """
+        q_ip_range, q_oop_range = self.grid_ranges()
+        n_oop, n_ip = self.npt
+        with h5py.File(output, "w") as f:
+            f["q_ip"] = np.linspace(*q_ip_range, n_ip)
+            f["q_oop"] = np.linspace(*q_oop_range, n_oop)
+            f["angle_incidence"] = [frame.angle_incidence for frame in self.frames]
+            f["angle_tilt"] = [frame.angle_tilt for frame in self.frames]
+            f.create_dataset(
+                "source",
+                data=[frame.source for frame in self.frames],
+                dtype=h5py.string_dtype(),
+            )
+            intensity = f.create_dataset(
+                "intensity",
+                shape=(len(self.frames), n_oop, n_ip),
+                dtype=np.float32,
+                chunks=(1, n_oop, n_ip),
+                fillvalue=np.nan,
+            )
+            intensity.attrs["axes"] = ["angle_incidence", "q_oop", "q_ip"]
+            for indices, stack in self.results(progress, report_every):
+                # Frames of a batch are consecutive, as frames are sorted by angle.
+                if indices == list(range(indices[0], indices[-1] + 1)):
+                    intensity[indices[0] : indices[-1] + 1] = stack
+                else:
+                    for i, frame in zip(indices, stack):
+                        intensity[i] = frame
+                f.flush()
+        return self.progress
+
+
+def remap_series(
+    config: ConfigGIWAXS,
+    frames: list[SeriesFrame],
+    output: str,
+    progress: Callable[[SeriesProgress], None] | None = print_progress,
+    **kwargs,
+) -> SeriesProgress:
+    """
+    Remap a GIWAXS series onto a common q grid, writing the stack to an HDF5 file.
+
+    Parameters
+    ----------
+    config : ConfigGIWAXS
+        The configuration, defining the detector and PONI geometry.
+    frames : list[SeriesFrame]
+        The frames of the series.
+    output : str
+        The path of the output HDF5 file.
+    progress : Callable[[SeriesProgress], None] | None, optional
+        Called with the progress of the remapping, by default `print_progress`.
+    **kwargs
+        Further arguments of `GIWAXSSeries`, e.g. `mask`, `npt`, `tolerance`.
+
+    Returns
+    -------
+    SeriesProgress
+        The final progress, including the throughput and any errors.
+    """
+    return GIWAXSSeries(config, frames, **kwargs).run(output, progress)
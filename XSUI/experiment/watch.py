@@ -0,0 +1,703 @@
+"""
+Live reduction of the frames written to an experiment directory.
+
+A `DirectoryWatcher` tails a directory for new image files, using `inotify` on
+Linux and periodic directory scans elsewhere (or on network file systems, where
+`inotify` does not see remote writes). A file is only queued once it is
+complete: with `inotify` it must have been closed after writing (or renamed into
+the directory), and in either mode its inode, size and change time must then be
+unchanged for a short settling time. Files are tracked by their change time
+(`st_ctime`) rather than their modification time, which copies such as
+`rsync -a` and `cp -p` preserve from the source. A file which fails to decode, such as one
+written with a pause longer than the settling time, is queued again once it is
+modified.
+
+A `LiveReduction` reduces the queued files with the cached integrator of the
+active scattering configuration, in a few worker threads. Both the file and the
+result queues are bounded, so a slow consumer stalls the workers and the
+watcher rather than accumulating frames in memory, and the record of processed
+files is bounded too, so memory stays constant over a long run.
+"""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import queue
+import select
+import stat
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+
+import numpy as np
+
+from XSUI.experiment.batch import (
+    FrameIndex,
+    ReducedFrame,
+    ReductionWriter,
+    reduce_file,
+)
+from XSUI.experiment.config_base import ConfigBase
+from XSUI.geometry.integrator import CachedIntegrator, get_integrator
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _libc.inotify_init1
+except (OSError, AttributeError):
+    # Not Linux, so directories are polled.
+    _libc = None
+
+INOTIFY_AVAILABLE = _libc is not None
+"""Whether directories can be watched with `inotify`."""
+
+IGNORED_PATTERNS = (".*", "*.tmp", "*.part", "*~")
+"""Patterns of hidden and temporary files, which are never queued."""
+
+# inotify event flags, from <sys/inotify.h>.
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_IN_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+_IN_EVENT = struct.Struct("iIII")
+
+
+class _Inotify:
+    """A minimal, non-blocking `inotify` instance."""
+
+    def __init__(self):
+        self.fd = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: dict[int, str] = {}
+
+    def add(self, directory: str) -> None:
+        """Watch a directory (but not its subdirectories)."""
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(directory), _IN_WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+        self.watches[wd] = directory
+
+    def read(self, timeout: float) -> list[tuple[str, int]]:
+        """Wait up to `timeout` seconds for events, as (path, mask) pairs."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            buffer = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = _IN_EVENT.unpack_from(buffer, offset)
+            offset += _IN_EVENT.size
+            name = buffer[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & _IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if mask & _IN_Q_OVERFLOW:
+                events.append(("", mask))
+            elif directory is not None and name:
+                events.append((os.path.join(directory, os.fsdecode(name)), mask))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class SeenFiles:
+    """
+    A bounded record of the files already queued, by path and stat signature.
+
+    The oldest entries are evicted beyond `maxsize`, raising a change time
+    watermark: files not changed since the watermark are considered seen. The
+    change time of a file is set by the file system whenever the file is
+    written, renamed or has its times set, so a file copied or moved into the
+    directory is never below the watermark, whatever its modification time.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of files to remember, by default 65536.
+    watermark : int, optional
+        The initial watermark, in nanoseconds since the epoch, by default 0.
+    """
+
+    def __init__(self, maxsize: int = 1 << 16, watermark: int = 0):
+        self.maxsize = maxsize
+        self.watermark = watermark
+        self._files: OrderedDict[str, tuple[int, int, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __contains__(self, item: tuple[str, tuple[int, int, int]]) -> bool:
+        path, signature = item
+        return signature[2] <= self.watermark or self._files.get(path) == signature
+
+    def add(self, path: str, signature: tuple[int, int, int]) -> None:
+        """Record a queued file, by its (inode, size, change time) signature."""
+        self._files[path] = signature
+        self._files.move_to_end(path)
+        while len(self._files) > self.maxsize:
+            _, (_, _, ctime) = self._files.popitem(last=False)
+            self.watermark = max(self.watermark, ctime)
+
+
+def _signature(path: str) -> tuple[int, int, int] | None:
+    """The (inode, size, change time) of a file, or None if it is not a file."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return st.st_ino, st.st_size, st.st_ctime_ns
+
+
+class DirectoryWatcher:
+    """
+    A watcher of the complete image files written to a directory.
+
+    Parameters
+    ----------
+    directory : str
+        The directory to watch.
+    pattern : str, optional
+        The filename pattern of image files, e.g. `"*.tif"`, by default all files.
+    recursive : bool, optional
+        Whether to watch subdirectories, by default False.
+    poll : bool | None, optional
+        Whether to poll the directory rather than use `inotify`. By default
+        `inotify` is used if available. Network file systems must be polled.
+    poll_interval : float, optional
+        The interval between directory scans when polling, by default 0.5 s.
+    settle : float, optional
+        The time a file must be unchanged to be complete, by default 0.25 s.
+    maxsize : int, optional
+        The maximum number of queued files, by default 64. When the queue is
+        full, the watcher waits for the consumer.
+    process_existing : bool, optional
+        Whether to queue the files already in the directory, by default False,
+        in which case they are only queued once they are changed.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        pattern: str = "*",
+        recursive: bool = False,
+        poll: bool | None = None,
+        poll_interval: float = 0.5,
+        settle: float = 0.25,
+        maxsize: int = 64,
+        process_existing: bool = False,
+    ):
+        if not os.path.isdir(directory):
+            raise FileNotFoundError(f"No directory {directory}.")
+        self.directory = directory
+        self.pattern = pattern
+        self.recursive = recursive
+        self.poll = not INOTIFY_AVAILABLE if poll is None else poll
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.process_existing = process_existing
+        self.queue: queue.Queue[str] = queue.Queue(maxsize)
+        self.seen = SeenFiles()
+        self._pending: dict[str, tuple[tuple[int, int, int], float]] = {}
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __repr__(self):
+        mode = "poll" if self.poll else "inotify"
+        return f"<DirectoryWatcher directory={self.directory} pattern={self.pattern} mode={mode}>"
+
+    def matches(self, path: str) -> bool:
+        """Whether a path is an image file to queue."""
+        name = os.path.basename(path)
+        return fnmatch.fnmatch(name, self.pattern) and not any(
+            fnmatch.fnmatch(name, p) for p in IGNORED_PATTERNS
+        )
+
+    def _directories(self) -> Iterator[str]:
+        """The watched directories."""
+        if not self.recursive:
+            yield self.directory
+            return
+        for root, dirs, _ in os.walk(self.directory):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            yield root
+
+    def _touch(self, path: str, now: float) -> None:
+        """Mark a file as (possibly) written, restarting its settling time."""
+        signature = _signature(path)
+        if signature is None or (path, signature) in self.seen:
+            return
+        self._pending[path] = (signature, now)
+
+    def _files(self, directory: str | None = None) -> Iterator[str]:
+        """The image files of the watched (or a) directory."""
+        directories = self._directories() if directory is None else [directory]
+        for root in directories:
+            try:
+                with os.scandir(root) as entries:
+                    paths = [e.path for e in entries if e.is_file()]
+            except OSError:
+                continue
+            yield from filter(self.matches, paths)
+
+    def _scan(self, now: float, directory: str | None = None) -> None:
+        """Mark every new or changed file of the (or a) directory."""
+        for path in self._files(directory):
+            if path not in self._pending:
+                self._touch(path, now)
+
+    def _scan_existing(self, now: float) -> None:
+        """Mark the files already in the directory when the watcher starts."""
+        if self.process_existing:
+            self._scan(now)
+        else:
+            # Skipped files are queued once they change, e.g. if still being written.
+            for path in self._files():
+                signature = _signature(path)
+                if signature is not None:
+                    self.seen.add(path, signature)
+        self._ready.set()
+
+    def _release(self, now: float) -> None:
+        """Queue the pending files which are unchanged for the settling time."""
+        for path, (signature, since) in list(self._pending.items()):
+            current = _signature(path)
+            if current is None:
+                del self._pending[path]
+            elif current != signature:
+                self._pending[path] = (current, now)
+            elif now - since >= self.settle:
+                while not self._stop.is_set():
+                    try:
+                        self.queue.put(path, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                else:
+                    return
+                del self._pending[path]
+                self.seen.add(path, signature)
+
+    def _run_inotify(self) -> None:
+        inotify = _Inotify()
+        try:
+            for directory in self._directories():
+                inotify.add(directory)
+            self._scan_existing(time.monotonic())
+            while not self._stop.is_set():
+                timeout = self.settle if self._pending else self.poll_interval
+                for path, mask in inotify.read(timeout):
+                    now = time.monotonic()
+                    if mask & _IN_Q_OVERFLOW:
+                        # Events were dropped, so rescan for any missed files.
+                        self._scan(now)
+                    elif mask & _IN_ISDIR:
+                        if self.recursive and mask & (_IN_CREATE | _IN_MOVED_TO):
+                            inotify.add(path)
+                            self._scan(now, path)
+                    elif mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO):
+                        if self.matches(path):
+                            self._touch(path, now)
+                    elif path in self._pending:
+                        # Still being written, so restart the settling time.
+                        self._touch(path, now)
+                self._release(time.monotonic())
+        finally:
+            inotify.close()
+
+    def _run_poll(self) -> None:
+        self._scan_existing(time.monotonic())
+        next_scan = time.monotonic() + self.poll_interval
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= next_scan:
+                self._scan(now)
+                next_scan = now + self.poll_interval
+            self._release(now)
+            timeout = min(self.settle, self.poll_interval) if self._pending else None
+            self._stop.wait(
+                max(next_scan - time.monotonic(), 0) if timeout is None else timeout
+            )
+
+    def _run(self) -> None:
+        try:
+            if self.poll:
+                self._run_poll()
+            else:
+                self._run_inotify()
+        except Exception as e:
+            print(f"Stopped watching {self.directory}: {e}")
+            raise
+
+    def start(self) -> "DirectoryWatcher":
+        """
+        Start watching the directory in a background thread.
+
+        Returns once the files already in the directory are scanned, so any
+        file written after this is queued.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._ready.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"watch:{self.directory}", daemon=True
+        )
+        self._thread.start()
+        while not self._ready.wait(0.1) and self._thread.is_alive():
+            continue
+        return self
+
+    def stop(self) -> None:
+        """Stop watching the directory."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        """Whether the watcher is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def get(self, timeout: float | None = None) -> str | None:
+        """Get the next complete file, or None after `timeout` seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def __enter__(self) -> "DirectoryWatcher":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+
+@dataclass
+class LiveStatus:
+    """
+    The status of a live reduction.
+
+    Attributes
+    ----------
+    files_done : int
+        The number of files reduced.
+    frames_done : int
+        The number of frames reduced.
+    queued : int
+        The number of complete files waiting to be reduced.
+    latency : float
+        The mean time from a file being last changed to its reduction, in seconds.
+    last_latency : float
+        The latency of the most recent file, in seconds.
+    errors : deque[tuple[str, str]]
+        The (path, message) of the most recent files that failed to reduce, and
+        the (`path:frame`, message) of the frames that failed to index.
+    """
+
+    files_done: int = 0
+    frames_done: int = 0
+    queued: int = 0
+    latency: float = 0.0
+    last_latency: float = 0.0
+    errors: deque[tuple[str, str]] = field(default_factory=lambda: deque(maxlen=100))
+
+    def __str__(self):
+        return (
+            f"{self.files_done} files, {self.frames_done} frames, {self.queued} queued, "
+            f"latency {self.last_latency:.2f} s (mean {self.latency:.2f} s), "
+            f"{len(self.errors)} errors"
+        )
+
+
+def print_status(status: LiveStatus) -> None:
+    """Print the status of a live reduction."""
+    print(f"Live reduction: {status}")
+
+
+class LiveReduction:
+    """
+    A live reduction of the image files written to a directory.
+
+    Parameters
+    ----------
+    config : ConfigBase
+        The active scattering configuration, which can be changed during the
+        reduction with `set_config`.
+    directory : str
+        The directory to watch.
+    pattern : str, optional
+        The filename pattern of image files, by default all files.
+    mask : np.ndarray | None, optional
+        The mask of invalid pixels, by default None.
+    npt : int, optional
+        The number of radial bins, by default 1000.
+    unit : str, optional
+        The radial unit, by default "q_nm^-1".
+    npt_azim : int, optional
+        The number of azimuthal bins of 2D integrations, by default 360.
+    dims : int, optional
+        Integrate to 1D (`1`), 2D (`2`) or both (`3`), by default 1.
+    workers : int, optional
+        The number of reduction threads, by default 2.
+    maxsize : int, optional
+        The maximum number of reduced frames waiting for the consumer, by default 64.
+    index : FrameIndex | None, optional
+        Called in the reduction threads with each frame as it is read, such as a
+        `FrameIndexer` to fill the image index. By default None.
+    **kwargs
+        Further arguments of `DirectoryWatcher`, e.g. `recursive`, `poll` and `settle`.
+    """
+
+    def __init__(
+        self,
+        config: ConfigBase,
+        directory: str,
+        pattern: str = "*",
+        mask: np.ndarray | None = None,
+        npt: int = 1000,
+        unit: str = "q_nm^-1",
+        npt_azim: int = 360,
+        dims: int = 1,
+        workers: int = 2,
+        maxsize: int = 64,
+        index: FrameIndex | None = None,
+        **kwargs,
+    ):
+        if dims not in (1, 2, 3):
+            raise ValueError(f"`dims` must be 1, 2 or 3, not {dims}.")
+        self.watcher = DirectoryWatcher(directory, pattern, **kwargs)
+        self.integrator_kwargs = {
+            "mask": mask,
+            "npt": npt,
+            "unit": unit,
+            "npt_azim": npt_azim,
+        }
+        self.dims = dims
+        self.workers = workers
+        self.index = index
+        self.results_queue: queue.Queue[ReducedFrame] = queue.Queue(maxsize)
+        self.status = LiveStatus()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self.set_config(config)
+
+    def __repr__(self):
+        return (
+            f"<LiveReduction directory={self.watcher.directory} workers={self.workers}>"
+        )
+
+    def set_config(self, config: ConfigBase) -> CachedIntegrator:
+        """
+        Set the active scattering configuration, for the files queued from now on.
+
+        The integrator is built (and warmed) before it replaces the previous one,
+        so the reduction does not stall.
+
+        Parameters
+        ----------
+        config : ConfigBase
+            The scattering configuration.
+
+        Returns
+        -------
+        CachedIntegrator
+            The integrator of the configuration.
+        """
+        integrator = get_integrator(config, **self.integrator_kwargs).warm(self.dims)
+        with self._lock:
+            self.config = config
+            self.integrator = integrator
+        return integrator
+
+    def _put(self, result: ReducedFrame) -> bool:
+        """Put a result in the bounded queue, waiting for space unless stopped."""
+        while not self._stop.is_set():
+            try:
+                self.results_queue.put(result, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            path = self.watcher.get(timeout=0.1)
+            if path is None:
+                continue
+            with self._lock:
+                integrator = self.integrator
+            try:
+                changed = os.stat(path).st_ctime
+                frames = reduce_file(integrator, path, self.dims, index=self.index)
+            except Exception as e:
+                self.status.errors.append((path, str(e)))
+                continue
+            for result in frames:
+                if result.index_error is not None:
+                    self.status.errors.append(
+                        (f"{path}:{result.frame}", result.index_error)
+                    )
+                if not self._put(result):
+                    return
+            latency = max(time.time() - changed, 0.0)
+            with self._lock:
+                status = self.status
+                status.files_done += 1
+                status.frames_done += len(frames)
+                status.last_latency = latency
+                status.latency += (latency - status.latency) / status.files_done
+                status.queued = self.watcher.queue.qsize()
+
+    def start(self) -> "LiveReduction":
+        """Start watching the directory and reducing its new files."""
+        if self._threads:
+            return self
+        self._stop.clear()
+        self.watcher.start()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"reduce:{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop the watcher and the reduction threads."""
+        self._stop.set()
+        self.watcher.stop()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self) -> "LiveReduction":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+    def results(self, timeout: float | None = None) -> Iterator[ReducedFrame]:
+        """
+        Iterate over the reduced frames as they are ready.
+
+        Parameters
+        ----------
+        timeout : float | None, optional
+            Stop after no frame is reduced for `timeout` seconds. By default
+            iterate until the reduction is stopped.
+
+        Yields
+        ------
+        ReducedFrame
+            The integration results of each frame.
+        """
+        idle = 0.0
+        while not self._stop.is_set() or not self.results_queue.empty():
+            try:
+                yield self.results_queue.get(timeout=0.1)
+                idle = 0.0
+            except queue.Empty:
+                idle += 0.1
+                if timeout is not None and idle >= timeout:
+                    return
+
+    def run(
+        self,
+        output: str,
+        progress: Callable[[LiveStatus], None] | None = print_status,
+        report_every: float = 60.0,
+        duration: float | None = None,
+    ) -> LiveStatus:
+        """
+        Reduce new files until interrupted, streaming the results to an HDF5 file.
+
+        Parameters
+        ----------
+        output : str
+            The path of the output HDF5 file, which is overwritten.
+        progress : Callable[[LiveStatus], None] | None, optional
+            Called with the status of the reduction every `report_every` seconds,
+            by default `print_status`.
+        report_every : float, optional
+            The interval between status reports, by default 60 seconds.
+        duration : float | None, optional
+            Stop after this many seconds. By default run until interrupted.
+
+        Returns
+        -------
+        LiveStatus
+            The final status of the reduction.
+        """
+        start = last_report = time.monotonic()
+        with self, ReductionWriter(output, flush_every=1) as writer:
+            try:
+                while duration is None or time.monotonic() - start < duration:
+                    try:
+                        writer.append(self.results_queue.get(timeout=0.5))
+                    except queue.Empty:
+                        pass
+                    now = time.monotonic()
+                    if progress is not None and now - last_report >= report_every:
+                        self.status.queued = self.watcher.queue.qsize()
+                        progress(self.status)
+                        last_report = now
+            except KeyboardInterrupt:
+                pass
+        if progress is not None:
+            progress(self.status)
+        return self.status
+
+
+def watch_directory(
+    config: ConfigBase,
+    directory: str,
+    output: str,
+    pattern: str = "*",
+    progress: Callable[[LiveStatus], None] | None = print_status,
+    **kwargs,
+) -> LiveStatus:
+    """
+    Reduce the image files written to a directory until interrupted.
+
+    Parameters
+    ----------
+    config : ConfigBase
+        The scattering configuration, defining the detector and PONI geometry.
+    directory : str
+        The directory to watch.
+    output : str
+        The path of the output HDF5 file.
+    pattern : str, optional
+        The filename pattern of image files, by default all files.
+    progress : Callable[[LiveStatus], None] | None, optional
+        Called with the status of the reduction, by default `print_status`.
+    **kwargs
+        Further arguments of `LiveReduction`, e.g. `mask`, `npt`, `recursive`.
+
+    Returns
+    -------
+    LiveStatus
+        The final status of the reduction.
+    """
+    return LiveReduction(config, directory, pattern, **kwargs).run(output, progress)
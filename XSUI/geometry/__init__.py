@@ -0,0 +1,26 @@
+"""
+Geometry of the scattering experiment, and the integrators built from it.
+"""
+
+from XSUI.geometry.integrator import (
+    CachedIntegrator,
+    IntegratorCache,
+    integrator_cache,
+    get_integrator,
+    worker_pool,
+)
+from XSUI.geometry.giwaxs import (
+    GIWAXSRemapper,
+    RemapResult,
+    RemapperCache,
+    remapper_cache,
+    get_remapper,
+    q_sample,
+)
+from XSUI.geometry.calibration import (
+    CalibrationProgress,
+    RefinementResult,
+    RingCalibration,
+    calibrate_geometry,
+    pick_ring_peaks,
+)
@@ -0,0 +1,846 @@
+"""
+Automatic calibration of the detector geometry from the rings of a calibrant.
+
+The geometry (dist, poni1, poni2, rot1, rot2, rot3) is found without a manual
+guess in three steps:
+
+1. Ring peaks are picked from the image with vectorized filters: pixels on the
+   crest of a ring stand out from a smoothed background, and are local maxima
+   across the ring. Connected crests are arcs of the rings.
+2. Circles fitted to the arcs give the beam centre, and the radii of the rings.
+   Matching the innermost rings to the first reflections of the calibrant gives
+   candidate distances, which are screened by the fraction of peaks they place
+   on a calibrant ring.
+3. The best candidates (and any manual guess) are refined by robust least
+   squares of the radial residual of every peak to its nearest calibrant ring,
+   each start in a worker process of a pool. The refinement placing the most
+   peaks on a ring wins.
+"""
+
+import os
+import time
+from concurrent.futures import as_completed
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+
+import numpy as np
+import pyFAI.calibrant
+import pyFAI.detectors
+import pyFAI.io.ponifile
+from pyFAI.geometry import Geometry
+from scipy import ndimage, optimize
+
+from XSUI.detectors import get_detector
+from XSUI.geometry.integrator import worker_pool
+
+GEOMETRY_PARAMETERS = ("dist", "poni1", "poni2", "rot1", "rot2", "rot3")
+"""The refinable parameters of a geometry, in `pyFAI` order."""
+
+DEFAULT_FIXED = ("rot3",)
+"""The parameters kept fixed by default: rings barely depend on rot3."""
+
+DEFAULT_STARTS = 8
+"""The default number of starting geometries refined."""
+
+MAX_PEAKS = 5000
+"""The maximum number of ring peaks used by the refinement."""
+
+MIN_ARC_PIXELS = 20
+"""The minimum number of pixels of an arc of a ring."""
+
+MIN_RING_RADIUS = 10.0
+"""The minimum radius of a ring about the beam centre, in pixels."""
+
+RING_TOLERANCE = 2.0
+"""The distance (in pixels) of a peak from a ring within which it is on the ring."""
+
+SCREEN_TOLERANCE = 3.0
+"""The (looser) `RING_TOLERANCE` used while screening unrefined starts."""
+
+MAX_EVALUATIONS = 100
+"""The maximum number of residual evaluations of the refinement of a start."""
+
+
+#################################################
+#### Ring peaks
+#################################################
+@dataclass
+class RingPeaks:
+    """
+    The peaks picked on the rings of a calibrant image.
+
+    Attributes
+    ----------
+    d1, d2 : np.ndarray
+        The (row, column) pixel coordinates of the peaks.
+    weight : np.ndarray
+        The intensity of each peak above the background.
+    arc : np.ndarray
+        The index of the arc (connected ring crest) of each peak.
+    centre : tuple[float, float]
+        The (row, column) pixel coordinates of the common centre of the arcs,
+        i.e. the approximate beam centre.
+    radii : np.ndarray
+        The radii of the distinct rings about the centre, in pixels, increasing.
+    ring_pixels : np.ndarray
+        The number of peaks on each ring of `radii`.
+    """
+
+    d1: np.ndarray
+    d2: np.ndarray
+    weight: np.ndarray
+    arc: np.ndarray
+    centre: tuple[float, float]
+    radii: np.ndarray
+    ring_pixels: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.d1)
+
+    def __repr__(self):
+        return (
+            f"<RingPeaks peaks={len(self)} arcs={self.arc.max(initial=-1) + 1} "
+            f"rings={len(self.radii)} centre=({self.centre[0]:.1f}, "
+            f"{self.centre[1]:.1f})>"
+        )
+
+
+def _normalized_smooth(data: np.ndarray, valid: np.ndarray, sigma: float) -> np.ndarray:
+    """Gaussian smoothing ignoring invalid pixels (normalized convolution)."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return ndimage.gaussian_filter(data, sigma) / ndimage.gaussian_filter(
+            valid.astype(np.float32), sigma
+        )
+
+
+def ridge_pixels(
+    image: np.ndarray,
+    mask: np.ndarray | None = None,
+    threshold: float = 4.0,
+    background_sigma: float = 8.0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find the pixels on the crests of the rings of an image.
+
+    The image is lightly smoothed, and a heavily smoothed background is
+    subtracted. Pixels more than `threshold` robust standard deviations above
+    the background, which are local maxima along at least one of the four
+    pixel directions (i.e. across the ring), are on a crest.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The 2D calibrant image.
+    mask : np.ndarray | None, optional
+        The mask of invalid pixels. Negative and non-finite pixels are invalid.
+    threshold : float, optional
+        The threshold above the background, in robust standard deviations of
+        the background subtracted image, by default 4.
+    background_sigma : float, optional
+        The width of the background smoothing, in pixels, by default 8. It
+        should be wider than the rings.
+
+    Returns
+    -------
+    crest : np.ndarray
+        The boolean map of crest pixels.
+    residual : np.ndarray
+        The smoothed, background subtracted image.
+    """
+    data = np.asarray(image, dtype=np.float32)
+    valid = np.isfinite(data) & (data >= 0)
+    if mask is not None:
+        valid &= ~np.asarray(mask, dtype=bool)
+    data = np.where(valid, data, 0)
+    smooth = _normalized_smooth(data, valid, 1.0)
+    residual = smooth - _normalized_smooth(data, valid, background_sigma)
+    values = residual[valid]
+    if values.size == 0:
+        return np.zeros(data.shape, dtype=bool), residual
+    median = np.median(values)
+    noise = 1.4826 * np.median(np.abs(values - median))
+    crest = valid & (residual > median + threshold * max(noise, 1e-12))
+    padded = np.pad(np.nan_to_num(smooth, nan=-np.inf), 1, constant_values=-np.inf)
+    centre = padded[1:-1, 1:-1]
+    rows, cols = padded.shape
+    maxima = np.zeros_like(crest)
+    for dy, dx in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        ahead = padded[1 + dy : rows - 1 + dy, 1 + dx : cols - 1 + dx]
+        behind = padded[1 - dy : rows - 1 - dy, 1 - dx : cols - 1 - dx]
+        maxima |= (centre >= ahead) & (centre >= behind)
+    return crest & maxima, residual
+
+
+def fit_circles(
+    d1: np.ndarray, d2: np.ndarray, arc: np.ndarray, narcs: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Fit a circle to each arc of points, by algebraic (Kasa) least squares.
+
+    Parameters
+    ----------
+    d1, d2 : np.ndarray
+        The (row, column) coordinates of the points.
+    arc : np.ndarray
+        The index of the arc of each point, in `[0, narcs)`.
+    narcs : int
+        The number of arcs.
+
+    Returns
+    -------
+    centres : np.ndarray
+        The (narcs, 2) (row, column) centres of the circles.
+    radii : np.ndarray
+        The radii of the circles.
+    """
+    y, x = d1.astype(float), d2.astype(float)
+
+    def total(values):
+        return np.bincount(arc, values, minlength=narcs)
+
+    z = x * x + y * y
+    sx, sy, n = total(x), total(y), total(np.ones_like(x))
+    sxy = total(x * y)
+    normal = np.stack(
+        [
+            np.stack([total(x * x), sxy, sx], axis=-1),
+            np.stack([sxy, total(y * y), sy], axis=-1),
+            np.stack([sx, sy, n], axis=-1),
+        ],
+        axis=1,
+    )
+    rhs = np.stack([total(x * z), total(y * z), total(z)], axis=-1)
+    try:
+        solution = np.linalg.solve(normal, rhs[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        # Degenerate (such as straight) arcs get a least-squares solution.
+        solution = np.stack(
+            [np.linalg.lstsq(a, b, rcond=None)[0] for a, b in zip(normal, rhs)]
+        )
+    cx, cy = solution[:, 0] / 2, solution[:, 1] / 2
+    radii = np.sqrt(np.maximum(solution[:, 2] + cx**2 + cy**2, 0))
+    return np.stack([cy, cx], axis=-1), radii
+
+
+def pick_ring_peaks(
+    image: np.ndarray,
+    mask: np.ndarray | None = None,
+    threshold: float = 4.0,
+    min_arc: int = MIN_ARC_PIXELS,
+) -> RingPeaks:
+    """
+    Pick the peaks on the rings of a calibrant image, and their common centre.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The 2D calibrant image.
+    mask : np.ndarray | None, optional
+        The mask of invalid pixels, by default None.
+    threshold : float, optional
+        The threshold of ring crests (see `ridge_pixels`), by default 4.
+    min_arc : int, optional
+        The minimum number of pixels of an arc, by default `MIN_ARC_PIXELS`.
+        Smaller connected crests are noise.
+
+    Returns
+    -------
+    RingPeaks
+        The peaks, the centre of the rings and their radii.
+
+    Raises
+    ------
+    ValueError
+        If no rings are found.
+    """
+    crest, residual = ridge_pixels(image, mask, threshold)
+    labels, _ = ndimage.label(crest, structure=np.ones((3, 3)))
+    sizes = np.bincount(labels.ravel())
+    sizes[0] = 0
+    d1, d2 = np.nonzero(crest)
+    keep = sizes[labels[d1, d2]] >= min_arc
+    d1, d2 = d1[keep], d2[keep]
+    if d1.size == 0:
+        raise ValueError("No calibrant rings found in the image.")
+    arc_ids, arc = np.unique(labels[d1, d2], return_inverse=True)
+    narcs = arc_ids.size
+    centres, _ = fit_circles(d1, d2, arc, narcs)
+    # Refine the common centre of all arcs, each arc with its own radius.
+    counts = np.bincount(arc, minlength=narcs)
+
+    def residuals(centre):
+        distance = np.hypot(d1 - centre[0], d2 - centre[1])
+        return distance - (np.bincount(arc, distance, minlength=narcs) / counts)[arc]
+
+    start = np.median(centres[np.isfinite(centres).all(axis=1)], axis=0)
+    centre = optimize.least_squares(residuals, start, loss="soft_l1", f_scale=2.0).x
+    distance = np.hypot(d1 - centre[0], d2 - centre[1])
+    arc_radii = np.bincount(arc, distance, minlength=narcs) / counts
+    # Arcs of similar radii are parts of the same ring.
+    order = np.argsort(arc_radii)
+    sorted_radii = arc_radii[order]
+    gaps = np.diff(sorted_radii) > np.maximum(3.0, 0.02 * sorted_radii[1:])
+    rings = np.split(order, np.nonzero(gaps)[0] + 1)
+    radii = np.array([np.average(arc_radii[r], weights=counts[r]) for r in rings])
+    ring_pixels = np.array([counts[r].sum() for r in rings])
+    return RingPeaks(
+        d1=d1,
+        d2=d2,
+        weight=residual[d1, d2],
+        arc=arc,
+        centre=(float(centre[0]), float(centre[1])),
+        radii=radii,
+        ring_pixels=ring_pixels,
+    )
+
+
+def ring_residuals(
+    geometry: Geometry,
+    d1: np.ndarray,
+    d2: np.ndarray,
+    ring_tth: np.ndarray,
+    params: np.ndarray,
+) -> np.ndarray:
+    """
+    The radial residuals of peaks to their nearest calibrant rings.
+
+    Residuals are distances on the detector, `dist * (tan(2theta) -
+    tan(2theta_ring))`, rather than angles, so that a geometry cannot reduce
+    them by moving the detector close to the sample, where the rings of a
+    calibrant are dense in angle.
+
+    Parameters
+    ----------
+    geometry : Geometry
+        A geometry of the detector and wavelength.
+    d1, d2 : np.ndarray
+        The (row, column) pixel coordinates of the peaks.
+    ring_tth : np.ndarray
+        The increasing 2-theta angles of the calibrant rings, in radians.
+    params : np.ndarray
+        The (dist, poni1, poni2, rot1, rot2, rot3) parameters of the geometry.
+
+    Returns
+    -------
+    np.ndarray
+        The signed residual of each peak, in metres.
+    """
+    # The vectorized NumPy path is faster than the OpenMP one for a few
+    # thousand peaks, and does not oversubscribe the worker processes.
+    tth = geometry.tth(d1, d2, param=params, path="tan")
+    upper = np.clip(np.searchsorted(ring_tth, tth), 1, ring_tth.size - 1)
+    below = tth - ring_tth[upper - 1]
+    above = tth - ring_tth[upper]
+    nearest = np.where(below < -above, ring_tth[upper - 1], ring_tth[upper])
+    return params[0] * (np.tan(tth) - np.tan(nearest))
+
+
+#################################################
+#### Refinement
+#################################################
+@dataclass
+class RefinementResult:
+    """
+    The refined geometry of a starting guess.
+
+    Attributes
+    ----------
+    dist, poni1, poni2 : float
+        The sample-detector distance and the PONI coordinates, in metres.
+    rot1, rot2, rot3 : float
+        The rotations of the detector, in radians.
+    wavelength : float
+        The wavelength, in metres.
+    start : int
+        The index of the starting guess.
+    inliers : float
+        The fraction of peaks within `RING_TOLERANCE` pixels of a ring.
+    rms : float
+        The RMS radial residual of the peaks on a ring, in pixels.
+    nfev : int
+        The number of residual evaluations of the refinement.
+    """
+
+    dist: float
+    poni1: float
+    poni2: float
+    rot1: float
+    rot2: float
+    rot3: float
+    wavelength: float
+    start: int = 0
+    inliers: float = 0.0
+    rms: float = float("nan")
+    nfev: int = 0
+
+    def __str__(self):
+        return (
+            f"dist={self.dist:.5f} m, poni1={self.poni1:.5f} m, "
+            f"poni2={self.poni2:.5f} m, rot=({np.degrees(self.rot1):.3f}, "
+            f"{np.degrees(self.rot2):.3f}, {np.degrees(self.rot3):.3f}) deg, "
+            f"{self.inliers:.1%} on rings, RMS {self.rms:.2f} px"
+        )
+
+    @property
+    def params(self) -> np.ndarray:
+        """The (dist, poni1, poni2, rot1, rot2, rot3) parameters."""
+        return np.array([getattr(self, name) for name in GEOMETRY_PARAMETERS])
+
+    def poni(
+        self, detector: pyFAI.detectors.Detector | str
+    ) -> pyFAI.io.ponifile.PoniFile:
+        """The PONI file of the geometry, for a detector (or detector name)."""
+        if isinstance(detector, str):
+            detector = get_detector(detector)
+        return pyFAI.io.ponifile.PoniFile(
+            **{name: getattr(self, name) for name in GEOMETRY_PARAMETERS},
+            wavelength=self.wavelength,
+            detector=detector,
+        )
+
+
+@dataclass
+class CalibrationProgress:
+    """
+    The progress of an automatic calibration.
+
+    Attributes
+    ----------
+    stage : str
+        "peaks", "screening", "refining" or "done".
+    peaks : int
+        The number of ring peaks picked.
+    rings : int
+        The number of distinct rings found.
+    starts_done : int
+        The number of starting guesses refined.
+    starts_total : int
+        The number of starting guesses.
+    best : RefinementResult | None
+        The best refined geometry so far.
+    elapsed : float
+        The time since the start of the calibration, in seconds.
+    errors : dict[int, str]
+        The error message of each start that failed to refine.
+    """
+
+    stage: str = "peaks"
+    peaks: int = 0
+    rings: int = 0
+    starts_done: int = 0
+    starts_total: int = 0
+    best: RefinementResult | None = None
+    elapsed: float = 0.0
+    errors: dict[int, str] = field(default_factory=dict)
+
+    def __str__(self):
+        text = f"{self.stage}: {self.peaks} peaks on {self.rings} rings"
+        if self.starts_total:
+            text += f", {self.starts_done}/{self.starts_total} starts refined"
+        if self.best is not None:
+            text += f", best {self.best.inliers:.1%} on rings"
+        return f"{text} ({self.elapsed:.1f} s)"
+
+
+def print_progress(progress: CalibrationProgress) -> None:
+    """Print the progress of an automatic calibration."""
+    print(f"Calibration: {progress}")
+
+
+def better(result: RefinementResult, best: RefinementResult | None) -> bool:
+    """Whether a result places more peaks on rings (or fits them better) than the best."""
+    if best is None:
+        return True
+    if abs(result.inliers - best.inliers) > 1e-3:
+        return result.inliers > best.inliers
+    return result.rms < best.rms
+
+
+#################################################
+#### Worker processes
+#################################################
+_worker_geometry: Geometry | None = None
+_worker_peaks: tuple[np.ndarray, np.ndarray] = (np.empty(0), np.empty(0))
+_worker_rings: np.ndarray = np.empty(0)
+_worker_free: np.ndarray = np.arange(len(GEOMETRY_PARAMETERS))
+_worker_pixel: float = 1.0
+
+
+def _init_worker(
+    detector: pyFAI.detectors.Detector,
+    wavelength: float,
+    d1: np.ndarray,
+    d2: np.ndarray,
+    ring_tth: np.ndarray,
+    fixed: tuple[str, ...],
+) -> None:
+    """Set the peaks, calibrant rings and detector of a worker process."""
+    global _worker_geometry, _worker_peaks, _worker_rings, _worker_free, _worker_pixel
+    _worker_geometry = Geometry(detector=detector, wavelength=wavelength)
+    _worker_peaks = (d1, d2)
+    _worker_rings = ring_tth
+    _worker_free = np.array(
+        [i for i, name in enumerate(GEOMETRY_PARAMETERS) if name not in fixed]
+    )
+    _worker_pixel = max(detector.pixel1, detector.pixel2)
+
+
+def _refine_start(start: int, params: np.ndarray) -> RefinementResult:
+    """Refine a starting geometry by robust least squares in a worker process."""
+    d1, d2 = _worker_peaks
+    params = np.array(params, dtype=float)
+
+    def residuals(free):
+        params[_worker_free] = free
+        return ring_residuals(_worker_geometry, d1, d2, _worker_rings, params)
+
+    # The distance is kept within a factor of two of the start, whose
+    # matching of the rings it refines, and a pixel sets the scale of outliers.
+    dist = params[0]
+    scale = np.array([1e-2, 1e-3, 1e-3, 1e-2, 1e-2, 1e-2])[_worker_free]
+    lower = np.array([dist / 2, -np.inf, -np.inf, -np.pi, -np.pi, -np.pi])
+    upper = np.array([dist * 2, np.inf, np.inf, np.pi, np.pi, np.pi])
+    lower, upper = lower[_worker_free], upper[_worker_free]
+    fit = optimize.least_squares(
+        residuals,
+        params[_worker_free],
+        bounds=(lower, upper),
+        loss="soft_l1",
+        f_scale=_worker_pixel,
+        x_scale=scale,
+        max_nfev=MAX_EVALUATIONS,
+    )
+    params[_worker_free] = fit.x
+    residual = np.abs(residuals(fit.x)) / _worker_pixel
+    on_ring = residual < RING_TOLERANCE
+    rms = np.sqrt(np.mean(residual[on_ring] ** 2)) if on_ring.any() else np.inf
+    return RefinementResult(
+        *params,
+        wavelength=_worker_geometry.wavelength,
+        start=start,
+        inliers=float(on_ring.mean()),
+        rms=float(rms),
+        nfev=int(fit.nfev),
+    )
+
+
+class RingCalibration:
+    """
+    Automatic calibration of the geometry of a detector from a calibrant image.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The 2D calibrant image.
+    detector : pyFAI.detectors.Detector | str
+        The detector (or detector name) of the image.
+    wavelength : float
+        The wavelength, in metres.
+    calibrant : pyFAI.calibrant.Calibrant | str
+        The calibrant (or calibrant name, see `pyFAI.calibrant.ALL_CALIBRANTS`).
+    mask : np.ndarray | None, optional
+        The mask of invalid pixels, in addition to the detector mask.
+    guess : dict[str, float | None] | None, optional
+        A manual guess of any of the `GEOMETRY_PARAMETERS`, refined as an
+        additional start. A guess of only the distance is combined with the
+        beam centre found from the rings.
+    n_starts : int, optional
+        The number of screened starts refined, by default `DEFAULT_STARTS`.
+    fixed : tuple[str, ...], optional
+        The parameters kept at their starting value, by default `DEFAULT_FIXED`.
+    max_peaks : int, optional
+        The maximum number of peaks used by the refinement, by default
+        `MAX_PEAKS`. More peaks are randomly subsampled.
+    workers : int | None, optional
+        The number of worker processes, by default the number of CPUs.
+    seed : int, optional
+        The seed of the peak subsampling, by default 0.
+    """
+
+    def __init__(
+        self,
+        image: np.ndarray,
+        detector: pyFAI.detectors.Detector | str,
+        wavelength: float,
+        calibrant: pyFAI.calibrant.Calibrant | str,
+        mask: np.ndarray | None = None,
+        guess: dict[str, float | None] | None = None,
+        n_starts: int = DEFAULT_STARTS,
+        fixed: tuple[str, ...] = DEFAULT_FIXED,
+        max_peaks: int = MAX_PEAKS,
+        workers: int | None = None,
+        seed: int = 0,
+    ):
+        if not wavelength:
+            raise ValueError("The wavelength is needed to calibrate the geometry.")
+        if isinstance(detector, str):
+            detector = get_detector(detector)
+        if isinstance(calibrant, str):
+            calibrant = pyFAI.calibrant.get_calibrant(calibrant)
+        unknown = set(fixed) - set(GEOMETRY_PARAMETERS)
+        if unknown:
+            raise ValueError(f"Unknown geometry parameters {sorted(unknown)}.")
+        self.image = np.asarray(image)
+        self.detector = detector
+        self.wavelength = float(wavelength)
+        self.calibrant = calibrant
+        self.mask = self.image < 0
+        if detector.mask is not None and detector.mask.shape == self.image.shape:
+            self.mask |= detector.mask.astype(bool)
+        if mask is not None:
+            self.mask |= np.asarray(mask, dtype=bool)
+        self.guess = {k: v for k, v in (guess or {}).items() if v is not None}
+        self.n_starts = n_starts
+        self.fixed = tuple(fixed)
+        self.max_peaks = max_peaks
+        self.workers = workers or os.cpu_count() or 1
+        self.seed = seed
+        self._peaks: RingPeaks | None = None
+        self.progress = CalibrationProgress()
+
+    def __repr__(self):
+        return (
+            f"<RingCalibration calibrant={self.calibrant.name} "
+            f"detector={self.detector.name} wavelength={self.wavelength:.4e}>"
+        )
+
+    @property
+    def pixel(self) -> float:
+        """The (largest) pixel size of the detector, in metres."""
+        return max(self.detector.pixel1, self.detector.pixel2)
+
+    @property
+    def ring_tth(self) -> np.ndarray:
+        """The 2-theta angles of the calibrant rings at the wavelength, in radians."""
+        d = np.asarray(self.calibrant.dspacing, dtype=float) * 1e-10
+        sine = self.wavelength / (2 * d)
+        return np.unique(2 * np.arcsin(sine[(sine > 0) & (sine < 1)]))
+
+    @property
+    def peaks(self) -> RingPeaks:
+        """The ring peaks of the image, picked on first use."""
+        if self._peaks is None:
+            self._peaks = pick_ring_peaks(self.image, self.mask)
+        return self._peaks
+
+    def sample_peaks(self) -> tuple[np.ndarray, np.ndarray]:
+        """The (row, column) coordinates of at most `max_peaks` ring peaks."""
+        peaks = self.peaks
+        d1, d2 = peaks.d1.astype(float), peaks.d2.astype(float)
+        if len(peaks) > self.max_peaks:
+            rng = np.random.default_rng(self.seed)
+            chosen = np.sort(rng.choice(len(peaks), self.max_peaks, replace=False))
+            d1, d2 = d1[chosen], d2[chosen]
+        return d1, d2
+
+    def peak_angles(
+        self, result: RefinementResult
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The angles of the (sampled) ring peaks in a refined geometry.
+
+        Parameters
+        ----------
+        result : RefinementResult
+            The refined geometry.
+
+        Returns
+        -------
+        tth : np.ndarray
+            The 2-theta angle of each peak, in degrees.
+        chi : np.ndarray
+            The azimuthal angle of each peak, in degrees.
+        residual : np.ndarray
+            The radial residual of each peak to its nearest ring, in pixels.
+        """
+        d1, d2 = self.sample_peaks()
+        params = result.params
+        geometry = Geometry(*params, detector=self.detector, wavelength=self.wavelength)
+        tth = geometry.tth(d1, d2, path="tan")
+        chi = geometry.chi(d1, d2)
+        residual = ring_residuals(geometry, d1, d2, self.ring_tth, params)
+        return np.degrees(tth), np.degrees(chi), residual / self.pixel
+
+    def starts(self) -> list[np.ndarray]:
+        """
+        The starting geometries of the refinement.
+
+        The innermost rings about the beam centre are matched with each of the
+        first calibrant reflections, giving the distance of a detector normal
+        to the beam. These starts are screened by the fraction of peaks within
+        `SCREEN_TOLERANCE` pixels of a ring, and the best `n_starts` distinct
+        starts follow the manual guess, if any.
+
+        Returns
+        -------
+        list[np.ndarray]
+            The (dist, poni1, poni2, rot1, rot2, rot3) of each start.
+        """
+        peaks = self.peaks
+        ring_tth = self.ring_tth
+        rotations = [self.guess.get(name, 0.0) for name in ("rot1", "rot2", "rot3")]
+        # With no rotation, the PONI is the beam centre (at the pixel centre).
+        poni1 = (peaks.centre[0] + 0.5) * self.detector.pixel1
+        poni2 = (peaks.centre[1] + 0.5) * self.detector.pixel2
+        starts = []
+        if "dist" in self.guess:
+            guess = [
+                self.guess["dist"],
+                self.guess.get("poni1", poni1),
+                self.guess.get("poni2", poni2),
+                *rotations,
+            ]
+            starts.append(np.array(guess, dtype=float))
+            if "poni1" in self.guess or "poni2" in self.guess:
+                starts.append(np.array([self.guess["dist"], poni1, poni2, *rotations]))
+
+        d1, d2 = self.sample_peaks()
+        geometry = Geometry(detector=self.detector, wavelength=self.wavelength)
+        rings = (peaks.radii >= MIN_RING_RADIUS) & (
+            peaks.ring_pixels >= 0.25 * np.median(peaks.ring_pixels)
+        )
+        candidates = []
+        for radius in peaks.radii[rings][:5] * self.pixel:
+            for tth in ring_tth[:10]:
+                dist = radius / np.tan(tth)
+                params = np.array([dist, poni1, poni2, *rotations])
+                residual = ring_residuals(geometry, d1, d2, ring_tth, params)
+                score = np.mean(np.abs(residual) < SCREEN_TOLERANCE * self.pixel)
+                candidates.append((score, params))
+        candidates.sort(key=lambda c: -c[0])
+        screened = []
+        for _, params in candidates:
+            if all(abs(params[0] / s[0] - 1) > 0.01 for s in screened):
+                screened.append(params)
+            if len(screened) >= self.n_starts:
+                break
+        return starts + screened
+
+    def results(
+        self, progress: Callable[[CalibrationProgress], None] | None = None
+    ) -> Iterator[RefinementResult]:
+        """
+        Refine every start in a pool of worker processes.
+
+        Parameters
+        ----------
+        progress : Callable[[CalibrationProgress], None] | None, optional
+            Called with the progress after each stage, and each refined start.
+
+        Yields
+        ------
+        RefinementResult
+            The refined geometry of each start, in completion order.
+
+        Raises
+        ------
+        ValueError
+            If no rings are found in the image.
+        """
+        start_time = time.perf_counter()
+        self.progress = CalibrationProgress()
+
+        def report(stage: str) -> None:
+            self.progress.stage = stage
+            self.progress.elapsed = time.perf_counter() - start_time
+            if progress is not None:
+                progress(self.progress)
+
+        peaks = self.peaks
+        self.progress.peaks, self.progress.rings = len(peaks), len(peaks.radii)
+        report("screening")
+        starts = self.starts()
+        self.progress.starts_total = len(starts)
+        report("refining")
+        d1, d2 = self.sample_peaks()
+        with worker_pool(
+            max_workers=min(self.workers, max(len(starts), 1)),
+            initializer=_init_worker,
+            initargs=(
+                self.detector,
+                self.wavelength,
+                d1,
+                d2,
+                self.ring_tth,
+                self.fixed,
+            ),
+        ) as pool:
+            futures = {
+                pool.submit(_refine_start, i, params): i
+                for i, params in enumerate(starts)
+            }
+            for future in as_completed(futures):
+                self.progress.starts_done += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.progress.errors[futures[future]] = str(e)
+                    report("refining")
+                    continue
+                if better(result, self.progress.best):
+                    self.progress.best = result
+                report("refining")
+                yield result
+        report("done")
+
+    def run(
+        self, progress: Callable[[CalibrationProgress], None] | None = print_progress
+    ) -> RefinementResult:
+        """
+        Calibrate the geometry.
+
+        Parameters
+        ----------
+        progress : Callable[[CalibrationProgress], None] | None, optional
+            Called with the progress of the calibration, by default `print_progress`.
+
+        Returns
+        -------
+        RefinementResult
+            The refined geometry placing the most peaks on the calibrant rings.
+
+        Raises
+        ------
+        ValueError
+            If no rings are found, or no start could be refined.
+        """
+        for _ in self.results(progress):
+            pass
+        if self.progress.best is None:
+            raise ValueError(f"No geometry could be refined: {self.progress.errors}")
+        return self.progress.best
+
+
+def calibrate_geometry(
+    image: np.ndarray,
+    detector: pyFAI.detectors.Detector | str,
+    wavelength: float,
+    calibrant: pyFAI.calibrant.Calibrant | str,
+    progress: Callable[[CalibrationProgress], None] | None = print_progress,
+    **kwargs,
+) -> RefinementResult:
+    """
+    Calibrate the geometry of a detector from an image of calibrant rings.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The 2D calibrant image.
+    detector : pyFAI.detectors.Detector | str
+        The detector (or detector name) of the image.
+    wavelength : float
+        The wavelength, in metres.
+    calibrant : pyFAI.calibrant.Calibrant | str
+        The calibrant (or calibrant name), such as "AgBh" or "LaB6".
+    progress : Callable[[CalibrationProgress], None] | None, optional
+        Called with the progress of the calibration, by default `print_progress`.
+    **kwargs
+        Further arguments of `RingCalibration`, e.g. `mask`, `guess`, `workers`.
+
+    Returns
+    -------
+    RefinementResult
+        The refined geometry.
+    """
+    calibration = RingCalibration(image, detector, wavelength, calibrant, **kwargs)
+    return calibration.run(progress)
@@ -0,0 +1,477 @@
+"""
+Remapping of grazing-incidence (GIWAXS) images onto in-plane and out-of-plane q.
+
+The scattering vector of every pixel is computed at once from the pixel
+positions of the PONI geometry, and rotated into the frame of the sample by the
+incidence and tilt angles. The rebinning of the pixels onto a regular
+(q_oop, q_ip) grid is then a fixed linear map, stored as a sparse matrix, so
+remapping a frame (or a stack of frames) is a single sparse matrix product.
+
+The conventions follow the fiber units of `pyFAI` (`qip_nm^-1`, `qoop_nm^-1`):
+the sample is first rotated by the incidence angle about the horizontal axis,
+then by the tilt angle about the beam, and the detector axes are first
+re-oriented by the EXIF-like sample orientation (1-8) of `ImageGIWAXS`.
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable
+
+import numpy as np
+import pyFAI.detectors
+import pyFAI.io.ponifile
+import scipy.sparse
+from pyFAI.integrator.azimuthal import AzimuthalIntegrator
+
+from XSUI.geometry.integrator import (
+    detector_key,
+    geometry_key,
+    integrator_cache,
+    mask_digest,
+)
+
+ORIENTATIONS = {
+    1: ((1, 0), (0, 1)),
+    2: ((-1, 0), (0, 1)),
+    3: ((-1, 0), (0, -1)),
+    4: ((1, 0), (0, -1)),
+    5: ((0, -1), (-1, 0)),
+    6: ((0, -1), (1, 0)),
+    7: ((0, 1), (1, 0)),
+    8: ((0, 1), (-1, 0)),
+}
+"""
+The (horizontal, vertical) detector axes of each sample orientation, as the
+coefficients of the lab (x, y) axes, such that orientation 6 is rotated by 90
+degrees.
+"""
+
+SPLIT_METHODS = ("none", "bilinear")
+"""The pixel splitting methods of the rebinning."""
+
+
+def sample_rotation(incidence: float, tilt: float = 0.0) -> np.ndarray:
+    """
+    The rotation of a scattering vector from the lab frame into the sample frame.
+
+    Parameters
+    ----------
+    incidence : float
+        The incidence angle of the beam on the sample, in degrees.
+    tilt : float, optional
+        The tilt of the sample about the beam, in degrees, by default 0.
+
+    Returns
+    -------
+    np.ndarray
+        The 3x3 rotation of (beam, horizontal, vertical) components.
+    """
+    a, t = np.radians(incidence), np.radians(tilt)
+    ry = np.array(
+        [[np.cos(a), 0.0, np.sin(a)], [0.0, 1.0, 0.0], [-np.sin(a), 0.0, np.cos(a)]]
+    )
+    rx = np.array(
+        [[1.0, 0.0, 0.0], [0.0, np.cos(t), np.sin(t)], [0.0, -np.sin(t), np.cos(t)]]
+    )
+    return rx @ ry
+
+
+def q_sample(
+    ai: AzimuthalIntegrator,
+    incidence: float,
+    tilt: float = 0.0,
+    orientation: int = 1,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the in-plane and out-of-plane scattering vector of every pixel.
+
+    Parameters
+    ----------
+    ai : AzimuthalIntegrator
+        The geometry of the detector, which caches the pixel positions.
+    incidence : float
+        The incidence angle, in degrees.
+    tilt : float, optional
+        The tilt of the sample about the beam, in degrees, by default 0.
+    orientation : int, optional
+        The sample orientation (see `ORIENTATIONS`), by default 1.
+
+    Returns
+    -------
+    q_ip : np.ndarray
+        The signed in-plane scattering vector of each pixel, in nm^-1.
+    q_oop : np.ndarray
+        The out-of-plane scattering vector of each pixel, in nm^-1.
+    """
+    if orientation not in ORIENTATIONS:
+        raise ValueError(f"Unknown sample orientation {orientation}, not 1-8.")
+    pos = ai.position_array(corners=False)
+    z, y, x = pos[..., 0], pos[..., 1], pos[..., 2]
+    (hx, hy), (vx, vy) = ORIENTATIONS[orientation]
+    horizontal = hx * x + hy * y
+    vertical = vx * x + vy * y
+    k = 2.0e-9 * np.pi / ai.wavelength
+    r = np.sqrt(x * x + y * y + z * z)
+    q_lab = np.stack([z / r - 1.0, horizontal / r, vertical / r]) * k
+    q_beam, q_horz, q_vert = np.tensordot(
+        sample_rotation(incidence, tilt), q_lab, axes=1
+    )
+    q_ip = np.copysign(np.hypot(q_beam, q_horz), q_horz)
+    return q_ip, q_vert
+
+
+@dataclass
+class RemapResult:
+    """
+    A GIWAXS image remapped onto a regular (q_oop, q_ip) grid.
+
+    Attributes
+    ----------
+    intensity : np.ndarray
+        The (q_oop, q_ip) intensity, or a (frames, q_oop, q_ip) stack. Empty
+        bins are NaN.
+    q_ip : np.ndarray
+        The in-plane bin centres, in nm^-1.
+    q_oop : np.ndarray
+        The out-of-plane bin centres, in nm^-1.
+    """
+
+    intensity: np.ndarray
+    q_ip: np.ndarray
+    q_oop: np.ndarray
+
+    @property
+    def extent(self) -> tuple[float, float, float, float]:
+        """The (q_ip min, q_ip max, q_oop min, q_oop max) bin centres, for plotting."""
+        return (
+            float(self.q_ip[0]),
+            float(self.q_ip[-1]),
+            float(self.q_oop[0]),
+            float(self.q_oop[-1]),
+        )
+
+
+class GIWAXSRemapper:
+    """
+    A remapping of detector frames onto a regular (q_oop, q_ip) grid.
+
+    The rebinning is a sparse (bins, pixels) matrix of pixel weights, built once.
+    Each bin is the solid-angle corrected mean of its (weighted) pixels.
+
+    Parameters
+    ----------
+    q_ip : np.ndarray
+        The in-plane scattering vector of each pixel (see `q_sample`).
+    q_oop : np.ndarray
+        The out-of-plane scattering vector of each pixel.
+    solid_angle : np.ndarray | None
+        The relative solid angle of each pixel, or None for no correction.
+    mask : np.ndarray | None, optional
+        The mask of invalid pixels, by default None.
+    npt : tuple[int, int], optional
+        The number of (q_oop, q_ip) bins, by default (500, 500).
+    q_ip_range : tuple[float, float] | None, optional
+        The in-plane range of the grid. By default the range of the pixels.
+    q_oop_range : tuple[float, float] | None, optional
+        The out-of-plane range of the grid. By default the range of the pixels.
+    split : str, optional
+        "none" to add each pixel to its nearest bin, or "bilinear" to split it
+        between the four nearest bin centres, by default "bilinear".
+    """
+
+    def __init__(
+        self,
+        q_ip: np.ndarray,
+        q_oop: np.ndarray,
+        solid_angle: np.ndarray | None,
+        mask: np.ndarray | None = None,
+        npt: tuple[int, int] = (500, 500),
+        q_ip_range: tuple[float, float] | None = None,
+        q_oop_range: tuple[float, float] | None = None,
+        split: str = "bilinear",
+    ):
+        if split not in SPLIT_METHODS:
+            raise ValueError(f"Unknown split method `{split}`, not {SPLIT_METHODS}.")
+        self.shape = q_ip.shape
+        self.npt = tuple(int(n) for n in npt)
+        self.split = split
+        valid = np.isfinite(q_ip) & np.isfinite(q_oop)
+        if mask is not None:
+            valid &= ~np.asarray(mask, dtype=bool).reshape(self.shape)
+        pixels = np.flatnonzero(valid)
+        ip, oop = q_ip.ravel()[pixels], q_oop.ravel()[pixels]
+        self.q_ip_range = q_ip_range or (float(ip.min()), float(ip.max()))
+        self.q_oop_range = q_oop_range or (float(oop.min()), float(oop.max()))
+        self.q_ip = np.linspace(*self.q_ip_range, self.npt[1])
+        self.q_oop = np.linspace(*self.q_oop_range, self.npt[0])
+        self.matrix = self._rebinning(pixels, oop, ip)
+        weights = np.zeros(self.matrix.shape[1], dtype=np.float64)
+        weights[pixels] = 1.0 if solid_angle is None else solid_angle.ravel()[pixels]
+        with np.errstate(divide="ignore"):
+            norm = self.matrix @ weights
+            self.scale = np.where(norm > 0, 1.0 / norm, np.nan).astype(np.float32)
+
+    def __repr__(self):
+        return (
+            f"<GIWAXSRemapper npt={self.npt} split={self.split} "
+            f"nnz={self.matrix.nnz}>"
+        )
+
+    def _bin_coordinates(
+        self, values: np.ndarray, centres: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """The fractional bin coordinate of values, and whether it is on the grid."""
+        step = (centres[-1] - centres[0]) / max(len(centres) - 1, 1) or 1.0
+        coords = (values - centres[0]) / step
+        inside = (coords > -0.5) & (coords < len(centres) - 0.5)
+        return coords, inside
+
+    def _rebinning(
+        self, pixels: np.ndarray, oop: np.ndarray, ip: np.ndarray
+    ) -> scipy.sparse.csr_matrix:
+        """The sparse (bins, pixels) matrix of the pixel weights of each bin."""
+        n_oop, n_ip = self.npt
+        row, inside_row = self._bin_coordinates(oop, self.q_oop)
+        col, inside_col = self._bin_coordinates(ip, self.q_ip)
+        inside = inside_row & inside_col
+        pixels, row, col = pixels[inside], row[inside], col[inside]
+        if self.split == "none":
+            bins = np.rint(row).astype(np.int64) * n_ip + np.rint(col).astype(np.int64)
+            weights = np.ones(len(pixels), dtype=np.float32)
+        else:
+            # Split each pixel between the four surrounding bin centres.
+            r0 = np.clip(np.floor(row), 0, max(n_oop - 2, 0)).astype(np.int64)
+            c0 = np.clip(np.floor(col), 0, max(n_ip - 2, 0)).astype(np.int64)
+            fr = np.clip(row - r0, 0.0, 1.0).astype(np.float32)
+            fc = np.clip(col - c0, 0.0, 1.0).astype(np.float32)
+            r1 = np.minimum(r0 + 1, n_oop - 1)
+            c1 = np.minimum(c0 + 1, n_ip - 1)
+            bins = np.concatenate(
+                [r0 * n_ip + c0, r0 * n_ip + c1, r1 * n_ip + c0, r1 * n_ip + c1]
+            )
+            weights = np.concatenate(
+                [(1 - fr) * (1 - fc), (1 - fr) * fc, fr * (1 - fc), fr * fc]
+            )
+            pixels = np.tile(pixels, 4)
+        matrix = scipy.sparse.csr_matrix(
+            (weights, (bins, pixels)),
+            shape=(n_oop * n_ip, int(np.prod(self.shape))),
+            dtype=np.float32,
+        )
+        matrix.sum_duplicates()
+        matrix.eliminate_zeros()
+        return matrix
+
+    def remap(self, data: np.ndarray) -> RemapResult:
+        """
+        Remap a frame, or a stack of frames, onto the (q_oop, q_ip) grid.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            A detector frame, or a (frames, rows, cols) stack of frames.
+
+        Returns
+        -------
+        RemapResult
+            The remapped intensity and the bin centres.
+        """
+        data = np.asarray(data)
+        stack = data.ndim == len(self.shape) + 1
+        if data.shape[stack:] != self.shape:
+            raise ValueError(
+                f"Frames of shape {data.shape[stack:]} do not match the detector "
+                f"shape {self.shape}."
+            )
+        pixels = data.reshape(len(data) if stack else 1, -1).T
+        if not np.issubdtype(pixels.dtype, np.floating):
+            pixels = pixels.astype(np.float32)
+        elif not np.isfinite(pixels).all():
+            # Masked pixels have no weight, but would still propagate NaN.
+            pixels = np.nan_to_num(pixels, nan=0.0, posinf=0.0, neginf=0.0)
+        binned = (self.matrix @ pixels).T * self.scale
+        intensity = binned.reshape(-1, *self.npt)
+        return RemapResult(
+            intensity if stack else intensity[0], self.q_ip.copy(), self.q_oop.copy()
+        )
+
+
+class RemapperCache:
+    """
+    A thread-safe LRU cache of GIWAXS remappers.
+
+    The pixel scattering vectors are cached by geometry, incidence angle, tilt and
+    orientation, and shared by remappers of different masks and grids.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of remappers (and of pixel q maps) to hold, by default 4.
+    """
+
+    def __init__(self, maxsize: int = 4):
+        self.maxsize = maxsize
+        self._remappers: OrderedDict[Hashable, GIWAXSRemapper] = OrderedDict()
+        self._q_maps: OrderedDict[Hashable, tuple[np.ndarray, ...]] = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._remappers)
+
+    def clear(self) -> None:
+        """Remove all cached remappers."""
+        with self._lock:
+            self._remappers.clear()
+            self._q_maps.clear()
+
+    def _lru_get(self, cache: OrderedDict, key: Hashable):
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    def _lru_set(self, cache: OrderedDict, key: Hashable, value) -> None:
+        cache[key] = value
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
+
+    def get(
+        self,
+        poni: pyFAI.io.ponifile.PoniFile,
+        detector: pyFAI.detectors.Detector,
+        incidence: float,
+        tilt: float = 0.0,
+        orientation: int = 1,
+        mask: np.ndarray | None = None,
+        npt: tuple[int, int] = (500, 500),
+        q_ip_range: tuple[float, float] | None = None,
+        q_oop_range: tuple[float, float] | None = None,
+        split: str = "bilinear",
+        correct_solid_angle: bool = True,
+    ) -> GIWAXSRemapper:
+        """
+        Get the remapper of a geometry and sample angles, creating it on a cache miss.
+
+        Parameters
+        ----------
+        poni : pyFAI.io.ponifile.PoniFile
+            The geometry of the detector.
+        detector : pyFAI.detectors.Detector
+            The detector.
+        incidence : float
+            The incidence angle, in degrees.
+        tilt : float, optional
+            The tilt of the sample about the beam, in degrees, by default 0.
+        orientation : int, optional
+            The sample orientation (see `ORIENTATIONS`), by default 1.
+        mask : np.ndarray | None, optional
+            The mask of invalid pixels, by default None.
+        npt : tuple[int, int], optional
+            The number of (q_oop, q_ip) bins, by default (500, 500).
+        q_ip_range, q_oop_range : tuple[float, float] | None, optional
+            The ranges of the grid, by default the ranges of the pixels.
+        split : str, optional
+            The pixel splitting method (see `GIWAXSRemapper`), by default "bilinear".
+        correct_solid_angle : bool, optional
+            Whether to correct the intensity for the pixel solid angles, by
+            default True.
+
+        Returns
+        -------
+        GIWAXSRemapper
+            The cached remapper.
+        """
+        geom_key = (
+            geometry_key(poni),
+            detector_key(detector),
+            float(incidence),
+            float(tilt),
+            int(orientation or 1),
+        )
+        key = (
+            geom_key,
+            mask_digest(mask),
+            tuple(npt),
+            None if q_ip_range is None else tuple(q_ip_range),
+            None if q_oop_range is None else tuple(q_oop_range),
+            split,
+            correct_solid_angle,
+        )
+        with self._lock:
+            remapper = self._lru_get(self._remappers, key)
+            if remapper is not None:
+                return remapper
+            q_map = self._lru_get(self._q_maps, geom_key)
+            ai = integrator_cache.geometry(poni, detector)
+            if q_map is None:
+                q_map = q_sample(ai, incidence, tilt, orientation or 1)
+                self._lru_set(self._q_maps, geom_key, q_map)
+            solid_angle = ai.solidAngleArray() if correct_solid_angle else None
+            remapper = GIWAXSRemapper(
+                *q_map, solid_angle, mask, npt, q_ip_range, q_oop_range, split
+            )
+            self._lru_set(self._remappers, key, remapper)
+            return remapper
+
+
+remapper_cache = RemapperCache()
+"""The process-wide cache of GIWAXS remappers."""
+
+
+def get_remapper(
+    config,
+    mask: np.ndarray | None = None,
+    npt: tuple[int, int] = (500, 500),
+    q_ip_range: tuple[float, float] | None = None,
+    q_oop_range: tuple[float, float] | None = None,
+    split: str = "bilinear",
+    cache: RemapperCache | None = None,
+) -> GIWAXSRemapper:
+    """
+    Get the cached GIWAXS remapper of a grazing-incidence configuration.
+
+    Parameters
+    ----------
+    config : XSUI.experiment.config_giwaxs.ConfigGIWAXS
+        The configuration, which must define a `poni` geometry, and a `detector`
+        unless the PONI file defines one, and the sample angles.
+    mask : np.ndarray | None, optional
+        The mask of invalid pixels, by default None.
+    npt : tuple[int, int], optional
+        The number of (q_oop, q_ip) bins, by default (500, 500).
+    q_ip_range, q_oop_range : tuple[float, float] | None, optional
+        The ranges of the grid, by default the ranges of the pixels.
+    split : str, optional
+        The pixel splitting method (see `GIWAXSRemapper`), by default "bilinear".
+    cache : RemapperCache | None, optional
+        The remapper cache, by default the process-wide `remapper_cache`.
+
+    Returns
+    -------
+    GIWAXSRemapper
+        The cached remapper.
+
+    Raises
+    ------
+    ValueError
+        If the configuration has no geometry or detector.
+    """
+    if config.poni is None:
+        raise ValueError("The configuration does not define a PONI geometry.")
+    detector = config.detector if config.detector is not None else config.poni.detector
+    if detector is None:
+        raise ValueError("The configuration does not define a detector.")
+    cache = remapper_cache if cache is None else cache
+    return cache.get(
+        config.poni,
+        detector,
+        config.angle_incidence,
+        config.angle_tilt,
+        config.orientation,
+        mask,
+        npt,
+        q_ip_range,
+        q_oop_range,
+        split,
+    )
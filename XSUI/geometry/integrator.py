@@ -0,0 +1,445 @@
+"""
+Construction and caching of `pyFAI` azimuthal integrators.
+
+Building an `AzimuthalIntegrator` computes the pixel positions of the detector,
+and the first integration with a given number of bins, unit and mask builds the
+look-up table (LUT) or sparse (CSR) matrix of the integration engine. These
+setup costs dominate the integration of a single frame, so integrators are
+cached by their geometry, detector, mask, number of bins and unit, allowing a
+reduction of many frames with the same geometry to pay them exactly once.
+
+Each cached integrator has its own `AzimuthalIntegrator`, as the engines of an
+integrator are rebuilt whenever its mask or number of bins changes. Only the
+pixel positions are shared between the integrators of a geometry.
+"""
+
+import copy
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Hashable, Iterator
+
+import numpy as np
+import pyFAI.detectors
+import pyFAI.io.ponifile
+from pyFAI.integrator.azimuthal import AzimuthalIntegrator
+
+DEFAULT_METHOD = ("bbox", "csr", "cython")
+"""The default `pyFAI` integration method (pixel splitting, algorithm, implementation)."""
+
+WORKER_OMP_THREADS = 1
+"""The number of OpenMP threads of each process of a `worker_pool`."""
+
+_environment_lock = threading.Lock()
+_environment_users = 0
+_environment_restore = False
+
+
+def geometry_key(poni: pyFAI.io.ponifile.PoniFile) -> tuple[float, ...]:
+    """The PONI parameters identifying an integration geometry."""
+    return tuple(
+        None if v is None else float(v)
+        for v in (
+            poni.dist,
+            poni.poni1,
+            poni.poni2,
+            poni.rot1,
+            poni.rot2,
+            poni.rot3,
+            poni.wavelength,
+        )
+    )
+
+
+def detector_key(detector: pyFAI.detectors.Detector) -> tuple:
+    """The class, configuration and shape identifying a detector."""
+    config = sorted((k, repr(v)) for k, v in detector.get_config().items())
+    return (type(detector).__name__, tuple(config), tuple(detector.shape))
+
+
+def mask_digest(mask: np.ndarray | None) -> str | None:
+    """Hash the masked pixels (and shape) of a mask."""
+    if mask is None:
+        return None
+    mask = np.asarray(mask)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(mask.shape).encode("utf-8"))
+    h.update(np.packbits(mask.ravel() != 0).data)
+    return h.hexdigest()
+
+
+def _writeable(data: np.ndarray) -> np.ndarray:
+    """The frame, copied if read-only (i.e. memory-mapped), as pyFAI requires."""
+    return np.require(data, requirements="W")
+
+
+class CachedIntegrator:
+    """
+    An azimuthal integrator with a fixed mask, number of bins and unit.
+
+    Reusing the same instance reuses the LUT/CSR engines of its own
+    `AzimuthalIntegrator`, which are built on the first integration.
+
+    Parameters
+    ----------
+    ai : AzimuthalIntegrator
+        The azimuthal integrator, not shared with other cached integrators.
+    mask : np.ndarray | None
+        The mask of invalid pixels, or None.
+    npt : int
+        The number of radial bins.
+    unit : str
+        The radial unit, i.e. "q_nm^-1" or "2th_deg".
+    npt_azim : int
+        The number of azimuthal bins of 2D integrations.
+    method : tuple[str, str, str]
+        The `pyFAI` integration method.
+    """
+
+    def __init__(
+        self,
+        ai: AzimuthalIntegrator,
+        mask: np.ndarray | None,
+        npt: int,
+        unit: str,
+        npt_azim: int,
+        method: tuple[str, str, str],
+    ):
+        self.ai = ai
+        # A private copy, as pyFAI requires a writeable mask buffer.
+        self.mask = None if mask is None else np.array(mask, dtype=np.int8)
+        self.npt = npt
+        self.unit = unit
+        self.npt_azim = npt_azim
+        self.method = method
+
+    def __repr__(self):
+        return (
+            f"<CachedIntegrator npt={self.npt} unit={self.unit} "
+            f"npt_azim={self.npt_azim} method={self.method}>"
+        )
+
+    def integrate1d(self, data: np.ndarray, **kwargs):
+        """
+        Integrate a frame to a 1D profile.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            The detector frame.
+        **kwargs
+            Further arguments of `AzimuthalIntegrator.integrate1d`.
+
+        Returns
+        -------
+        pyFAI.containers.Integrate1dResult
+            The radial profile.
+        """
+        return self.ai.integrate1d(
+            _writeable(data),
+            self.npt,
+            mask=self.mask,
+            unit=self.unit,
+            method=self.method,
+            **kwargs,
+        )
+
+    def integrate2d(self, data: np.ndarray, **kwargs):
+        """
+        Integrate a frame to a 2D (radial, azimuthal) map.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            The detector frame.
+        **kwargs
+            Further arguments of `AzimuthalIntegrator.integrate2d`.
+
+        Returns
+        -------
+        pyFAI.containers.Integrate2dResult
+            The caked image.
+        """
+        return self.ai.integrate2d(
+            _writeable(data),
+            self.npt,
+            self.npt_azim,
+            mask=self.mask,
+            unit=self.unit,
+            method=self.method,
+            **kwargs,
+        )
+
+    def warm(self, dim: int = 1) -> "CachedIntegrator":
+        """
+        Build the integration engines ahead of the first frame.
+
+        Parameters
+        ----------
+        dim : int, optional
+            Build the engine of 1D (`1`), 2D (`2`) or both (`3`) integrations,
+            by default 1.
+
+        Returns
+        -------
+        CachedIntegrator
+            This integrator.
+        """
+        blank = np.zeros(self.ai.detector.shape, dtype=np.float32)
+        if dim & 1:
+            self.integrate1d(blank)
+        if dim & 2:
+            self.integrate2d(blank)
+        return self
+
+
+class IntegratorCache:
+    """
+    A thread-safe LRU cache of integrators.
+
+    Every cached integrator has its own azimuthal integrator, so that its engines
+    are never rebuilt by integrations with other masks or bins. The pixel positions
+    are shared by geometry and detector, so integrators of the same geometry with
+    different masks, bins or units compute them once.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of integrators to hold, by default 8.
+    """
+
+    def __init__(self, maxsize: int = 8):
+        self.maxsize = maxsize
+        self._integrators: OrderedDict[Hashable, CachedIntegrator] = OrderedDict()
+        self._geometries: OrderedDict[Hashable, AzimuthalIntegrator] = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._integrators)
+
+    def clear(self) -> None:
+        """Remove all cached integrators."""
+        with self._lock:
+            self._integrators.clear()
+            self._geometries.clear()
+
+    @staticmethod
+    def _lru_get(cache: OrderedDict, key: Hashable):
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    def _lru_set(self, cache: OrderedDict, key: Hashable, value) -> None:
+        cache[key] = value
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
+
+    def get(
+        self,
+        poni: pyFAI.io.ponifile.PoniFile,
+        detector: pyFAI.detectors.Detector,
+        mask: np.ndarray | None = None,
+        npt: int = 1000,
+        unit: str = "q_nm^-1",
+        npt_azim: int = 360,
+        method: tuple[str, str, str] = DEFAULT_METHOD,
+    ) -> CachedIntegrator:
+        """
+        Get the integrator of a geometry, creating it on a cache miss.
+
+        Parameters
+        ----------
+        poni : pyFAI.io.ponifile.PoniFile
+            The geometry of the detector.
+        detector : pyFAI.detectors.Detector
+            The detector.
+        mask : np.ndarray | None, optional
+            The mask of invalid pixels, by default None.
+        npt : int, optional
+            The number of radial bins, by default 1000.
+        unit : str, optional
+            The radial unit, by default "q_nm^-1".
+        npt_azim : int, optional
+            The number of azimuthal bins of 2D integrations, by default 360.
+        method : tuple[str, str, str], optional
+            The `pyFAI` integration method, by default `DEFAULT_METHOD`.
+
+        Returns
+        -------
+        CachedIntegrator
+            The cached integrator.
+        """
+        geom_key = (geometry_key(poni), detector_key(detector))
+        key = (geom_key, mask_digest(mask), npt, str(unit), npt_azim, tuple(method))
+        with self._lock:
+            integrator = self._lru_get(self._integrators, key)
+            if integrator is not None:
+                return integrator
+            geometry = self.geometry(poni, detector)
+            ai = copy.copy(geometry)
+            # Share the cached pixel positions, but not the integration engines.
+            ai._cached_array = geometry._cached_array
+            integrator = CachedIntegrator(ai, mask, npt, unit, npt_azim, method)
+            self._lru_set(self._integrators, key, integrator)
+            return integrator
+
+    def geometry(
+        self, poni: pyFAI.io.ponifile.PoniFile, detector: pyFAI.detectors.Detector
+    ) -> AzimuthalIntegrator:
+        """
+        Get the azimuthal integrator of a geometry, creating it on a cache miss.
+
+        It holds the pixel positions shared by the cached integrators of the
+        geometry, which integrate with copies of it.
+
+        Parameters
+        ----------
+        poni : pyFAI.io.ponifile.PoniFile
+            The geometry of the detector.
+        detector : pyFAI.detectors.Detector
+            The detector.
+
+        Returns
+        -------
+        AzimuthalIntegrator
+            The azimuthal integrator, which caches the pixel positions.
+        """
+        geom_key = (geometry_key(poni), detector_key(detector))
+        with self._lock:
+            ai = self._lru_get(self._geometries, geom_key)
+            if ai is None:
+                ai = AzimuthalIntegrator(
+                    dist=poni.dist,
+                    poni1=poni.poni1 or 0.0,
+                    poni2=poni.poni2 or 0.0,
+                    rot1=poni.rot1 or 0.0,
+                    rot2=poni.rot2 or 0.0,
+                    rot3=poni.rot3 or 0.0,
+                    detector=detector,
+                    wavelength=poni.wavelength,
+                )
+                self._lru_set(self._geometries, geom_key, ai)
+            return ai
+
+
+integrator_cache = IntegratorCache()
+"""The process-wide cache of integrators."""
+
+
+def get_integrator(
+    config,
+    mask: np.ndarray | None = None,
+    npt: int = 1000,
+    unit: str = "q_nm^-1",
+    npt_azim: int = 360,
+    method: tuple[str, str, str] = DEFAULT_METHOD,
+    cache: IntegratorCache | None = None,
+) -> CachedIntegrator:
+    """
+    Get the cached integrator of a scattering configuration.
+
+    Parameters
+    ----------
+    config : XSUI.experiment.config_base.ConfigBase
+        The configuration, which must define a `poni` geometry, and a `detector`
+        unless the PONI file defines one.
+    mask : np.ndarray | None, optional
+        The mask of invalid pixels, by default None.
+    npt : int, optional
+        The number of radial bins, by default 1000.
+    unit : str, optional
+        The radial unit, by default "q_nm^-1".
+    npt_azim : int, optional
+        The number of azimuthal bins of 2D integrations, by default 360.
+    method : tuple[str, str, str], optional
+        The `pyFAI` integration method, by default `DEFAULT_METHOD`.
+    cache : IntegratorCache | None, optional
+        The integrator cache, by default the process-wide `integrator_cache`.
+
+    Returns
+    -------
+    CachedIntegrator
+        The cached integrator.
+
+    Raises
+    ------
+    ValueError
+        If the configuration has no geometry or detector.
+    """
+    if config.poni is None:
+        raise ValueError("The configuration does not define a PONI geometry.")
+    detector = config.detector if config.detector is not None else config.poni.detector
+    if detector is None:
+        raise ValueError("The configuration does not define a detector.")
+    cache = integrator_cache if cache is None else cache
+    return cache.get(config.poni, detector, mask, npt, unit, npt_azim, method)
+
+
+@contextmanager
+def _worker_environment() -> Iterator[None]:
+    """Set `OMP_NUM_THREADS` for the processes started within, unless already set."""
+    global _environment_users, _environment_restore
+    with _environment_lock:
+        if _environment_users == 0:
+            _environment_restore = "OMP_NUM_THREADS" not in os.environ
+            if _environment_restore:
+                os.environ["OMP_NUM_THREADS"] = str(WORKER_OMP_THREADS)
+        _environment_users += 1
+    try:
+        yield
+    finally:
+        with _environment_lock:
+            _environment_users -= 1
+            if _environment_users == 0 and _environment_restore:
+                os.environ.pop("OMP_NUM_THREADS", None)
+
+
+@contextmanager
+def worker_pool(
+    max_workers: int,
+    initializer: Callable | None = None,
+    initargs: tuple = (),
+) -> Iterator[ProcessPoolExecutor]:
+    """
+    A pool of worker processes for `pyFAI` computations.
+
+    Parallelism comes from the processes, so each worker runs
+    `WORKER_OMP_THREADS` OpenMP threads. OpenMP reads `OMP_NUM_THREADS` once,
+    when `pyFAI` is imported, which is too late in a worker initializer and
+    already done in a fork of this process. Workers are therefore forked from a
+    fork server preloading `pyFAI` (or spawned where fork servers are not
+    available), with `OMP_NUM_THREADS` set while the pool is open.
+
+    Parameters
+    ----------
+    max_workers : int
+        The number of worker processes.
+    initializer : Callable | None, optional
+        Called in each worker process on start, by default None.
+    initargs : tuple, optional
+        The (picklable) arguments of `initializer`, by default none.
+
+    Yields
+    ------
+    ProcessPoolExecutor
+        The pool, which is shut down on exit.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # Only applies when the fork server is first started.
+        context.set_forkserver_preload([__name__])
+    else:
+        context = multiprocessing.get_context("spawn")
+    with _worker_environment():
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=context,
+            initializer=initializer,
+            initargs=initargs,
+        ) as pool:
+            yield pool
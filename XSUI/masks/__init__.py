@@ -0,0 +1,30 @@
+"""
+Tools for generating and combining pixel masks of detector images.
+"""
+
+from XSUI.masks.rasterize import (
+    flatten_path,
+    rasterize_polygons,
+    polygon_mask,
+    path_mask,
+    rasterize_rectangle,
+    rasterize_ellipse,
+    rasterize_shape,
+    shapes_mask,
+)
+from XSUI.masks.cache import (
+    LRUCache,
+    shape_key,
+    ShapeRasterCache,
+    IncrementalMask,
+)
+from XSUI.masks.codec import MASK_CODEC_VERSION, encode_mask, decode_mask
+from XSUI.masks.algebra import (
+    MaskExpr,
+    MaskLeaf,
+    MaskUnion,
+    MaskIntersection,
+    MaskDifference,
+    MaskCache,
+    mask_cache,
+)
@@ -0,0 +1,259 @@
+"""
+Lazy boolean algebra over masks, with a cache of materialized results.
+
+Mask expressions are built from leaves (i.e. a stored `DetectorMask` or
+`CustomMask`) combined with union (``|``), intersection (``&``) and difference
+(``-``). Nothing is loaded or computed until an expression is materialized,
+and the result is cached under a key derived from the identity and version of
+every member, so evaluating the same composite for many frames only computes
+it once.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+import numpy as np
+
+
+class MaskExpr:
+    """
+    Base class of a lazily evaluated mask expression.
+
+    Subclasses define `key`, a hashable identifier of the expression result, and
+    `_evaluate`, which computes the mask.
+    """
+
+    key: Hashable
+
+    def __or__(self, other: "MaskExpr") -> "MaskUnion":
+        return MaskUnion(self, other)
+
+    def __and__(self, other: "MaskExpr") -> "MaskIntersection":
+        return MaskIntersection(self, other)
+
+    def __sub__(self, other: "MaskExpr") -> "MaskDifference":
+        return MaskDifference(self, other)
+
+    def _evaluate(self, cache: "MaskCache") -> np.ndarray:
+        raise NotImplementedError
+
+    def _operand(self, op: "MaskExpr", cache: "MaskCache") -> np.ndarray:
+        """Evaluate an operand, reusing a cached result without caching a new one."""
+        cached = cache.get(op.key)
+        return cached if cached is not None else op._evaluate(cache)
+
+    def materialize(self, cache: "MaskCache | None" = None) -> np.ndarray:
+        """
+        Evaluate the expression, or return its cached result.
+
+        Parameters
+        ----------
+        cache : MaskCache | None, optional
+            The cache of materialized masks, by default the process-wide `mask_cache`.
+
+        Returns
+        -------
+        np.ndarray
+            The read-only boolean mask.
+        """
+        cache = mask_cache if cache is None else cache
+        result = cache.get(self.key)
+        if result is None:
+            result = np.asarray(self._evaluate(cache), dtype=bool)
+            result.flags.writeable = False
+            cache[self.key] = result
+        return result
+
+
+class MaskLeaf(MaskExpr):
+    """
+    A single stored mask, loaded on first evaluation.
+
+    Parameters
+    ----------
+    key : Hashable
+        An identifier of the mask contents, such as its table, ID and version.
+    loader : Callable[[], np.ndarray]
+        A function returning the mask array.
+    """
+
+    def __init__(self, key: Hashable, loader: Callable[[], np.ndarray]):
+        self.key = key
+        self.loader = loader
+
+    def __repr__(self):
+        return f"<MaskLeaf key={self.key}>"
+
+    def _evaluate(self, cache: "MaskCache") -> np.ndarray:
+        return np.asarray(self.loader()) != 0
+
+    @classmethod
+    def from_array(cls, mask: np.ndarray) -> "MaskLeaf":
+        """Create a leaf from an in-memory mask, keyed by its contents."""
+        mask = np.ascontiguousarray(mask)
+        digest = hashlib.blake2b(mask.data, digest_size=16).hexdigest()
+        return cls(("array", mask.shape, digest), lambda: mask)
+
+    @classmethod
+    def from_model(cls, model) -> "MaskLeaf":
+        """
+        Create a leaf from a stored `DetectorMask` or `CustomMask`.
+
+        Persisted masks are keyed by their table, ID and version. Masks that have
+        not been persisted yet are keyed by a hash of their encoded data.
+
+        Parameters
+        ----------
+        model : DetectorMask | CustomMask
+            The mask model, which must provide the decoded `mask` property.
+
+        Returns
+        -------
+        MaskLeaf
+            The leaf loading the decoded mask of the model.
+        """
+        if model.id is not None:
+            key = (model.__tablename__, model.id, model.version)
+        else:
+            data = getattr(model, "detector_mask", None) or model.mask_data
+            key = (
+                model.__tablename__,
+                hashlib.blake2b(data, digest_size=16).hexdigest(),
+            )
+        return cls(key, lambda: model.mask)
+
+
+class _MaskReduction(MaskExpr):
+    """An associative, commutative combination of masks (union or intersection)."""
+
+    _symbol: str
+    _ufunc: np.ufunc
+
+    def __init__(self, *operands: MaskExpr):
+        # Flatten nested reductions of the same type.
+        self.operands: list[MaskExpr] = []
+        for op in operands:
+            if type(op) is type(self):
+                self.operands.extend(op.operands)
+            else:
+                self.operands.append(op)
+        if not self.operands:
+            raise ValueError(f"{type(self).__name__} requires at least one mask.")
+        # Operand order does not affect the result, so sort the member keys.
+        self.key = (
+            self._symbol,
+            tuple(sorted({op.key for op in self.operands}, key=repr)),
+        )
+
+    def __repr__(self):
+        return f" {self._symbol} ".join(repr(op) for op in self.operands)
+
+    def _evaluate(self, cache: "MaskCache") -> np.ndarray:
+        result = None
+        for op in self.operands:
+            mask = self._operand(op, cache)
+            if result is None:
+                result = np.array(mask, dtype=bool)
+            elif mask.shape != result.shape:
+                raise ValueError(
+                    f"Cannot combine masks of shape {result.shape} and {mask.shape}."
+                )
+            else:
+                self._ufunc(result, mask, out=result)
+        return result
+
+
+class MaskUnion(_MaskReduction):
+    """The union of masks, i.e. pixels masked by any operand."""
+
+    _symbol = "|"
+    _ufunc = np.logical_or
+
+
+class MaskIntersection(_MaskReduction):
+    """The intersection of masks, i.e. pixels masked by every operand."""
+
+    _symbol = "&"
+    _ufunc = np.logical_and
+
+
+class MaskDifference(MaskExpr):
+    """
+    The difference of two masks, i.e. pixels masked by `left` but not by `right`.
+
+    Parameters
+    ----------
+    left, right : MaskExpr
+        The masks to subtract.
+    """
+
+    def __init__(self, left: MaskExpr, right: MaskExpr):
+        self.left = left
+        self.right = right
+        self.key = ("-", left.key, right.key)
+
+    def __repr__(self):
+        return f"({self.left!r} - {self.right!r})"
+
+    def _evaluate(self, cache: "MaskCache") -> np.ndarray:
+        left = self._operand(self.left, cache)
+        right = self._operand(self.right, cache)
+        if left.shape != right.shape:
+            raise ValueError(
+                f"Cannot combine masks of shape {left.shape} and {right.shape}."
+            )
+        return left & ~right
+
+
+class MaskCache:
+    """
+    A thread-safe LRU cache of materialized masks, bounded by total bytes.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        The maximum number of bytes of masks to hold, by default 256 MiB.
+    """
+
+    def __init__(self, max_bytes: int = 256 << 20):
+        self.max_bytes = max_bytes
+        self._masks: OrderedDict[Hashable, np.ndarray] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._masks)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._masks
+
+    def get(self, key: Hashable) -> np.ndarray | None:
+        """Return the cached mask for `key`, or None if it is not cached."""
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+            return mask
+
+    def __setitem__(self, key: Hashable, mask: np.ndarray) -> None:
+        with self._lock:
+            old = self._masks.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+            self._masks[key] = mask
+            self._nbytes += mask.nbytes
+            while self._nbytes > self.max_bytes and len(self._masks) > 1:
+                _, evicted = self._masks.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        """Remove all cached masks."""
+        with self._lock:
+            self._masks.clear()
+            self._nbytes = 0
+
+
+mask_cache = MaskCache()
+"""The process-wide cache of materialized mask expressions."""
@@ -0,0 +1,329 @@
+"""
+Caching of rasterized shapes and incremental recomposition of drawn masks.
+
+Drawn shapes are identified by a hash of their geometry, so a shape that has
+not changed between two relayout events is never rasterized twice. The
+composite mask keeps a per-pixel coverage count of the drawn shapes, allowing
+a single shape to be added or removed exactly without touching the others.
+"""
+
+import hashlib
+import json
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Hashable
+
+import numpy as np
+
+from XSUI.masks.rasterize import BBox, rasterize_shape
+
+_GEOMETRY_KEYS = ("type", "x0", "y0", "x1", "y1", "path")
+"""The Plotly shape properties that define the rasterized pixels."""
+
+_RELAYOUT_SHAPE_KEY = re.compile(r"^shapes\[(\d+)\]\.(\w+)$")
+"""Matches the partial shape updates in `relayoutData`, i.e. `shapes[2].x0`."""
+
+_MISSING = object()
+"""The default of cache lookups, as shapes without pixels are cached as None."""
+
+
+class LRUCache(OrderedDict):
+    """
+    A least-recently-used mapping with a maximum number of entries.
+
+    Lookups, insertions and evictions hold a lock, as the caches are shared by
+    the callback threads of the web application.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of entries to hold, by default 128.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self._lock = threading.RLock()
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self._lock:
+            value = super().__getitem__(key)
+            self.move_to_end(key)
+            return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            while len(self) > self.maxsize:
+                self.popitem(last=False)
+
+    def __delitem__(self, key: Hashable) -> None:
+        with self._lock:
+            super().__delitem__(key)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value for `key` (marking it as recently used) or `default`."""
+        with self._lock:
+            return self[key] if key in self else default
+
+    def pop(self, key: Hashable, *default: Any) -> Any:
+        """Remove `key` and return its value, or `default` if given."""
+        with self._lock:
+            return super().pop(key, *default)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            super().clear()
+
+
+def shape_key(shape_data: dict) -> str:
+    """
+    Hash the geometry of a Plotly drawn shape.
+
+    Only the properties that affect the rasterized pixels are hashed, so
+    styling changes (line colour, opacity, etc.) do not invalidate the cache.
+
+    Parameters
+    ----------
+    shape_data : dict
+        A Plotly layout shape.
+
+    Returns
+    -------
+    str
+        A hex digest identifying the shape geometry.
+    """
+    geometry = {k: shape_data[k] for k in _GEOMETRY_KEYS if k in shape_data}
+    encoded = json.dumps(geometry, sort_keys=True).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class ShapeRasterCache:
+    """
+    An LRU cache of rasterized shapes, keyed by shape geometry and image shape.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of rasterized shapes to hold, by default 256.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self._cache = LRUCache(maxsize)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def clear(self) -> None:
+        """Remove all cached rasters."""
+        self._cache.clear()
+
+    def get(
+        self, shape_data: dict, shape: tuple[int, int]
+    ) -> tuple[str, tuple[BBox, np.ndarray] | None]:
+        """
+        Get the raster of a shape, rasterizing it on a cache miss.
+
+        Parameters
+        ----------
+        shape_data : dict
+            A Plotly layout shape.
+        shape : tuple[int, int]
+            The (rows, cols) shape of the image.
+
+        Returns
+        -------
+        key : str
+            The geometry hash of the shape.
+        raster : tuple[BBox, np.ndarray] | None
+            The bounding box and sub-mask of the shape, or None if it covers no
+            pixels. Cached sub-masks are read-only.
+        """
+        key = shape_key(shape_data)
+        cache_key = (key, tuple(shape))
+        raster = self._cache.get(cache_key, _MISSING)
+        if raster is not _MISSING:
+            return key, raster
+        raster = rasterize_shape(shape_data, shape)
+        if raster is not None:
+            raster[1].flags.writeable = False
+        self._cache[cache_key] = raster
+        return key, raster
+
+
+class IncrementalMask:
+    """
+    A composite of a base mask and drawn shapes, updated incrementally.
+
+    The base mask holds the contributions that do not come from drawn shapes
+    (i.e. non-positive image pixels and the detector mask). Drawn shapes are
+    accumulated in a per-pixel coverage count, so that adding or removing a
+    shape only updates the pixels inside that shape's bounding box.
+
+    Parameters
+    ----------
+    base : np.ndarray
+        The boolean base mask, which also defines the image shape.
+    base_key : Hashable, optional
+        An identifier of the base mask contents, used to detect when the base
+        mask needs to be replaced, by default None.
+    cache : ShapeRasterCache | None, optional
+        The shape raster cache to use. By default a private cache is created.
+    """
+
+    def __init__(
+        self,
+        base: np.ndarray,
+        base_key: Hashable = None,
+        cache: ShapeRasterCache | None = None,
+    ):
+        self.base = np.asarray(base, dtype=bool)
+        self.base_key = base_key
+        self.cache = cache if cache is not None else ShapeRasterCache()
+        self.shapes: list[dict] = []
+        self._coverage = np.zeros(self.base.shape, dtype=np.uint16)
+        self._mask = self.base.copy()
+        self._active: dict[str, tuple[tuple[BBox, np.ndarray] | None, int]] = {}
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """The (rows, cols) shape of the mask."""
+        return self.base.shape
+
+    @property
+    def mask(self) -> np.ndarray:
+        """A copy of the current composite mask."""
+        return self._mask.copy()
+
+    def rebase(self, base: np.ndarray, base_key: Hashable = None) -> np.ndarray:
+        """
+        Replace the base mask, keeping the drawn shapes.
+
+        Parameters
+        ----------
+        base : np.ndarray
+            The new boolean base mask, of the same shape as the existing one.
+        base_key : Hashable, optional
+            An identifier of the new base mask contents, by default None.
+
+        Returns
+        -------
+        np.ndarray
+            A copy of the updated composite mask.
+        """
+        base = np.asarray(base, dtype=bool)
+        if base.shape != self.shape:
+            raise ValueError(
+                f"Base mask shape {base.shape} does not match mask shape {self.shape}."
+            )
+        self.base = base
+        self.base_key = base_key
+        np.logical_or(self.base, self._coverage > 0, out=self._mask)
+        return self.mask
+
+    def clear(self) -> np.ndarray:
+        """
+        Remove all drawn shapes, leaving only the base mask.
+
+        Returns
+        -------
+        np.ndarray
+            A copy of the updated composite mask.
+        """
+        self.shapes = []
+        self._active.clear()
+        self._coverage.fill(0)
+        np.copyto(self._mask, self.base)
+        return self.mask
+
+    def _apply(self, raster: tuple[BBox, np.ndarray] | None, sign: int) -> None:
+        """Add (`sign=1`) or remove (`sign=-1`) a raster from the coverage count."""
+        if raster is None:
+            return
+        bbox, sub_mask = raster
+        coverage = self._coverage[bbox]
+        if sign > 0:
+            coverage += sub_mask
+        else:
+            coverage -= sub_mask
+        np.logical_or(self.base[bbox], coverage > 0, out=self._mask[bbox])
+
+    def update(self, shapes: list[dict]) -> np.ndarray:
+        """
+        Set the drawn shapes, rasterizing and recomposing only the changes.
+
+        Parameters
+        ----------
+        shapes : list[dict]
+            The full list of Plotly layout shapes.
+
+        Returns
+        -------
+        np.ndarray
+            A copy of the updated composite mask.
+        """
+        rasters = {}
+        wanted = Counter()
+        for shape_data in shapes:
+            key, raster = self.cache.get(shape_data, self.shape)
+            rasters[key] = raster
+            wanted[key] += 1
+
+        # Remove the contributions of shapes that are no longer drawn.
+        for key, (raster, count) in list(self._active.items()):
+            removed = count - wanted.get(key, 0)
+            for _ in range(max(removed, 0)):
+                self._apply(raster, -1)
+            if key not in wanted:
+                del self._active[key]
+        # Add the contributions of new shapes.
+        for key, count in wanted.items():
+            _, current = self._active.get(key, (None, 0))
+            for _ in range(max(count - current, 0)):
+                self._apply(rasters[key], 1)
+            self._active[key] = (rasters[key], count)
+
+        self.shapes = list(shapes)
+        return self.mask
+
+    def update_from_relayout(self, relayout_data: dict | None) -> np.ndarray:
+        """
+        Update the drawn shapes from a Plotly `relayoutData` event.
+
+        Handles both the full `shapes` list (sent when shapes are drawn or
+        erased) and partial `shapes[i].key` updates (sent when a shape is
+        dragged or resized). Events that do not modify shapes, such as zooming,
+        leave the mask unchanged.
+
+        Parameters
+        ----------
+        relayout_data : dict | None
+            The `relayoutData` of the figure.
+
+        Returns
+        -------
+        np.ndarray
+            A copy of the updated composite mask.
+        """
+        if not relayout_data:
+            return self.mask
+        if "shapes" in relayout_data:
+            return self.update(relayout_data["shapes"])
+
+        shapes = None
+        for prop, value in relayout_data.items():
+            match = _RELAYOUT_SHAPE_KEY.match(prop)
+            if match is None:
+                continue
+            index, attr = int(match.group(1)), match.group(2)
+            if index >= len(self.shapes):
+                continue
+            if shapes is None:
+                shapes = [dict(s) for s in self.shapes]
+            shapes[index][attr] = value
+        if shapes is None:
+            return self.mask
+        return self.update(shapes)
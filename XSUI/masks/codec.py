@@ -0,0 +1,84 @@
+"""
+A compact, pickle-free serialization of boolean pixel masks.
+
+Masks are bit-packed (one bit per pixel) and then zlib compressed. The shape
+and dtype of the mask are stored alongside the encoded bytes rather than in
+them, so that they can be held in separate database columns.
+"""
+
+import zlib
+
+import numpy as np
+
+MASK_CODEC_VERSION = 1
+"""The version of the mask encoding produced by `encode_mask`."""
+
+
+def encode_mask(mask: np.ndarray, level: int = 6) -> tuple[bytes, tuple[int, ...], str]:
+    """
+    Encode a mask as bit-packed, zlib compressed bytes.
+
+    Any non-zero pixel is considered masked.
+
+    Parameters
+    ----------
+    mask : np.ndarray
+        The mask array, of any dtype.
+    level : int, optional
+        The zlib compression level, by default 6.
+
+    Returns
+    -------
+    data : bytes
+        The encoded mask.
+    shape : tuple[int, ...]
+        The shape of the mask.
+    dtype : str
+        The dtype of the mask, restored on decoding.
+    """
+    mask = np.asarray(mask)
+    packed = np.packbits(mask.ravel() != 0)
+    return zlib.compress(packed.tobytes(), level), mask.shape, mask.dtype.str
+
+
+def decode_mask(
+    data: bytes,
+    shape: tuple[int, ...] | list[int],
+    dtype: str = "|b1",
+    version: int = MASK_CODEC_VERSION,
+) -> np.ndarray:
+    """
+    Decode a mask encoded by `encode_mask`.
+
+    Parameters
+    ----------
+    data : bytes
+        The encoded mask.
+    shape : tuple[int, ...] | list[int]
+        The shape of the mask.
+    dtype : str, optional
+        The dtype of the mask, by default boolean.
+    version : int, optional
+        The version of the encoding, by default `MASK_CODEC_VERSION`.
+
+    Returns
+    -------
+    np.ndarray
+        The decoded mask.
+
+    Raises
+    ------
+    ValueError
+        If the encoding version is unsupported, or the data does not match the shape.
+    """
+    if version != MASK_CODEC_VERSION:
+        raise ValueError(f"Unsupported mask encoding version {version}.")
+    shape = tuple(shape)
+    count = int(np.prod(shape))
+    packed = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    if packed.size != (count + 7) // 8:
+        raise ValueError(
+            f"Encoded mask of {packed.size} bytes does not match the shape {shape}."
+        )
+    mask = np.unpackbits(packed, count=count).view(bool).reshape(shape)
+    return mask.astype(np.dtype(dtype), copy=False)
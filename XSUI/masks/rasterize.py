@@ -0,0 +1,371 @@
+"""
+Vectorized rasterization of drawn shapes into boolean pixel masks.
+
+Shapes drawn on the calibration image are given in data (pixel) coordinates,
+where the centre of pixel ``[row, col]`` sits at ``(x=col, y=row)``. All
+rasterization is restricted to the bounding box of the shape (clipped to the
+image), so the cost scales with the area of the shape rather than with the
+size of the detector.
+"""
+
+import numpy as np
+from svg.path import parse_path, Path, Move, Linear
+
+BBox = tuple[slice, slice]
+"""A (rows, cols) pair of slices locating a sub-mask inside the full image."""
+
+
+def _clip_bbox(
+    x_min: float, y_min: float, x_max: float, y_max: float, shape: tuple[int, int]
+) -> BBox | None:
+    """
+    Convert a floating point bounding box into the pixel slices it covers.
+
+    Parameters
+    ----------
+    x_min, y_min, x_max, y_max : float
+        The bounding box in data coordinates.
+    shape : tuple[int, int]
+        The (rows, cols) shape of the image.
+
+    Returns
+    -------
+    BBox | None
+        The (rows, cols) slices of the pixel centres inside the bounding box,
+        or None if the bounding box does not overlap the image.
+    """
+    r0 = max(int(np.ceil(y_min)), 0)
+    r1 = min(int(np.floor(y_max)) + 1, shape[0])
+    c0 = max(int(np.ceil(x_min)), 0)
+    c1 = min(int(np.floor(x_max)) + 1, shape[1])
+    if r0 >= r1 or c0 >= c1:
+        return None
+    return slice(r0, r1), slice(c0, c1)
+
+
+def flatten_path(path: str | Path, tolerance: float = 0.25) -> list[np.ndarray]:
+    """
+    Flatten an SVG path into a list of polygons.
+
+    Linear segments contribute their end points, while curved segments
+    (Bezier curves and arcs) are sampled so that consecutive vertices are no
+    more than `tolerance` pixels apart along the curve.
+
+    Parameters
+    ----------
+    path : str | Path
+        An SVG path description (as produced by the Plotly shape drawing tools)
+        or an already parsed `svg.path.Path`.
+    tolerance : float, optional
+        The maximum arc length between vertices of a flattened curve, in pixels.
+        By default 0.25.
+
+    Returns
+    -------
+    list[np.ndarray]
+        One (N, 2) array of (x, y) vertices per sub-path.
+    """
+    if isinstance(path, str):
+        path = parse_path(path)
+
+    polygons: list[np.ndarray] = []
+    vertices: list[complex] = []
+    for segment in path:
+        if isinstance(segment, Move):
+            # A move starts a new sub-path
+            if len(vertices) > 2:
+                polygons.append(vertices)
+            vertices = [segment.end]
+            continue
+        if not vertices:
+            vertices = [segment.start]
+        if isinstance(segment, Linear):
+            vertices.append(segment.end)
+        else:
+            n = int(np.clip(np.ceil(segment.length() / tolerance), 2, 4096))
+            vertices.extend(segment.point(t) for t in np.linspace(0, 1, n + 1)[1:])
+    if len(vertices) > 2:
+        polygons.append(vertices)
+
+    return [
+        np.column_stack([np.real(poly), np.imag(poly)]).astype(np.float64)
+        for poly in map(np.asarray, polygons)
+    ]
+
+
+def _polygon_edges(polygons: list[np.ndarray]) -> np.ndarray:
+    """Return the closed edges of each polygon as an (E, 4) array of x0, y0, x1, y1."""
+    edges = [
+        np.column_stack([poly, np.roll(poly, -1, axis=0)])
+        for poly in polygons
+        if len(poly) > 2
+    ]
+    if not edges:
+        return np.empty((0, 4), dtype=np.float64)
+    return np.concatenate(edges)
+
+
+def rasterize_polygons(
+    polygons: list[np.ndarray], shape: tuple[int, int]
+) -> tuple[BBox, np.ndarray] | None:
+    """
+    Rasterize polygons with the even-odd rule inside their bounding box.
+
+    Each edge is intersected with the pixel-centre scanlines it spans, and the
+    interior of every scanline is filled by the parity of the crossings to the
+    left of each pixel. The work is proportional to the number of crossings plus
+    the area of the bounding box, with no per-pixel Python loop.
+
+    Parameters
+    ----------
+    polygons : list[np.ndarray]
+        A list of (N, 2) arrays of (x, y) vertices. Polygons are implicitly
+        closed, and overlapping polygons are combined with the even-odd rule.
+    shape : tuple[int, int]
+        The (rows, cols) shape of the image.
+
+    Returns
+    -------
+    tuple[BBox, np.ndarray] | None
+        The (rows, cols) slices of the bounding box and the boolean mask within
+        it, or None if the polygons do not cover any pixel of the image.
+    """
+    edges = _polygon_edges(polygons)
+    if len(edges) == 0:
+        return None
+    xs, ys = edges[:, [0, 2]], edges[:, [1, 3]]
+    bbox = _clip_bbox(xs.min(), ys.min(), xs.max(), ys.max(), shape)
+    if bbox is None:
+        return None
+    rows, cols = bbox
+    n_rows, n_cols = rows.stop - rows.start, cols.stop - cols.start
+
+    # Only non-horizontal edges can cross a scanline.
+    x0, y0, x1, y1 = edges[edges[:, 1] != edges[:, 3]].T
+    y_lo, y_hi = np.minimum(y0, y1), np.maximum(y0, y1)
+    # Scanlines y crossed by each edge, with the half-open rule y_lo <= y < y_hi
+    # so that shared vertices are only counted once.
+    first = np.clip(np.ceil(y_lo).astype(np.int64), rows.start, rows.stop)
+    last = np.clip(np.ceil(y_hi).astype(np.int64), rows.start, rows.stop)
+    counts = last - first
+    valid = counts > 0
+    x0, y0, x1, y1 = x0[valid], y0[valid], x1[valid], y1[valid]
+    first, counts = first[valid], counts[valid]
+    if len(counts) == 0:
+        return bbox, np.zeros((n_rows, n_cols), dtype=bool)
+
+    # Expand every edge into the scanlines it crosses.
+    edge_idx = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    y = (first[edge_idx] + offsets).astype(np.float64)
+    t = (y - y0[edge_idx]) / (y1[edge_idx] - y0[edge_idx])
+    x_cross = x0[edge_idx] + t * (x1[edge_idx] - x0[edge_idx])
+
+    # Toggle the parity of every pixel centre strictly to the right of a crossing.
+    col = np.clip(np.floor(x_cross).astype(np.int64) + 1 - cols.start, 0, n_cols)
+    toggles = np.zeros((n_rows, n_cols + 1), dtype=np.uint8)
+    np.add.at(toggles, (y.astype(np.int64) - rows.start, col), 1)
+    inside = np.cumsum(toggles[:, :-1], axis=1, dtype=np.uint8) & 1
+    return bbox, inside.astype(bool)
+
+
+def polygon_mask(
+    vertices: np.ndarray | list[np.ndarray],
+    shape: tuple[int, int],
+    out: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Create a boolean mask of the pixels inside a polygon.
+
+    Parameters
+    ----------
+    vertices : np.ndarray | list[np.ndarray]
+        An (N, 2) array of (x, y) vertices, or a list of such arrays which are
+        combined with the even-odd rule.
+    shape : tuple[int, int]
+        The (rows, cols) shape of the image.
+    out : np.ndarray | None, optional
+        A boolean mask to OR the polygon into. By default a new mask is created.
+
+    Returns
+    -------
+    np.ndarray
+        The boolean mask of the image shape.
+    """
+    if out is None:
+        out = np.zeros(shape, dtype=bool)
+    polygons = [vertices] if isinstance(vertices, np.ndarray) else vertices
+    raster = rasterize_polygons(
+        [np.asarray(p, dtype=np.float64) for p in polygons], shape
+    )
+    if raster is not None:
+        bbox, sub_mask = raster
+        out[bbox] |= sub_mask
+    return out
+
+
+def path_mask(
+    path: str | Path,
+    shape: tuple[int, int],
+    out: np.ndarray | None = None,
+    tolerance: float = 0.25,
+) -> np.ndarray:
+    """
+    Create a boolean mask of the pixels inside a closed SVG path.
+
+    Parameters
+    ----------
+    path : str | Path
+        The SVG path description, such as the `path` of a Plotly drawn shape.
+    shape : tuple[int, int]
+        The (rows, cols) shape of the image.
+    out : np.ndarray | None, optional
+        A boolean mask to OR the path into. By default a new mask is created.
+    tolerance : float, optional
+        The flattening tolerance of curved segments in pixels, by default 0.25.
+
+    Returns
+    -------
+    np.ndarray
+        The boolean mask of the image shape.
+    """
+    return polygon_mask(flatten_path(path, tolerance), shape, out=out)
+
+
+def rasterize_rectangle(
+    x0: float, y0: float, x1: float, y1: float, shape: tuple[int, int]
+) -> tuple[BBox, np.ndarray] | None:
+    """
+    Rasterize an axis-aligned rectangle inside its bounding box.
+
+    Parameters
+    ----------
+    x0, y0, x1, y1 : float
+        Opposite corners of the rectangle in data coordinates, in any order.
+        Pixel centres on the boundary are included.
+    shape : tuple[int, int]
+        The (rows, cols) shape of the image.
+
+    Returns
+    -------
+    tuple[BBox, np.ndarray] | None
+        The (rows, cols) slices of the bounding box and the boolean mask within
+        it, or None if the rectangle does not cover any pixel of the image.
+    """
+    bbox = _clip_bbox(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1), shape)
+    if bbox is None:
+        return None
+    rows, cols = bbox
+    return bbox, np.ones((rows.stop - rows.start, cols.stop - cols.start), bool)
+
+
+def rasterize_ellipse(
+    x0: float, y0: float, x1: float, y1: float, shape: tuple[int, int]
+) -> tuple[BBox, np.ndarray] | None:
+    """
+    Rasterize the ellipse inscribed in a rectangle inside its bounding box.
+
+    This matches the Plotly `circle` shape, which is defined by its bounding
+    rectangle and is a circle when the rectangle is square.
+
+    Parameters
+    ----------
+    x0, y0, x1, y1 : float
+        Opposite corners of the bounding rectangle in data coordinates.
+    shape : tuple[int, int]
+        The (rows, cols) shape of the image.
+
+    Returns
+    -------
+    tuple[BBox, np.ndarray] | None
+        The (rows, cols) slices of the bounding box and the boolean mask within
+        it, or None if the ellipse does not cover any pixel of the image.
+    """
+    bbox = _clip_bbox(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1), shape)
+    if bbox is None:
+        return None
+    rows, cols = bbox
+    radius_x, radius_y = abs(x1 - x0) / 2, abs(y1 - y0) / 2
+    if radius_x == 0 or radius_y == 0:
+        return None
+    # Open (broadcast) grids keep the temporaries to one row plus one column.
+    dy = (np.arange(rows.start, rows.stop) - (y0 + y1) / 2)[:, np.newaxis] / radius_y
+    dx = (np.arange(cols.start, cols.stop) - (x0 + x1) / 2)[np.newaxis, :] / radius_x
+    return bbox, (dy**2 + dx**2) <= 1
+
+
+def rasterize_shape(
+    shape_data: dict, shape: tuple[int, int]
+) -> tuple[BBox, np.ndarray] | None:
+    """
+    Rasterize a Plotly drawn shape inside its bounding box.
+
+    Parameters
+    ----------
+    shape_data : dict
+        A Plotly layout shape, as found in `relayoutData["shapes"]`. Supports
+        the `rect`, `circle` and `path` shape types.
+    shape : tuple[int, int]
+        The (rows, cols) shape of the image.
+
+    Returns
+    -------
+    tuple[BBox, np.ndarray] | None
+        The (rows, cols) slices of the bounding box and the boolean mask within
+        it, or None if the shape type is unsupported or covers no pixels.
+    """
+    match shape_data.get("type"):
+        case "rect":
+            return rasterize_rectangle(
+                shape_data["x0"],
+                shape_data["y0"],
+                shape_data["x1"],
+                shape_data["y1"],
+                shape,
+            )
+        case "circle":
+            return rasterize_ellipse(
+                shape_data["x0"],
+                shape_data["y0"],
+                shape_data["x1"],
+                shape_data["y1"],
+                shape,
+            )
+        case "path":
+            return rasterize_polygons(flatten_path(shape_data["path"]), shape)
+    return None
+
+
+def shapes_mask(
+    shapes: list[dict],
+    shape: tuple[int, int],
+    out: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Combine Plotly drawn shapes into a single boolean mask.
+
+    Every shape is rasterized only within its clipped bounding box and OR'ed
+    into one mask buffer, so no full image temporaries are created per shape.
+
+    Parameters
+    ----------
+    shapes : list[dict]
+        The Plotly layout shapes, as found in `relayoutData["shapes"]`.
+    shape : tuple[int, int]
+        The (rows, cols) shape of the image.
+    out : np.ndarray | None, optional
+        A boolean mask to OR the shapes into. By default a new mask is created.
+
+    Returns
+    -------
+    np.ndarray
+        The boolean mask of the image shape.
+    """
+    if out is None:
+        out = np.zeros(shape, dtype=bool)
+    for shape_data in shapes:
+        raster = rasterize_shape(shape_data, shape)
+        if raster is not None:
+            bbox, sub_mask = raster
+            out[bbox] |= sub_mask
+    return out
@@ -0,0 +1,26 @@
+"""
+Storage of image data outside of the browser and the database.
+"""
+
+from XSUI.storage.image_store import ImageStore, image_digest, image_store
+from XSUI.storage.uploads import (
+    SpooledUpload,
+    UploadSpool,
+    spool_bytes,
+    purge_uploads,
+    read_image,
+)
+from XSUI.storage.frames import (
+    FrameSource,
+    NpyFrameSource,
+    FabioFrameSource,
+    HDF5FrameSource,
+    open_frames,
+)
+from XSUI.storage.codec import (
+    EncodedImage,
+    encode_frame,
+    decode_frame,
+    decode_rows,
+)
+from XSUI.storage.blobs import BlobStore, blob_store
@@ -0,0 +1,179 @@
+"""
+A content-addressed store of blobs on disk, outside of the database.
+
+Blobs are named by the hash of their contents and sharded into subdirectories
+by the first two characters of the hash. Writes go to a temporary file in the
+same directory and are atomically renamed into place, so readers never see a
+partial blob, and writing a blob that already exists costs only the hash.
+Blobs are read through memory maps, so a read only touches the pages used and
+never copies the file into memory.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from XSUI.storage.image_store import image_digest
+
+BLOB_DIR = os.path.join(tempfile.gettempdir(), "XSUI_blobs")
+"""The default directory of the blob store."""
+
+ARRAY_SUFFIX = "npy"
+"""The suffix of blobs holding raw `.npy` arrays."""
+
+
+class BlobStore:
+    """
+    A content-addressed, deduplicated store of files.
+
+    Parameters
+    ----------
+    root : str, optional
+        The directory of the store, by default `BLOB_DIR`.
+    """
+
+    def __init__(self, root: str = BLOB_DIR):
+        self.root = root
+
+    def __repr__(self):
+        return f"<BlobStore root={self.root}>"
+
+    def path(self, digest: str, suffix: str = "") -> str:
+        """The path of a blob, by its digest and suffix."""
+        name = f"{digest}.{suffix}" if suffix else digest
+        return os.path.join(self.root, digest[:2], name)
+
+    def __contains__(self, key: str | tuple[str, str]) -> bool:
+        digest, suffix = (key, "") if isinstance(key, str) else key
+        return os.path.exists(self.path(digest, suffix))
+
+    def _write(self, path: str, write) -> bool:
+        """Atomically write a blob with `write(file)`, unless it already exists."""
+        if os.path.exists(path):
+            return False
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return True
+
+    def put_bytes(
+        self, data: bytes | memoryview, digest: str | None = None, suffix: str = ""
+    ) -> str:
+        """
+        Store a blob of bytes.
+
+        Parameters
+        ----------
+        data : bytes | memoryview
+            The blob contents.
+        digest : str | None, optional
+            The digest to store the blob under. By default the hash of `data`.
+        suffix : str, optional
+            The suffix of the blob file, identifying its format, by default none.
+
+        Returns
+        -------
+        str
+            The digest of the blob.
+        """
+        if digest is None:
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        self._write(self.path(digest, suffix), lambda f: f.write(data))
+        return digest
+
+    def put_array(self, data: np.ndarray, digest: str | None = None) -> str:
+        """
+        Store an array as a memory-mappable `.npy` blob.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            The array.
+        digest : str | None, optional
+            The digest to store the array under. By default the `image_digest`
+            of the array.
+
+        Returns
+        -------
+        str
+            The digest of the array.
+        """
+        if digest is None:
+            digest = image_digest(data)
+        self._write(
+            self.path(digest, ARRAY_SUFFIX),
+            lambda f: np.save(f, np.ascontiguousarray(data), allow_pickle=False),
+        )
+        return digest
+
+    def open_bytes(self, digest: str, suffix: str = "") -> np.ndarray:
+        """
+        Memory-map a blob of bytes.
+
+        Parameters
+        ----------
+        digest : str
+            The digest of the blob.
+        suffix : str, optional
+            The suffix of the blob file, by default none.
+
+        Returns
+        -------
+        np.ndarray
+            The read-only uint8 memory map of the blob.
+
+        Raises
+        ------
+        KeyError
+            If the blob is not in the store.
+        """
+        path = self.path(digest, suffix)
+        if not os.path.exists(path):
+            raise KeyError(f"Blob `{digest}` not found in {self.root}.")
+        if os.path.getsize(path) == 0:
+            return np.empty(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode="r")
+
+    def open_array(self, digest: str) -> np.ndarray:
+        """
+        Memory-map an array stored by `put_array`.
+
+        Parameters
+        ----------
+        digest : str
+            The digest of the array.
+
+        Returns
+        -------
+        np.ndarray
+            The read-only memory-mapped array.
+
+        Raises
+        ------
+        KeyError
+            If the array is not in the store.
+        """
+        path = self.path(digest, ARRAY_SUFFIX)
+        if not os.path.exists(path):
+            raise KeyError(f"Array `{digest}` not found in {self.root}.")
+        return np.load(path, mmap_mode="r")
+
+    def delete(self, digest: str, suffix: str = "") -> None:
+        """Remove a blob from the store, if present."""
+        try:
+            os.remove(self.path(digest, suffix))
+        except FileNotFoundError:
+            pass
+
+
+blob_store = BlobStore()
+"""The process-wide blob store of the web application."""
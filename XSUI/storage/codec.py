@@ -0,0 +1,284 @@
+"""
+A compressed, chunked serialization of detector images for database blobs.
+
+Images are split into chunks of whole rows, and each chunk is byte-shuffled
+and compressed independently. Byte shuffling groups the bytes of equal
+significance across pixels, so the high bytes of integer detector counts (and
+the large zero or gap regions of detector frames) compress to almost nothing.
+Because chunks are independent, a range of rows is decoded by decompressing
+only the chunks that overlap it.
+
+Chunks are compressed with zlib, from the standard library, or stored
+uncompressed. The shape, dtype, compression and chunk offsets are stored
+alongside the encoded bytes rather than in them, so that they can be held in
+separate database columns.
+"""
+
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+
+IMAGE_CODEC_VERSION = 1
+"""The version of the image encoding produced by `encode_frame`."""
+
+DEFAULT_CHUNK_ROWS = 64
+"""The number of image rows per independently compressed chunk."""
+
+DEFAULT_COMPRESSION = "zlib"
+"""The chunk compression of new images."""
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    """
+    An image encoded by `encode_frame`.
+
+    Attributes
+    ----------
+    data : bytes
+        The concatenated compressed chunks.
+    shape : tuple[int, ...]
+        The shape of the image.
+    dtype : str
+        The dtype string of the image.
+    compression : str
+        The chunk compression, "zlib" or "none".
+    chunk_rows : int
+        The number of rows per chunk.
+    offsets : tuple[int, ...]
+        The byte offset of each chunk in `data`, followed by the total length.
+    shuffle : bool
+        Whether the chunk bytes are shuffled before compression.
+    """
+
+    data: bytes
+    shape: tuple[int, ...]
+    dtype: str
+    compression: str
+    chunk_rows: int
+    offsets: tuple[int, ...]
+    shuffle: bool = True
+
+    @property
+    def ratio(self) -> float:
+        """The compression ratio of the image."""
+        nbytes = int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+        return nbytes / max(len(self.data), 1)
+
+
+def shuffle_bytes(data: np.ndarray) -> bytes:
+    """Group the bytes of equal significance of every element together."""
+    itemsize = data.dtype.itemsize
+    raw = np.ascontiguousarray(data).view(np.uint8)
+    if itemsize == 1:
+        return raw.tobytes()
+    return raw.reshape(-1, itemsize).T.tobytes()
+
+
+def unshuffle_bytes(data: bytes, dtype: np.dtype) -> np.ndarray:
+    """Invert `shuffle_bytes`, returning a flat array of `dtype`."""
+    dtype = np.dtype(dtype)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if dtype.itemsize == 1:
+        return raw.view(dtype)
+    return np.ascontiguousarray(raw.reshape(dtype.itemsize, -1).T).view(dtype).ravel()
+
+
+def _compress(data: bytes, compression: str, level: int | None) -> bytes:
+    if compression == "zlib":
+        return zlib.compress(data, level or 6)
+    if compression == "none":
+        return data
+    raise ValueError(f"Unsupported image compression `{compression}`.")
+
+
+def _decompress(data: bytes, compression: str) -> bytes:
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "none":
+        return bytes(data)
+    raise ValueError(f"Unsupported image compression `{compression}`.")
+
+
+def encode_frame(
+    image: np.ndarray,
+    compression: str = DEFAULT_COMPRESSION,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    shuffle: bool | None = None,
+    level: int | None = None,
+) -> EncodedImage:
+    """
+    Encode an image as chunks of byte-shuffled, compressed rows.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The image data, with rows along the first axis.
+    compression : str, optional
+        The chunk compression, "zlib" or "none", by default
+        `DEFAULT_COMPRESSION`.
+    chunk_rows : int, optional
+        The number of rows per chunk, by default `DEFAULT_CHUNK_ROWS`.
+    shuffle : bool | None, optional
+        Whether to shuffle the bytes of each chunk. By default images with
+        multi-byte elements are shuffled.
+    level : int | None, optional
+        The compression level, by default that of the compressor.
+
+    Returns
+    -------
+    EncodedImage
+        The encoded image and the metadata needed to decode it.
+    """
+    image = np.atleast_2d(np.asarray(image))
+    if shuffle is None:
+        shuffle = image.dtype.itemsize > 1
+    chunks = []
+    offsets = [0]
+    for start in range(0, max(image.shape[0], 1), chunk_rows):
+        chunk = image[start : start + chunk_rows]
+        raw = shuffle_bytes(chunk) if shuffle else np.ascontiguousarray(chunk).tobytes()
+        chunks.append(_compress(raw, compression, level))
+        offsets.append(offsets[-1] + len(chunks[-1]))
+    return EncodedImage(
+        b"".join(chunks),
+        image.shape,
+        image.dtype.str,
+        compression,
+        chunk_rows,
+        tuple(offsets),
+        shuffle,
+    )
+
+
+def chunk_range(
+    offsets: tuple[int, ...] | list[int], chunk_rows: int, start: int, stop: int
+) -> tuple[int, int, int, int]:
+    """
+    Find the chunks, and their byte range, overlapping a range of rows.
+
+    Parameters
+    ----------
+    offsets : tuple[int, ...] | list[int]
+        The chunk byte offsets of the encoded image.
+    chunk_rows : int
+        The number of rows per chunk.
+    start, stop : int
+        The range of rows.
+
+    Returns
+    -------
+    first, last : int
+        The range of chunk indices.
+    byte_start, byte_stop : int
+        The byte range of those chunks in the encoded data.
+    """
+    first = start // chunk_rows
+    last = min(-(-stop // chunk_rows), len(offsets) - 1)
+    return first, last, offsets[first], offsets[last]
+
+
+def decode_rows(
+    data: bytes,
+    shape: tuple[int, ...] | list[int],
+    dtype: str,
+    compression: str,
+    chunk_rows: int,
+    offsets: tuple[int, ...] | list[int],
+    start: int = 0,
+    stop: int | None = None,
+    shuffle: bool = True,
+    version: int = IMAGE_CODEC_VERSION,
+    data_offset: int = 0,
+) -> np.ndarray:
+    """
+    Decode a range of rows of an image encoded by `encode_frame`.
+
+    Only the chunks overlapping the rows are decompressed.
+
+    Parameters
+    ----------
+    data : bytes
+        The encoded image, or a slice of it starting at `data_offset`.
+    shape : tuple[int, ...] | list[int]
+        The shape of the image.
+    dtype : str
+        The dtype of the image.
+    compression : str
+        The chunk compression.
+    chunk_rows : int
+        The number of rows per chunk.
+    offsets : tuple[int, ...] | list[int]
+        The chunk byte offsets of the encoded image.
+    start : int, optional
+        The first row to decode, by default 0.
+    stop : int | None, optional
+        The row after the last to decode, by default the last row.
+    shuffle : bool, optional
+        Whether the chunk bytes were shuffled, by default True.
+    version : int, optional
+        The version of the encoding, by default `IMAGE_CODEC_VERSION`.
+    data_offset : int, optional
+        The offset of `data` within the encoded image, when only the bytes of
+        the required chunks were read, by default 0.
+
+    Returns
+    -------
+    np.ndarray
+        The decoded rows.
+
+    Raises
+    ------
+    ValueError
+        If the encoding version is unsupported, or the data does not match the shape.
+    """
+    if version != IMAGE_CODEC_VERSION:
+        raise ValueError(f"Unsupported image encoding version {version}.")
+    shape = tuple(shape)
+    dtype = np.dtype(dtype)
+    stop = shape[0] if stop is None else min(stop, shape[0])
+    start = max(start, 0)
+    if stop <= start:
+        return np.empty((0, *shape[1:]), dtype=dtype)
+    first, last, _, _ = chunk_range(offsets, chunk_rows, start, stop)
+    out = np.empty((stop - start, *shape[1:]), dtype=dtype)
+    for i in range(first, last):
+        chunk_start = i * chunk_rows
+        nrows = min(chunk_rows, shape[0] - chunk_start)
+        raw = _decompress(
+            data[offsets[i] - data_offset : offsets[i + 1] - data_offset], compression
+        )
+        if shuffle:
+            chunk = unshuffle_bytes(raw, dtype)
+        else:
+            chunk = np.frombuffer(raw, dtype=dtype)
+        if chunk.size != nrows * int(np.prod(shape[1:])):
+            raise ValueError(f"Encoded chunk {i} does not match the shape {shape}.")
+        chunk = chunk.reshape(nrows, *shape[1:])
+        lo, hi = max(start, chunk_start), min(stop, chunk_start + nrows)
+        out[lo - start : hi - start] = chunk[lo - chunk_start : hi - chunk_start]
+    return out
+
+
+def decode_frame(
+    data: bytes,
+    shape: tuple[int, ...] | list[int],
+    dtype: str,
+    compression: str,
+    chunk_rows: int,
+    offsets: tuple[int, ...] | list[int],
+    shuffle: bool = True,
+    version: int = IMAGE_CODEC_VERSION,
+) -> np.ndarray:
+    """Decode a whole image encoded by `encode_frame` (see `decode_rows`)."""
+    return decode_rows(
+        data,
+        shape,
+        dtype,
+        compression,
+        chunk_rows,
+        offsets,
+        shuffle=shuffle,
+        version=version,
+    )
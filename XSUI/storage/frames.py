@@ -0,0 +1,316 @@
+"""
+Lazy, random access to the frames of single and multi-frame image files.
+
+A `FrameSource` exposes the frames of a file as a sequence, reading only the
+requested frame. Uncompressed frames (raw EDF frames, contiguous HDF5 datasets
+and `.npy` stacks) are memory-mapped, so reading them costs no more than the
+pages touched. Compressed frames are decoded on demand and kept in a small
+least-recently-used cache, so browsing a long scan holds only a few frames in
+memory.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Iterator
+
+import fabio
+import h5py
+import numpy as np
+
+try:
+    # Registers the compression filters (i.e. bitshuffle/LZ4) of Eiger HDF5 files.
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+HDF5_EXTENSIONS = (".h5", ".hdf5", ".hdf", ".nxs")
+"""File extensions opened with `h5py` rather than `fabio`."""
+
+
+class FrameSource:
+    """
+    Base class of a lazily read sequence of image frames.
+
+    Subclasses implement `__len__` and `_read`, which returns a single frame.
+
+    Parameters
+    ----------
+    path : str
+        The path of the image file.
+    cache_size : int, optional
+        The number of decoded (i.e. not memory-mapped) frames to cache, by default 4.
+    """
+
+    def __init__(self, path: str, cache_size: int = 4):
+        self.path = path
+        self.cache_size = cache_size
+        self._cache: OrderedDict[int, np.ndarray] = OrderedDict()
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"<{type(self).__name__} path={self.path} frames={len(self)}>"
+
+    def _read(self, index: int) -> tuple[np.ndarray, bool]:
+        """Read a frame, returning the frame and whether it is memory-mapped."""
+        raise NotImplementedError
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError(f"Frame {index} out of range for {n} frames.")
+        frame = self._cache.get(index)
+        if frame is not None:
+            self._cache.move_to_end(index)
+            return frame
+        frame, mapped = self._read(index)
+        frame.flags.writeable = False
+        if not mapped and self.cache_size > 0:
+            self._cache[index] = frame
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return frame
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def header(self) -> dict:
+        """The metadata of the file, such as its acquisition time, if any."""
+        return {}
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        """The shape of a single frame."""
+        return self[0].shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        """The dtype of the frames."""
+        return self[0].dtype
+
+    def close(self) -> None:
+        """Release the file handles and the decoded frame cache."""
+        self._cache.clear()
+
+    def __enter__(self) -> "FrameSource":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+class NpyFrameSource(FrameSource):
+    """
+    Frames of a 2D image or 3D stack stored as a `.npy` file, memory-mapped.
+
+    Parameters
+    ----------
+    path : str
+        The path of the `.npy` file.
+    cache_size : int, optional
+        Unused, as all frames are memory-mapped.
+    """
+
+    def __init__(self, path: str, cache_size: int = 4):
+        super().__init__(path, cache_size)
+        self._array = np.load(path, mmap_mode="r")
+        if self._array.ndim == 2:
+            self._array = self._array[np.newaxis]
+
+    def __len__(self) -> int:
+        return self._array.shape[0]
+
+    def _read(self, index: int) -> tuple[np.ndarray, bool]:
+        return self._array[index], True
+
+
+class FabioFrameSource(FrameSource):
+    """
+    Frames of any image format supported by `fabio`.
+
+    Raw (uncompressed, not gzipped) EDF frames are memory-mapped from their
+    offset in the file. Other frames are decoded by `fabio` on demand.
+
+    Parameters
+    ----------
+    path : str
+        The path of the image file.
+    cache_size : int, optional
+        The number of decoded frames to cache, by default 4.
+    """
+
+    def __init__(self, path: str, cache_size: int = 4):
+        super().__init__(path, cache_size)
+        self._image = fabio.open(path)
+        self._nframes = max(getattr(self._image, "nframes", 1), 1)
+
+    def __len__(self) -> int:
+        return self._nframes
+
+    @property
+    def header(self) -> dict:
+        """The `fabio` header of the (first frame of the) file."""
+        return dict(self._image.header)
+
+    def _memmap_edf_frame(self, index: int) -> np.ndarray | None:
+        """Memory-map a raw EDF frame, or return None if it is not mappable."""
+        frames = getattr(self._image, "_frames", None)
+        if frames is None or self.path.endswith((".gz", ".bz2")):
+            return None
+        frame = frames[index]
+        if (
+            getattr(frame, "_data_compression", None) is not None
+            or getattr(frame, "bfname", None)
+            or getattr(frame, "incomplete_data", False)
+            or frame.start is None
+        ):
+            return None
+        dtype = np.dtype(frame._dtype)
+        if getattr(frame, "_data_byteorder", None) == "HighByteFirst":
+            dtype = dtype.newbyteorder(">")
+        else:
+            dtype = dtype.newbyteorder("<")
+        shape = tuple(frame.shape)
+        if int(np.prod(shape)) * dtype.itemsize > frame.blobsize:
+            return None
+        return np.memmap(
+            self.path, dtype=dtype, mode="r", offset=frame.start, shape=shape
+        )
+
+    def _read(self, index: int) -> tuple[np.ndarray, bool]:
+        mapped = self._memmap_edf_frame(index)
+        if mapped is not None:
+            return mapped, True
+        if self._nframes == 1:
+            return np.asarray(self._image.data), False
+        return np.asarray(self._image.getframe(index).data), False
+
+    def close(self) -> None:
+        super().close()
+        self._image.close()
+
+
+class HDF5FrameSource(FrameSource):
+    """
+    Frames of one or more 3D datasets in an HDF5 file, such as an Eiger master file.
+
+    Contiguous, uncompressed datasets are memory-mapped. Chunked or compressed
+    datasets are read one frame at a time, so only the chunks of the requested
+    frame are decoded.
+
+    Parameters
+    ----------
+    path : str
+        The path of the HDF5 file.
+    dataset : str | None, optional
+        The path of the dataset within the file. By default the Eiger/NeXus
+        `entry/data/data_*` datasets are used, or otherwise the largest 2D or
+        3D dataset in the file.
+    cache_size : int, optional
+        The number of decoded frames to cache, by default 4.
+    """
+
+    def __init__(self, path: str, dataset: str | None = None, cache_size: int = 4):
+        super().__init__(path, cache_size)
+        self._file = h5py.File(path, "r")
+        if dataset is not None:
+            self._datasets = [self._file[dataset]]
+        else:
+            self._datasets = self._find_datasets()
+        if not self._datasets:
+            raise ValueError(f"No image datasets found in `{path}`.")
+        lengths = [ds.shape[0] if ds.ndim == 3 else 1 for ds in self._datasets]
+        self._offsets = np.cumsum([0, *lengths])
+        self._mapped: dict[int, np.ndarray | None] = {}
+
+    def _find_datasets(self) -> list[h5py.Dataset]:
+        """Find the image datasets of an Eiger master file, or the largest one."""
+        data_group = self._file.get("entry/data")
+        if isinstance(data_group, h5py.Group):
+            names = sorted(k for k in data_group if k.startswith("data"))
+            datasets = []
+            for name in names:
+                try:
+                    datasets.append(data_group[name])
+                except KeyError:
+                    # An external link to a data file that is not present.
+                    continue
+            if datasets:
+                return datasets
+
+        found = []
+        self._file.visititems(
+            lambda name, obj: (
+                found.append(obj)
+                if isinstance(obj, h5py.Dataset) and obj.ndim in (2, 3)
+                else None
+            )
+        )
+        return [max(found, key=lambda ds: ds.size)] if found else []
+
+    def __len__(self) -> int:
+        return int(self._offsets[-1])
+
+    def _memmap_dataset(self, i: int) -> np.ndarray | None:
+        """Memory-map a contiguous, uncompressed dataset, or return None."""
+        if i not in self._mapped:
+            ds = self._datasets[i]
+            offset = ds.id.get_offset() if ds.chunks is None else None
+            if offset is None or ds.compression is not None:
+                self._mapped[i] = None
+            else:
+                self._mapped[i] = np.memmap(
+                    ds.file.filename,
+                    dtype=ds.dtype,
+                    mode="r",
+                    offset=offset,
+                    shape=ds.shape,
+                )
+        return self._mapped[i]
+
+    def _read(self, index: int) -> tuple[np.ndarray, bool]:
+        i = int(np.searchsorted(self._offsets, index, side="right")) - 1
+        ds = self._datasets[i]
+        local = index - self._offsets[i]
+        mapped = self._memmap_dataset(i)
+        if mapped is not None:
+            return (mapped[local] if ds.ndim == 3 else mapped), True
+        return (ds[local] if ds.ndim == 3 else ds[()]), False
+
+    def close(self) -> None:
+        super().close()
+        self._mapped.clear()
+        self._file.close()
+
+
+def open_frames(path: str, cache_size: int = 4, **kwargs) -> FrameSource:
+    """
+    Open the frames of an image file.
+
+    Parameters
+    ----------
+    path : str
+        The path of the image file. HDF5 files (see `HDF5_EXTENSIONS`) are
+        opened with `h5py`, `.npy` files with `numpy`, and all other formats
+        with `fabio`.
+    cache_size : int, optional
+        The number of decoded frames to cache, by default 4.
+    **kwargs
+        Further arguments for the frame source, such as the HDF5 `dataset`.
+
+    Returns
+    -------
+    FrameSource
+        The lazily read frames of the file.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in HDF5_EXTENSIONS:
+        return HDF5FrameSource(path, cache_size=cache_size, **kwargs)
+    if ext == ".npy":
+        return NpyFrameSource(path, cache_size=cache_size)
+    return FabioFrameSource(path, cache_size=cache_size)
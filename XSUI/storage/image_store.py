@@ -0,0 +1,168 @@
+"""
+An in-process, content-addressed store of image arrays.
+
+Images are keyed by a hash of their contents, so that only the key needs to
+travel between the browser and the server (i.e. through a `dcc.Store`), while
+callbacks fetch the pixels directly from the store without copying. The store
+is bounded by the total number of bytes held in memory, evicting the least
+recently used images first, and can optionally spill evicted images to disk
+from where they are memory-mapped back on demand.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def image_digest(data: np.ndarray) -> str:
+    """
+    Hash the contents, shape and dtype of an image array.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The image array.
+
+    Returns
+    -------
+    str
+        A 32 character hex digest identifying the image.
+    """
+    data = np.ascontiguousarray(data)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{data.dtype.str}{data.shape}".encode("utf-8"))
+    h.update(data.data)
+    return h.hexdigest()
+
+
+class ImageStore:
+    """
+    A byte-size bounded LRU store of read-only image arrays keyed by content hash.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        The maximum number of bytes of image data to keep in memory, by default 1 GiB.
+    spill_dir : str | None, optional
+        A directory to spill evicted images to as `.npy` files. Spilled images
+        are memory-mapped when requested again. By default evicted images are
+        discarded.
+    """
+
+    def __init__(self, max_bytes: int = 1 << 30, spill_dir: str | None = None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        self._images: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._images or (
+                self.spill_dir is not None and os.path.exists(self._spill_path(key))
+            )
+
+    @property
+    def nbytes(self) -> int:
+        """The number of bytes of image data currently held in memory."""
+        return self._nbytes
+
+    def _spill_path(self, key: str) -> str:
+        return os.path.join(self.spill_dir, f"{key}.npy")
+
+    def _evict(self) -> None:
+        """Evict the least recently used images until within the byte budget."""
+        while self._nbytes > self.max_bytes and len(self._images) > 1:
+            key, data = self._images.popitem(last=False)
+            self._nbytes -= data.nbytes
+            if self.spill_dir is not None and not isinstance(data, np.memmap):
+                path = self._spill_path(key)
+                if not os.path.exists(path):
+                    # Write atomically so a concurrent reader never sees a partial file.
+                    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        np.save(f, data, allow_pickle=False)
+                    os.replace(tmp_path, path)
+
+    def put(self, data: np.ndarray) -> str:
+        """
+        Add an image to the store.
+
+        A read-only view of the array is stored without copying, so the array
+        must not be modified after it is added. Adding an image that is already
+        stored only marks it as recently used.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            The image array.
+
+        Returns
+        -------
+        str
+            The content hash key of the image.
+        """
+        data = np.ascontiguousarray(data)
+        key = image_digest(data)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return key
+            view = data.view()
+            view.flags.writeable = False
+            self._images[key] = view
+            self._nbytes += view.nbytes
+            self._evict()
+        return key
+
+    def get(self, key: str) -> np.ndarray:
+        """
+        Get a read-only image from the store without copying.
+
+        Parameters
+        ----------
+        key : str
+            The content hash key of the image.
+
+        Returns
+        -------
+        np.ndarray
+            The image array, or a read-only memory map if it was spilled to disk.
+
+        Raises
+        ------
+        KeyError
+            If the image is not in the store.
+        """
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key]
+            if self.spill_dir is not None and os.path.exists(self._spill_path(key)):
+                return np.load(self._spill_path(key), mmap_mode="r")
+        raise KeyError(f"Image `{key}` not found in the image store.")
+
+    def discard(self, key: str) -> None:
+        """Remove an image (and any spilled copy) from the store, if present."""
+        with self._lock:
+            data = self._images.pop(key, None)
+            if data is not None:
+                self._nbytes -= data.nbytes
+            if self.spill_dir is not None and os.path.exists(self._spill_path(key)):
+                os.remove(self._spill_path(key))
+
+
+image_store = ImageStore(
+    max_bytes=1 << 30,
+    spill_dir=os.path.join(tempfile.gettempdir(), "XSUI_image_store"),
+)
+"""The process-wide image store shared by the web application callbacks."""
@@ -0,0 +1,147 @@
+"""
+Summary statistics and acquisition metadata of detector images.
+
+These are computed once when an image is ingested and stored in the image
+index, so that images can be listed, sorted and filtered without loading their
+pixel data.
+"""
+
+import datetime
+import re
+from dataclasses import asdict, dataclass
+
+import numpy as np
+
+ACQUISITION_TIME_KEYS = (
+    "acquisition_time",
+    "DateTime",
+    "Date",
+    "date",
+    "time",
+    "start_time",
+    "_array_data.header_contents",
+)
+"""Header keys searched (in order) for the acquisition time of an image."""
+
+_TIME_FORMATS = (
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y:%m:%d %H:%M:%S",
+    "%Y/%b/%d %H:%M:%S.%f",
+    "%Y-%b-%dT%H:%M:%S.%f",
+    "%a %b %d %H:%M:%S %Y",
+    "%d-%b-%Y %H:%M:%S",
+)
+"""Time formats of EDF, TIFF and Pilatus/Eiger headers."""
+
+_PILATUS_TIME = re.compile(r"#\s*(\d{4}[-/]\w{3}[-/]\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?)")
+"""The acquisition time line of a Pilatus header, e.g. `# 2013-Mar-04T12:34:56.123`."""
+
+
+@dataclass(frozen=True)
+class ImageStatistics:
+    """
+    Summary statistics of the valid pixels of an image.
+
+    Attributes
+    ----------
+    minimum, maximum, mean : float | None
+        The minimum, maximum and mean valid pixel value, or None if no pixel
+        is valid.
+    saturated : int
+        The number of pixels at or above the saturation value.
+    """
+
+    minimum: float | None
+    maximum: float | None
+    mean: float | None
+    saturated: int
+
+    def as_dict(self) -> dict:
+        """The statistics as a dictionary."""
+        return asdict(self)
+
+
+def image_statistics(
+    data: np.ndarray, saturation: float | None = None
+) -> ImageStatistics:
+    """
+    Compute the summary statistics of an image.
+
+    Negative pixels (detector gaps and bad pixels) and non-finite pixels are
+    not valid.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The image data.
+    saturation : float | None, optional
+        The pixel value at which the detector saturates. By default the maximum
+        value of integer dtypes, and no saturation for float dtypes.
+
+    Returns
+    -------
+    ImageStatistics
+        The statistics of the image.
+    """
+    data = np.asarray(data)
+    if saturation is None and data.dtype.kind in "iu":
+        saturation = np.iinfo(data.dtype).max
+    valid = data >= 0
+    if data.dtype.kind == "f":
+        valid &= np.isfinite(data)
+    saturated = int(np.count_nonzero(data >= saturation)) if saturation else 0
+    values = data[valid]
+    if values.size == 0:
+        return ImageStatistics(None, None, None, saturated)
+    return ImageStatistics(
+        float(values.min()),
+        float(values.max()),
+        float(values.mean(dtype=np.float64)),
+        saturated,
+    )
+
+
+def parse_time(value: str) -> datetime.datetime | None:
+    """Parse a header time string, returning None if the format is unknown."""
+    value = value.strip()
+    match = _PILATUS_TIME.search(value)
+    if match is not None:
+        value = match.group(1)
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def acquisition_time(header: dict | None) -> datetime.datetime | None:
+    """
+    Find the acquisition time in a `fabio` image header.
+
+    Parameters
+    ----------
+    header : dict | None
+        The image header, such as `fabio.open(path).header`.
+
+    Returns
+    -------
+    datetime.datetime | None
+        The acquisition time, or None if the header has no recognised time.
+    """
+    if not header:
+        return None
+    for key in ACQUISITION_TIME_KEYS:
+        value = header.get(key)
+        if value:
+            time = parse_time(str(value))
+            if time is not None:
+                return time
+    return None
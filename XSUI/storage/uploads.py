@@ -0,0 +1,199 @@
+"""
+Spooling of uploaded files to disk in bounded memory.
+
+Uploaded files are written to a spool directory in chunks while being hashed,
+and are then named by their content hash so that repeated uploads of the same
+file are stored once. Image readers such as `fabio` are handed the file path
+rather than an in-memory copy of the file.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from XSUI.storage.frames import open_frames
+
+UPLOAD_DIR = os.path.join(tempfile.gettempdir(), "XSUI_uploads")
+"""The directory where uploaded files are spooled."""
+
+CHUNK_SIZE = 1 << 20
+"""The size of the chunks in which uploads are read and written, in bytes."""
+
+UPLOAD_TTL = 3600.0
+"""The time after which spooled uploads are deleted, in seconds."""
+
+_PURGE_INTERVAL = 60.0
+"""The minimum time between purges of the spool directory, in seconds."""
+
+_last_purge = 0.0
+
+
+def purge_uploads(max_age: float = UPLOAD_TTL, directory: str = UPLOAD_DIR) -> int:
+    """
+    Delete the spooled uploads that were last written or reused before `max_age`.
+
+    Parameters
+    ----------
+    max_age : float, optional
+        The age of the files to delete, in seconds, by default `UPLOAD_TTL`.
+    directory : str, optional
+        The spool directory, by default `UPLOAD_DIR`.
+
+    Returns
+    -------
+    int
+        The number of deleted files.
+    """
+    global _last_purge
+    _last_purge = time.time()
+    expiry = _last_purge - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < expiry:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            # Removed by a concurrent purge.
+            continue
+    return removed
+
+
+@dataclass(frozen=True)
+class SpooledUpload:
+    """
+    A file that has been spooled to disk.
+
+    Attributes
+    ----------
+    path : str
+        The path of the spooled file, named by its content hash.
+    filename : str
+        The original name of the uploaded file.
+    digest : str
+        The hex digest of the file contents.
+    size : int
+        The size of the file in bytes.
+    """
+
+    path: str
+    filename: str
+    digest: str
+    size: int
+
+
+class UploadSpool:
+    """
+    An incremental writer of an uploaded file to the spool directory.
+
+    Use as a context manager, writing chunks with `write`. On a successful exit
+    the file is moved to its content-addressed path and available as `result`.
+    On an exception the partial file is removed. Spooled files expire after
+    `UPLOAD_TTL`, and are purged when later uploads are spooled.
+
+    Parameters
+    ----------
+    filename : str
+        The original name of the uploaded file. Its extension is kept, as
+        `fabio` uses it to identify the file format.
+    directory : str, optional
+        The spool directory, by default `UPLOAD_DIR`.
+    """
+
+    def __init__(self, filename: str, directory: str = UPLOAD_DIR):
+        self.filename = os.path.basename(filename)
+        self.directory = directory
+        self.result: SpooledUpload | None = None
+        self._hash = hashlib.blake2b(digest_size=16)
+        self._size = 0
+        self._file = None
+
+    def __enter__(self) -> "UploadSpool":
+        os.makedirs(self.directory, exist_ok=True)
+        if time.time() - _last_purge > _PURGE_INTERVAL:
+            purge_uploads(directory=self.directory)
+        self._file = tempfile.NamedTemporaryFile(
+            dir=self.directory, suffix=".part", delete=False
+        )
+        return self
+
+    def write(self, chunk: bytes) -> None:
+        """Write and hash a chunk of the uploaded file."""
+        self._hash.update(chunk)
+        self._file.write(chunk)
+        self._size += len(chunk)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._file.close()
+        if exc_type is not None:
+            os.remove(self._file.name)
+            return
+        digest = self._hash.hexdigest()
+        # Keep compound extensions (e.g. `.edf.gz`) for format identification.
+        _, dot, ext = self.filename.partition(".")
+        path = os.path.join(self.directory, f"{digest}{dot}{ext}")
+        try:
+            # Identical contents may already be spooled, so renew their expiry.
+            os.utime(path)
+            os.remove(self._file.name)
+        except FileNotFoundError:
+            os.replace(self._file.name, path)
+        self.result = SpooledUpload(path, self.filename, digest, self._size)
+
+
+def spool_bytes(
+    data: bytes, filename: str, directory: str = UPLOAD_DIR
+) -> SpooledUpload:
+    """
+    Spool an in-memory file to disk.
+
+    Parameters
+    ----------
+    data : bytes
+        The file contents.
+    filename : str
+        The original name of the file.
+    directory : str, optional
+        The spool directory, by default `UPLOAD_DIR`.
+
+    Returns
+    -------
+    SpooledUpload
+        The spooled file.
+    """
+    with UploadSpool(filename, directory) as spool:
+        view = memoryview(data)
+        for start in range(0, len(view), CHUNK_SIZE):
+            spool.write(view[start : start + CHUNK_SIZE])
+    return spool.result
+
+
+def read_image(path: str, index: int = 0) -> np.ndarray:
+    """
+    Read a single frame of an image file.
+
+    Only the requested frame is read, and uncompressed frames are memory-mapped
+    (see `XSUI.storage.frames`).
+
+    Parameters
+    ----------
+    path : str
+        The path of the image file, in any format supported by `fabio` or HDF5.
+    index : int, optional
+        The index of the frame, by default the first.
+
+    Returns
+    -------
+    np.ndarray
+        The (read-only) image data.
+    """
+    with open_frames(path, cache_size=0) as frames:
+        return frames[index]
@@ -1 +1,3 @@
 from XSUI.webapp.dash.callbacks.callback_calibration import *
+from XSUI.webapp.dash.callbacks.callback_index import *
+from XSUI.webapp.dash.callbacks.callback_waxs import *
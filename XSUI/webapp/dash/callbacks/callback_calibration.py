@@ -1,6 +1,8 @@
 # Import packages
 from typing import Optional
 from dash import Dash, html, dash_table, dcc, callback, Output, Input, State, ctx
+from dash import clientside_callback
+from dash import Patch, no_update
 import fabio.readbytestream
 import pandas as pd
 import numpy as np
@@ -10,15 +12,36 @@ from dash.exceptions import PreventUpdate
 from pyFAI.detectors import _detector_class_names
 from pyFAI.calibrant import ALL_CALIBRANTS
 from pyFAI.io.ponifile import PoniFile
-from pyFAI.detectors import Detector, detector_factory
+from pyFAI.detectors import Detector
 import fabio
-from svg.path import parse_path
+from XSUI.masks import IncrementalMask, LRUCache, ShapeRasterCache
+from XSUI.storage import image_digest, image_store, read_image, spool_bytes
+from XSUI.detectors import get_detector, get_detector_mask
+from XSUI.detectors.registry import BEAMLINE_DETECTORS
+from XSUI.geometry.calibration import (
+    CalibrationProgress,
+    RefinementResult,
+    RingCalibration,
+)
+from XSUI.webapp.fastapi.models.images import ImageCalibrant
+from XSUI.webapp.fastapi.models.index import FrameIndexer
+from XSUI.webapp.pyramid import pyramid_cache
+from XSUI.webapp.rendering import (
+    DEFAULT_COLORSCALE,
+    image_data_uri,
+    mask_data_uri,
+    pixel_value,
+    render_image,
+)
 import os
 import base64
 import io
 import json
 import scipy.constants as sc
 import datetime
+import dataclasses
+import threading
+import uuid
 
 # from XSUI.webapp.dash.models import (
 #     ImageCalibrant,
@@ -77,11 +100,36 @@ def pixel_beamcentre(poni: PoniFile, detector: Detector):
     return pix_coords
 
 
+_shape_raster_cache = ShapeRasterCache(maxsize=256)
+"""Rasterized drawn shapes shared between mask updates."""
+
+_incremental_masks = LRUCache(maxsize=8)
+"""Incrementally updated composite masks, keyed by the browser session."""
+
+
 #################################################
 #### CALLBACKS
 #################################################
 
 
+### Session
+# Give each browser tab its own id, so concurrent sessions never share a mask.
+clientside_callback(
+    """
+    function(session_id) {
+        if (session_id) {
+            return window.dash_clientside.no_update;
+        }
+        return window.crypto && crypto.randomUUID
+            ? crypto.randomUUID()
+            : Date.now().toString(36) + Math.random().toString(36).slice(2);
+    }
+    """,
+    Output("calibration_tab-session_id", "data"),
+    Input("calibration_tab-session_id", "data"),
+)
+
+
 ### Poni File
 @callback(
     Output("calibration_tab-poni_file", "data"),
@@ -169,7 +217,7 @@ def update_detector_dropdown(poni_file: str) -> Optional[str]:
     if poni_file:
         poni_dict: dict = json.loads(poni_file)
         detector = poni_dict.get("detector")
-        if detector in _detector_class_names:
+        if detector in _detector_class_names or detector in BEAMLINE_DETECTORS:
             return detector
         else:
             print(f"Detector {detector} not found in known detector classes.")
@@ -287,17 +335,26 @@ def update_rotation3_input(poni_file: str) -> Optional[float]:
 
 
 ## Figure Generation
+_IMAGE_TRACE, _MASK_TRACE, _BEAMCENTRE_TRACE = 0, 1, 2
+"""The trace indices of the calibration figure, which always holds all three
+traces so that the overlays can be updated in place with a `Patch`."""
+
+_mask_overlays = LRUCache(maxsize=16)
+"""Encoded mask overlays, keyed by the mask contents."""
+
+
 @callback(
     Output("calibration_tab-image_data", "data"),
     Output("calibration_tab-image_plot", "figure"),
     Output("calibration_tab-uploaded_filename", "children"),
     Input("calibration_tab-upload_calibration_data", "contents"),
     Input("calibration_tab-upload_calibration_data", "filename"),
+    Input("calibration_tab-upload_handle", "data"),
     Input("calibration_tab-poni_file", "data"),
     Input("calibration_tab-image_plot_mask", "data"),
-    State("calibration_tab-image_plot", "figure"),
     State("calibration_tab-input-detector_dropdown", "value"),
     State("calibration_tab-image_data", "data"),
+    State("calibration_tab-session_id", "data"),
     running=[
         (Output("calibration_tab-upload_calibration_data", "disabled"), True, False),
     ],
@@ -306,23 +363,35 @@ def update_rotation3_input(poni_file: str) -> Optional[float]:
 def figure_callback(
     img_upload_contents: str,
     filename: str,
+    upload_handle: dict | None,
     poni_file: str,
-    mask_data: np.ndarray | None,
-    figure: go.Figure,
+    mask_data: dict | None,
     detector: str,
-    fig_data: np.ndarray | None,
-    # figure: go.Figure,
-    # detector: str,
-) -> tuple[np.ndarray | None, go.Figure, str]:
+    fig_data: str | None,
+    session_id: str | None,
+) -> tuple[str | None, go.Figure | Patch, str]:
     # Get the ID name of the trigger
     trigger_id, trigger_sig = ctx.triggered[0]["prop_id"].split(".")
 
     print("Trigger ID:", trigger_id)
     # Whether to create a new figure or not from uploaded data:
     if trigger_id == "calibration_tab-upload_calibration_data":
-        fig, fig_data = upload_calibration_data(img_upload_contents, filename)
+        data = upload_calibration_data(img_upload_contents, filename)
+        # Keep the pixels server-side; the browser only holds the image key.
+        fig_data = image_store.put(data) if data is not None else None
+    elif trigger_id == "calibration_tab-upload_handle":
+        # Streamed uploads are already decoded into the image store.
+        data, fig_data, filename = upload_handle_image(upload_handle)
+    elif fig_data is not None:
+        # The figure already holds the image, so only send the changed overlay.
+        if trigger_id == "calibration_tab-poni_file":
+            fig = update_image_figure_beamcentre(poni_file, detector)
+        else:
+            fig = update_image_figure_mask(mask_data)
+        return (fig_data, fig, filename)
     else:
-        fig = figure
+        # Without an image the figure only holds the (small) overlays.
+        data = None
         # query = db.session.query(ImageCalibrant)
         # calibrant_image = query.filter_by(filename=filename)
         # print("The Query is :", calibrant_image)
@@ -333,15 +402,22 @@ def figure_callback(
         #     fig_data = None
         #     print(f"Image data for {filename} not found in database.")
 
-    # Add beam centre scatter if PONI file is available
-    if trigger_id == "calibration_tab-poni_file":
-        # Update or add the beam centre scatter trace
-        fig = update_image_figure_beamcentre(poni_file, fig, detector)
-
-    if trigger_id == "calibration_tab-image_plot_mask":
-        # Update or add the mask heatmap trace
-        fig = update_image_figure_mask(mask_data, fig)
-
+    if data is not None:
+        # The new figure has no drawn shapes, so neither should the mask.
+        composite = _incremental_masks.get(session_id)
+        if composite is not None:
+            composite.clear()
+
+    # Rebuild the figure, keeping the current mask and beam centre overlays.
+    mask = stored_mask(mask_data)
+    if mask is not None and data is not None and mask.shape != np.shape(data):
+        mask = None
+    fig = calibration_image_figure(
+        data,
+        mask=mask,
+        beamcentre=beamcentre_coords(poni_file, detector),
+        key=fig_data,
+    )
     return (fig_data, fig, filename)
 
 
@@ -349,9 +425,9 @@ def figure_callback(
 def upload_calibration_data(
     contents: str,
     filename: str,
-) -> tuple[go.Figure, np.ndarray | None]:
+) -> np.ndarray | None:
     """
-    Process the uploaded calibration data and return a plot.
+    Process the uploaded calibration data.
 
     Parameters
     ----------
@@ -361,145 +437,331 @@ def upload_calibration_data(
         The name of the uploaded file.
     Returns
     -------
-    fig : go.Figure
-        The figure containing the calibration data.
     data : np.ndarray | None
         The image data from the uploaded file, or None if no data is available.
     """
-    # A figure:
-    fig: go.Figure | None = None
-    if contents:
-        # Decode the base64 contents
-        content_type, content_string = contents.split(",")
-        print("Got content type:", content_type, "for filename:", filename)
-        decoded = base64.b64decode(content_string)
-        byte_buffer_data = io.BytesIO(
-            decoded
-        )  # Use BytesIO to read the bytes as a file-like object
-        byte_buffer_data.name = filename
-        byte_buffer_data.seek(0)
-
-        fabio_data = fabio.open(byte_buffer_data)
-        # fabio_data = fabio.openimage._openimage(byte_buffer_data)
-
-        data = fabio_data.data
-
-        # Place the image data into the database.
-        # db_img = ImageCalibrant(filename, data)
-        # db.session.add(db_img)
-        # db.session.commit()
-        # print("Image data added to database.")
-
-        fig = px.imshow(
-            np.log10(fabio_data.data),
-            color_continuous_scale="inferno",
-            title="Calibrant Image (Draw Pixel Mask)",
-            labels={"color": "Intensity (log10)"},
-        )
-    else:
+    if not contents:
+        return None
+    # Decode the base64 contents
+    content_type, content_string = contents.split(",")
+    print("Got content type:", content_type, "for filename:", filename)
+    # Spool the decoded file to disk and let fabio read it from the path.
+    spooled = spool_bytes(base64.b64decode(content_string), filename)
+
+    data = read_image(spooled.path)
+
+    # Place the image data into the database.
+    try:
+        FrameIndexer(ImageCalibrant)(filename, 0, 1, data)
+    except Exception as e:
+        print(f"Could not add {filename} to the database: {e}")
+    return data
+
+
+def upload_handle_image(
+    upload_handle: dict | None,
+) -> tuple[np.ndarray | None, str | None, str | None]:
+    """
+    Get the image of a streamed upload.
+
+    Parameters
+    ----------
+    upload_handle : dict | None
+        The handle returned by the FastAPI `/uploads` endpoint, containing the
+        image store `key` and original `filename` of the uploaded image.
+
+    Returns
+    -------
+    data : np.ndarray | None
+        The image data, or None if the image is not available.
+    key : str | None
+        The image store key, or None if the image is not available.
+    filename : str | None
+        The name of the uploaded file.
+    """
+    if not upload_handle:
+        return None, None, None
+    key, filename = upload_handle.get("key"), upload_handle.get("filename")
+    try:
+        return image_store.get(key), key, filename
+    except KeyError as e:
+        print(e)
+        return None, None, filename
+
+
+def calibration_image_figure(
+    data: np.ndarray | None,
+    mask: np.ndarray | None = None,
+    beamcentre: np.ndarray | None = None,
+    key: str | None = None,
+) -> go.Figure:
+    """
+    Create the figure of a calibrant image.
+
+    A figure with an image always holds the image, mask and beam centre traces
+    (at `_IMAGE_TRACE`, `_MASK_TRACE` and `_BEAMCENTRE_TRACE`), empty if there
+    is no overlay, so that the overlays can later be patched in place.
+
+    Parameters
+    ----------
+    data : np.ndarray | None
+        The image data, or None for a figure of the overlays only.
+    mask : np.ndarray | None, optional
+        The boolean mask overlay, by default None.
+    beamcentre : np.ndarray | None, optional
+        The pixel coordinates (y, x) of the beam centre, by default None.
+    key : str | None, optional
+        The image store key of the image. If given, the image is rendered from
+        its cached pyramid at a resolution fitting the figure, and refined as
+        the figure is zoomed (see `update_image_zoom`).
+
+    Returns
+    -------
+    go.Figure
+        The figure of the (log10) image intensity, rendered on the server.
+    """
+    if data is None:
         fig = go.Figure(
             layout={
                 "title": "Calibrant Image (Draw Pixel Mask)",
             }
         )
-        data = None
+        if mask is not None:
+            fig.add_trace(mask_trace(mask))
+        if beamcentre is not None:
+            fig.add_trace(beamcentre_trace(beamcentre))
+        return fig
+    # Colour-map and encode the image on the server rather than sending every
+    # pixel value as a heatmap; pixel values are looked up on hover instead.
+    if key is not None:
+        pyramid = pyramid_cache.get(key)
+        rgba, placement = pyramid.render_region()
+        vmin, vmax = pyramid.limits
+    else:
+        rgba, (vmin, vmax) = render_image(data, log=True)
+        placement = {"x0": 0, "y0": 0, "dx": 1, "dy": 1}
+    fig = go.Figure(
+        image_trace(rgba, placement),
+        layout={
+            "title": "Calibrant Image (Draw Pixel Mask)",
+            "xaxis": {"constrain": "domain"},
+            "yaxis": {"autorange": "reversed", "scaleanchor": "x"},
+        },
+    )
+    fig.add_trace(mask_trace(mask))
+    fig.add_trace(beamcentre_trace(beamcentre))
+    # An empty trace holding the colour bar of the rendered image.
+    fig.add_scatter(
+        x=[None],
+        y=[None],
+        mode="markers",
+        marker={
+            "colorscale": DEFAULT_COLORSCALE,
+            "cmin": vmin,
+            "cmax": vmax,
+            "color": [vmin],
+            "showscale": True,
+            "colorbar": {"title": {"text": "Intensity (log10)"}},
+        },
+        hoverinfo="skip",
+        showlegend=False,
+    )
+    return fig
+
+
+def image_trace(rgba: np.ndarray, placement: dict) -> go.Image:
+    """The rendered image, placed in full resolution pixel coordinates."""
+    return go.Image(
+        source=image_data_uri(rgba),
+        x0=placement["x0"],
+        y0=placement["y0"],
+        dx=placement["dx"],
+        dy=placement["dy"],
+        hovertemplate="x: %{x}<br>y: %{y}<extra></extra>",
+        name="Image",
+    )
 
-    return fig, data
 
+def beamcentre_coords(poni_file: str | None, detector: str | None) -> np.ndarray | None:
+    """The pixel coordinates (y, x) of the beam centre, if the geometry is known."""
+    if not poni_file:
+        return None
+    poni_dict: dict = json.loads(poni_file)
+    poni = PoniFile(**poni_dict)
+    det = get_detector(detector) if detector else poni.detector
+    if not det:
+        return None
+    return pixel_beamcentre(poni, det)
+
+
+def beamcentre_trace(bc_coords: np.ndarray | None) -> go.Scatter:
+    """The beam centre marker, empty if the beam centre is unknown."""
+    return go.Scatter(
+        x=[bc_coords[1]] if bc_coords is not None else [],
+        y=[bc_coords[0]] if bc_coords is not None else [],
+        mode="markers",
+        marker=dict(color="red", size=10, symbol="x"),
+        name="Beam Centre",
+    )
 
-def update_image_figure_beamcentre(
-    poni_file: str, figure: go.Figure, detector: str
-) -> go.Figure:
-    # Check if figure already has a heatmap trace
-    has_beamcentre_scatter = False
-    bc_obj = None
-    if "data" in figure:
-        for ax_obj in figure["data"]:
-            if ax_obj["type"] == "scatter" and ax_obj["name"] == "Beam Centre":
-                bc_obj = ax_obj
-                has_beamcentre_scatter = True
-                break
-
-    bc_coords = None
-    if poni_file:
-        poni_dict: dict = json.loads(poni_file)
-        poni = PoniFile(**poni_dict)
-        det = detector_factory(detector) if detector else poni.detector
-        if det:
-            bc_coords = pixel_beamcentre(poni, det)
-
-    if bc_coords is not None:
-        if bc_obj:
-            # Update the existing scatter trace with new beam centre coordinates
-            bc_obj["x"] = [bc_coords[1]]
-            bc_obj["y"] = [bc_coords[0]]
-        else:
-            # Create new tracefigure.add_trace(
-            go.Scatter(
-                x=[bc_coords[1]],
-                y=[bc_coords[0]],
-                mode="markers",
-                marker=dict(color="red", size=10, symbol="x"),
-                name="Beam Centre",
-            )
-    elif has_beamcentre_scatter and bc_obj:
-        # If no beam centre coordinates, remove the scatter trace
-        figure["data"] = [
-            ax_obj
-            for ax_obj in figure["data"]
-            if not (ax_obj["type"] == "scatter" and ax_obj["name"] == "Beam Centre")
-        ]
-    return figure
-
-
-def update_image_figure_mask(
-    mask_data: np.ndarray | None, figure: dict | go.Figure
-) -> go.Figure:
-    # Check if figure already has a heatmap trace
-    if isinstance(figure, dict):
-        figure = go.Figure(**figure)
-    has_mask_heatmap = False
-    heatmap = None
-    if "data" in figure:
-        for ax_obj in figure["data"]:
-            if ax_obj["type"] == "heatmap" and ax_obj["name"] == "Mask":
-                heatmap = ax_obj
-                has_mask_heatmap = True
-                break
-
-    if mask_data:
-        mask_data = np.asarray(mask_data)
-        # If mask data is provided, apply it to the image
-        mask_shape = np.shape(mask_data)
-        x, y = np.indices(mask_shape)
-        colorscale = [[0, "rgba(0,0,0,0)"], [1, "rgba(0,222,256,1)"]]
-        no_hover_mask_data = mask_data.astype(object)
-        no_hover_mask_data[no_hover_mask_data == 0] = (
-            None  # Set non-masked pixels to None
-        )
 
-        if has_mask_heatmap and heatmap:
-            # Update the existing heatmap trace
-            heatmap["z"] = no_hover_mask_data
-
-        if not has_mask_heatmap:
-            figure.add_heatmap(
-                z=no_hover_mask_data,
-                colorscale=colorscale,
-                hoverongaps=False,
-                colorbar=None,
-                showscale=False,
-                # hovertemplate="Mask",
-                name="Mask",
+def mask_source(mask: np.ndarray) -> str:
+    """The PNG data URI of a mask overlay, cached by the mask contents."""
+    key = image_digest(mask)
+    source = _mask_overlays.get(key)
+    if source is None:
+        source = mask_data_uri(mask)
+        _mask_overlays[key] = source
+    return source
+
+
+def mask_trace(mask: np.ndarray | None) -> go.Image:
+    """The mask overlay image, hidden if there is no mask."""
+    return go.Image(
+        source=mask_source(mask) if mask is not None else None,
+        visible=mask is not None,
+        hoverinfo="skip",
+        name="Mask",
+    )
+
+
+def stored_mask(mask_data: dict | None) -> np.ndarray | None:
+    """Get the current mask of the mask store from the image store."""
+    key = mask_data.get("key") if mask_data else None
+    if key is None:
+        return None
+    try:
+        return image_store.get(key)
+    except KeyError as e:
+        print(e)
+        return None
+
+
+def update_image_figure_beamcentre(poni_file: str, detector: str) -> Patch:
+    """
+    Patch the beam centre marker of the calibration figure.
+
+    Parameters
+    ----------
+    poni_file : str
+        The JSON encoded PONI file.
+    detector : str
+        The name of the detector.
+
+    Returns
+    -------
+    Patch
+        The update of the beam centre trace coordinates.
+    """
+    bc_coords = beamcentre_coords(poni_file, detector)
+    patched = Patch()
+    patched["data"][_BEAMCENTRE_TRACE]["x"] = (
+        [bc_coords[1]] if bc_coords is not None else []
+    )
+    patched["data"][_BEAMCENTRE_TRACE]["y"] = (
+        [bc_coords[0]] if bc_coords is not None else []
+    )
+    return patched
+
+
+def update_image_figure_mask(mask_data: dict | None) -> Patch:
+    """
+    Patch the mask overlay of the calibration figure.
+
+    The overlay is a 1-bit PNG, cached by the mask contents, so it is sent in
+    a few kilobytes independently of the image.
+
+    Parameters
+    ----------
+    mask_data : dict | None
+        The mask store, holding the image store `key` of the current mask.
+
+    Returns
+    -------
+    Patch
+        The update of the mask trace.
+    """
+    patched = Patch()
+    mask = stored_mask(mask_data)
+    patched["data"][_MASK_TRACE]["visible"] = mask is not None
+    if mask is not None:
+        patched["data"][_MASK_TRACE]["source"] = mask_source(mask)
+    return patched
+
+
+def relayout_ranges(
+    relayout_data: dict,
+) -> tuple[tuple[float, float] | None, tuple[float, float] | None] | None:
+    """
+    Get the axis ranges of a zoom or pan `relayoutData` event.
+
+    Returns None for events that do not change the axes, and None for an axis
+    that is autoscaled.
+    """
+    ranges = []
+    changed = False
+    for axis in ("xaxis", "yaxis"):
+        if f"{axis}.range[0]" in relayout_data:
+            changed = True
+            ranges.append(
+                (relayout_data[f"{axis}.range[0]"], relayout_data[f"{axis}.range[1]"])
             )
-    elif has_mask_heatmap:
-        # If no mask data is provided, remove the heatmap trace
-        figure["data"] = [
-            ax_obj
-            for ax_obj in figure["data"]
-            if not (ax_obj["type"] == "heatmap" and ax_obj["name"] == "Mask")
-        ]
-    return figure
+        elif f"{axis}.range" in relayout_data:
+            changed = True
+            ranges.append(tuple(relayout_data[f"{axis}.range"]))
+        else:
+            changed |= f"{axis}.autorange" in relayout_data
+            ranges.append(None)
+    return tuple(ranges) if changed else None
+
+
+@callback(
+    Output("calibration_tab-image_plot", "figure", allow_duplicate=True),
+    Input("calibration_tab-image_plot", "relayoutData"),
+    State("calibration_tab-image_data", "data"),
+    prevent_initial_call=True,
+)
+def update_image_zoom(relayout_data: dict | None, img_key: str | None) -> Patch:
+    """Render the visible region of the image at the resolution of the zoom."""
+    if not relayout_data or img_key is None:
+        raise PreventUpdate
+    ranges = relayout_ranges(relayout_data)
+    if ranges is None:
+        raise PreventUpdate
+    try:
+        pyramid = pyramid_cache.get(img_key)
+    except KeyError:
+        raise PreventUpdate
+    rgba, placement = pyramid.render_region(*ranges)
+    patched = Patch()
+    trace = image_trace(rgba, placement)
+    for prop in ("source", "x0", "y0", "dx", "dy"):
+        patched["data"][_IMAGE_TRACE][prop] = trace[prop]
+    return patched
+
+
+@callback(
+    Output("calibration_tab-image_hover", "children"),
+    Input("calibration_tab-image_plot", "hoverData"),
+    State("calibration_tab-image_data", "data"),
+    prevent_initial_call=True,
+)
+def update_image_hover(hover_data: dict | None, img_key: str | None) -> str:
+    """Look up the value of the hovered pixel in the server-side image."""
+    if not hover_data or img_key is None:
+        raise PreventUpdate
+    point = hover_data["points"][0]
+    try:
+        data = image_store.get(img_key)
+    except KeyError:
+        raise PreventUpdate
+    x, y = point.get("x"), point.get("y")
+    if x is None or y is None:
+        raise PreventUpdate
+    value = pixel_value(data, x, y)
+    if value is None:
+        raise PreventUpdate
+    return f"Pixel (x={round(x)}, y={round(y)}): {value:g}"
 
 
 @callback(
@@ -509,6 +771,7 @@ def update_image_figure_mask(
     Input("calibration_tab-input-use_detector_mask", "value"),
     State("calibration_tab-image_data", "data"),
     State("calibration_tab-image_plot_mask", "data"),
+    State("calibration_tab-session_id", "data"),
     prevent_initial_call=True,
     running=[
         (Output("calibration_tab-upload_calibration_data", "disabled"), True, False),
@@ -520,13 +783,18 @@ def update_mask(
     relayoutData: dict,
     detector: str | None,
     use_mask: bool,
-    img_data: np.ndarray,
-    existing_mask: np.ndarray,
-) -> np.ndarray | None:
+    img_key: str | None,
+    existing_mask: dict | None,
+    session_id: str | None,
+) -> dict | None:
     # def update_mask(
     #     relayoutData: dict, detector: str | None, use_mask: bool, existing_mask: np.ndarray
     # ) -> np.ndarray | None:
-    """Reconstruct the masking based on the relayout data."""
+    """
+    Reconstruct the masking based on the relayout data.
+
+    The mask is kept in the image store, and the mask store only holds its `key`.
+    """
 
     trigger_id, trigger_sig = ctx.triggered[0]["prop_id"].split(".")
 
@@ -537,83 +805,273 @@ def update_mask(
     # else:
     #     img_data = None
 
-    masks = []
+    img_data = None
     img_data_shape = None
-    if img_data is not None:
-        img_data = np.asarray(img_data)
-        img_data_shape = np.shape(img_data)
-        masks.append(img_data <= 0)  # Add a mask for zero values in the image data
+    det_mask = None
+    if img_key is not None:
+        try:
+            img_data = image_store.get(img_key)
+            img_data_shape = np.shape(img_data)
+        except KeyError as e:
+            print(f"{e} Ignoring image data for the mask.")
 
     if detector and use_mask:
-        mask = detector_factory(detector).mask
-        if img_data is not None and np.shape(img_data) == mask.shape:
-            masks.append(mask)
-        elif img_data is None:
-            img_data_shape = mask.shape
-            masks.append(mask)
-        else:
+        det_mask = get_detector_mask(detector)
+        if det_mask is not None and img_data is None:
+            img_data_shape = det_mask.shape
+        elif det_mask is not None and np.shape(img_data) != det_mask.shape:
             print(
-                f"Detector mask shape {mask.shape} does not match image data shape {np.shape(img_data)}. Skipping detector mask."
+                f"Detector mask shape {det_mask.shape} does not match image data shape {np.shape(img_data)}. Skipping detector mask."
             )
+            det_mask = None
+
+    previous = existing_mask.get("key") if existing_mask else None
+    if img_data_shape is None:
+        # No image or detector to define the mask shape.
+        if previous is None:
+            raise PreventUpdate
+        return None
+
+    # Rebuild the base mask only when the image or detector mask changes.
+    base_key = (
+        img_key if img_data is not None else None,
+        detector if det_mask is not None else None,
+    )
+    composite = _incremental_masks.get(session_id)
+    if composite is None or composite.base_key != base_key:
+        # All base contributions are OR'ed into a single preallocated buffer.
+        base = np.zeros(img_data_shape, dtype=bool)
+        if img_data is not None:
+            np.less_equal(img_data, 0, out=base)  # Mask zero values in the image
+        if det_mask is not None:
+            base |= det_mask.astype(bool, copy=False)
+        if (
+            composite is None
+            or composite.shape != img_data_shape
+            or composite.base_key[0] != base_key[0]
+        ):
+            # A new image is shown without shapes, so start from an empty mask.
+            composite = IncrementalMask(base, base_key, cache=_shape_raster_cache)
+            _incremental_masks[session_id] = composite
+        else:
+            # Only the detector mask changed, so keep the drawn shapes.
+            composite.rebase(base, base_key)
+
+    # Only shapes that changed since the last event are rasterized.
+    key = image_store.put(composite.update_from_relayout(relayoutData))
+    if key == previous:
+        # Events such as zooming do not change the mask.
+        raise PreventUpdate
+    return {"key": key}
+
+
+### Automatic Calibration
+@dataclasses.dataclass
+class CalibrationJob:
+    """An automatic calibration running in a background thread."""
+
+    calibration: RingCalibration
+    progress: CalibrationProgress | None = None
+    result: RefinementResult | None = None
+    error: str | None = None
+    done: bool = False
+    plotted: RefinementResult | None = None
+
+
+_calibration_jobs = LRUCache(maxsize=4)
+"""Running and finished automatic calibrations, keyed by job id."""
+
+_MAX_PLOTTED_PEAKS = 5000
+"""The maximum number of ring peaks drawn in the calibration plot."""
+
+
+def start_calibration_job(calibration: RingCalibration) -> str:
+    """
+    Run an automatic calibration in a background thread.
+
+    The calibration refines its starting geometries in a process pool, and
+    its progress is polled by `poll_auto_calibration`.
+
+    Parameters
+    ----------
+    calibration : RingCalibration
+        The calibration to run.
+
+    Returns
+    -------
+    str
+        The id of the job in `_calibration_jobs`.
+    """
+    job_id = uuid.uuid4().hex
+    job = CalibrationJob(calibration)
+
+    def report(progress: CalibrationProgress) -> None:
+        # The calibration updates its progress in place, so keep a snapshot.
+        job.progress = dataclasses.replace(progress, errors=dict(progress.errors))
+
+    def run() -> None:
+        try:
+            job.result = calibration.run(progress=report)
+        except Exception as e:
+            job.error = str(e)
+        finally:
+            job.done = True
+
+    _calibration_jobs[job_id] = job
+    threading.Thread(target=run, name=f"calibration-{job_id}", daemon=True).start()
+    return job_id
+
+
+def calibration_peaks_figure(
+    calibration: RingCalibration, result: RefinementResult
+) -> go.Figure:
+    """
+    Create the figure of the ring peaks in a refined geometry.
+
+    The peaks are drawn by azimuthal angle and 2-theta, over the 2-theta of
+    the calibrant rings, so a good geometry shows straight lines of peaks on
+    the rings.
+
+    Parameters
+    ----------
+    calibration : RingCalibration
+        The calibration, holding the peaks and calibrant.
+    result : RefinementResult
+        The refined geometry.
+
+    Returns
+    -------
+    go.Figure
+        The WebGL scatter of the peaks, coloured by their radial residual.
+    """
+    tth, chi, residual = calibration.peak_angles(result)
+    step = max(len(tth) // _MAX_PLOTTED_PEAKS, 1)
+    tth, chi, residual = tth[::step], chi[::step], residual[::step]
+    fig = go.Figure(
+        go.Scattergl(
+            x=chi,
+            y=tth,
+            mode="markers",
+            marker={
+                "size": 3,
+                "color": np.abs(residual),
+                "cmin": 0,
+                "cmax": 2,
+                "colorscale": "Viridis",
+                "colorbar": {"title": {"text": "Residual (px)"}},
+            },
+            hovertemplate="chi: %{x:.2f}°<br>2θ: %{y:.3f}°<extra></extra>",
+            name="Ring Peaks",
+        ),
+        layout={
+            "title": f"Ring Peaks ({result.inliers:.1%} on rings, "
+            f"RMS {result.rms:.2f} px)",
+            "xaxis": {"title": {"text": "chi (°)"}},
+            "yaxis": {"title": {"text": "2θ (°)"}},
+        },
+    )
+    rings = np.degrees(calibration.ring_tth)
+    for ring in rings[(rings >= tth.min()) & (rings <= tth.max())]:
+        fig.add_hline(y=ring, line={"color": "red", "width": 1}, opacity=0.5)
+    return fig
+
+
+@callback(
+    Output("calibration_tab-auto_calibration_job", "data"),
+    Output("calibration_tab-auto_calibration_interval", "disabled"),
+    Output("calibration_tab-auto_calibration_status", "children"),
+    Input("calibration_tab-btn-auto_calibrate", "n_clicks"),
+    State("calibration_tab-image_data", "data"),
+    State("calibration_tab-image_plot_mask", "data"),
+    State("calibration_tab-input-detector_dropdown", "value"),
+    State("calibration_tab-input-wavelength", "value"),
+    State("calibration_tab-calibrant_dropdown", "value"),
+    State("calibration_tab-input-sdd", "value"),
+    State("calibration_tab-input-poni1", "value"),
+    State("calibration_tab-input-poni2", "value"),
+    State("calibration_tab-input-rot1", "value"),
+    State("calibration_tab-input-rot2", "value"),
+    State("calibration_tab-input-rot3", "value"),
+    prevent_initial_call=True,
+    running=[(Output("calibration_tab-btn-auto_calibrate", "disabled"), True, False)],
+)
+def start_auto_calibration(
+    n_clicks: int,
+    img_key: str | None,
+    mask_data: dict | None,
+    detector: str | None,
+    wavelength: Optional[float],
+    calibrant: str | None,
+    sdd: Optional[float],
+    poni1: Optional[float],
+    poni2: Optional[float],
+    rot1: Optional[float],
+    rot2: Optional[float],
+    rot3: Optional[float],
+) -> tuple[str | None, bool, str]:
+    """
+    Start the automatic calibration of the geometry from the calibrant image.
 
-    if relayoutData and "shapes" in relayoutData:
-        # Process the shapes to update the mask
-        shapes = relayoutData["shapes"]
-        # Create numpy coordinate array
-        coords = np.indices(np.asarray(img_data).shape)
-        # Check each pixel is contained in any of the shapes
-        for shape in shapes:
-            if shape["type"] == "rect":
-                mask = (
-                    (coords[:, 0] >= shape["y0"])
-                    & (coords[:, 0] <= shape["y1"])
-                    & (coords[:, 1] >= shape["x0"])
-                    & (coords[:, 1] <= shape["x1"])
-                )
-            elif shape["type"] == "circle":
-                # Circle mask
-                center_x = (shape["x0"] + shape["x1"]) / 2
-                center_y = (shape["y0"] + shape["y1"]) / 2
-                radius = (shape["x1"] - shape["x0"]) / 2
-                mask = (
-                    (coords[1] - center_x) ** 2 + (coords[0] - center_y) ** 2
-                ) <= radius**2
-            elif shape["type"] == "path":
-                # Get the trace points
-                descrption = shape["path"]
-                path = parse_path(descrption)
-                x_min, y_min, x_max, y_max = path.boundingbox()
-
-                # Use ray tracing method to see if point is contained or not
-                # i.e. from the point of interest, does a line intersect odd or even?
-                mask = np.zeros(img_data_shape, dtype=bool)
-                for y in range(img_data_shape[0]):
-                    for x in range(img_data_shape[1]):
-                        # Check if point (x, y) is inside the path
-                        if x_min < x and x < x_max and y_min < y and y < y_max:
-                            # Could be inside the path
-                            intersections = 0
-                            for segment in path:
-                                # Check if the segment intersects with a horizontal line from (x, y)
-                                # Substitute x value of point into the segment equation:
-                                x0, y0 = segment.start.real, segment.start.imag
-                                x1, y1 = segment.end.real, segment.end.imag
-                                if (x0 < x and x < x1) or (x1 < x and x < x0):
-                                    # X within the segment
-                                    point = (x - x0) / (x1 - x0)
-                                    if np.isclose(
-                                        y, segment.point(point).imag, atol=1e-3
-                                    ):
-                                        # Point is on the segment
-                                        intersections += 1
-                            if intersections % 2 == 1:
-                                mask[y, x] = True
-            else:
-                continue
-            masks.append(mask)
-
-    if len(masks) > 0:
-        # Create a new mask
-        mask = np.bitwise_or.reduce([*masks])
-        return mask
-    return None
+    Any PONI parameters already entered are refined as an additional guess.
+    """
+    if img_key is None:
+        return no_update, True, "Upload a calibrant image to calibrate."
+    if not detector or not wavelength or calibrant not in ALL_CALIBRANTS:
+        return no_update, True, "Select a detector, wavelength and calibrant."
+    try:
+        image = image_store.get(img_key)
+    except KeyError as e:
+        return no_update, True, str(e)
+    mask = stored_mask(mask_data)
+    if mask is not None and mask.shape != np.shape(image):
+        mask = None
+    guess = {"dist": sdd, "poni1": poni1, "poni2": poni2}
+    for name, rotation in (("rot1", rot1), ("rot2", rot2), ("rot3", rot3)):
+        guess[name] = np.deg2rad(rotation) if rotation is not None else None
+    try:
+        calibration = RingCalibration(
+            image, detector, wavelength, calibrant, mask=mask, guess=guess
+        )
+    except ValueError as e:
+        return no_update, True, str(e)
+    return start_calibration_job(calibration), False, "Picking ring peaks..."
+
+
+@callback(
+    Output("calibration_tab-auto_calibration_status", "children", allow_duplicate=True),
+    Output("calibration_tab-calibration_plot", "figure"),
+    Output("calibration_tab-poni_file", "data", allow_duplicate=True),
+    Output(
+        "calibration_tab-auto_calibration_interval", "disabled", allow_duplicate=True
+    ),
+    Input("calibration_tab-auto_calibration_interval", "n_intervals"),
+    State("calibration_tab-auto_calibration_job", "data"),
+    State("calibration_tab-input-detector_dropdown", "value"),
+    prevent_initial_call=True,
+)
+def poll_auto_calibration(
+    n_intervals: int, job_id: str | None, detector: str | None
+) -> tuple[str, go.Figure, str, bool]:
+    """
+    Report the progress of the automatic calibration.
+
+    The best geometry so far is plotted as it improves, and the final geometry
+    is set as the PONI file, which updates the PONI inputs and beam centre.
+    """
+    job: CalibrationJob | None = _calibration_jobs.get(job_id) if job_id else None
+    if job is None:
+        return "The calibration is no longer available.", no_update, no_update, True
+    best = job.result or (job.progress.best if job.progress else None)
+    fig = no_update
+    if best is not None and best is not job.plotted:
+        fig = calibration_peaks_figure(job.calibration, best)
+        job.plotted = best
+    if not job.done:
+        status = (
+            f"Calibrating: {job.progress}" if job.progress else "Picking ring peaks..."
+        )
+        return status, fig, no_update, False
+    if job.error is not None:
+        return f"Calibration failed: {job.error}", fig, no_update, True
+    poni = job.result.poni(detector or job.calibration.detector)
+    return f"Calibrated: {job.result}", fig, json.dumps(poni.as_dict()), True
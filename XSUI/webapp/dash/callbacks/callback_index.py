@@ -0,0 +1,138 @@
+# Import packages
+from dash import callback, Output, Input
+from dash.exceptions import PreventUpdate
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+from XSUI.webapp.fastapi.database import get_engine
+from XSUI.webapp.fastapi.models.index import IMAGE_TABLES, page_index
+
+_FILTER_SYMBOLS = (
+    ("ge", ">="),
+    ("le", "<="),
+    ("lt", "<"),
+    ("gt", ">"),
+    ("ne", "!="),
+    ("eq", "="),
+    ("contains", None),
+)
+"""The `DataTable` filter operators, and their symbols, in matching order."""
+
+
+#################################################
+#### Functions
+#################################################
+def parse_filter_query(filter_query: str | None) -> list[tuple[str, str, object]]:
+    """
+    Parse the `filter_query` of a `DataTable` into (column, operator, value) filters.
+
+    Parameters
+    ----------
+    filter_query : str | None
+        The filter query, such as `{maximum} > 1000 && {filename} contains Ag`.
+
+    Returns
+    -------
+    list[tuple[str, str, object]]
+        The filters, with numeric values converted to floats.
+    """
+    filters = []
+    for part in (filter_query or "").split(" && "):
+        part = part.strip()
+        if not part.startswith("{") or "}" not in part:
+            continue
+        column, _, expression = part[1:].partition("}")
+        expression = expression.strip()
+        for name, symbol in _FILTER_SYMBOLS:
+            for token in (f"{name} ", f"{symbol} " if symbol else None):
+                if token and expression.startswith(token):
+                    value = expression[len(token) :].strip()
+                    if value[:1] == value[-1:] and value[:1] in "\"'`":
+                        value = value[1:-1]
+                    elif name != "contains":
+                        try:
+                            value = float(value)
+                        except ValueError:
+                            pass
+                    filters.append((column, name, value))
+                    break
+            else:
+                continue
+            break
+    return filters
+
+
+def index_table_page(
+    image_table: str,
+    page_current: int,
+    page_size: int,
+    sort_by: list[dict] | None,
+    filter_query: str | None,
+) -> tuple[list[dict], int]:
+    """
+    Query a page of the image index for a `DataTable`.
+
+    Parameters
+    ----------
+    image_table : str
+        The table name of the image model.
+    page_current : int
+        The index of the current page.
+    page_size : int
+        The number of rows per page.
+    sort_by : list[dict] | None
+        The `DataTable` sort order, of `column_id` and `direction`.
+    filter_query : str | None
+        The `DataTable` filter query.
+
+    Returns
+    -------
+    data : list[dict]
+        The rows of the page.
+    page_count : int
+        The number of pages.
+    """
+    sort = [(s["column_id"], s["direction"] == "asc") for s in sort_by or []]
+    try:
+        with orm.Session(get_engine()) as session:
+            entries, total = page_index(
+                session,
+                image_table,
+                page_current or 0,
+                page_size,
+                parse_filter_query(filter_query),
+                sort,
+            )
+            data = [entry.as_row() for entry in entries]
+    except (ValueError, sa.exc.OperationalError) as e:
+        print(f"Could not query the image index: {e}")
+        raise PreventUpdate
+    return data, max(-(-total // page_size), 1)
+
+
+#################################################
+#### CALLBACKS
+#################################################
+for _tab, _image_table in (
+    ("waxs", IMAGE_TABLES["waxs"]),
+    ("giwaxs", IMAGE_TABLES["giwaxs"]),
+):
+
+    @callback(
+        Output(f"{_tab}_tab-image_index", "data"),
+        Output(f"{_tab}_tab-image_index", "page_count"),
+        Input(f"{_tab}_tab-image_index", "page_current"),
+        Input(f"{_tab}_tab-image_index", "page_size"),
+        Input(f"{_tab}_tab-image_index", "sort_by"),
+        Input(f"{_tab}_tab-image_index", "filter_query"),
+    )
+    def update_index_table(
+        page_current: int,
+        page_size: int,
+        sort_by: list[dict] | None,
+        filter_query: str | None,
+        image_table: str = _image_table,
+    ) -> tuple[list[dict], int]:
+        """Page through the image index, sorted and filtered in the database."""
+        return index_table_page(
+            image_table, page_current, page_size, sort_by, filter_query
+        )
@@ -0,0 +1,186 @@
+# Import packages
+import os
+from dash import callback, clientside_callback, Output, Input, State, Patch
+from dash.exceptions import PreventUpdate
+import numpy as np
+import plotly.graph_objects as go
+from XSUI.webapp.dash.callbacks.callback_calibration import relayout_ranges
+from XSUI.webapp.dash.callbacks.callback_index import parse_filter_query
+from XSUI.webapp.profiles import CurveSet, curve_cache, list_reductions
+
+
+#################################################
+#### Functions
+#################################################
+def load_curves(path: str | None) -> CurveSet:
+    """Get the cached curve set of a reduction output, or prevent the update."""
+    if not path:
+        raise PreventUpdate
+    try:
+        return curve_cache.get(path)
+    except (KeyError, OSError) as e:
+        print(f"Could not read the profiles of {path}: {e}")
+        raise PreventUpdate
+
+
+def select_curves(
+    curves: CurveSet, filter_query: str | None, sort_by: list[dict] | None
+) -> np.ndarray:
+    """
+    Filter and sort the curves of a curve set by the state of a `DataTable`.
+
+    Parameters
+    ----------
+    curves : CurveSet
+        The curve set.
+    filter_query : str | None
+        The `DataTable` filter query.
+    sort_by : list[dict] | None
+        The `DataTable` sort order, of `column_id` and `direction`.
+
+    Returns
+    -------
+    np.ndarray
+        The indices of the selected curves, in order.
+    """
+    sort = [(s["column_id"], s["direction"] == "asc") for s in sort_by or []]
+    try:
+        table = curves.select(parse_filter_query(filter_query), sort)
+    except ValueError as e:
+        print(f"Could not filter the profiles: {e}")
+        raise PreventUpdate
+    return table["curve"].to_numpy()
+
+
+def profile_figure(traces: list[dict], log: bool, uirevision: str) -> go.Figure:
+    """
+    The figure of overlaid profiles.
+
+    Parameters
+    ----------
+    traces : list[dict]
+        The decimated `scattergl` traces of the curves.
+    log : bool
+        Whether to plot the intensity on a log scale.
+    uirevision : str
+        Keep the zoom while this is unchanged, such as the reduction path.
+    """
+    fig = go.Figure(data=traces)
+    fig.update_layout(
+        xaxis_title="Radial",
+        yaxis_title="Intensity",
+        yaxis_type="log" if log else "linear",
+        showlegend=len(traces) > 1,
+        hovermode="closest",
+        uirevision=uirevision,
+        margin={"l": 60, "r": 20, "t": 30, "b": 50},
+    )
+    return fig
+
+
+#################################################
+#### CALLBACKS
+#################################################
+@callback(
+    Output("waxs_tab-reduction_dropdown", "options"),
+    Input("waxs_tab-reduction_refresh", "n_clicks"),
+)
+def update_reduction_options(n_clicks: int) -> list[dict]:
+    """List the reduction outputs, newest first."""
+    return [
+        {"label": os.path.basename(path), "value": path} for path in list_reductions()
+    ]
+
+
+# Measure the plot in the browser, so curves are decimated to its pixel width.
+clientside_callback(
+    """
+    function(path) {
+        const plot = document.getElementById("waxs-plot");
+        return plot ? plot.offsetWidth : null;
+    }
+    """,
+    Output("waxs_tab-plot_width", "data"),
+    Input("waxs_tab-reduction_dropdown", "value"),
+)
+
+
+@callback(
+    Output("waxs_tab-curve_table", "data"),
+    Output("waxs_tab-curve_table", "page_count"),
+    Output("waxs_tab-curve_count", "children"),
+    Input("waxs_tab-reduction_dropdown", "value"),
+    Input("waxs_tab-curve_table", "page_current"),
+    Input("waxs_tab-curve_table", "page_size"),
+    Input("waxs_tab-curve_table", "sort_by"),
+    Input("waxs_tab-curve_table", "filter_query"),
+)
+def update_curve_table(
+    path: str | None,
+    page_current: int,
+    page_size: int,
+    sort_by: list[dict] | None,
+    filter_query: str | None,
+) -> tuple[list[dict], int, str]:
+    """Page through the curves of a reduction, sorted and filtered on the server."""
+    curves = load_curves(path)
+    selected = select_curves(curves, filter_query, sort_by)
+    start = (page_current or 0) * page_size
+    page = curves.table.iloc[selected[start : start + page_size]]
+    count = f"{selected.size} of {len(curves)} curves overlaid"
+    return page.to_dict("records"), max(-(-selected.size // page_size), 1), count
+
+
+@callback(
+    Output("waxs-plot", "figure"),
+    Input("waxs_tab-reduction_dropdown", "value"),
+    Input("waxs_tab-curve_table", "filter_query"),
+    Input("waxs_tab-curve_table", "sort_by"),
+    Input("waxs_tab-decimation", "value"),
+    Input("waxs_tab-log_scale", "value"),
+    Input("waxs_tab-plot_width", "data"),
+)
+def update_profile_plot(
+    path: str | None,
+    filter_query: str | None,
+    sort_by: list[dict] | None,
+    method: str,
+    log_scale: list[str],
+    width: int | None,
+) -> go.Figure:
+    """Overlay every selected curve, decimated to the width of the plot."""
+    curves = load_curves(path)
+    selected = select_curves(curves, filter_query, sort_by)
+    traces = curves.traces(selected, width, None, method)
+    return profile_figure(traces, "log" in (log_scale or []), path)
+
+
+@callback(
+    Output("waxs-plot", "figure", allow_duplicate=True),
+    Input("waxs-plot", "relayoutData"),
+    State("waxs_tab-reduction_dropdown", "value"),
+    State("waxs_tab-curve_table", "filter_query"),
+    State("waxs_tab-curve_table", "sort_by"),
+    State("waxs_tab-decimation", "value"),
+    State("waxs_tab-plot_width", "data"),
+    prevent_initial_call=True,
+)
+def update_profile_zoom(
+    relayout_data: dict | None,
+    path: str | None,
+    filter_query: str | None,
+    sort_by: list[dict] | None,
+    method: str,
+    width: int | None,
+) -> Patch:
+    """Decimate the visible radial range again at the resolution of the zoom."""
+    if not relayout_data:
+        raise PreventUpdate
+    ranges = relayout_ranges(relayout_data)
+    if ranges is None:
+        raise PreventUpdate
+    curves = load_curves(path)
+    selected = select_curves(curves, filter_query, sort_by)
+    patched = Patch()
+    patched["data"] = curves.traces(selected, width, ranges[0], method)
+    return patched
@@ -7,6 +7,13 @@ from dash import Dash, html, dash_table, dcc, callback, Output, Input
 import pandas as pd
 import plotly.express as px
 import dash_bootstrap_components as dbc
+from XSUI.webapp.fastapi.database import get_engine
+from XSUI.webapp.fastapi.models import (
+    bases_list_all,
+    index_missing_images,
+    migrate_image_tables,
+    migrate_mask_tables,
+)
 
 # temp_dir = tempfile.gettempdir()
 # temp_sqlite_db = os.path.join(temp_dir, "XSUI_sqlite.db")
@@ -32,6 +39,18 @@ app = Dash(__name__, server=server, external_stylesheets=external_stylesheets)
 
 # print("Database initialized at:", temp_sqlite_db)
 
+# Upgrade tables of older releases, and create the tables used by the callbacks
+with get_engine().begin() as connection:
+    migrated_tables = migrate_mask_tables(connection)
+    migrated_tables += migrate_image_tables(connection)
+    for base in bases_list_all:
+        base.metadata.create_all(connection)
+    indexed = index_missing_images(connection)
+if migrated_tables:
+    print(f"Migrated tables: {migrated_tables}")
+if indexed:
+    print(f"Indexed {indexed} images.")
+
 
 # Create the tabs
 from XSUI.webapp.dash.tabs import CalibrationTab
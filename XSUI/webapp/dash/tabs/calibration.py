@@ -3,6 +3,7 @@ from dash import html, dcc
 import dash_bootstrap_components as dbc
 from pyFAI.detectors import _detector_class_names
 from pyFAI.calibrant import ALL_CALIBRANTS
+from XSUI.detectors.registry import BEAMLINE_DETECTORS
 
 
 class CalibrationTab(dcc.Tab):
@@ -71,6 +72,10 @@ class CalibrationTab(dcc.Tab):
                             ),
                             # TODO: Do I need store?
                             dcc.Store(id="calibration_tab-poni_file", data=""),
+                            # Identifies the browser tab, to keep its drawn mask apart
+                            dcc.Store(
+                                id="calibration_tab-session_id", storage_type="session"
+                            ),
                             # Detector Properties
                             dbc.Row(
                                 [
@@ -85,7 +90,10 @@ class CalibrationTab(dcc.Tab):
                                 id="calibration_tab-input-detector_dropdown",
                                 options=[
                                     {"label": name, "value": name}
-                                    for name in _detector_class_names
+                                    for name in [
+                                        *BEAMLINE_DETECTORS,
+                                        *_detector_class_names,
+                                    ]
                                 ],
                                 value=None,
                             ),
@@ -268,7 +276,30 @@ class CalibrationTab(dcc.Tab):
                                             for cal in ALL_CALIBRANTS.keys()
                                             # if cal != "AgBeh"
                                         ],
-                                        value="AgBeh",
+                                        value="AgBh",
+                                    ),
+                                ]
+                            ),
+                            # Automatic calibration of the geometry from the rings
+                            dbc.Row(
+                                [
+                                    html.Button(
+                                        "Auto Calibrate",
+                                        id="calibration_tab-btn-auto_calibrate",
+                                        n_clicks=0,
+                                    ),
+                                    html.Div(
+                                        id="calibration_tab-auto_calibration_status"
+                                    ),
+                                    dcc.Store(
+                                        id="calibration_tab-auto_calibration_job",
+                                        data=None,
+                                    ),
+                                    # Polls the progress of a running calibration
+                                    dcc.Interval(
+                                        id="calibration_tab-auto_calibration_interval",
+                                        interval=500,
+                                        disabled=True,
                                     ),
                                 ]
                             ),
@@ -288,6 +319,9 @@ class CalibrationTab(dcc.Tab):
                                         multiple=False,
                                     ),
                                     html.Div(id="calibration_tab-uploaded_filename"),
+                                    dcc.Store(
+                                        id="calibration_tab-upload_handle", data=None
+                                    ),
                                 ]
                             ),
                             dbc.Row(
@@ -310,6 +344,8 @@ class CalibrationTab(dcc.Tab):
                                             ]
                                         },
                                     ),
+                                    # Pixel values are looked up on hover
+                                    html.Div(id="calibration_tab-image_hover"),
                                     dcc.Store(
                                         id="calibration_tab-image_data", data=None
                                     ),
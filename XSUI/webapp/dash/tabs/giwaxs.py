@@ -3,6 +3,7 @@ from dash import Dash, html, dash_table, dcc, callback, Output, Input
 import pandas as pd
 import plotly.express as px
 import dash_bootstrap_components as dbc
+from XSUI.webapp.fastapi.models.index import ImageIndex
 
 
 class GIWAXSTab(dcc.Tab):
@@ -22,9 +23,22 @@ class GIWAXSTab(dcc.Tab):
                                 "GI-WAXS Data",
                                 className="text-secondary text-left fs-5",
                             ),
+                            # Pages through the image index on the server
                             dash_table.DataTable(
+                                id="giwaxs_tab-image_index",
                                 data=None,
+                                columns=[
+                                    {"name": name, "id": name}
+                                    for name in ImageIndex.TABLE_COLUMNS
+                                ],
+                                page_current=0,
                                 page_size=12,
+                                page_action="custom",
+                                sort_action="custom",
+                                sort_mode="multi",
+                                sort_by=[],
+                                filter_action="custom",
+                                filter_query="",
                                 style_table={"overflowX": "auto"},
                             ),
                         ],
@@ -3,6 +3,8 @@ from dash import Dash, html, dash_table, dcc, callback, Output, Input
 import pandas as pd
 import plotly.express as px
 import dash_bootstrap_components as dbc
+from XSUI.webapp.fastapi.models.index import ImageIndex
+from XSUI.webapp.profiles import CURVE_COLUMNS, DECIMATION_METHODS
 
 
 class WAXSTab(dcc.Tab):
@@ -21,9 +23,22 @@ class WAXSTab(dcc.Tab):
                             html.Div(
                                 "WAXS Data", className="text-secondary text-left fs-5"
                             ),
+                            # Pages through the image index on the server
                             dash_table.DataTable(
+                                id="waxs_tab-image_index",
                                 data=None,
+                                columns=[
+                                    {"name": name, "id": name}
+                                    for name in ImageIndex.TABLE_COLUMNS
+                                ],
+                                page_current=0,
                                 page_size=12,
+                                page_action="custom",
+                                sort_action="custom",
+                                sort_mode="multi",
+                                sort_by=[],
+                                filter_action="custom",
+                                filter_query="",
                                 style_table={"overflowX": "auto"},
                             ),
                         ],
@@ -35,6 +50,69 @@ class WAXSTab(dcc.Tab):
                     ### Placeholder for Point of normal incidence data.
                 ]
             ),
-            dcc.Graph(figure={}, id="waxs-plot"),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        [
+                            html.Div(
+                                "Integrated Profiles",
+                                className="text-secondary text-left fs-5",
+                            ),
+                            # Reduction outputs in the reduction directory
+                            dcc.Dropdown(
+                                id="waxs_tab-reduction_dropdown",
+                                options=[],
+                                placeholder="Select a reduction",
+                            ),
+                            html.Button(
+                                "Refresh", id="waxs_tab-reduction_refresh", n_clicks=0
+                            ),
+                            dcc.RadioItems(
+                                id="waxs_tab-decimation",
+                                options=[
+                                    {"label": label, "value": method}
+                                    for method, label in DECIMATION_METHODS.items()
+                                ],
+                                value="minmax",
+                                inline=True,
+                            ),
+                            dcc.Checklist(
+                                id="waxs_tab-log_scale",
+                                options=[{"label": "Log intensity", "value": "log"}],
+                                value=[],
+                                inline=True,
+                            ),
+                            # Filters and sorts the curves on the server; every
+                            # curve matching the filter is overlaid.
+                            dash_table.DataTable(
+                                id="waxs_tab-curve_table",
+                                data=None,
+                                columns=[
+                                    {"name": name, "id": name} for name in CURVE_COLUMNS
+                                ],
+                                page_current=0,
+                                page_size=12,
+                                page_action="custom",
+                                sort_action="custom",
+                                sort_mode="multi",
+                                sort_by=[],
+                                filter_action="custom",
+                                filter_query="",
+                                style_table={"overflowX": "auto"},
+                            ),
+                            html.Div(id="waxs_tab-curve_count"),
+                        ],
+                        width=4,
+                    ),
+                    dbc.Col(
+                        [
+                            dcc.Graph(figure={}, id="waxs-plot"),
+                            # The plot width in pixels, to decimate curves to.
+                            dcc.Store(id="waxs_tab-plot_width", data=None),
+                        ],
+                        width=8,
+                    ),
+                ]
+            ),
         ]
         super().__init__(layout, **kwargs)
@@ -0,0 +1,297 @@
+"""
+Binary responses of arrays, for scripted clients of the REST API.
+
+Arrays are streamed either as `.npy` files (readable by `numpy.load`), or as
+raw C-ordered bytes with the shape and dtype in the `X-Array-Shape` and
+`X-Array-Dtype` headers. Responses support single HTTP byte ranges, and only
+the rows of the array covering the requested range are read, so a client can
+fetch part of a large frame without the server reading (or decompressing) the
+rest of it.
+"""
+
+import io
+import math
+from typing import Callable, Iterator
+
+import h5py
+import numpy as np
+from numpy.lib import format as npy_format
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+ARRAY_FORMATS = {
+    "npy": "application/octet-stream",
+    "bin": "application/octet-stream",
+}
+"""The media types of the array formats, by file suffix."""
+
+STREAM_CHUNK = 1 << 20
+"""The target number of bytes read per chunk of a streamed response."""
+
+
+def npy_header(shape: tuple[int, ...], dtype: np.dtype) -> bytes:
+    """
+    The header of a C-ordered `.npy` file.
+
+    Parameters
+    ----------
+    shape : tuple[int, ...]
+        The shape of the array.
+    dtype : np.dtype
+        The dtype of the array.
+
+    Returns
+    -------
+    bytes
+        The magic string, version and padded header dictionary.
+    """
+    header = {
+        "descr": npy_format.dtype_to_descr(np.dtype(dtype)),
+        "fortran_order": False,
+        "shape": tuple(shape),
+    }
+    buffer = io.BytesIO()
+    npy_format.write_array_header_1_0(buffer, header)
+    return buffer.getvalue()
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Parse a HTTP `Range` header into a byte range.
+
+    Only single ranges are supported. Multiple ranges, and ranges of units
+    other than bytes, are ignored (and the full body is sent).
+
+    Parameters
+    ----------
+    header : str | None
+        The value of the `Range` header, such as `bytes=0-1023` or `bytes=-512`.
+    size : int
+        The size of the body.
+
+    Returns
+    -------
+    tuple[int, int] | None
+        The (start, stop) of the range, or None for the full body.
+
+    Raises
+    ------
+    ValueError
+        If the range is malformed or not satisfiable.
+    """
+    if not header:
+        return None
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, sep, last = ranges.strip().partition("-")
+    if not sep:
+        raise ValueError(f"Malformed range `{header}`.")
+    try:
+        if first:
+            start = int(first)
+            stop = min(int(last) + 1, size) if last else size
+        else:
+            start = max(size - int(last), 0)
+            stop = size
+    except ValueError:
+        raise ValueError(f"Malformed range `{header}`.")
+    if start >= size or stop <= start:
+        raise ValueError(f"Range `{header}` not satisfiable for {size} bytes.")
+    return start, stop
+
+
+class ArrayBody:
+    """
+    The bytes of an array, read lazily by row.
+
+    Parameters
+    ----------
+    shape : tuple[int, ...]
+        The shape of the array.
+    dtype : np.dtype | str
+        The dtype of the array.
+    read_rows : Callable[[int, int], np.ndarray]
+        Reads the rows `[start, stop)` of the first axis of the array.
+    fmt : str, optional
+        "npy" to prefix the `.npy` header, or "bin" for the raw bytes only,
+        by default "npy".
+    chunk_rows : int | None, optional
+        Read whole multiples of this number of rows where possible, such as the
+        chunk size of a compressed image, by default None.
+    """
+
+    def __init__(
+        self,
+        shape: tuple[int, ...],
+        dtype: np.dtype | str,
+        read_rows: Callable[[int, int], np.ndarray],
+        fmt: str = "npy",
+        chunk_rows: int | None = None,
+    ):
+        if fmt not in ARRAY_FORMATS:
+            raise ValueError(f"Unknown array format `{fmt}`.")
+        self.shape = tuple(int(n) for n in shape) or (1,)
+        self.dtype = np.dtype(dtype)
+        if self.dtype.metadata:
+            # Drop the metadata of `h5py` dtypes, which `.npy` headers cannot hold.
+            self.dtype = np.dtype(
+                self.dtype.descr if self.dtype.fields else self.dtype.str
+            )
+        if self.dtype.hasobject:
+            raise TypeError(f"Arrays of dtype {self.dtype} have no binary form.")
+        self.read_rows = read_rows
+        self.fmt = fmt
+        self.prefix = npy_header(self.shape, self.dtype) if fmt == "npy" else b""
+        self.row_bytes = math.prod(self.shape[1:]) * self.dtype.itemsize
+        self.size = len(self.prefix) + self.shape[0] * self.row_bytes
+        batch = max(STREAM_CHUNK // max(self.row_bytes, 1), 1)
+        if chunk_rows:
+            batch = max(batch // chunk_rows, 1) * chunk_rows
+        self.batch_rows = batch
+
+    def __repr__(self):
+        return f"<ArrayBody shape={self.shape} dtype={self.dtype.str} fmt={self.fmt}>"
+
+    @classmethod
+    def from_array(cls, data: np.ndarray, fmt: str = "npy") -> "ArrayBody":
+        """The body of an array in memory (or memory-mapped)."""
+        data = np.asarray(data)
+        rows = data.reshape(1) if data.ndim == 0 else data
+        return cls(data.shape, data.dtype, lambda a, b: rows[a:b], fmt)
+
+    @classmethod
+    def from_hdf5(cls, path: str, name: str, fmt: str = "npy") -> "ArrayBody":
+        """
+        The body of an HDF5 dataset, read by row from the file.
+
+        Parameters
+        ----------
+        path : str
+            The path of the HDF5 file.
+        name : str
+            The name of the dataset in the file.
+        fmt : str, optional
+            The array format, by default "npy".
+
+        Raises
+        ------
+        KeyError
+            If the file has no such dataset.
+        """
+        with h5py.File(path, "r") as f:
+            dataset = f[name]
+            if not isinstance(dataset, h5py.Dataset):
+                raise KeyError(f"`{name}` is not a dataset of {path}.")
+            shape, dtype, chunks = dataset.shape, dataset.dtype, dataset.chunks
+
+        def read_rows(start: int, stop: int) -> np.ndarray:
+            with h5py.File(path, "r") as f:
+                return f[name][start:stop] if shape else f[name][()].reshape(1)
+
+        return cls(shape, dtype, read_rows, fmt, chunks[0] if chunks else None)
+
+    @property
+    def headers(self) -> dict[str, str]:
+        """The headers describing the array."""
+        return {
+            "X-Array-Shape": ",".join(str(n) for n in self.shape),
+            "X-Array-Dtype": self.dtype.str,
+        }
+
+    def iter_range(self, start: int = 0, stop: int | None = None) -> Iterator[bytes]:
+        """
+        Iterate over the bytes `[start, stop)` of the body, in chunks.
+
+        Parameters
+        ----------
+        start : int, optional
+            The first byte, by default 0.
+        stop : int | None, optional
+            The byte after the last, by default the end of the body.
+
+        Yields
+        ------
+        bytes
+            The chunks of the range, of about `STREAM_CHUNK` bytes.
+        """
+        stop = self.size if stop is None else min(stop, self.size)
+        nprefix = len(self.prefix)
+        if start < nprefix:
+            yield self.prefix[start : min(stop, nprefix)]
+        if stop <= nprefix or self.row_bytes == 0:
+            return
+        offset = max(start - nprefix, 0)
+        end = stop - nprefix
+        row = offset // self.row_bytes
+        last = -(-end // self.row_bytes)
+        while row < last:
+            # Align batches to `batch_rows`, so chunked blobs decode whole chunks.
+            batch_stop = min((row // self.batch_rows + 1) * self.batch_rows, last)
+            rows = np.ascontiguousarray(self.read_rows(row, batch_stop), self.dtype)
+            data = memoryview(rows).cast("B")
+            base = row * self.row_bytes
+            yield data[max(offset - base, 0) : end - base].tobytes()
+            row = batch_stop
+
+
+def array_response(
+    request: Request,
+    body: ArrayBody,
+    filename: str | None = None,
+    etag: str | None = None,
+    immutable: bool = False,
+) -> Response:
+    """
+    Stream an array body, honouring `Range`, `If-None-Match` and `HEAD` requests.
+
+    Parameters
+    ----------
+    request : Request
+        The request.
+    body : ArrayBody
+        The array body.
+    filename : str | None, optional
+        The download filename, without suffix. By default none is given.
+    etag : str | None, optional
+        The entity tag of the array, such as its content hash.
+    immutable : bool, optional
+        Whether the array never changes at this URL, such as a content-addressed
+        image, so clients may cache it indefinitely. By default False.
+
+    Returns
+    -------
+    Response
+        The full (200), partial (206), not modified (304) or unsatisfiable
+        range (416) response.
+    """
+    headers = {"Accept-Ranges": "bytes", **body.headers}
+    if etag is not None:
+        headers["ETag"] = f'"{etag}.{body.fmt}"'
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+    if immutable:
+        headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    if filename is not None:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}.{body.fmt}"'
+    try:
+        byte_range = parse_range(request.headers.get("range"), body.size)
+    except ValueError as e:
+        headers["Content-Range"] = f"bytes */{body.size}"
+        return Response(str(e), status_code=416, headers=headers)
+    status = 200
+    start, stop = 0, body.size
+    if byte_range is not None:
+        status = 206
+        start, stop = byte_range
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{body.size}"
+    headers["Content-Length"] = str(stop - start)
+    media_type = ARRAY_FORMATS[body.fmt]
+    if request.method == "HEAD":
+        return Response(status_code=status, headers=headers, media_type=media_type)
+    return StreamingResponse(
+        body.iter_range(start, stop),
+        status_code=status,
+        headers=headers,
+        media_type=media_type,
+    )
@@ -3,6 +3,7 @@ from dash import html, dcc
 import dash_bootstrap_components as dbc
 from pyFAI.detectors import _detector_class_names
 from pyFAI.calibrant import ALL_CALIBRANTS
+from XSUI.detectors.registry import BEAMLINE_DETECTORS
 
 
 class CalibrationTab(dcc.Tab):
@@ -75,6 +76,10 @@ class CalibrationTab(dcc.Tab):
                             ),
                             # TODO: Do I need store?
                             dcc.Store(id="calibration_tab-poni_file", data=""),
+                            # Identifies the browser tab, to keep its drawn mask apart
+                            dcc.Store(
+                                id="calibration_tab-session_id", storage_type="session"
+                            ),
                             # Detector Properties
                             dbc.Row(
                                 [
@@ -89,7 +94,10 @@ class CalibrationTab(dcc.Tab):
                                 id="calibration_tab-input-detector_dropdown",
                                 options=[
                                     {"label": name, "value": name}
-                                    for name in _detector_class_names
+                                    for name in [
+                                        *BEAMLINE_DETECTORS,
+                                        *_detector_class_names,
+                                    ]
                                 ],
                                 value=None,
                             ),
@@ -291,7 +299,15 @@ class CalibrationTab(dcc.Tab):
                                         ),
                                         multiple=False,
                                     ),
+                                    # Streams the file to the `/uploads` endpoint
+                                    html.Button(
+                                        "Stream Large Calibration Data File",
+                                        id="calibration_tab-btn-stream_upload",
+                                    ),
                                     html.Div(id="calibration_tab-uploaded_filename"),
+                                    dcc.Store(
+                                        id="calibration_tab-upload_handle", data=None
+                                    ),
                                 ]
                             ),
                             dbc.Row(
@@ -314,6 +330,8 @@ class CalibrationTab(dcc.Tab):
                                             ]
                                         },
                                     ),
+                                    # Pixel values are looked up on hover
+                                    html.Div(id="calibration_tab-image_hover"),
                                     dcc.Store(
                                         id="calibration_tab-image_data", data=None
                                     ),
@@ -11,10 +11,12 @@ import dash_bootstrap_components as dbc
 # server = flask.Flask(__name__)
 # server.app_context().push()
 external_stylesheets = [dbc.themes.CERULEAN]
+# The layout only holds the calibration tab of the shared callbacks.
 dash_app = Dash(
     __name__,
     external_stylesheets=external_stylesheets,
     requests_pathname_prefix="/dashboard1/",
+    suppress_callback_exceptions=True,
 )
 
 from XSUI.webapp.fastapi.dash_tabs.calibration import CalibrationTab
@@ -69,9 +71,41 @@ dash_app.layout = dbc.Container(
     fluid=True,
 )
 
+# Stream large calibration files to the FastAPI `/uploads` endpoint from the
+# browser, instead of base64 encoding them into a `dcc.Upload` callback payload.
+dash_app.clientside_callback(
+    """
+    async function(n_clicks) {
+        const file = await new Promise((resolve) => {
+            const input = document.createElement("input");
+            input.type = "file";
+            input.onchange = () => resolve(input.files[0]);
+            input.click();
+        });
+        if (!file) {
+            return window.dash_clientside.no_update;
+        }
+        const response = await fetch(
+            "/uploads?filename=" + encodeURIComponent(file.name),
+            {method: "POST", body: file},
+        );
+        if (!response.ok) {
+            throw new Error(await response.text());
+        }
+        return await response.json();
+    }
+    """,
+    Output("calibration_tab-upload_handle", "data"),
+    Input("calibration_tab-btn-stream_upload", "n_clicks"),
+    prevent_initial_call=True,
+)
+
+# Register the server callbacks, such as reading the image of a streamed upload.
+from XSUI.webapp.dash.callbacks import *
+
 # Run the app
 if __name__ == "__main__":
-    # import the call backs
-    from XSUI.webapp.dash.callbacks import *
+    import uvicorn
 
-    dash_app.run(debug=True)
+    # The app is served under FastAPI, which provides the `/uploads` endpoint.
+    uvicorn.run("XSUI.webapp.fastapi.main:app", host="127.0.0.1", port=8000)
@@ -0,0 +1,209 @@
+"""
+The database connection shared by the FastAPI endpoints and the Dash callbacks.
+
+FastAPI endpoints use an async engine (`aiosqlite` for the local SQLite
+database) through the `get_session` dependency, so database calls never block
+the event loop. The Dash callbacks, which run in WSGI worker threads, use a
+synchronous engine on the same database. SQLite connections are opened in WAL
+mode, so readers are not blocked by a writer.
+
+The database URL and SQL logging are configured by the `XSUI_DATABASE_URL` and
+`XSUI_DATABASE_ECHO` environment variables.
+"""
+
+import logging
+import os
+import tempfile
+from typing import Annotated, AsyncIterator, Iterable
+
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+temp_dir = tempfile.gettempdir()
+temp_sqlite_db = os.path.join(temp_dir, "XSUI_sqlite.db")
+"""The path of the default SQLite database."""
+
+DATABASE_URL = os.environ.get(
+    "XSUI_DATABASE_URL", f"sqlite+aiosqlite:///{temp_sqlite_db}"
+)
+"""The async database URL."""
+
+DATABASE_ECHO = os.environ.get("XSUI_DATABASE_ECHO", "").lower()
+"""Log SQL statements if "1"/"true", or statements and results if "debug"."""
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "foreign_keys": "ON",
+    "temp_store": "MEMORY",
+    "cache_size": -64000,
+    "mmap_size": 256 << 20,
+}
+"""The pragmas of every SQLite connection, tuned for concurrent readers."""
+
+BULK_INSERT_BATCH = 1000
+"""The number of rows per statement of `bulk_insert`."""
+
+
+def sync_url(url: str) -> str:
+    """The synchronous driver URL of an async database URL."""
+    return url.replace("+aiosqlite", "").replace("+asyncpg", "+psycopg")
+
+
+def configure_logging(echo: str | bool = DATABASE_ECHO) -> None:
+    """
+    Configure the logging of SQL statements.
+
+    Parameters
+    ----------
+    echo : str | bool, optional
+        True, "1" or "true" to log statements, "debug" to also log results,
+        and anything else to log only warnings. By default `DATABASE_ECHO`.
+    """
+    echo = str(echo).lower()
+    if echo == "debug":
+        level = logging.DEBUG
+    elif echo in ("1", "true"):
+        level = logging.INFO
+    else:
+        level = logging.WARNING
+    logging.getLogger("sqlalchemy.engine").setLevel(level)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Apply `SQLITE_PRAGMAS` to a new SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def _configure_engine(engine: sa.Engine) -> sa.Engine:
+    if engine.dialect.name == "sqlite":
+        sa.event.listen(engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+
+_engine: sa.Engine | None = None
+_async_engine: AsyncEngine | None = None
+_async_sessions: async_sessionmaker[AsyncSession] | None = None
+
+
+def get_engine() -> sa.Engine:
+    """Get the synchronous database engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        configure_logging()
+        _engine = _configure_engine(
+            sa.create_engine(sync_url(DATABASE_URL), pool_pre_ping=True)
+        )
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """Get the async database engine, creating it on first use."""
+    global _async_engine, _async_sessions
+    if _async_engine is None:
+        configure_logging()
+        _async_engine = create_async_engine(DATABASE_URL, pool_pre_ping=True)
+        _configure_engine(_async_engine.sync_engine)
+        _async_sessions = async_sessionmaker(_async_engine, expire_on_commit=False)
+    return _async_engine
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    """
+    Provide a database session for the duration of a request.
+
+    Use as a FastAPI dependency (see `SessionDep`). The session is rolled back
+    if the request fails, and closed when it completes.
+
+    Yields
+    ------
+    AsyncSession
+        The session of the request.
+    """
+    get_async_engine()
+    async with _async_sessions() as session:
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+
+
+SessionDep = Annotated[AsyncSession, Depends(get_session)]
+"""The type of an endpoint parameter receiving the request database session."""
+
+
+async def create_all(bases: Iterable[type[orm.DeclarativeBase]]) -> list[str]:
+    """
+    Create the tables of declarative bases, if they do not exist.
+
+    Parameters
+    ----------
+    bases : Iterable[type[orm.DeclarativeBase]]
+        The declarative bases of the models.
+
+    Returns
+    -------
+    list[str]
+        The names of the tables.
+    """
+    tables = []
+    async with get_async_engine().begin() as connection:
+        for base in bases:
+            await connection.run_sync(base.metadata.create_all)
+            tables += base.metadata.tables.keys()
+    return tables
+
+
+async def bulk_insert(
+    session: AsyncSession,
+    model: type[orm.DeclarativeBase],
+    rows: Iterable[dict],
+    batch_size: int = BULK_INSERT_BATCH,
+) -> int:
+    """
+    Insert many rows of a model with batched `executemany` statements.
+
+    Unlike adding model instances to the session, no objects are created or
+    tracked, and each batch is a single statement. The caller commits.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        The database session.
+    model : type[orm.DeclarativeBase]
+        The model to insert rows of.
+    rows : Iterable[dict]
+        The column values of each row.
+    batch_size : int, optional
+        The number of rows per statement, by default `BULK_INSERT_BATCH`.
+
+    Returns
+    -------
+    int
+        The number of inserted rows.
+    """
+    statement = sa.insert(model)
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            await session.execute(statement, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        await session.execute(statement, batch)
+        count += len(batch)
+    return count
@@ -1,36 +1,72 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 import tempfile, os
+import h5py
 import sqlite3
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
 import uvicorn
 from XSUI.webapp.fastapi.dash_tabs.dash_main import dash_app
 from fastapi.middleware.wsgi import WSGIMiddleware
+from XSUI.storage import image_store, open_frames
+from XSUI.webapp.pyramid import TILE_SIZE, pyramid_cache
+from XSUI.webapp.rendering import encode_image
+from XSUI.webapp.fastapi.arrays import ARRAY_FORMATS, ArrayBody, array_response
+from XSUI.webapp.fastapi.uploads import spool_request
+from XSUI.experiment.batch import REDUCTION_DIR
+from XSUI.detectors import precompute_detector_masks
 
 
-temp_dir = tempfile.gettempdir()
-temp_sqlite_db = os.path.join(temp_dir, "XSUI_sqlite.db")
+from XSUI.webapp.fastapi.database import (
+    SessionDep,
+    create_all,
+    get_async_engine,
+)
+from XSUI.webapp.fastapi.models import (
+    bases_list_all,
+    CompositeMask,
+    IMAGE_MODELS,
+    IMAGE_TABLES,
+    ImageCalibrant,
+    index_image,
+    index_missing_images,
+    ingest_image,
+    MASK_MODELS,
+    migrate_image_tables,
+    migrate_mask_tables,
+    page_index,
+)
 
-# Initialize the app
-app = FastAPI()
-
-# Mount the Dash app to the FastAPI app
-app.mount("/dashboard1/", WSGIMiddleware(dash_app.server))
-
-# Initialize the database connection
-db = sa.create_engine(f"sqlite:///{temp_sqlite_db}", echo=True)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the database tables on startup, and release the pool on shutdown."""
+    # Upgrade tables of older releases, which `create_all` does not alter
+    async with get_async_engine().begin() as connection:
+        migrated_tables = await connection.run_sync(migrate_mask_tables)
+        migrated_tables += await connection.run_sync(migrate_image_tables)
+    if migrated_tables:
+        print(f"Migrated tables: {migrated_tables}")
+    # Create all tables in the database
+    created_tables = await create_all(bases_list_all)
+    print(f"Created tables: {created_tables}")
+    # Index the images of older releases, which were stored without an entry
+    async with get_async_engine().begin() as connection:
+        indexed = await connection.run_sync(index_missing_images)
+    if indexed:
+        print(f"Indexed {indexed} images.")
+    # Build the beamline detectors and persist their masks ahead of the first request
+    await run_in_threadpool(precompute_detector_masks)
+    yield
+    await get_async_engine().dispose()
 
-from XSUI.webapp.fastapi.models import bases_list_all
 
-# Create all tables in the database
-created_tables = []
-for base in bases_list_all:
-    base.metadata.create_all(db)
+# Initialize the app
+app = FastAPI(lifespan=lifespan)
 
-    # Collect the names of created tables
-    created_tables += base.metadata.tables.keys()
-print(f"Created tables: {created_tables}")
+# Mount the Dash app to the FastAPI app
+app.mount("/dashboard1/", WSGIMiddleware(dash_app.server))
 
 session_status: dict = {
     "calibrant": None,
@@ -44,6 +80,274 @@ async def root():
     return {"message": "Hello World"}
 
 
+@app.post("/uploads")
+async def upload_image(
+    request: Request, session: SessionDep, filename: str | None = None
+) -> dict:
+    """
+    Upload an image file, streamed to disk in chunks.
+
+    Accepts either a raw request body (with the `filename` query parameter) or
+    a `multipart/form-data` body containing a single file. The file is hashed
+    while spooled (off the event loop), decoded by `fabio` from its path, and
+    added to the image store and the calibrant images (see `ingest_image`).
+    Only a handle to the (first frame of the) image is returned. Spooled files
+    expire after `XSUI.storage.uploads.UPLOAD_TTL`.
+    """
+    spooled = await spool_request(request, filename)
+
+    def read_first_frame(path: str) -> tuple:
+        # Only the first frame of multi-frame files is read.
+        with open_frames(path, cache_size=0) as frames:
+            return frames[0], len(frames), frames.header
+
+    try:
+        data, nframes, header = await run_in_threadpool(read_first_frame, spooled.path)
+    except Exception as e:
+        raise HTTPException(
+            status_code=415, detail=f"Could not read `{spooled.filename}`: {e}"
+        )
+
+    def index_upload() -> tuple:
+        # Encoding and summarizing the image are kept off the event loop.
+        image = ImageCalibrant(spooled.filename, data)
+        return image, index_image(image, data, header)
+
+    image, entry = await run_in_threadpool(index_upload)
+    entry = await session.run_sync(lambda s: ingest_image(s, image, entry=entry))
+    await session.commit()
+    return {
+        "key": image_store.put(data),
+        "filename": spooled.filename,
+        "digest": spooled.digest,
+        "size": spooled.size,
+        "nframes": nframes,
+        "image_id": entry.image_id,
+        "shape": list(data.shape),
+        "dtype": data.dtype.str,
+    }
+
+
+@app.get("/images/{key}/pyramid")
+async def image_pyramid(key: str) -> dict:
+    """Describe the pyramid of an image in the image store, for tile clients."""
+    try:
+        pyramid = await run_in_threadpool(pyramid_cache.get, key)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Image `{key}` not found.")
+    return {
+        "shape": list(pyramid.shape),
+        "levels": pyramid.nlevels,
+        "tile_size": TILE_SIZE,
+        "limits": list(pyramid.limits),
+    }
+
+
+@app.get("/images/{key}/tiles/{level}/{row}/{col}.png")
+async def image_tile(key: str, level: int, row: int, col: int) -> Response:
+    """
+    Get a rendered PNG tile of a level of an image pyramid.
+
+    Level `n` is downsampled by `2 ** n` (see `XSUI.webapp.pyramid`), and tiles
+    are `TILE_SIZE` pixels square, except at the bottom and right edges.
+    """
+
+    def render() -> bytes:
+        pyramid = pyramid_cache.get(key)
+        return encode_image(pyramid.render_tile(level, row, col))
+
+    try:
+        tile = await run_in_threadpool(render)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Image `{key}` not found.")
+    except IndexError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    # Tiles are addressed by the image content hash, so never change.
+    return Response(
+        tile,
+        media_type="image/png",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
+@app.get("/images")
+async def list_images(
+    session: SessionDep,
+    table: str = "waxs",
+    page: int = 0,
+    page_size: int = 50,
+    sort: str | None = None,
+) -> dict:
+    """
+    List a page of the image index of a table, without loading any image.
+
+    The `sort` parameter is a comma separated list of index columns, each
+    prefixed by `-` for a descending order.
+    """
+    if table not in IMAGE_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown image table `{table}`.")
+    sort_by = [
+        (column.lstrip("-"), not column.startswith("-"))
+        for column in (sort.split(",") if sort else [])
+    ]
+    try:
+        entries, total = await session.run_sync(
+            page_index, IMAGE_TABLES[table], page, page_size, None, sort_by
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "images": [entry.as_row() for entry in entries],
+    }
+
+
+def _array_format(fmt: str) -> str:
+    """Check the suffix of an array endpoint."""
+    if fmt not in ARRAY_FORMATS:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown array format `{fmt}`, use one of {list(ARRAY_FORMATS)}.",
+        )
+    return fmt
+
+
+@app.api_route("/images/{key}.{fmt}", methods=["GET", "HEAD"])
+async def image_store_array(request: Request, key: str, fmt: str) -> Response:
+    """Get an uploaded image of the image store as a `.npy` or raw binary array."""
+    fmt = _array_format(fmt)
+    try:
+        data = await run_in_threadpool(image_store.get, key)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Image `{key}` not found.")
+    return array_response(
+        request, ArrayBody.from_array(data, fmt), key, etag=key, immutable=True
+    )
+
+
+@app.api_route("/images/{table}/{image_id}.{fmt}", methods=["GET", "HEAD"])
+async def image_array(
+    request: Request, session: SessionDep, table: str, image_id: int, fmt: str
+) -> Response:
+    """
+    Get a stored image as a `.npy` or raw binary array, streamed from the blob store.
+
+    Byte ranges only read (and decompress) the rows of the image they cover.
+    """
+    fmt = _array_format(fmt)
+    if table not in IMAGE_MODELS:
+        raise HTTPException(status_code=404, detail=f"Unknown image table `{table}`.")
+    image = await session.get(IMAGE_MODELS[table], image_id)
+    if image is None:
+        raise HTTPException(
+            status_code=404, detail=f"Image {image_id} not found in `{table}`."
+        )
+    body = ArrayBody(
+        image.image_shape,
+        image.image_dtype,
+        image.read_rows,
+        fmt,
+        image.image_chunk_rows,
+    )
+    stem = os.path.splitext(os.path.basename(image.filename))[0]
+    return array_response(request, body, stem, etag=image.image_hash, immutable=True)
+
+
+@app.api_route("/masks/{kind}/{mask_id}.{fmt}", methods=["GET", "HEAD"])
+async def mask_array(
+    request: Request, session: SessionDep, kind: str, mask_id: int, fmt: str
+) -> Response:
+    """Get a detector, custom or composite mask as a `.npy` or raw binary array."""
+    fmt = _array_format(fmt)
+    if kind not in MASK_MODELS:
+        raise HTTPException(status_code=404, detail=f"Unknown mask kind `{kind}`.")
+
+    def load_mask(sync_session: orm.Session) -> tuple | None:
+        # Only the rows are loaded here, on the event loop. Masks are decoded
+        # (and composites materialized) from the loaded models in the threadpool.
+        model = sync_session.get(MASK_MODELS[kind], mask_id)
+        if model is None:
+            return None
+        if isinstance(model, CompositeMask):
+            members = [model.detector, *model.cust_masks]
+            version = "_".join(f"{m.id}.{m.version}" for m in members)
+            return model.expression().materialize, version
+        return lambda: model.mask, model.version
+
+    loaded = await session.run_sync(load_mask)
+    if loaded is None:
+        raise HTTPException(status_code=404, detail=f"Mask {mask_id} not found.")
+    decode, version = loaded
+    mask = await run_in_threadpool(decode)
+    return array_response(
+        request,
+        ArrayBody.from_array(mask, fmt),
+        f"{kind}_{mask_id}",
+        etag=f"{kind}-{mask_id}-{version}",
+    )
+
+
+def _reduction_path(name: str) -> str:
+    """The path of a reduction output file, by its name."""
+    path = os.path.join(REDUCTION_DIR, f"{os.path.basename(name)}.h5")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Reduction `{name}` not found.")
+    return path
+
+
+@app.get("/reductions")
+async def list_reductions() -> dict:
+    """List the batch reduction outputs (see `XSUI.experiment.batch`)."""
+    names = []
+    if os.path.isdir(REDUCTION_DIR):
+        names = sorted(
+            os.path.splitext(name)[0]
+            for name in os.listdir(REDUCTION_DIR)
+            if name.endswith(".h5")
+        )
+    return {"directory": REDUCTION_DIR, "reductions": names}
+
+
+@app.get("/reductions/{name}")
+async def reduction_datasets(name: str) -> dict:
+    """Describe the datasets of a reduction output, such as `radial` and `intensity`."""
+    path = _reduction_path(name)
+
+    def describe() -> dict:
+        with h5py.File(path, "r") as f:
+            return {
+                key: {"shape": list(ds.shape), "dtype": ds.dtype.str}
+                for key, ds in f.items()
+                if isinstance(ds, h5py.Dataset)
+            }
+
+    return {"name": name, "datasets": await run_in_threadpool(describe)}
+
+
+@app.api_route("/reductions/{name}/{dataset}.{fmt}", methods=["GET", "HEAD"])
+async def reduction_array(
+    request: Request, name: str, dataset: str, fmt: str
+) -> Response:
+    """
+    Get a dataset of a reduction output as a `.npy` or raw binary array.
+
+    Byte ranges only read the frames (rows) of the dataset they cover.
+    """
+    fmt = _array_format(fmt)
+    path = _reduction_path(name)
+    try:
+        body = await run_in_threadpool(ArrayBody.from_hdf5, path, dataset, fmt)
+    except KeyError:
+        raise HTTPException(
+            status_code=404, detail=f"Dataset `{dataset}` not found in `{name}`."
+        )
+    except TypeError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    return array_response(request, body, f"{name}_{dataset}")
+
+
 @app.get("/items/{item_id}")
 async def read_item(item_id: int):
     """Get an item by its ID."""
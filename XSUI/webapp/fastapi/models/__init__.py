@@ -3,12 +3,26 @@ from XSUI.webapp.fastapi.models.images import (
     ImageGIWAXS,
     ImageCalibrant,
     ImageBase,
+    migrate_image_tables,
+)
+from XSUI.webapp.fastapi.models.index import (
+    FrameIndexer,
+    ImageIndex,
+    IMAGE_MODELS,
+    IMAGE_TABLES,
+    index_image,
+    index_missing_images,
+    ingest_image,
+    page_index,
+    query_index,
 )
 from XSUI.webapp.fastapi.models.masks import (
     DetectorMask,
     CustomMask,
     CompositeMask,
     MaskBase,
+    MASK_MODELS,
+    migrate_mask_tables,
 )
 import sqlalchemy.orm as orm
 
@@ -16,6 +30,7 @@ models_list_all = [
     ImageWAXS,
     ImageGIWAXS,
     ImageCalibrant,
+    ImageIndex,
     DetectorMask,
     CustomMask,
     CompositeMask,
@@ -2,47 +2,189 @@
 Models for storing WAXS and GIWAXS images in a database using Flask-SQLAlchemy.
 
 These models define the structure of the database tables for storing image data, including metadata and image attributes.
+Image pixels are kept in a content-addressed blob store on disk (see `XSUI.storage.blobs`),
+optionally as chunked, byte-shuffled and compressed blobs (see `XSUI.storage.codec`),
+while the models only hold the image hash, shape, dtype and chunk layout.
 """
 
+import io
+import pickle
+
+import numpy as np
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
+from XSUI.storage.blobs import blob_store
+from XSUI.storage.codec import (
+    DEFAULT_COMPRESSION,
+    IMAGE_CODEC_VERSION,
+    decode_rows,
+    encode_frame,
+)
+from XSUI.storage.image_store import image_digest
+from XSUI.storage.uploads import read_image, spool_bytes
+from XSUI.webapp.fastapi.models.masks import load_legacy_mask
 
 
 class ImageBase(orm.DeclarativeBase):
     pass
 
 
-class ImageWAXS(ImageBase):
+def store_image(image: np.ndarray, compression: str) -> dict:
+    """
+    Store an image in the blob store.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The image.
+    compression : str
+        The compression of the blob, or "none" for an uncompressed `.npy` file.
+
+    Returns
+    -------
+    dict
+        The values of the image columns of `ImageBlobMixin`.
+    """
+    image = np.asarray(image)
+    columns = {
+        "image_hash": image_digest(image),
+        "image_shape": list(image.shape),
+        "image_dtype": image.dtype.str,
+        "image_compression": compression,
+        "image_codec": IMAGE_CODEC_VERSION,
+    }
+    if compression == "none":
+        blob_store.put_array(image, columns["image_hash"])
+        return columns | {
+            "image_shuffle": False,
+            "image_chunk_rows": None,
+            "image_chunk_offsets": None,
+        }
+    encoded = encode_frame(image, compression)
+    blob_store.put_bytes(encoded.data, columns["image_hash"], compression)
+    return columns | {
+        "image_shuffle": encoded.shuffle,
+        "image_chunk_rows": encoded.chunk_rows,
+        "image_chunk_offsets": list(encoded.offsets),
+    }
+
+
+class ImageBlobMixin:
+    """
+    Columns and accessors of an image stored in the content-addressed blob store.
+
+    The database row only holds the hash and layout of the image, while the
+    pixels are stored in `blob_store` (see `XSUI.storage.blobs`), deduplicated
+    by content. Uncompressed images are stored as `.npy` files and read as
+    zero-copy memory maps. Compressed images are stored as chunked blobs (see
+    `XSUI.storage.codec`), where `read_rows` only decompresses the chunks of
+    the requested rows straight from the memory-mapped file.
+    """
+
+    default_compression: str = DEFAULT_COMPRESSION
+    """The compression of new images of the model, or "none" for zero-copy reads."""
+
+    image_hash: orm.Mapped[str] = orm.mapped_column(
+        sa.String(32), nullable=False, index=True
+    )
+    image_shape: orm.Mapped[list] = orm.mapped_column(sa.JSON, nullable=False)
+    image_dtype: orm.Mapped[str] = orm.mapped_column(sa.String(16), nullable=False)
+    image_compression: orm.Mapped[str] = orm.mapped_column(
+        sa.String(16), nullable=False
+    )
+    image_shuffle: orm.Mapped[bool] = orm.mapped_column(
+        sa.Boolean, nullable=False, default=False
+    )
+    image_chunk_rows: orm.Mapped[int | None] = orm.mapped_column(
+        sa.Integer, nullable=True
+    )
+    image_chunk_offsets: orm.Mapped[list | None] = orm.mapped_column(
+        sa.JSON, nullable=True
+    )
+    image_codec: orm.Mapped[int] = orm.mapped_column(
+        sa.Integer, nullable=False, default=IMAGE_CODEC_VERSION
+    )
+
+    def _set_image(self, image: np.ndarray, compression: str | None = None) -> None:
+        """Store an image in the blob store, keeping its hash and layout."""
+        columns = store_image(image, compression or self.default_compression)
+        for name, value in columns.items():
+            setattr(self, name, value)
+
+    @property
+    def image(self) -> np.ndarray:
+        """The (read-only) image."""
+        return self.read_rows()
+
+    def read_rows(self, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """
+        Read a range of rows of the image.
+
+        Parameters
+        ----------
+        start : int, optional
+            The first row to read, by default 0.
+        stop : int | None, optional
+            The row after the last to read, by default the last row.
+
+        Returns
+        -------
+        np.ndarray
+            The rows, as a read-only memory map for uncompressed images.
+        """
+        if self.image_compression == "none":
+            return blob_store.open_array(self.image_hash)[start:stop]
+        stop = self.image_shape[0] if stop is None else min(stop, self.image_shape[0])
+        return decode_rows(
+            blob_store.open_bytes(self.image_hash, self.image_compression),
+            self.image_shape,
+            self.image_dtype,
+            self.image_compression,
+            self.image_chunk_rows,
+            self.image_chunk_offsets,
+            max(start, 0),
+            stop,
+            shuffle=self.image_shuffle,
+            version=self.image_codec,
+        )
+
+
+class ImageWAXS(ImageBlobMixin, ImageBase):
     __tablename__ = "waxs_images"
 
     id = sa.Column(sa.Integer, primary_key=True)
     filename = sa.Column(sa.String(255), nullable=False, unique=True)
-    image_data = sa.Column(sa.LargeBinary, nullable=False)
 
     def __repr__(self):
         return f"<ImageWAXS id={self.id} filename={self.filename}>"
 
-    def __init__(self, filename, image_data):
+    def __init__(
+        self, filename: str, image_data: np.ndarray, compression: str | None = None
+    ):
         self.filename = filename
-        self.image_data = image_data
+        self._set_image(image_data, compression)
 
 
-class ImageCalibrant(ImageBase):
+class ImageCalibrant(ImageBlobMixin, ImageBase):
     __tablename__ = "calibrant_images"
 
+    # Calibrants are re-read interactively, so are stored for zero-copy reads.
+    default_compression = "none"
+
     id = sa.Column(sa.Integer, primary_key=True)
     filename = sa.Column(sa.String(255), nullable=False, unique=True)
-    image_data = sa.Column(sa.LargeBinary, nullable=False)
 
     def __repr__(self):
         return f"<ImageCalibrant id={self.id} filename={self.filename}>"
 
-    def __init__(self, filename, image_data):
+    def __init__(
+        self, filename: str, image_data: np.ndarray, compression: str | None = None
+    ):
         self.filename = filename
-        self.image_data = image_data
+        self._set_image(image_data, compression)
 
 
-class ImageGIWAXS(ImageBase):
+class ImageGIWAXS(ImageBlobMixin, ImageBase):
     __tablename__ = "giwaxs_images"
 
     id = sa.Column(sa.Integer, primary_key=True)
@@ -52,11 +194,130 @@ class ImageGIWAXS(ImageBase):
     angle_tilt = sa.Column(sa.Float, nullable=False)
     orientation = sa.Column(sa.Integer, nullable=True)
 
-    image_data = sa.Column(sa.LargeBinary, nullable=False)
-
     def __repr__(self):
         return f"<ImageGIWAXS id={self.id} filename={self.filename}>"
 
-    def __init__(self, filename, image_data):
+    def __init__(
+        self, filename: str, image_data: np.ndarray, compression: str | None = None
+    ):
         self.filename = filename
-        self.image_data = image_data
+        self._set_image(image_data, compression)
+
+
+_IMAGE_COLUMNS = (
+    ("image_hash", "VARCHAR(32) NOT NULL DEFAULT ''"),
+    ("image_shape", "JSON NOT NULL DEFAULT '[]'"),
+    ("image_dtype", "VARCHAR(16) NOT NULL DEFAULT ''"),
+    ("image_compression", "VARCHAR(16) NOT NULL DEFAULT 'none'"),
+    ("image_shuffle", "BOOLEAN NOT NULL DEFAULT FALSE"),
+    ("image_chunk_rows", "INTEGER"),
+    ("image_chunk_offsets", "JSON"),
+    ("image_codec", f"INTEGER NOT NULL DEFAULT {IMAGE_CODEC_VERSION}"),
+)
+"""The columns of `ImageBlobMixin`, as added to legacy image tables."""
+
+
+def load_legacy_image(data: bytes, filename: str) -> np.ndarray:
+    """
+    Load an image stored in the `image_data` column, before the blob store.
+
+    Parameters
+    ----------
+    data : bytes
+        The stored image: an array pickled by `ndarray.dumps`, a `.npy` file or
+        the contents of the uploaded image file.
+    filename : str
+        The name of the image file.
+
+    Returns
+    -------
+    np.ndarray
+        The image.
+
+    Raises
+    ------
+    ValueError
+        If the data cannot be read as an image.
+    """
+    data = bytes(data)
+    try:
+        if data.startswith(b"\x93NUMPY"):
+            return np.load(io.BytesIO(data), allow_pickle=False)
+        if data.startswith(b"\x80"):
+            # The same restricted unpickler of plain arrays as legacy masks.
+            return load_legacy_mask(data)
+        return read_image(spool_bytes(data, filename).path)
+    except (OSError, ValueError, pickle.UnpicklingError) as e:
+        raise ValueError(f"Could not read the legacy image `{filename}`: {e}") from e
+
+
+def migrate_image_tables(connection: sa.Connection) -> list[str]:
+    """
+    Upgrade image tables created before images were moved to the blob store.
+
+    `create_all` does not alter existing tables, so the columns of
+    `ImageBlobMixin` are added to legacy tables here. The images of their
+    `image_data` column are stored in the blob store with the compression of
+    their model, and the column is then dropped. Run before creating the
+    tables, within a transaction.
+
+    Parameters
+    ----------
+    connection : sa.Connection
+        The database connection.
+
+    Returns
+    -------
+    list[str]
+        The names of the upgraded tables.
+
+    Raises
+    ------
+    ValueError
+        If a legacy image cannot be read, leaving the transaction to roll back.
+    """
+    inspector = sa.inspect(connection)
+    migrated = []
+    for model in (ImageWAXS, ImageCalibrant, ImageGIWAXS):
+        table = model.__tablename__
+        if not inspector.has_table(table):
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table)}
+        if "image_data" not in columns:
+            continue
+        # Legacy rows are re-encoded below, so the defaults are never kept.
+        for name, definition in _IMAGE_COLUMNS:
+            if name not in columns:
+                connection.execute(
+                    sa.text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                )
+        rows = connection.execute(
+            sa.text(f"SELECT id, filename, image_data FROM {table}")
+        )
+        updates = []
+        for row_id, filename, data in rows.fetchall():
+            image = load_legacy_image(data, filename)
+            updates.append(
+                {"row_id": row_id} | store_image(image, model.default_compression)
+            )
+        if updates:
+            assignments = ", ".join(f"{name} = :{name}" for name, _ in _IMAGE_COLUMNS)
+            connection.execute(
+                sa.text(
+                    f"UPDATE {table} SET {assignments} WHERE id = :row_id"
+                ).bindparams(
+                    sa.bindparam("image_shape", type_=sa.JSON),
+                    sa.bindparam("image_chunk_offsets", type_=sa.JSON),
+                ),
+                updates,
+            )
+        connection.execute(
+            sa.text(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_image_hash "
+                f"ON {table} (image_hash)"
+            )
+        )
+        connection.execute(sa.text(f"ALTER TABLE {table} DROP COLUMN image_data"))
+        print(f"Migrated {len(updates)} legacy images in `{table}`.")
+        migrated.append(table)
+    return migrated
@@ -0,0 +1,428 @@
+"""
+An index of image metadata and statistics, for queries without loading image blobs.
+
+Each stored image has one `ImageIndex` row, populated when the image is
+ingested (see `ingest_image`), i.e. when it is uploaded or read by a batch or
+live reduction (see `FrameIndexer`). Listing, sorting and filtering images only
+touches this table and its indexes.
+"""
+
+import datetime
+
+import numpy as np
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+
+from XSUI.storage.image_store import image_digest
+from XSUI.storage.metadata import acquisition_time, image_statistics
+from XSUI.webapp.fastapi.database import get_engine
+from XSUI.webapp.fastapi.models.images import (
+    ImageBase,
+    ImageCalibrant,
+    ImageGIWAXS,
+    ImageWAXS,
+)
+
+
+class ImageIndex(ImageBase):
+    """
+    The metadata and summary statistics of a stored image.
+
+    The image itself is identified by its table (`image_table`) and ID
+    (`image_id`) in one of the image models.
+    """
+
+    __tablename__ = "image_index"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    image_table = sa.Column(sa.String(32), nullable=False)
+    image_id = sa.Column(sa.Integer, nullable=False)
+    filename = sa.Column(sa.String(255), nullable=False)
+    digest = sa.Column(sa.String(32), nullable=False)
+    rows = sa.Column(sa.Integer, nullable=False)
+    cols = sa.Column(sa.Integer, nullable=False)
+    dtype = sa.Column(sa.String(16), nullable=False)
+    minimum = sa.Column(sa.Float, nullable=True)
+    maximum = sa.Column(sa.Float, nullable=True)
+    mean = sa.Column(sa.Float, nullable=True)
+    saturated = sa.Column(sa.Integer, nullable=False, default=0)
+    acquired_at = sa.Column(sa.DateTime, nullable=True)
+    ingested_at = sa.Column(sa.DateTime, nullable=False, default=datetime.datetime.now)
+    angle_incidence = sa.Column(sa.Float, nullable=True)
+    angle_tilt = sa.Column(sa.Float, nullable=True)
+
+    __table_args__ = (
+        sa.UniqueConstraint("image_table", "image_id"),
+        sa.UniqueConstraint("image_table", "digest"),
+        sa.Index("ix_image_index_table_filename", "image_table", "filename"),
+        sa.Index("ix_image_index_table_acquired", "image_table", "acquired_at"),
+        sa.Index("ix_image_index_table_maximum", "image_table", "maximum"),
+        sa.Index(
+            "ix_image_index_table_angles",
+            "image_table",
+            "angle_incidence",
+            "angle_tilt",
+        ),
+    )
+
+    TABLE_COLUMNS = (
+        "filename",
+        "rows",
+        "cols",
+        "dtype",
+        "minimum",
+        "maximum",
+        "mean",
+        "saturated",
+        "acquired_at",
+        "angle_incidence",
+        "angle_tilt",
+    )
+    """The columns listed in the image tables of the web application."""
+
+    def __repr__(self):
+        return (
+            f"<ImageIndex id={self.id} image_table={self.image_table} "
+            f"image_id={self.image_id} filename={self.filename}>"
+        )
+
+    def as_row(self) -> dict:
+        """
+        The listed columns of the entry, for a Dash `DataTable`.
+
+        The row also holds the `image_id` and `digest` of the image, which
+        address it in the `/images/{table}/{image_id}` endpoints and their ETag.
+        """
+        row = {column: getattr(self, column) for column in self.TABLE_COLUMNS}
+        row["image_id"] = self.image_id
+        row["digest"] = self.digest
+        if row["acquired_at"] is not None:
+            row["acquired_at"] = row["acquired_at"].isoformat(sep=" ")
+        return row
+
+
+def index_image(
+    image,
+    data: np.ndarray,
+    header: dict | None = None,
+    saturation: float | None = None,
+) -> ImageIndex:
+    """
+    Create the index entry of a stored image.
+
+    Parameters
+    ----------
+    image : ImageWAXS | ImageCalibrant | ImageGIWAXS
+        The image model. Its ID is set by `ingest_image` if it is not flushed.
+    data : np.ndarray
+        The image data.
+    header : dict | None, optional
+        The `fabio` header of the image, used for the acquisition time.
+    saturation : float | None, optional
+        The saturation value of the detector (see `image_statistics`).
+
+    Returns
+    -------
+    ImageIndex
+        The index entry, to be added to the session.
+    """
+    data = np.asarray(data)
+    stats = image_statistics(data, saturation)
+    return ImageIndex(
+        image_table=image.__tablename__,
+        image_id=image.id,
+        filename=image.filename,
+        digest=getattr(image, "image_hash", None) or image_digest(data),
+        rows=data.shape[0],
+        cols=data.shape[1] if data.ndim > 1 else 1,
+        dtype=data.dtype.str,
+        minimum=stats.minimum,
+        maximum=stats.maximum,
+        mean=stats.mean,
+        saturated=stats.saturated,
+        acquired_at=acquisition_time(header),
+        angle_incidence=getattr(image, "angle_incidence", None),
+        angle_tilt=getattr(image, "angle_tilt", None),
+    )
+
+
+def ingest_image(
+    session: orm.Session,
+    image,
+    data: np.ndarray | None = None,
+    header: dict | None = None,
+    saturation: float | None = None,
+    entry: ImageIndex | None = None,
+) -> ImageIndex:
+    """
+    Add an image model and its index entry to a session.
+
+    Images are deduplicated by content: if an identical image is already in the
+    table, the new model is not added and the existing entry is returned. A
+    different image with the filename of a stored image has its filename
+    suffixed by its digest. The image is inserted straight away, so that an
+    identical image stored concurrently (i.e. by another reduction worker) is
+    caught by the unique digest of the index, in which case the session is
+    rolled back and the stored entry returned.
+
+    Parameters
+    ----------
+    session : orm.Session
+        The database session. The caller commits the session.
+    image : ImageWAXS | ImageCalibrant | ImageGIWAXS
+        The new image model.
+    data : np.ndarray | None, optional
+        The image data, required unless `entry` is given.
+    header : dict | None, optional
+        The `fabio` header of the image, used for the acquisition time.
+    saturation : float | None, optional
+        The saturation value of the detector (see `image_statistics`).
+    entry : ImageIndex | None, optional
+        The index entry of the image from `index_image`, i.e. computed off the
+        event loop. By default it is computed from `data`.
+
+    Returns
+    -------
+    ImageIndex
+        The index entry of the image, or of the identical stored image.
+    """
+    if entry is None:
+        entry = index_image(image, data, header, saturation)
+    existing = _stored_entry(session, image.__tablename__, entry.digest)
+    if existing is not None:
+        return existing
+    model = type(image)
+    taken = session.scalar(
+        sa.select(model.id).where(model.filename == image.filename).limit(1)
+    )
+    if taken is not None:
+        image.filename = f"{image.filename} ({entry.digest[:8]})"
+    try:
+        session.add(image)
+        session.flush()
+        entry.image_id = image.id
+        entry.filename = image.filename
+        session.add(entry)
+        session.flush()
+    except sa.exc.IntegrityError:
+        session.rollback()
+        existing = _stored_entry(session, image.__tablename__, entry.digest)
+        if existing is None:
+            raise
+        return existing
+    return entry
+
+
+def _stored_entry(
+    session: orm.Session, image_table: str, digest: str
+) -> ImageIndex | None:
+    """The index entry of a stored image of a table, by its digest."""
+    return session.scalars(
+        sa.select(ImageIndex).where(
+            ImageIndex.image_table == image_table, ImageIndex.digest == digest
+        )
+    ).first()
+
+
+def index_missing_images(connection: sa.Connection) -> int:
+    """
+    Index the stored images that have no index entry.
+
+    Images of older releases (see `migrate_image_tables`) were stored without
+    an index entry, so they would neither be listed nor deduplicated by
+    `ingest_image`. Run after creating the tables, within a transaction.
+
+    Parameters
+    ----------
+    connection : sa.Connection
+        The database connection.
+
+    Returns
+    -------
+    int
+        The number of indexed images.
+    """
+    indexed = 0
+    with orm.Session(connection) as session:
+        for model in IMAGE_MODELS.values():
+            entries = sa.select(ImageIndex.image_id).where(
+                ImageIndex.image_table == model.__tablename__
+            )
+            images = session.scalars(sa.select(model).where(model.id.not_in(entries)))
+            for image in images:
+                session.add(index_image(image, image.image))
+                indexed += 1
+        session.flush()
+    return indexed
+
+
+class FrameIndexer:
+    """
+    Ingest the frames read by a reduction into an image table.
+
+    Called with each frame as it is read (see `XSUI.experiment.batch`), which
+    stores the frame and its index entry in its own short transaction.
+    Instances are picklable, so the frames of a `BatchReduction` are encoded and
+    indexed in its worker processes. The tables are created (if they do not
+    exist) when the indexer is created, i.e. once, before the workers start.
+
+    Parameters
+    ----------
+    model : type[ImageWAXS] | type[ImageCalibrant], optional
+        The image model, by default `ImageWAXS`.
+    saturation : float | None, optional
+        The saturation value of the detector (see `image_statistics`).
+    """
+
+    def __init__(self, model: type = ImageWAXS, saturation: float | None = None):
+        self.model = model
+        self.saturation = saturation
+        ImageBase.metadata.create_all(get_engine())
+
+    def __repr__(self):
+        return f"<FrameIndexer model={self.model.__name__}>"
+
+    def __call__(
+        self,
+        path: str,
+        frame: int,
+        nframes: int,
+        data: np.ndarray,
+        header: dict | None = None,
+    ) -> ImageIndex:
+        """
+        Ingest a frame of an image file.
+
+        Parameters
+        ----------
+        path : str
+            The path of the image file.
+        frame : int
+            The index of the frame within the file.
+        nframes : int
+            The number of frames of the file. Frames of multi-frame files are
+            stored as `path:frame`.
+        data : np.ndarray
+            The frame.
+        header : dict | None, optional
+            The `fabio` header of the file, used for the acquisition time.
+
+        Returns
+        -------
+        ImageIndex
+            The index entry of the frame.
+        """
+        filename = path if nframes == 1 else f"{path}:{frame}"
+        image = self.model(filename, data)
+        entry = index_image(image, data, header, self.saturation)
+        with orm.Session(get_engine(), expire_on_commit=False) as session:
+            entry = ingest_image(session, image, entry=entry)
+            session.commit()
+        return entry
+
+
+_FILTER_OPERATORS = {
+    "eq": lambda c, v: c == v,
+    "ne": lambda c, v: c != v,
+    "lt": lambda c, v: c < v,
+    "le": lambda c, v: c <= v,
+    "gt": lambda c, v: c > v,
+    "ge": lambda c, v: c >= v,
+    "contains": lambda c, v: c.contains(str(v), autoescape=True),
+}
+"""The `DataTable` filter operators, as SQL expressions."""
+
+
+def query_index(
+    image_table: str,
+    filters: list[tuple[str, str, object]] | None = None,
+    sort_by: list[tuple[str, bool]] | None = None,
+) -> sa.Select:
+    """
+    Build a query of the index entries of an image table.
+
+    Parameters
+    ----------
+    image_table : str
+        The table name of the image model, such as `ImageWAXS.__tablename__`.
+    filters : list[tuple[str, str, object]] | None, optional
+        Filters of (column, operator, value), with the operators of a Dash
+        `DataTable` (`eq`, `ne`, `lt`, `le`, `gt`, `ge` and `contains`).
+    sort_by : list[tuple[str, bool]] | None, optional
+        The (column, ascending) sort order. By default entries are ordered by
+        acquisition time, then filename.
+
+    Returns
+    -------
+    sa.Select
+        The query of `ImageIndex` entries.
+    """
+    query = sa.select(ImageIndex).where(ImageIndex.image_table == image_table)
+    for column, operator, value in filters or []:
+        if column not in ImageIndex.TABLE_COLUMNS or operator not in _FILTER_OPERATORS:
+            raise ValueError(f"Unsupported filter `{column} {operator} {value}`.")
+        query = query.where(
+            _FILTER_OPERATORS[operator](getattr(ImageIndex, column), value)
+        )
+    order = []
+    for column, ascending in sort_by or []:
+        if column not in ImageIndex.TABLE_COLUMNS:
+            raise ValueError(f"Unsupported sort column `{column}`.")
+        attr = getattr(ImageIndex, column)
+        order.append(attr.asc() if ascending else attr.desc())
+    order += [ImageIndex.acquired_at.asc(), ImageIndex.filename.asc()]
+    return query.order_by(*order)
+
+
+def page_index(
+    session: orm.Session,
+    image_table: str,
+    page: int = 0,
+    page_size: int = 12,
+    filters: list[tuple[str, str, object]] | None = None,
+    sort_by: list[tuple[str, bool]] | None = None,
+) -> tuple[list[ImageIndex], int]:
+    """
+    Get a page of the index entries of an image table.
+
+    Parameters
+    ----------
+    session : orm.Session
+        The database session.
+    image_table : str
+        The table name of the image model.
+    page : int, optional
+        The index of the page, by default 0.
+    page_size : int, optional
+        The number of entries per page, by default 12.
+    filters, sort_by : optional
+        The filters and sort order (see `query_index`).
+
+    Returns
+    -------
+    entries : list[ImageIndex]
+        The entries of the page.
+    total : int
+        The number of entries matching the filters.
+    """
+    query = query_index(image_table, filters, sort_by)
+    total = session.scalar(
+        sa.select(sa.func.count()).select_from(query.order_by(None).subquery())
+    )
+    entries = session.scalars(query.offset(page * page_size).limit(page_size)).all()
+    return list(entries), total
+
+
+IMAGE_TABLES = {
+    "waxs": ImageWAXS.__tablename__,
+    "giwaxs": ImageGIWAXS.__tablename__,
+    "calibrant": ImageCalibrant.__tablename__,
+}
+"""The image table names, by the name of the web application tab."""
+
+IMAGE_MODELS = {
+    "waxs": ImageWAXS,
+    "giwaxs": ImageGIWAXS,
+    "calibrant": ImageCalibrant,
+}
+"""The image models, by the name of the web application tab."""
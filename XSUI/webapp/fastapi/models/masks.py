@@ -2,10 +2,14 @@
 Models for storing the masks used in WAXS and GIWAXS imaging in a database using Flask-SQLAlchemy.
 """
 
+import io
+import pickle
 import numpy as np
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
 from typing import List
+from XSUI.masks.codec import MASK_CODEC_VERSION, encode_mask, decode_mask
+from XSUI.masks.algebra import MaskLeaf, MaskUnion
 
 
 # Create an association table for CompositeMask and CustomMask
@@ -18,6 +22,7 @@ class DetectorMask(MaskBase):
     A model for storing detector masks used in WAXS and GIWAXS imaging.
 
     Model data is typically generated through `pyFAI` registered detectors.
+    The mask is stored bit-packed and compressed (see `XSUI.masks.codec`).
     """
 
     __tablename__ = "detector_masks"
@@ -25,13 +30,29 @@ class DetectorMask(MaskBase):
     id = sa.Column(sa.Integer, primary_key=True)
     detector_mask = sa.Column(sa.LargeBinary, nullable=False)
     detector_name = sa.Column(sa.String(50), nullable=False)
+    mask_shape = sa.Column(sa.JSON, nullable=False)
+    mask_dtype = sa.Column(sa.String(16), nullable=False)
+    mask_codec = sa.Column(sa.Integer, nullable=False, default=MASK_CODEC_VERSION)
+    version = sa.Column(sa.Integer, nullable=False)
+    """Incremented on every update, identifying cached composites of this mask."""
+
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return f"<DetectorMask id={self.id} detector_name={self.detector_name}>"
 
     def __init__(self, detector_name, detector_mask: np.ndarray):
         self.detector_name = detector_name
-        self.detector_mask = detector_mask.dumps()
+        self.detector_mask, shape, self.mask_dtype = encode_mask(detector_mask)
+        self.mask_shape = list(shape)
+        self.mask_codec = MASK_CODEC_VERSION
+
+    @property
+    def mask(self) -> np.ndarray:
+        """The decoded detector mask."""
+        return decode_mask(
+            self.detector_mask, self.mask_shape, self.mask_dtype, self.mask_codec
+        )
 
 
 association_table = sa.Table(
@@ -48,25 +69,45 @@ class CustomMask(MaskBase):
     A model for storing custom masks used in WAXS and GIWAXS imaging.
 
     Typically generated through the `Plotly` interactive figure interface.
+    The mask is stored bit-packed and compressed (see `XSUI.masks.codec`).
     """
 
     __tablename__ = "custom_masks"
 
     id = orm.mapped_column(sa.Integer, primary_key=True)
     mask_data = sa.Column(sa.LargeBinary, nullable=False)
+    mask_shape = sa.Column(sa.JSON, nullable=False)
+    mask_dtype = sa.Column(sa.String(16), nullable=False)
+    mask_codec = sa.Column(sa.Integer, nullable=False, default=MASK_CODEC_VERSION)
+    version = sa.Column(sa.Integer, nullable=False)
+    """Incremented on every update, identifying cached composites of this mask."""
+
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return f"<CustomMask id={self.id}>"
 
     def __init__(self, mask_data: np.ndarray):
-        self.mask_data = mask_data.dumps()
+        self.mask_data, shape, self.mask_dtype = encode_mask(mask_data)
+        self.mask_shape = list(shape)
+        self.mask_codec = MASK_CODEC_VERSION
+
+    @property
+    def mask(self) -> np.ndarray:
+        """The decoded custom mask."""
+        return decode_mask(
+            self.mask_data, self.mask_shape, self.mask_dtype, self.mask_codec
+        )
 
 
 class CompositeMask(MaskBase):
     """
     A model for storing composite masks, which are combinations of multiple masks.
 
-    Useful for complex masking scenarios in WAXS and GIWAXS imaging.
+    Useful for complex masking scenarios in WAXS and GIWAXS imaging. The
+    combined mask is evaluated lazily as the union of the detector mask and the
+    custom masks, and cached by the member IDs and versions (see
+    `XSUI.masks.algebra`).
     """
 
     __tablename__ = "composite_masks"
@@ -75,6 +116,7 @@ class CompositeMask(MaskBase):
     detector_mask: orm.Mapped[int] = orm.mapped_column(
         sa.ForeignKey("detector_masks.id")
     )
+    detector: orm.Mapped["DetectorMask"] = orm.relationship()
     cust_masks: orm.Mapped[List["CustomMask"]] = orm.relationship(
         secondary=association_table
     )
@@ -82,5 +124,143 @@ class CompositeMask(MaskBase):
     def __repr__(self):
         return f"<CompositeMask id={self.id}>"
 
-    def __init__(self, mask_data: np.ndarray):
-        self.mask_data = mask_data.dumps()
+    def __init__(
+        self, detector_mask: DetectorMask, cust_masks: List[CustomMask] | None = None
+    ):
+        self.detector = detector_mask
+        self.cust_masks = list(cust_masks) if cust_masks else []
+
+    def expression(self) -> MaskUnion:
+        """The lazy union of the detector mask and the custom masks."""
+        return MaskUnion(
+            MaskLeaf.from_model(self.detector),
+            *(MaskLeaf.from_model(m) for m in self.cust_masks),
+        )
+
+    @property
+    def mask(self) -> np.ndarray:
+        """The materialized (read-only) composite mask."""
+        return self.expression().materialize()
+
+
+MASK_MODELS = {
+    "detector": DetectorMask,
+    "custom": CustomMask,
+    "composite": CompositeMask,
+}
+"""The mask models, by kind."""
+
+
+_LEGACY_PICKLE_GLOBALS = {
+    ("numpy.core.multiarray", "_reconstruct"),
+    ("numpy._core.multiarray", "_reconstruct"),
+    ("numpy", "ndarray"),
+    ("numpy", "dtype"),
+    ("_codecs", "encode"),
+}
+"""The only globals allowed when unpickling masks stored by `ndarray.dumps`."""
+
+_LEGACY_MASK_COLUMNS = {
+    "detector_masks": "detector_mask",
+    "custom_masks": "mask_data",
+}
+"""The mask blob column of each table that held pickled masks."""
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    """An unpickler of plain numpy arrays, refusing any other object."""
+
+    def find_class(self, module: str, name: str):
+        if (module, name) not in _LEGACY_PICKLE_GLOBALS:
+            raise pickle.UnpicklingError(
+                f"Refusing to load `{module}.{name}` from a legacy mask."
+            )
+        return super().find_class(module, name)
+
+
+def load_legacy_mask(data: bytes) -> np.ndarray:
+    """
+    Load a mask stored by `ndarray.dumps`, before masks were bit-packed.
+
+    Parameters
+    ----------
+    data : bytes
+        The pickled mask.
+
+    Returns
+    -------
+    np.ndarray
+        The mask.
+
+    Raises
+    ------
+    pickle.UnpicklingError
+        If the data holds anything other than a numpy array.
+    """
+    mask = _ArrayUnpickler(io.BytesIO(data)).load()
+    if not isinstance(mask, np.ndarray):
+        raise pickle.UnpicklingError("A legacy mask is not a numpy array.")
+    return mask
+
+
+def migrate_mask_tables(connection: sa.Connection) -> list[str]:
+    """
+    Upgrade mask tables created before masks were bit-packed.
+
+    `create_all` does not alter existing tables, so the `mask_shape`,
+    `mask_dtype`, `mask_codec` and `version` columns are added to legacy
+    tables here, and their pickled masks are re-encoded in place. Run before
+    creating the tables, within a transaction.
+
+    Parameters
+    ----------
+    connection : sa.Connection
+        The database connection.
+
+    Returns
+    -------
+    list[str]
+        The names of the upgraded tables.
+    """
+    inspector = sa.inspect(connection)
+    migrated = []
+    for table, blob in _LEGACY_MASK_COLUMNS.items():
+        if not inspector.has_table(table):
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table)}
+        if "mask_codec" in columns:
+            continue
+        # Legacy rows are re-encoded below, so the defaults are never kept.
+        for name, definition in (
+            ("mask_shape", "JSON NOT NULL DEFAULT '[]'"),
+            ("mask_dtype", "VARCHAR(16) NOT NULL DEFAULT '|b1'"),
+            ("mask_codec", f"INTEGER NOT NULL DEFAULT {MASK_CODEC_VERSION}"),
+            ("version", "INTEGER NOT NULL DEFAULT 1"),
+        ):
+            if name not in columns:
+                connection.execute(
+                    sa.text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                )
+        rows = connection.execute(sa.text(f"SELECT id, {blob} FROM {table}"))
+        updates = []
+        for row_id, data in rows.fetchall():
+            encoded, shape, dtype = encode_mask(load_legacy_mask(data))
+            updates.append(
+                {
+                    "row_id": row_id,
+                    "data": encoded,
+                    "shape": list(shape),
+                    "dtype": dtype,
+                }
+            )
+        if updates:
+            connection.execute(
+                sa.text(
+                    f"UPDATE {table} SET {blob} = :data, mask_shape = :shape, "
+                    "mask_dtype = :dtype WHERE id = :row_id"
+                ).bindparams(sa.bindparam("shape", type_=sa.JSON)),
+                updates,
+            )
+        print(f"Migrated {len(updates)} legacy masks in `{table}`.")
+        migrated.append(table)
+    return migrated
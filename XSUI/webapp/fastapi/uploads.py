@@ -0,0 +1,172 @@
+"""
+Streaming of upload request bodies to the upload spool.
+
+The body is received on the event loop and gathered into `CHUNK_SIZE` chunks,
+which are parsed, hashed and written to disk in the thread pool. Multipart
+bodies are parsed as they arrive, so the file is never held in memory nor
+copied through a temporary file before it is spooled (see `XSUI.storage`).
+"""
+
+from typing import AsyncIterator
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from XSUI.storage import SpooledUpload, UploadSpool
+from XSUI.storage.uploads import CHUNK_SIZE
+
+
+class MultipartFileSpool:
+    """
+    An incremental writer of the first file of a `multipart/form-data` body.
+
+    Follows the protocol of `UploadSpool`: use as a context manager, writing
+    chunks of the body with `write`. Other form fields are discarded.
+
+    Parameters
+    ----------
+    boundary : bytes
+        The multipart boundary of the body.
+    filename : str | None, optional
+        The name of the uploaded file, by default the name given in the form.
+    """
+
+    def __init__(self, boundary: bytes, filename: str | None = None):
+        self.filename = filename
+        self.spool: UploadSpool | None = None
+        self._writing = False
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._headers: dict[bytes, bytes] = {}
+        self._parser = MultipartParser(
+            boundary,
+            callbacks={
+                "on_part_begin": self._on_part_begin,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+            },
+        )
+
+    @property
+    def result(self) -> SpooledUpload | None:
+        """The spooled file, available after a successful exit."""
+        return self.spool.result if self.spool is not None else None
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _on_headers_finished(self) -> None:
+        if self.spool is not None:
+            # Only the first file is spooled.
+            return
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        if b"filename" not in options:
+            return
+        filename = self.filename or options[b"filename"].decode("utf-8", "replace")
+        self.spool = UploadSpool(filename).__enter__()
+        self._writing = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._writing:
+            self.spool.write(data[start:end])
+
+    def _on_part_end(self) -> None:
+        self._writing = False
+
+    def __enter__(self) -> "MultipartFileSpool":
+        return self
+
+    def write(self, chunk: bytes) -> None:
+        """Parse a chunk of the body, spooling the file data it contains."""
+        self._parser.write(chunk)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            try:
+                self._parser.finalize()
+                if self._writing:
+                    raise MultipartParseError("The file part is truncated.")
+            except MultipartParseError as e:
+                self.__exit__(type(e), e, e.__traceback__)
+                raise
+        if self.spool is not None:
+            self.spool.__exit__(exc_type, exc, tb)
+
+
+async def _body_chunks(request: Request) -> AsyncIterator[bytes]:
+    """The body of a request, in chunks of at least `CHUNK_SIZE` bytes."""
+    buffer = bytearray()
+    async for chunk in request.stream():
+        buffer += chunk
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+async def spool_request(request: Request, filename: str | None = None) -> SpooledUpload:
+    """
+    Spool the file in the body of a request, without blocking the event loop.
+
+    Parameters
+    ----------
+    request : Request
+        The request, with either a raw file body or a `multipart/form-data`
+        body containing a file.
+    filename : str | None, optional
+        The name of the uploaded file. Required for a raw body, and by default
+        the name given in the form of a multipart body.
+
+    Returns
+    -------
+    SpooledUpload
+        The spooled file.
+
+    Raises
+    ------
+    HTTPException
+        If the file name, the multipart boundary or the file is missing, or the
+        multipart body is malformed.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type"))
+    if content_type == b"multipart/form-data":
+        if b"boundary" not in options:
+            raise HTTPException(status_code=400, detail="Missing multipart boundary.")
+        spool = MultipartFileSpool(options[b"boundary"], filename)
+    elif filename:
+        spool = UploadSpool(filename)
+    else:
+        raise HTTPException(status_code=400, detail="Missing upload filename.")
+
+    await run_in_threadpool(spool.__enter__)
+    try:
+        try:
+            async for chunk in _body_chunks(request):
+                await run_in_threadpool(spool.write, chunk)
+        except BaseException as e:
+            await run_in_threadpool(spool.__exit__, type(e), e, e.__traceback__)
+            raise
+        await run_in_threadpool(spool.__exit__, None, None, None)
+    except MultipartParseError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed upload form: {e}")
+    if spool.result is None:
+        raise HTTPException(status_code=400, detail="No file in upload form.")
+    return spool.result
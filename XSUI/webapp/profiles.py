@@ -0,0 +1,554 @@
+"""
+Decimated overlays of many 1D integrated profiles.
+
+Overlaying thousands of curves of thousands of points each is too much data
+for the browser to receive as JSON and draw as SVG. Instead, every curve is
+decimated on the server to about the pixel width of the plot (min-max buckets,
+which keep every peak, or largest-triangle-three-buckets, which keeps the
+shape), curves are concatenated into a few WebGL `Scattergl` traces separated
+by NaN gaps, and the coordinates are sent as base64 typed arrays. Curves are
+filtered and sorted on the server, and when the plot is zoomed, only the
+visible range is decimated again at the finer resolution.
+"""
+
+import base64
+import glob
+import math
+import os
+import threading
+import warnings
+from typing import Literal
+
+import h5py
+import numpy as np
+import pandas as pd
+from plotly.colors import sample_colorscale
+
+from XSUI.experiment.batch import REDUCTION_DIR
+from XSUI.masks.cache import LRUCache
+
+DECIMATION_METHODS = {
+    "minmax": "Min-max",
+    "lttb": "LTTB",
+}
+"""The curve decimation methods, and their labels."""
+
+MAX_PLOT_POINTS = 500_000
+"""The maximum total number of points of an overlay, over all curves."""
+
+MIN_CURVE_POINTS = 64
+"""The minimum number of points a curve is decimated to."""
+
+DEFAULT_PLOT_WIDTH = 1000
+"""The width of the plot in pixels, when the browser has not reported it."""
+
+TRACE_GROUPS = 12
+"""The number of traces (and colours) many curves are grouped into."""
+
+MAX_NAMED_CURVES = 24
+"""Curves are drawn as individual named traces up to this number of curves."""
+
+CURVE_COLORSCALE = "viridis"
+"""The Plotly colour scale of overlaid curves, in order of selection."""
+
+CURVE_COLUMNS = ("curve", "source", "frame", "maximum", "mean")
+"""The columns of the table of curves."""
+
+_FILTER_OPERATORS = {
+    "eq": lambda s, v: s == v,
+    "ne": lambda s, v: s != v,
+    "lt": lambda s, v: s < v,
+    "le": lambda s, v: s <= v,
+    "gt": lambda s, v: s > v,
+    "ge": lambda s, v: s >= v,
+    "contains": lambda s, v: s.astype(str).str.contains(str(v), regex=False),
+}
+"""The `DataTable` filter operators, as operations on table columns."""
+
+
+#################################################
+#### Decimation
+#################################################
+def typed_array(data: np.ndarray) -> dict:
+    """
+    Encode an array as a Plotly typed array of little-endian float32.
+
+    Typed arrays are sent as base64 bytes rather than JSON lists of numbers,
+    which are about 2.5 times smaller and decoded by the browser without
+    parsing. NaN values (gaps between curves) are preserved.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The 1D array.
+
+    Returns
+    -------
+    dict
+        The `dtype` and base64 `bdata` of the array.
+    """
+    data = np.ascontiguousarray(data, dtype="<f4")
+    return {"dtype": "f4", "bdata": base64.b64encode(data).decode("ascii")}
+
+
+def minmax_indices(y: np.ndarray, n_points: int) -> np.ndarray:
+    """
+    Decimate curves by keeping the minimum and maximum of each bucket.
+
+    Every peak and dip of a curve survives, so narrow Bragg peaks are not lost
+    however far the curve is decimated. The first and last points are kept.
+
+    Parameters
+    ----------
+    y : np.ndarray
+        The (curves, points) values of curves sharing the same x values.
+    n_points : int
+        The approximate number of points to keep per curve (two per bucket).
+
+    Returns
+    -------
+    np.ndarray
+        The (curves, kept points) sorted indices of the kept points.
+    """
+    ncurves, n = y.shape
+    if n <= max(n_points, 2):
+        return np.broadcast_to(np.arange(n), (ncurves, n))
+    size = math.ceil(n / max(n_points // 2, 1))
+    nbuckets = math.ceil(n / size)
+    padded = np.full((ncurves, nbuckets * size), np.nan, dtype=y.dtype)
+    padded[:, :n] = y
+    buckets = padded.reshape(ncurves, nbuckets, size)
+    nan = np.isnan(buckets)
+    lo = np.where(nan, np.inf, buckets).argmin(axis=2)
+    hi = np.where(nan, -np.inf, buckets).argmax(axis=2)
+    starts = np.arange(nbuckets) * size
+    indices = np.sort(np.stack([lo, hi], axis=2), axis=2) + starts[:, None]
+    indices = np.minimum(indices.reshape(ncurves, 2 * nbuckets), n - 1)
+    # Keep the end points too, so that a zoomed curve reaches the plot edges.
+    first = np.zeros((ncurves, 1), dtype=indices.dtype)
+    return np.hstack([first, indices, first + n - 1])
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_points: int) -> np.ndarray:
+    """
+    Decimate curves by largest-triangle-three-buckets.
+
+    The first and last points are kept, and from each bucket in between, the
+    point forming the largest triangle with the previously kept point and the
+    mean of the next bucket. The visual shape of the curve is preserved with
+    one point per bucket. All curves are decimated together, bucket by bucket.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        The increasing x values shared by the curves.
+    y : np.ndarray
+        The (curves, points) values of the curves.
+    n_points : int
+        The number of points to keep per curve.
+
+    Returns
+    -------
+    np.ndarray
+        The (curves, n_points) sorted indices of the kept points.
+    """
+    ncurves, n = y.shape
+    if n <= max(n_points, 3):
+        return np.broadcast_to(np.arange(n), (ncurves, n))
+    nbuckets = n_points - 2
+    edges = (np.linspace(0, n - 2, nbuckets + 1)).astype(np.intp) + 1
+    edges[-1] = n - 1
+    # The mean of each bucket (and of the last point), ignoring NaN values.
+    starts = np.append(edges[:-1], n - 1)
+    finite = np.isfinite(y)
+    counts = np.add.reduceat(finite, starts, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_y = np.add.reduceat(np.where(finite, y, 0), starts, axis=1) / counts
+    mean_x = np.add.reduceat(x, starts) / np.diff(np.append(starts, n))
+    rows = np.arange(ncurves)
+    indices = np.empty((ncurves, n_points), dtype=np.intp)
+    indices[:, 0] = 0
+    indices[:, -1] = n - 1
+    selected = indices[:, 0]
+    for i in range(nbuckets):
+        lo, hi = edges[i], edges[i + 1]
+        xa, ya = x[selected], y[rows, selected]
+        with np.errstate(invalid="ignore"):
+            area = np.abs(
+                (xa - mean_x[i + 1])[:, None] * (y[:, lo:hi] - ya[:, None])
+                - (xa[:, None] - x[lo:hi]) * (mean_y[:, i + 1] - ya)[:, None]
+            )
+        selected = lo + np.nan_to_num(area, nan=-1.0).argmax(axis=1)
+        indices[:, i + 1] = selected
+    return indices
+
+
+def decimate(
+    x: np.ndarray,
+    y: np.ndarray,
+    n_points: int,
+    method: Literal["minmax", "lttb"] = "minmax",
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decimate curves sharing the same x values.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        The increasing x values shared by the curves.
+    y : np.ndarray
+        The (curves, points) values of the curves.
+    n_points : int
+        The approximate number of points to keep per curve.
+    method : {"minmax", "lttb"}, optional
+        The decimation method (see `DECIMATION_METHODS`), by default "minmax".
+
+    Returns
+    -------
+    x : np.ndarray
+        The (curves, kept points) x values of the kept points.
+    y : np.ndarray
+        The (curves, kept points) values of the kept points.
+    """
+    if method == "minmax":
+        indices = minmax_indices(y, n_points)
+    elif method == "lttb":
+        indices = lttb_indices(x, y, n_points)
+    else:
+        raise ValueError(f"Unknown decimation method `{method}`.")
+    return x[indices], np.take_along_axis(y, indices, axis=1)
+
+
+def curve_points(ncurves: int, width: int | None = None) -> int:
+    """
+    The number of points to decimate each of a number of curves to.
+
+    Curves are decimated to two points per pixel of the plot width, but to
+    fewer when there are so many curves that the total would exceed
+    `MAX_PLOT_POINTS`.
+
+    Parameters
+    ----------
+    ncurves : int
+        The number of curves.
+    width : int | None, optional
+        The width of the plot in pixels, by default `DEFAULT_PLOT_WIDTH`.
+
+    Returns
+    -------
+    int
+        The number of points per curve.
+    """
+    width = int(width or DEFAULT_PLOT_WIDTH)
+    budget = MAX_PLOT_POINTS // max(ncurves, 1)
+    return max(min(2 * width, budget), MIN_CURVE_POINTS)
+
+
+#################################################
+#### Curve sets
+#################################################
+def filter_table(
+    table: pd.DataFrame, filters: list[tuple[str, str, object]]
+) -> pd.DataFrame:
+    """
+    Filter a table by (column, operator, value) filters.
+
+    Parameters
+    ----------
+    table : pd.DataFrame
+        The table.
+    filters : list[tuple[str, str, object]]
+        The filters, such as parsed from a `DataTable` filter query.
+
+    Returns
+    -------
+    pd.DataFrame
+        The rows matching every filter.
+
+    Raises
+    ------
+    ValueError
+        If a filter has an unknown column or operator.
+    """
+    keep = np.ones(len(table), dtype=bool)
+    for column, operator, value in filters:
+        if column not in table.columns or operator not in _FILTER_OPERATORS:
+            raise ValueError(f"Unsupported filter `{column} {operator} {value}`.")
+        try:
+            keep &= _FILTER_OPERATORS[operator](table[column], value).to_numpy()
+        except TypeError:
+            raise ValueError(f"Unsupported filter `{column} {operator} {value}`.")
+    return table[keep]
+
+
+class CurveSet:
+    """
+    The 1D profiles of a reduction output, with a table of their statistics.
+
+    Parameters
+    ----------
+    radial : np.ndarray
+        The radial bin centres shared by the curves.
+    intensity : np.ndarray
+        The (curves, radial) integrated intensities.
+    source : np.ndarray | None, optional
+        The image file of each curve.
+    frame : np.ndarray | None, optional
+        The frame index of each curve within its file.
+    """
+
+    def __init__(
+        self,
+        radial: np.ndarray,
+        intensity: np.ndarray,
+        source: np.ndarray | None = None,
+        frame: np.ndarray | None = None,
+    ):
+        self.radial = np.asarray(radial, dtype=np.float32)
+        self.intensity = np.asarray(intensity, dtype=np.float32).reshape(
+            -1, self.radial.size
+        )
+        ncurves = len(self.intensity)
+        if source is None:
+            source = np.full(ncurves, "")
+        if frame is None:
+            frame = np.zeros(ncurves, dtype=int)
+        with warnings.catch_warnings():
+            # All-NaN curves (such as failed frames) have NaN statistics.
+            warnings.simplefilter("ignore", RuntimeWarning)
+            maximum = np.nanmax(self.intensity, axis=1)
+            mean = np.nanmean(self.intensity, axis=1)
+        self.table = pd.DataFrame(
+            {
+                "curve": np.arange(ncurves),
+                "source": [os.path.basename(str(s)) for s in source],
+                "frame": np.asarray(frame, dtype=int),
+                "maximum": maximum.astype(float),
+                "mean": mean.astype(float),
+            }
+        )
+
+    def __repr__(self):
+        return f"<CurveSet curves={len(self)} points={self.radial.size}>"
+
+    def __len__(self) -> int:
+        return len(self.intensity)
+
+    @classmethod
+    def from_hdf5(cls, path: str) -> "CurveSet":
+        """
+        Read the 1D profiles of a reduction output file.
+
+        Parameters
+        ----------
+        path : str
+            The path of an HDF5 file written by `ReductionWriter`.
+
+        Raises
+        ------
+        KeyError
+            If the file has no 1D profiles.
+        """
+        with h5py.File(path, "r") as f:
+            if "radial" not in f or "intensity" not in f:
+                raise KeyError(f"{path} has no 1D profiles.")
+            intensity = f["intensity"]
+            if intensity.ndim != 2:
+                raise KeyError(f"{path} has no 1D profiles.")
+            n = intensity.shape[0]
+            source = f["source"].asstr()[:n] if "source" in f else None
+            frame = f["frame"][:n] if "frame" in f else None
+            return cls(f["radial"][()], intensity.astype(np.float32)[()], source, frame)
+
+    def select(
+        self,
+        filters: list[tuple[str, str, object]] | None = None,
+        sort_by: list[tuple[str, bool]] | None = None,
+    ) -> pd.DataFrame:
+        """
+        Filter and sort the table of curves.
+
+        Parameters
+        ----------
+        filters : list[tuple[str, str, object]] | None, optional
+            The (column, operator, value) filters, by default none.
+        sort_by : list[tuple[str, bool]] | None, optional
+            The (column, ascending) sort order, by default the curve order.
+
+        Returns
+        -------
+        pd.DataFrame
+            The selected rows of the table.
+
+        Raises
+        ------
+        ValueError
+            If a filter or sort column is unsupported.
+        """
+        table = filter_table(self.table, filters or [])
+        if sort_by:
+            columns = [column for column, _ in sort_by]
+            if not set(columns) <= set(self.table.columns):
+                raise ValueError(f"Unsupported sort columns {columns}.")
+            table = table.sort_values(
+                columns, ascending=[asc for _, asc in sort_by], kind="stable"
+            )
+        return table
+
+    def traces(
+        self,
+        curves: np.ndarray,
+        width: int | None = None,
+        x_range: tuple[float, float] | None = None,
+        method: Literal["minmax", "lttb"] = "minmax",
+    ) -> list[dict]:
+        """
+        The WebGL traces of decimated curves.
+
+        Parameters
+        ----------
+        curves : np.ndarray
+            The indices of the curves to draw, in order.
+        width : int | None, optional
+            The width of the plot in pixels, by default `DEFAULT_PLOT_WIDTH`.
+        x_range : tuple[float, float] | None, optional
+            The visible radial range, to decimate only the points within it.
+            By default the full range.
+        method : {"minmax", "lttb"}, optional
+            The decimation method, by default "minmax".
+
+        Returns
+        -------
+        list[dict]
+            The `scattergl` traces, with x and y as typed arrays. Up to
+            `MAX_NAMED_CURVES` curves get a named trace each, and more curves
+            are concatenated into `TRACE_GROUPS` traces.
+        """
+        curves = np.asarray(curves, dtype=np.intp)
+        if curves.size == 0:
+            return []
+        x = self.radial
+        window = slice(None)
+        if x_range is not None:
+            lo, hi = sorted(x_range)
+            start = max(np.searchsorted(x, lo) - 1, 0)
+            stop = min(np.searchsorted(x, hi, side="right") + 1, x.size)
+            window = slice(start, max(stop, start + 1))
+        x_kept, y_kept = decimate(
+            x[window],
+            self.intensity[curves, window],
+            curve_points(curves.size, width),
+            method,
+        )
+        if curves.size <= MAX_NAMED_CURVES:
+            groups = [[i] for i in range(curves.size)]
+            names = [
+                f"{self.table.source[c]} #{self.table.frame[c]}"
+                for c in curves.tolist()
+            ]
+        else:
+            groups = np.array_split(np.arange(curves.size), TRACE_GROUPS)
+            names = [
+                f"curves {curves[g[0]]}-{curves[g[-1]]}" if len(g) > 1 else ""
+                for g in groups
+            ]
+        colours = sample_colorscale(
+            CURVE_COLORSCALE, np.linspace(0, 1, max(len(groups), 2))
+        )
+        traces = []
+        for group, name, colour in zip(groups, names, colours):
+            # Separate the curves of a trace by a NaN point, so they are not joined.
+            gap = np.full((len(group), 1), np.nan, dtype=np.float32)
+            xs = np.hstack([x_kept[group], gap]).ravel()[:-1]
+            ys = np.hstack([y_kept[group], gap]).ravel()[:-1]
+            traces.append(
+                {
+                    "type": "scattergl",
+                    "mode": "lines",
+                    "name": name,
+                    "x": typed_array(xs),
+                    "y": typed_array(ys),
+                    "line": {"width": 1, "color": colour},
+                    "connectgaps": False,
+                }
+            )
+        return traces
+
+
+class CurveCache:
+    """
+    A thread-safe LRU cache of the curve sets of reduction output files.
+
+    Curve sets are keyed by path and modification time, so a file that is
+    still being written by a live reduction is read again when it changes.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of curve sets to hold, by default 4.
+    """
+
+    def __init__(self, maxsize: int = 4):
+        self._curves = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._curves)
+
+    def get(self, path: str) -> CurveSet:
+        """
+        Get the curve set of a reduction output file, reading it if needed.
+
+        Parameters
+        ----------
+        path : str
+            The path of the reduction output file.
+
+        Returns
+        -------
+        CurveSet
+            The 1D profiles of the file.
+
+        Raises
+        ------
+        KeyError
+            If the file has no 1D profiles.
+        OSError
+            If the file cannot be read.
+        """
+        key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+        with self._lock:
+            curves = self._curves.get(key)
+        if curves is None:
+            curves = CurveSet.from_hdf5(path)
+            with self._lock:
+                self._curves[key] = curves
+        return curves
+
+    def clear(self) -> None:
+        """Remove all cached curve sets."""
+        with self._lock:
+            self._curves.clear()
+
+
+curve_cache = CurveCache()
+"""The process-wide cache of curve sets."""
+
+
+def list_reductions(directory: str = REDUCTION_DIR) -> list[str]:
+    """
+    List the reduction output files of a directory, newest first.
+
+    Parameters
+    ----------
+    directory : str, optional
+        The directory of reduction outputs, by default `REDUCTION_DIR`.
+
+    Returns
+    -------
+    list[str]
+        The paths of the HDF5 files.
+    """
+    paths = glob.glob(os.path.join(directory, "*.h5"))
+    paths += glob.glob(os.path.join(directory, "*.hdf5"))
+    return sorted(paths, key=os.path.getmtime, reverse=True)
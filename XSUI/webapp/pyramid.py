@@ -0,0 +1,267 @@
+"""
+Multi-resolution pyramids of detector images.
+
+Each level of a pyramid halves the resolution of the previous one, so a client
+zoomed out to the whole detector is sent a coarse level and a client zoomed in
+is sent the visible region at full resolution. Levels are generated lazily by
+2x2 max pooling by default, so hot pixels and thin diffraction rings remain
+visible at coarse levels. All levels share the colour limits of the full
+resolution image, so the colour mapping does not change with the zoom.
+"""
+
+import math
+import threading
+from typing import Literal
+
+import numpy as np
+
+from XSUI.masks.cache import LRUCache
+from XSUI.storage.image_store import image_store
+from XSUI.webapp.rendering import colour_limits, render_image, scale_values
+
+TILE_SIZE = 256
+"""The width and height of pyramid tiles, in pixels."""
+
+MAX_DISPLAY_PIXELS = 1024
+"""The maximum width or height of a rendered viewport, in pixels."""
+
+
+def downsample(data: np.ndarray, how: Literal["max", "mean"] = "max") -> np.ndarray:
+    """
+    Halve the resolution of an image by 2x2 pooling.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The 2D image data. Odd dimensions are padded by repeating the edge.
+    how : {"max", "mean"}, optional
+        Pool by the maximum (preserving hot pixels and thin rings) or the mean
+        (preserving the integrated intensity), by default "max".
+
+    Returns
+    -------
+    np.ndarray
+        The downsampled image, of shape `ceil(rows / 2), ceil(cols / 2)`.
+    """
+    rows, cols = data.shape
+    pad = ((0, rows % 2), (0, cols % 2))
+    if any(p for _, p in pad):
+        data = np.pad(data, pad, mode="edge")
+    blocks = data.reshape(data.shape[0] // 2, 2, data.shape[1] // 2, 2)
+    if how == "max":
+        return blocks.max(axis=(1, 3))
+    if how == "mean":
+        return blocks.mean(axis=(1, 3), dtype=np.float32)
+    raise ValueError(f"Unsupported pooling `{how}`.")
+
+
+class ImagePyramid:
+    """
+    A lazily generated multi-resolution pyramid of an image.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The full resolution 2D image data (level 0).
+    how : {"max", "mean"}, optional
+        The pooling used to generate coarser levels, by default "max".
+    log : bool, optional
+        Whether the image is rendered with a log10 colour scale, by default True.
+    """
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        how: Literal["max", "mean"] = "max",
+        log: bool = True,
+    ):
+        self.how = how
+        self.log = log
+        self._levels: list[np.ndarray] = [data]
+        self._lock = threading.Lock()
+        # The colour limits of the full resolution image, shared by all levels.
+        self.limits = colour_limits(scale_values(data, log))
+        # Levels are generated until the whole image fits in a single tile.
+        self.nlevels = 1 + max(
+            math.ceil(math.log2(max(max(data.shape) / TILE_SIZE, 1))), 0
+        )
+
+    def __repr__(self):
+        return f"<ImagePyramid shape={self.shape} levels={self.nlevels}>"
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """The (rows, cols) shape of the full resolution image."""
+        return self._levels[0].shape
+
+    def level(self, n: int) -> np.ndarray:
+        """
+        Get a level of the pyramid, generating it (and finer levels) if needed.
+
+        Parameters
+        ----------
+        n : int
+            The level, where level `n` is downsampled by a factor of `2 ** n`.
+
+        Returns
+        -------
+        np.ndarray
+            The image data of the level.
+        """
+        if not 0 <= n < self.nlevels:
+            raise IndexError(f"Level {n} out of range for {self.nlevels} levels.")
+        with self._lock:
+            while len(self._levels) <= n:
+                self._levels.append(downsample(self._levels[-1], self.how))
+            return self._levels[n]
+
+    def choose_level(
+        self, width: float, height: float, max_pixels: int = MAX_DISPLAY_PIXELS
+    ) -> int:
+        """
+        Choose the finest level showing a region in at most `max_pixels` per side.
+
+        Parameters
+        ----------
+        width, height : float
+            The size of the visible region, in full resolution pixels.
+        max_pixels : int, optional
+            The maximum width or height of the rendered region, by default
+            `MAX_DISPLAY_PIXELS`.
+
+        Returns
+        -------
+        int
+            The pyramid level.
+        """
+        factor = max(width, height) / max_pixels
+        n = math.ceil(math.log2(factor)) if factor > 1 else 0
+        return min(n, self.nlevels - 1)
+
+    def render_region(
+        self,
+        x_range: tuple[float, float] | None = None,
+        y_range: tuple[float, float] | None = None,
+        max_pixels: int = MAX_DISPLAY_PIXELS,
+    ) -> tuple[np.ndarray, dict]:
+        """
+        Render the visible region of the image at the appropriate level.
+
+        Parameters
+        ----------
+        x_range, y_range : tuple[float, float] | None, optional
+            The visible axis ranges, in full resolution pixel coordinates (in
+            either order). By default the whole image is rendered.
+        max_pixels : int, optional
+            The maximum width or height of the rendered region, by default
+            `MAX_DISPLAY_PIXELS`.
+
+        Returns
+        -------
+        rgba : np.ndarray
+            The rendered (rows, cols, 4) uint8 region.
+        placement : dict
+            The `x0`, `y0`, `dx` and `dy` of a Plotly Image trace displaying the
+            region in full resolution pixel coordinates, and the `level`.
+        """
+        rows, cols = self.shape
+        x_lo, x_hi = sorted(x_range) if x_range is not None else (-0.5, cols - 0.5)
+        y_lo, y_hi = sorted(y_range) if y_range is not None else (-0.5, rows - 0.5)
+        n = self.choose_level(x_hi - x_lo, y_hi - y_lo, max_pixels)
+        f = 2**n
+        data = self.level(n)
+        # The level pixels overlapping the visible region.
+        c0 = min(max(int(math.floor((x_lo + 0.5) / f)), 0), data.shape[1] - 1)
+        c1 = min(max(int(math.ceil((x_hi + 0.5) / f)), c0 + 1), data.shape[1])
+        r0 = min(max(int(math.floor((y_lo + 0.5) / f)), 0), data.shape[0] - 1)
+        r1 = min(max(int(math.ceil((y_hi + 0.5) / f)), r0 + 1), data.shape[0])
+        rgba, _ = render_image(data[r0:r1, c0:c1], self.log, self.limits)
+        # A level pixel covers `f` full resolution pixels, centred between them.
+        placement = {
+            "x0": c0 * f + (f - 1) / 2,
+            "y0": r0 * f + (f - 1) / 2,
+            "dx": f,
+            "dy": f,
+            "level": n,
+        }
+        return rgba, placement
+
+    def render_tile(self, n: int, row: int, col: int) -> np.ndarray:
+        """
+        Render a `TILE_SIZE` tile of a level.
+
+        Parameters
+        ----------
+        n : int
+            The pyramid level.
+        row, col : int
+            The tile indices within the level.
+
+        Returns
+        -------
+        np.ndarray
+            The rendered (rows, cols, 4) uint8 tile. Edge tiles may be smaller.
+        """
+        data = self.level(n)
+        r0, c0 = row * TILE_SIZE, col * TILE_SIZE
+        if not (0 <= r0 < data.shape[0] and 0 <= c0 < data.shape[1]):
+            raise IndexError(f"Tile ({row}, {col}) out of range for level {n}.")
+        tile = data[r0 : r0 + TILE_SIZE, c0 : c0 + TILE_SIZE]
+        rgba, _ = render_image(tile, self.log, self.limits)
+        return rgba
+
+
+class PyramidCache:
+    """
+    A thread-safe LRU cache of image pyramids, keyed by image store key.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of pyramids to hold, by default 8.
+    """
+
+    def __init__(self, maxsize: int = 8):
+        self._pyramids = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pyramids)
+
+    def get(self, key: str, how: Literal["max", "mean"] = "max") -> ImagePyramid:
+        """
+        Get the pyramid of an image in the image store, creating it if needed.
+
+        Parameters
+        ----------
+        key : str
+            The image store key (content hash) of the image.
+        how : {"max", "mean"}, optional
+            The pooling used to generate coarser levels, by default "max".
+
+        Returns
+        -------
+        ImagePyramid
+            The pyramid of the image.
+
+        Raises
+        ------
+        KeyError
+            If the image is not in the image store.
+        """
+        with self._lock:
+            pyramid = self._pyramids.get((key, how))
+        if pyramid is None:
+            pyramid = ImagePyramid(image_store.get(key), how)
+            with self._lock:
+                self._pyramids[(key, how)] = pyramid
+        return pyramid
+
+    def clear(self) -> None:
+        """Remove all cached pyramids."""
+        with self._lock:
+            self._pyramids.clear()
+
+
+pyramid_cache = PyramidCache()
+"""The process-wide cache of image pyramids."""
@@ -0,0 +1,263 @@
+"""
+Server-side rendering of detector images to compressed colour images.
+
+Rather than sending every pixel value to the browser as a heatmap, images are
+colour-mapped on the server with vectorized NumPy (an optional log scale,
+percentile limits and a lookup table) and encoded as PNG or WebP. The encoded
+image is displayed by Plotly as an `Image` trace, and pixel values are looked
+up on the server when hovered. Masks are encoded the same way, as 1-bit PNG
+overlays.
+"""
+
+import base64
+import io
+from typing import Literal
+
+import numpy as np
+from PIL import Image
+from plotly.colors import get_colorscale, sample_colorscale, unlabel_rgb
+
+DEFAULT_COLORSCALE = "inferno"
+"""The Plotly colour scale used to render detector images."""
+
+MASK_COLOUR = (0, 222, 255)
+"""The RGB colour of masked pixels in mask overlays."""
+
+DEFAULT_PERCENTILES = (1.0, 99.8)
+"""The percentiles of valid pixel values mapped to the ends of the colour scale."""
+
+_luts: dict[tuple[str, int], np.ndarray] = {}
+"""Cache of colour lookup tables, keyed by colour scale name and size."""
+
+
+def colour_lut(colorscale: str = DEFAULT_COLORSCALE, n: int = 256) -> np.ndarray:
+    """
+    Get the lookup table of a Plotly colour scale.
+
+    Parameters
+    ----------
+    colorscale : str, optional
+        The name of the Plotly colour scale, by default `DEFAULT_COLORSCALE`.
+    n : int, optional
+        The number of colours, by default 256.
+
+    Returns
+    -------
+    np.ndarray
+        The (n, 3) uint8 RGB colours, read-only.
+    """
+    key = (colorscale, n)
+    lut = _luts.get(key)
+    if lut is None:
+        colours = sample_colorscale(
+            get_colorscale(colorscale), np.linspace(0, 1, n), colortype="rgb"
+        )
+        lut = np.array([unlabel_rgb(c) for c in colours]).round().astype(np.uint8)
+        lut.flags.writeable = False
+        _luts[key] = lut
+    return lut
+
+
+def scale_values(data: np.ndarray, log: bool = True) -> np.ndarray:
+    """
+    Scale pixel values for display.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The image data.
+    log : bool, optional
+        Whether to take the log10 of the values, by default True. Non-positive
+        values become NaN rather than raising warnings.
+
+    Returns
+    -------
+    np.ndarray
+        The float32 display values, with NaN for invalid pixels.
+    """
+    values = np.asarray(data, dtype=np.float32)
+    if not log:
+        return values
+    scaled = np.full(values.shape, np.nan, dtype=np.float32)
+    np.log10(values, out=scaled, where=values > 0)
+    return scaled
+
+
+def colour_limits(
+    values: np.ndarray,
+    percentiles: tuple[float, float] = DEFAULT_PERCENTILES,
+    max_samples: int = 1 << 18,
+) -> tuple[float, float]:
+    """
+    Find the colour limits of display values from their percentiles.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The display values, with NaN for invalid pixels.
+    percentiles : tuple[float, float], optional
+        The lower and upper percentiles, by default `DEFAULT_PERCENTILES`.
+    max_samples : int, optional
+        The maximum number of pixels sampled to estimate the percentiles, by
+        default 262144. Large images are strided rather than sorted in full.
+
+    Returns
+    -------
+    tuple[float, float]
+        The values mapped to the lower and upper ends of the colour scale.
+    """
+    flat = values.reshape(-1)
+    step = max(flat.size // max_samples, 1)
+    sample = flat[::step]
+    sample = sample[np.isfinite(sample)]
+    if sample.size == 0:
+        return 0.0, 1.0
+    vmin, vmax = np.percentile(sample, percentiles)
+    if vmax <= vmin:
+        vmax = vmin + 1.0
+    return float(vmin), float(vmax)
+
+
+def render_image(
+    data: np.ndarray,
+    log: bool = True,
+    limits: tuple[float, float] | None = None,
+    colorscale: str = DEFAULT_COLORSCALE,
+) -> tuple[np.ndarray, tuple[float, float]]:
+    """
+    Colour-map an image.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The 2D image data.
+    log : bool, optional
+        Whether to use a log10 colour scale, by default True.
+    limits : tuple[float, float] | None, optional
+        The display values at the ends of the colour scale. By default found
+        from the percentiles of the image (see `colour_limits`).
+    colorscale : str, optional
+        The name of the Plotly colour scale, by default `DEFAULT_COLORSCALE`.
+
+    Returns
+    -------
+    rgba : np.ndarray
+        The (rows, cols, 4) uint8 image. Invalid pixels are transparent.
+    limits : tuple[float, float]
+        The display values at the ends of the colour scale.
+    """
+    values = scale_values(data, log)
+    if limits is None:
+        limits = colour_limits(values)
+    vmin, vmax = limits
+    lut = colour_lut(colorscale)
+    # Map to LUT indices in place, with invalid pixels in an extra last entry.
+    n = len(lut)
+    valid = np.isfinite(values)
+    values -= vmin
+    values *= (n - 1) / (vmax - vmin)
+    np.clip(values, 0, n - 1, out=values)
+    indices = np.full(values.shape, n, dtype=np.uint16)
+    np.rint(values, out=values)
+    indices[valid] = values[valid]
+    rgba_lut = np.zeros((n + 1, 4), dtype=np.uint8)
+    rgba_lut[:n, :3] = lut
+    rgba_lut[:n, 3] = 255
+    return rgba_lut[indices], limits
+
+
+def encode_image(
+    rgba: np.ndarray,
+    fmt: Literal["png", "webp"] = "png",
+    compress_level: int = 1,
+) -> bytes:
+    """
+    Encode a colour image.
+
+    Parameters
+    ----------
+    rgba : np.ndarray
+        The (rows, cols, 3 or 4) uint8 image.
+    fmt : {"png", "webp"}, optional
+        The image format, by default "png". WebP is encoded losslessly.
+    compress_level : int, optional
+        The PNG compression level, by default 1, favouring encoding speed.
+
+    Returns
+    -------
+    bytes
+        The encoded image.
+    """
+    buffer = io.BytesIO()
+    image = Image.fromarray(np.ascontiguousarray(rgba))
+    if fmt == "png":
+        image.save(buffer, format="PNG", compress_level=compress_level)
+    elif fmt == "webp":
+        image.save(buffer, format="WEBP", lossless=True, method=0)
+    else:
+        raise ValueError(f"Unsupported image format `{fmt}`.")
+    return buffer.getvalue()
+
+
+def image_data_uri(rgba: np.ndarray, fmt: Literal["png", "webp"] = "png") -> str:
+    """Encode a colour image as a base64 data URI, for an Image trace `source`."""
+    encoded = base64.b64encode(encode_image(rgba, fmt)).decode("ascii")
+    return f"data:image/{fmt};base64,{encoded}"
+
+
+def encode_mask_image(
+    mask: np.ndarray, colour: tuple[int, int, int] = MASK_COLOUR
+) -> bytes:
+    """
+    Encode a mask as a 1-bit palette PNG, transparent where not masked.
+
+    A palette image needs a single bit per pixel before compression, rather
+    than the four bytes of an RGBA image, so even full detector masks encode to
+    a few kilobytes.
+
+    Parameters
+    ----------
+    mask : np.ndarray
+        The 2D mask, where non-zero pixels are masked.
+    colour : tuple[int, int, int], optional
+        The RGB colour of masked pixels, by default `MASK_COLOUR`.
+
+    Returns
+    -------
+    bytes
+        The encoded PNG image.
+    """
+    indices = np.ascontiguousarray(mask, dtype=bool).view(np.uint8)
+    image = Image.fromarray(indices)
+    image.putpalette([0, 0, 0, *colour])
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", transparency=0, bits=1)
+    return buffer.getvalue()
+
+
+def mask_data_uri(mask: np.ndarray, colour: tuple[int, int, int] = MASK_COLOUR) -> str:
+    """Encode a mask overlay as a base64 PNG data URI, for an Image trace `source`."""
+    encoded = base64.b64encode(encode_mask_image(mask, colour)).decode("ascii")
+    return f"data:image/png;base64,{encoded}"
+
+
+def pixel_value(data: np.ndarray, x: float, y: float) -> float | None:
+    """
+    Look up the value of the pixel at plot coordinates.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The image data.
+    x, y : float
+        The plot coordinates, where pixel centres lie on integer coordinates.
+
+    Returns
+    -------
+    float | None
+        The pixel value, or None if the coordinates lie outside the image.
+    """
+    row, col = int(round(y)), int(round(x))
+    if not (0 <= row < data.shape[0] and 0 <= col < data.shape[1]):
+        return None
+    return float(data[row, col])
@@ -0,0 +1,284 @@
+import hashlib
+import io
+
+import fabio
+import h5py
+import numpy as np
+import pytest
+import sqlalchemy.orm as orm
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from XSUI.storage import image_store
+from XSUI.webapp.fastapi import database
+from XSUI.webapp.fastapi.models import CompositeMask, CustomMask, DetectorMask
+from XSUI.webapp.pyramid import pyramid_cache
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        database, "DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path / 'api.db'}"
+    )
+    for name in ("_engine", "_async_engine", "_async_sessions"):
+        monkeypatch.setattr(database, name, None)
+    from XSUI.webapp.fastapi.main import app
+
+    with TestClient(app) as client:
+        yield client
+    if database._engine is not None:
+        database._engine.dispose()
+
+
+def frame(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 1000, (32, 24), dtype=np.int32)
+
+
+def edf_bytes(data: np.ndarray, tmp_path) -> bytes:
+    path = tmp_path / "upload.edf"
+    fabio.edfimage.EdfImage(data=data).write(str(path))
+    return path.read_bytes()
+
+
+def test_list_then_fetch(client, tmp_path):
+    data = frame(0)
+    response = client.post(
+        "/uploads", params={"filename": "a.edf"}, content=edf_bytes(data, tmp_path)
+    )
+    assert response.status_code == 200
+
+    listing = client.get("/images", params={"table": "calibrant"}).json()
+    assert listing["total"] == 1
+    row = listing["images"][0]
+    assert row["filename"] == "a.edf"
+    assert row["image_id"] == response.json()["image_id"]
+
+    image = client.get(f"/images/calibrant/{row['image_id']}.npy")
+    assert image.status_code == 200
+    assert image.headers["etag"] == f'"{row["digest"]}.npy"'
+    np.testing.assert_array_equal(np.load(io.BytesIO(image.content)), data)
+
+
+def test_raw_upload(client, tmp_path):
+    data = frame(0)
+    content = edf_bytes(data, tmp_path)
+    response = client.post("/uploads", params={"filename": "a.edf"}, content=content)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["filename"] == "a.edf"
+    assert body["size"] == len(content)
+    assert body["digest"] == hashlib.blake2b(content, digest_size=16).hexdigest()
+    assert body["nframes"] == 1
+    assert body["shape"] == [32, 24]
+    image = client.get(f"/images/{body['key']}.npy")
+    np.testing.assert_array_equal(np.load(io.BytesIO(image.content)), data)
+
+
+def test_multipart_upload(client, tmp_path):
+    data = frame(1)
+    response = client.post(
+        "/uploads",
+        data={"note": "ignored"},
+        files={"file": ("b.edf", edf_bytes(data, tmp_path))},
+    )
+    assert response.status_code == 200
+    assert response.json()["filename"] == "b.edf"
+    image = client.get(f"/images/{response.json()['key']}.npy")
+    np.testing.assert_array_equal(np.load(io.BytesIO(image.content)), data)
+
+
+def test_multiframe_upload(client, tmp_path):
+    stack = np.stack([frame(i) for i in range(3)])
+    with h5py.File(tmp_path / "stack.h5", "w") as f:
+        f["entry/data/data"] = stack
+    response = client.post(
+        "/uploads",
+        params={"filename": "stack.h5"},
+        content=(tmp_path / "stack.h5").read_bytes(),
+    )
+    assert response.status_code == 200
+    assert response.json()["nframes"] == 3
+    assert response.json()["shape"] == [32, 24]
+
+
+def test_duplicate_upload(client, tmp_path):
+    content = edf_bytes(frame(0), tmp_path)
+    first = client.post("/uploads", params={"filename": "a.edf"}, content=content)
+    second = client.post("/uploads", params={"filename": "b.edf"}, content=content)
+    assert second.json()["image_id"] == first.json()["image_id"]
+    assert client.get("/images", params={"table": "calibrant"}).json()["total"] == 1
+
+
+@pytest.mark.parametrize(
+    "kwargs, status",
+    [
+        ({"content": b"data"}, 400),
+        (
+            {
+                "content": b"--x\r\nContent-Disposition: form-data; name=note\r\n"
+                b"\r\nno file\r\n--x--\r\n",
+                "headers": {"Content-Type": "multipart/form-data; boundary=x"},
+            },
+            400,
+        ),
+        ({"params": {"filename": "a.edf"}, "content": b"not an image"}, 415),
+        (
+            {
+                "content": b"--x\r\nContent-Disposition: form-data; name=file; "
+                b'filename="a.edf"\r\n\r\ntruncated',
+                "headers": {"Content-Type": "multipart/form-data; boundary=x"},
+            },
+            400,
+        ),
+        (
+            {
+                "content": b"data",
+                "headers": {"Content-Type": "multipart/form-data"},
+            },
+            400,
+        ),
+    ],
+)
+def test_invalid_upload(client, kwargs, status):
+    assert client.post("/uploads", **kwargs).status_code == status
+
+
+def upload(client, data: np.ndarray, tmp_path) -> dict:
+    content = edf_bytes(data, tmp_path)
+    return client.post("/uploads", params={"filename": "a.edf"}, content=content).json()
+
+
+@pytest.mark.parametrize("fmt", ["npy", "bin"])
+def test_image_ranges(client, tmp_path, fmt):
+    data = frame(0)
+    url = f"/images/calibrant/{upload(client, data, tmp_path)['image_id']}.{fmt}"
+    full = client.get(url)
+    assert full.headers["x-array-shape"] == "32,24"
+    assert full.headers["x-array-dtype"] == data.dtype.str
+    assert full.headers["content-disposition"] == f'attachment; filename="a.{fmt}"'
+    if fmt == "bin":
+        assert full.content == data.tobytes()
+    size = len(full.content)
+
+    for header, start, stop in [
+        ("bytes=0-99", 0, 100),
+        ("bytes=1000-2999", 1000, 3000),
+        ("bytes=-10", size - 10, size),
+        (f"bytes=3000-{size + 100}", 3000, size),
+    ]:
+        part = client.get(url, headers={"Range": header})
+        assert part.status_code == 206
+        assert part.headers["content-range"] == f"bytes {start}-{stop - 1}/{size}"
+        assert part.content == full.content[start:stop]
+
+    head = client.head(url)
+    assert head.status_code == 200
+    assert head.content == b""
+    assert head.headers["content-length"] == str(size)
+
+    cached = client.get(url, headers={"If-None-Match": full.headers["etag"]})
+    assert cached.status_code == 304
+
+    for header in ("bytes=99999-", "bytes=10-5", "bytes=a-b"):
+        invalid = client.get(url, headers={"Range": header})
+        assert invalid.status_code == 416
+        assert invalid.headers["content-range"] == f"bytes */{size}"
+    # Multiple ranges are not supported, so the full body is sent.
+    assert client.get(url, headers={"Range": "bytes=0-1,5-6"}).status_code == 200
+
+
+def test_not_found(client, tmp_path):
+    image_id = upload(client, frame(0), tmp_path)["image_id"]
+    assert client.get(f"/images/calibrant/{image_id}.png").status_code == 404
+    assert client.get(f"/images/calibrant/{image_id + 1}.npy").status_code == 404
+    assert client.get(f"/images/unknown/{image_id}.npy").status_code == 404
+    assert client.get("/images/unknown.npy").status_code == 404
+    assert client.get("/images", params={"table": "unknown"}).status_code == 404
+    assert client.get("/masks/custom/1.npy").status_code == 404
+    assert client.get("/masks/unknown/1.npy").status_code == 404
+
+
+def test_masks(client):
+    detector = frame(1) % 2 == 0
+    custom = frame(2) % 3 == 0
+    with orm.Session(database.get_engine()) as session:
+        composite = CompositeMask(
+            DetectorMask("Pilatus2M", detector), [CustomMask(custom)]
+        )
+        session.add(composite)
+        session.commit()
+        ids = {
+            "detector": composite.detector.id,
+            "custom": composite.cust_masks[0].id,
+            "composite": composite.id,
+        }
+
+    expected = {"detector": detector, "custom": custom, "composite": detector | custom}
+    etags = {}
+    for kind, mask_id in ids.items():
+        response = client.get(f"/masks/{kind}/{mask_id}.npy")
+        assert response.status_code == 200
+        np.testing.assert_array_equal(
+            np.load(io.BytesIO(response.content)), expected[kind]
+        )
+        etags[kind] = response.headers["etag"]
+
+    with orm.Session(database.get_engine()) as session:
+        session.get(CustomMask, ids["custom"]).mask_data = CustomMask(~custom).mask_data
+        session.commit()
+    # Composites are revalidated when any member mask is updated.
+    for kind, status in [("detector", 304), ("custom", 200), ("composite", 200)]:
+        response = client.get(
+            f"/masks/{kind}/{ids[kind]}.npy", headers={"If-None-Match": etags[kind]}
+        )
+        assert response.status_code == status
+    np.testing.assert_array_equal(
+        np.load(io.BytesIO(response.content)), detector | ~custom
+    )
+
+
+def test_reductions(client, tmp_path, monkeypatch):
+    monkeypatch.setattr("XSUI.webapp.fastapi.main.REDUCTION_DIR", str(tmp_path))
+    intensity = np.random.default_rng(0).random((5, 100), dtype=np.float32)
+    with h5py.File(tmp_path / "run.h5", "w") as f:
+        f["intensity"] = intensity
+        f["radial"] = np.linspace(0, 30, 100)
+        f["paths"] = np.array([b"a.edf"] * 5, dtype=h5py.string_dtype())
+
+    assert client.get("/reductions").json()["reductions"] == ["run"]
+    datasets = client.get("/reductions/run").json()["datasets"]
+    assert datasets["intensity"] == {"shape": [5, 100], "dtype": "<f4"}
+    rows = client.get(
+        "/reductions/run/intensity.bin", headers={"Range": "bytes=400-1199"}
+    )
+    assert rows.status_code == 206
+    np.testing.assert_array_equal(
+        np.frombuffer(rows.content, np.float32).reshape(2, 100), intensity[1:3]
+    )
+    assert client.get("/reductions/missing").status_code == 404
+    assert client.get("/reductions/run/missing.npy").status_code == 404
+    assert client.get("/reductions/run/paths.npy").status_code == 415
+
+
+def test_pyramid_tiles(client):
+    key = image_store.put(
+        np.random.default_rng(0).integers(1, 1000, (300, 600), dtype=np.int32)
+    )
+    pyramid = client.get(f"/images/{key}/pyramid").json()
+    assert pyramid == {
+        "shape": [300, 600],
+        "levels": 3,
+        "tile_size": 256,
+        "limits": list(pyramid_cache.get(key).limits),
+    }
+    tile = client.get(f"/images/{key}/tiles/0/1/2.png")
+    assert tile.status_code == 200
+    assert "immutable" in tile.headers["cache-control"]
+    expected = pyramid_cache.get(key).render_tile(0, 1, 2)
+    np.testing.assert_array_equal(
+        np.asarray(Image.open(io.BytesIO(tile.content))), expected
+    )
+    assert client.get(f"/images/{key}/tiles/3/0/0.png").status_code == 404
+    assert client.get(f"/images/{key}/tiles/0/2/0.png").status_code == 404
+    assert client.get("/images/missing/pyramid").status_code == 404
+    assert client.get("/images/missing/tiles/0/0/0.png").status_code == 404
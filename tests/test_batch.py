@@ -0,0 +1,79 @@
+import fabio
+import h5py
+import numpy as np
+import pyFAI.detectors
+import pytest
+from pyFAI.io.ponifile import PoniFile
+
+from XSUI.experiment.batch import BatchReduction, reduce_file
+from XSUI.experiment.config_base import ConfigBase
+from XSUI.geometry import get_integrator
+
+SHAPE = (64, 48)
+
+
+@pytest.fixture(scope="module")
+def config() -> ConfigBase:
+    detector = pyFAI.detectors.Detector(pixel1=1e-4, pixel2=1e-4, max_shape=SHAPE)
+    poni = PoniFile(
+        {
+            "dist": 0.1,
+            "poni1": 0.003,
+            "poni2": 0.002,
+            "detector": detector,
+            "wavelength": 1e-10,
+        }
+    )
+    return ConfigBase(detector=detector, poni=poni)
+
+
+@pytest.fixture
+def images(tmp_path) -> str:
+    rng = np.random.default_rng(0)
+    with h5py.File(tmp_path / "stack.h5", "w") as f:
+        f["entry/data/data"] = rng.integers(1, 100, (10, *SHAPE), dtype=np.int32)
+    for i in range(2):
+        data = rng.integers(1, 100, SHAPE, dtype=np.int32)
+        fabio.edfimage.EdfImage(data=data).write(str(tmp_path / f"{i}.edf"))
+    return str(tmp_path)
+
+
+def test_reduce_file_axes(config, images):
+    integrator = get_integrator(config, npt=50, npt_azim=36)
+    (result,) = reduce_file(integrator, f"{images}/0.edf", dims=3)
+    assert result.radial.shape == result.intensity.shape == (50,)
+    assert result.radial_2d.shape == (50,)
+    assert result.intensity_2d.shape == (36, 50)
+    assert result.azimuthal.shape == (36,)
+
+
+def test_batch_output_layout(config, images, tmp_path):
+    output = tmp_path / "reduction.h5"
+    batch = BatchReduction(
+        config, f"{images}/*", npt=50, npt_azim=36, dims=3, workers=2, frames_per_task=4
+    )
+    progress = batch.run(str(output), progress=None)
+    assert progress.errors == {}
+    assert (progress.files_done, progress.frames_done) == (3, 12)
+
+    integrator = get_integrator(config, npt=50, npt_azim=36)
+    with h5py.File(output) as f:
+        assert f["intensity"].shape == (12, 50)
+        assert f["intensity_2d"].shape == (12, 36, 50)
+        sources = [s.decode() for s in f["source"][()]]
+        frames = sorted(zip(sources, f["frame"][()]))
+        expected = [(f"{images}/stack.h5", i) for i in range(10)]
+        expected += [(f"{images}/{i}.edf", 0) for i in range(2)]
+        assert frames == sorted(expected)
+        # The 1D intensities are stored with the 1D radial axis.
+        frame = fabio.open(f"{images}/0.edf").data
+        np.testing.assert_allclose(
+            f["radial"][()], integrator.integrate1d(frame).radial
+        )
+        np.testing.assert_allclose(
+            f["radial_2d"][()], integrator.integrate2d(frame).radial
+        )
+        row = sources.index(f"{images}/0.edf")
+        np.testing.assert_allclose(
+            f["intensity"][row], integrator.integrate1d(frame).intensity, rtol=1e-5
+        )
@@ -0,0 +1,92 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+
+from XSUI.storage import BlobStore, blob_store, image_digest
+from XSUI.webapp.fastapi.models import ImageBase, ImageWAXS
+
+
+@pytest.fixture
+def store(tmp_path) -> BlobStore:
+    return BlobStore(str(tmp_path / "blobs"))
+
+
+def test_put_bytes(store):
+    digest = store.put_bytes(b"pixels")
+    assert digest == hashlib.blake2b(b"pixels", digest_size=16).hexdigest()
+    path = store.path(digest)
+    assert path == os.path.join(store.root, digest[:2], digest)
+    assert digest in store and (digest, "zlib") not in store
+    assert store.open_bytes(digest).tobytes() == b"pixels"
+    assert not store.open_bytes(digest).flags.writeable
+
+    assert store.put_bytes(memoryview(b"data"), "custom", "zlib") == "custom"
+    assert store.open_bytes("custom", "zlib").tobytes() == b"data"
+    assert store.put_bytes(b"") in store
+    assert store.open_bytes(store.put_bytes(b"")).size == 0
+
+
+def test_deduplicated(store):
+    digest = store.put_bytes(b"pixels")
+    mtime = os.stat(store.path(digest)).st_mtime_ns
+    assert store.put_bytes(b"pixels") == digest
+    # The existing blob is not rewritten.
+    assert os.stat(store.path(digest)).st_mtime_ns == mtime
+    assert sorted(os.listdir(os.path.dirname(store.path(digest)))) == [digest]
+
+
+def test_put_array(store):
+    data = np.random.default_rng(0).integers(0, 1000, (30, 20), dtype=np.int32)
+    digest = store.put_array(data[:, ::2])
+    assert digest == image_digest(data[:, ::2])
+    stored = store.open_array(digest)
+    assert isinstance(stored, np.memmap)
+    assert not stored.flags.writeable
+    np.testing.assert_array_equal(stored, data[:, ::2])
+    assert store.put_array(data[:, ::2].copy()) == digest
+
+
+def test_missing_and_delete(store):
+    with pytest.raises(KeyError):
+        store.open_bytes("missing")
+    with pytest.raises(KeyError):
+        store.open_array("missing")
+    digest = store.put_bytes(b"pixels")
+    store.delete(digest)
+    assert digest not in store
+    store.delete(digest)
+
+
+def test_failed_write(store):
+    def fail(f):
+        f.write(b"partial")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        store._write(store.path("partial"), fail)
+    # Neither the blob nor the temporary file are left behind.
+    assert os.listdir(os.path.join(store.root, "pa")) == []
+
+
+def test_images_share_blobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "root", str(tmp_path / "blobs"))
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'images.db'}")
+    ImageBase.metadata.create_all(engine)
+    frame = np.random.default_rng(0).integers(0, 1000, (64, 48), dtype=np.int32)
+    with orm.Session(engine) as session:
+        session.add_all([ImageWAXS("a.edf", frame), ImageWAXS("b.edf", frame)])
+        session.commit()
+    # The database only holds the layout of the image, not its pixels.
+    with engine.connect() as connection:
+        row = connection.execute(sa.text("SELECT * FROM waxs_images")).mappings()
+        assert all(not isinstance(v, bytes) for v in row.first().values())
+    blobs = [name for _, _, names in os.walk(blob_store.root) for name in names]
+    assert blobs == [f"{image_digest(frame)}.zlib"]
+    with orm.Session(engine) as session:
+        for image in session.scalars(sa.select(ImageWAXS)):
+            np.testing.assert_array_equal(image.image, frame)
+    engine.dispose()
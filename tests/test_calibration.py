@@ -0,0 +1,180 @@
+import numpy as np
+import pyFAI.calibrant
+import pyFAI.detectors
+import pytest
+from pyFAI.geometry import Geometry
+from pyFAI.integrator.azimuthal import AzimuthalIntegrator
+
+from XSUI.geometry.calibration import (
+    GEOMETRY_PARAMETERS,
+    RefinementResult,
+    RingCalibration,
+    better,
+    calibrate_geometry,
+    fit_circles,
+    pick_ring_peaks,
+    ring_residuals,
+)
+
+SHAPE = (400, 500)
+WAVELENGTH = 1e-10
+TRUE_GEOMETRY = {
+    "dist": 0.08,
+    "poni1": 0.018,
+    "poni2": 0.022,
+    "rot1": 0.02,
+    "rot2": -0.01,
+    "rot3": 0.0,
+}
+
+
+@pytest.fixture(scope="module")
+def detector() -> pyFAI.detectors.Detector:
+    return pyFAI.detectors.Detector(pixel1=1e-4, pixel2=1e-4, max_shape=SHAPE)
+
+
+@pytest.fixture(scope="module")
+def image(detector) -> np.ndarray:
+    # Silver behenate rings with Poisson background counts.
+    ai = AzimuthalIntegrator(**TRUE_GEOMETRY, detector=detector, wavelength=WAVELENGTH)
+    calibrant = pyFAI.calibrant.get_calibrant("AgBh")
+    calibrant.wavelength = WAVELENGTH
+    rings = calibrant.fake_calibration_image(ai, Imax=1000)
+    return rings + np.random.default_rng(0).poisson(5, SHAPE)
+
+
+def test_fit_circles():
+    angles = np.linspace(0, np.pi, 50)
+    d1 = np.concatenate([30 + 10 * np.sin(angles), -5 + 40 * np.cos(angles)])
+    d2 = np.concatenate([20 + 10 * np.cos(angles), 7 + 40 * np.sin(angles)])
+    arc = np.repeat([0, 1], 50)
+    centres, radii = fit_circles(d1, d2, arc, 2)
+    np.testing.assert_allclose(centres, [[30, 20], [-5, 7]], atol=1e-9)
+    np.testing.assert_allclose(radii, [10, 40])
+
+
+def test_pick_ring_peaks(image, detector):
+    peaks = pick_ring_peaks(image)
+    ai = AzimuthalIntegrator(**TRUE_GEOMETRY, detector=detector, wavelength=WAVELENGTH)
+    fit2d = ai.getFit2D()
+    # The fitted centre is the beam centre, in pixel (index) coordinates.
+    centre = (fit2d["centerY"] - 0.5, fit2d["centerX"] - 0.5)
+    np.testing.assert_allclose(peaks.centre, centre, atol=1.0)
+    assert len(peaks.radii) > 10
+    assert len(peaks.ring_pixels) == len(peaks.radii)
+    assert (np.diff(peaks.radii) > 0).all()
+    # The innermost rings are the first orders of the 58.38 A lamellar spacing.
+    np.testing.assert_allclose(
+        peaks.radii[:4] / peaks.radii[0], [1, 2, 3, 4], rtol=0.02
+    )
+    tth = Geometry(**TRUE_GEOMETRY, detector=detector, wavelength=WAVELENGTH).tth(
+        peaks.d1, peaks.d2
+    )
+    calibration = RingCalibration(image, detector, WAVELENGTH, "AgBh")
+    nearest = np.abs(tth[:, None] - calibration.ring_tth[None, :]).min(axis=1)
+    assert np.mean(nearest < np.radians(0.05)) > 0.95
+
+
+def test_no_rings(detector):
+    noise = np.random.default_rng(0).poisson(5, SHAPE)
+    with pytest.raises(ValueError, match="No calibrant rings"):
+        pick_ring_peaks(noise)
+    with pytest.raises(ValueError, match="No calibrant rings"):
+        RingCalibration(noise, detector, WAVELENGTH, "AgBh").run(None)
+
+
+def test_ring_residuals(image, detector):
+    calibration = RingCalibration(image, detector, WAVELENGTH, "AgBh")
+    d1, d2 = calibration.sample_peaks()
+    assert len(d1) == min(len(calibration.peaks), calibration.max_peaks)
+    geometry = Geometry(detector=detector, wavelength=WAVELENGTH)
+    params = np.array([TRUE_GEOMETRY[name] for name in GEOMETRY_PARAMETERS])
+    residual = ring_residuals(geometry, d1, d2, calibration.ring_tth, params)
+    assert np.median(np.abs(residual)) < 0.5 * calibration.pixel
+    params[0] *= 1.05
+    wrong = ring_residuals(geometry, d1, d2, calibration.ring_tth, params)
+    assert np.median(np.abs(wrong)) > np.median(np.abs(residual))
+
+
+def test_starts(image, detector):
+    calibration = RingCalibration(image, detector, WAVELENGTH, "AgBh", n_starts=4)
+    starts = calibration.starts()
+    assert len(starts) == 4
+    # The best screened start matches the first ring to the first reflection.
+    assert starts[0][0] == pytest.approx(TRUE_GEOMETRY["dist"], rel=0.05)
+    dists = sorted(s[0] for s in starts)
+    assert all(b / a - 1 > 0.01 for a, b in zip(dists, dists[1:]))
+
+    guess = {"dist": 0.1, "poni1": 0.01, "rot1": None}
+    calibration = RingCalibration(
+        image, detector, WAVELENGTH, "AgBh", guess=guess, n_starts=2
+    )
+    starts = calibration.starts()
+    assert len(starts) == 4
+    assert starts[0][:2].tolist() == [0.1, 0.01]
+    # The guessed distance is also tried at the beam centre of the rings.
+    assert starts[1][0] == 0.1 and starts[1][1] != 0.01
+
+
+def test_calibrate(image, detector):
+    stages = []
+    reports = []
+
+    def progress(report):
+        stages.append(report.stage)
+        reports.append(report)
+
+    result = calibrate_geometry(
+        image, detector, WAVELENGTH, "AgBh", progress, n_starts=3, workers=2
+    )
+    # Within a pixel (1e-4 m) and a milliradian of the true geometry.
+    for name, value in TRUE_GEOMETRY.items():
+        tolerance = 1e-3 if name.startswith("rot") else 1e-4
+        assert getattr(result, name) == pytest.approx(value, abs=tolerance)
+    assert result.inliers > 0.95 and result.rms < 1.0
+    assert result.wavelength == WAVELENGTH
+    assert stages == ["screening"] + ["refining"] * 4 + ["done"]
+    assert reports[-1].starts_done == reports[-1].starts_total == 3
+    assert reports[-1].best is result
+
+    poni = result.poni(detector)
+    assert poni.dist == result.dist and poni.detector is detector
+    assert poni.wavelength == WAVELENGTH
+
+
+def test_peak_angles(image, detector):
+    calibration = RingCalibration(image, detector, WAVELENGTH, "AgBh")
+    result = RefinementResult(**TRUE_GEOMETRY, wavelength=WAVELENGTH)
+    tth, chi, residual = calibration.peak_angles(result)
+    assert len(tth) == len(chi) == len(residual) == calibration.max_peaks
+    assert np.median(np.abs(residual)) < 0.5
+    assert tth.min() > 0 and np.abs(chi).max() <= 180
+
+
+def test_better():
+    result = RefinementResult(**TRUE_GEOMETRY, wavelength=WAVELENGTH)
+    assert better(result, None)
+    more = RefinementResult(**TRUE_GEOMETRY, wavelength=WAVELENGTH, inliers=0.9)
+    less = RefinementResult(**TRUE_GEOMETRY, wavelength=WAVELENGTH, inliers=0.8)
+    assert better(more, less) and not better(less, more)
+    finer = RefinementResult(
+        **TRUE_GEOMETRY, wavelength=WAVELENGTH, inliers=0.9, rms=0.3
+    )
+    coarser = RefinementResult(
+        **TRUE_GEOMETRY, wavelength=WAVELENGTH, inliers=0.9005, rms=0.5
+    )
+    assert better(finer, coarser)
+
+
+def test_invalid(image, detector):
+    with pytest.raises(ValueError, match="wavelength"):
+        RingCalibration(image, detector, None, "AgBh")
+    with pytest.raises(ValueError, match="Unknown"):
+        RingCalibration(image, detector, WAVELENGTH, "AgBh", fixed=("tilt",))
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[:10] = True
+    image = image.copy()
+    image[-1] = -1
+    calibration = RingCalibration(image, detector, WAVELENGTH, "AgBh", mask=mask)
+    assert calibration.mask[:10].all() and calibration.mask[-1].all()
+    assert not calibration.mask[10:-1].any()
@@ -0,0 +1,130 @@
+import json
+
+import numpy as np
+import pyFAI.detectors
+import pytest
+from dash import Patch
+from dash._callback_context import context_value
+from dash._utils import AttributeDict
+from dash.exceptions import PreventUpdate
+from pyFAI.io.ponifile import PoniFile
+
+from XSUI.storage import image_store
+from XSUI.webapp.dash.callbacks import callback_calibration as calibration
+
+SHAPE = (40, 60)
+
+
+def trigger(prop_id: str) -> None:
+    context_value.set(AttributeDict(triggered_inputs=[{"prop_id": prop_id}]))
+
+
+def apply_patch(figure: dict, patch: Patch) -> dict:
+    """Apply the assignments of a patch to a figure dictionary."""
+    for operation in patch.to_plotly_json()["operations"]:
+        assert operation["operation"] == "Assign"
+        *path, last = operation["location"]
+        target = figure
+        for part in path:
+            target = target[part]
+        target[last] = operation["params"]["value"]
+    return figure
+
+
+def poni_file(poni1: float = 0.002) -> str:
+    detector = pyFAI.detectors.Detector(pixel1=1e-4, pixel2=1e-4, max_shape=SHAPE)
+    poni = PoniFile({"dist": 0.1, "poni1": poni1, "poni2": 0.003, "detector": detector})
+    return json.dumps(poni.as_dict())
+
+
+@pytest.fixture
+def image_key() -> str:
+    data = np.random.default_rng(0).integers(1, 1000, SHAPE).astype(np.float32)
+    return image_store.put(data)
+
+
+def mask_data(seed: int) -> dict:
+    return {"key": image_store.put(np.random.default_rng(seed).random(SHAPE) < 0.2)}
+
+
+def figure(image_key, mask=None, poni=None) -> dict:
+    trigger("calibration_tab-upload_handle.data")
+    handle = {"key": image_key, "filename": "a.edf"}
+    _, fig, _ = calibration.figure_callback(
+        None, None, handle, poni, mask, None, None, "session"
+    )
+    assert not isinstance(fig, Patch)
+    return fig.to_plotly_json()
+
+
+def test_trace_layout(image_key):
+    fig = figure(image_key)
+    names = [trace.get("name") for trace in fig["data"][:3]]
+    assert names == ["Image", "Mask", "Beam Centre"]
+    assert fig["data"][calibration._MASK_TRACE]["visible"] is False
+    assert list(fig["data"][calibration._BEAMCENTRE_TRACE]["x"]) == []
+
+
+@pytest.mark.parametrize(
+    "prop_id, overlay",
+    [
+        ("calibration_tab-image_plot_mask.data", "mask"),
+        ("calibration_tab-poni_file.data", "poni"),
+    ],
+)
+def test_patched_overlays(image_key, prop_id, overlay):
+    mask = mask_data(1) if overlay == "mask" else None
+    poni = poni_file() if overlay == "poni" else None
+    fig = figure(image_key)
+    trigger(prop_id)
+    _, patch, _ = calibration.figure_callback(
+        None, "a.edf", None, poni, mask, None, image_key, "session"
+    )
+    assert isinstance(patch, Patch)
+    # The image itself is never resent.
+    locations = [op["location"] for op in patch.to_plotly_json()["operations"]]
+    assert all(location[1] != calibration._IMAGE_TRACE for location in locations)
+
+    # The patched figure matches a figure rebuilt with the overlay.
+    patched = apply_patch(fig, patch)["data"]
+    expected = figure(image_key, mask=mask, poni=poni)["data"]
+    for index in (calibration._MASK_TRACE, calibration._BEAMCENTRE_TRACE):
+        assert patched[index].get("source") == expected[index].get("source")
+        assert patched[index].get("visible") == expected[index].get("visible")
+        for axis in ("x", "y"):
+            np.testing.assert_allclose(
+                patched[index].get(axis, []), expected[index].get(axis, [])
+            )
+
+
+def test_mask_patch_cleared(image_key):
+    trigger("calibration_tab-image_plot_mask.data")
+    _, patch, _ = calibration.figure_callback(
+        None, "a.edf", None, None, None, None, image_key, "session"
+    )
+    operations = patch.to_plotly_json()["operations"]
+    assert [op["params"]["value"] for op in operations] == [False]
+
+
+def test_beamcentre():
+    coords = calibration.beamcentre_coords(poni_file(poni1=0.002), None)
+    np.testing.assert_allclose(coords[:2], [19.5, 29.5])
+    assert calibration.beamcentre_coords(None, None) is None
+
+
+def test_zoom_keeps_mask(image_key):
+    trigger("calibration_tab-image_plot.relayoutData")
+    shapes = {"shapes": [{"type": "rect", "x0": 5, "y0": 5, "x1": 20, "y1": 15}]}
+    stored = calibration.update_mask(shapes, None, False, image_key, None, "zoom")
+    mask = image_store.get(stored["key"])
+    assert mask[10, 10] and not mask[30, 40]
+    with pytest.raises(PreventUpdate):
+        zoom = {"xaxis.range[0]": 0, "xaxis.range[1]": 10}
+        calibration.update_mask(zoom, None, False, image_key, stored, "zoom")
+
+
+def test_mask_source_cached():
+    mask = np.random.default_rng(0).random(SHAPE) < 0.2
+    source = calibration.mask_source(mask)
+    assert calibration.mask_source(mask.copy()) is source
+    assert calibration.mask_source(~mask) != source
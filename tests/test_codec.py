@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+
+from XSUI.storage import blob_store, decode_frame, decode_rows, encode_frame
+from XSUI.storage import codec
+from XSUI.storage.codec import IMAGE_CODEC_VERSION, shuffle_bytes, unshuffle_bytes
+from XSUI.webapp.fastapi.models import ImageCalibrant, ImageGIWAXS, ImageWAXS
+
+
+def detector_frame(shape=(200, 150), dtype=np.int32) -> np.ndarray:
+    # Poisson counts with module gaps, as in a Pilatus frame.
+    frame = np.random.default_rng(0).poisson(20, shape).astype(dtype)
+    frame[:, 60:67] = -1
+    frame[97:114] = -1
+    return frame
+
+
+def decode(encoded, **kwargs) -> np.ndarray:
+    return decode_rows(
+        encoded.data,
+        encoded.shape,
+        encoded.dtype,
+        encoded.compression,
+        encoded.chunk_rows,
+        encoded.offsets,
+        shuffle=encoded.shuffle,
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize(
+    "dtype", [np.int32, np.uint16, np.float32, np.float64, np.uint8, ">i4"]
+)
+def test_shuffle(dtype):
+    data = detector_frame((7, 9)).astype(dtype)
+    shuffled = shuffle_bytes(data)
+    assert len(shuffled) == data.nbytes
+    np.testing.assert_array_equal(
+        unshuffle_bytes(shuffled, data.dtype).reshape(data.shape), data
+    )
+
+
+@pytest.mark.parametrize("compression", ["zlib", "none"])
+@pytest.mark.parametrize("chunk_rows", [1, 7, 64, 500])
+@pytest.mark.parametrize("shuffle", [None, False])
+def test_round_trip(compression, chunk_rows, shuffle):
+    frame = detector_frame()
+    encoded = encode_frame(frame, compression, chunk_rows, shuffle)
+    assert len(encoded.offsets) == -(-200 // chunk_rows) + 1
+    assert encoded.offsets[-1] == len(encoded.data)
+    decoded = decode_frame(
+        encoded.data,
+        list(encoded.shape),
+        encoded.dtype,
+        encoded.compression,
+        encoded.chunk_rows,
+        list(encoded.offsets),
+        encoded.shuffle,
+    )
+    assert decoded.dtype == frame.dtype
+    np.testing.assert_array_equal(decoded, frame)
+
+
+@pytest.mark.parametrize("shape", [(0, 5), (1, 1), (5,), (3, 4, 2)])
+def test_shapes(shape):
+    frame = np.arange(int(np.prod(shape)), dtype=np.uint16).reshape(shape)
+    encoded = encode_frame(frame, chunk_rows=2)
+    np.testing.assert_array_equal(decode(encoded), np.atleast_2d(frame))
+
+
+def test_compression_ratio():
+    encoded = encode_frame(detector_frame())
+    assert encoded.ratio > 3
+    assert encoded.ratio > encode_frame(detector_frame(), shuffle=False).ratio
+    assert encode_frame(detector_frame(), "none").ratio == 1
+
+
+def test_partial_rows(monkeypatch):
+    frame = detector_frame()
+    encoded = encode_frame(frame, chunk_rows=16)
+    decompressed = []
+    decompress = codec._decompress
+
+    def counting(data, compression):
+        decompressed.append(len(data))
+        return decompress(data, compression)
+
+    monkeypatch.setattr(codec, "_decompress", counting)
+    for start, stop in [(0, 1), (15, 17), (30, 80), (190, 500), (199, None)]:
+        decompressed.clear()
+        rows = decode(encoded, start=start, stop=stop)
+        np.testing.assert_array_equal(rows, frame[start:stop])
+        stop = min(stop or 200, 200)
+        assert len(decompressed) == -(-stop // 16) - start // 16
+    assert decode(encoded, start=50, stop=50).shape == (0, 150)
+
+    # Only the bytes of the overlapping chunks need to be read.
+    first, last, byte_start, byte_stop = codec.chunk_range(encoded.offsets, 16, 30, 80)
+    assert (first, last) == (1, 5)
+    rows = decode_rows(
+        encoded.data[byte_start:byte_stop],
+        encoded.shape,
+        encoded.dtype,
+        "zlib",
+        16,
+        encoded.offsets,
+        30,
+        80,
+        data_offset=byte_start,
+    )
+    np.testing.assert_array_equal(rows, frame[30:80])
+
+
+def test_invalid():
+    encoded = encode_frame(detector_frame())
+    with pytest.raises(ValueError, match="version"):
+        decode(encoded, version=IMAGE_CODEC_VERSION + 1)
+    with pytest.raises(ValueError, match="does not match"):
+        decode_frame(
+            encoded.data, (200, 100), encoded.dtype, "zlib", 64, encoded.offsets
+        )
+    with pytest.raises(ValueError, match="compression"):
+        encode_frame(detector_frame(), "lz4")
+
+
+@pytest.fixture
+def blobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "root", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize("model", [ImageWAXS, ImageCalibrant, ImageGIWAXS])
+@pytest.mark.parametrize("compression", [None, "zlib", "none"])
+def test_models(blobs, model, compression):
+    frame = detector_frame()
+    image = model("a.edf", frame, compression)
+    assert image.image_compression == compression or model.default_compression
+    assert image.image_shape == [200, 150]
+    assert image.image_dtype == frame.dtype.str
+    np.testing.assert_array_equal(image.image, frame)
+    np.testing.assert_array_equal(image.read_rows(90, 120), frame[90:120])
+    np.testing.assert_array_equal(image.read_rows(190, 400), frame[190:])
+    if image.image_compression == "none":
+        # Uncompressed images are read-only memory maps of the blob.
+        assert isinstance(image.image, np.memmap)
+        assert not image.image.flags.writeable
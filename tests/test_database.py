@@ -0,0 +1,124 @@
+import asyncio
+import logging
+
+import pytest
+import sqlalchemy as sa
+
+from XSUI.webapp.fastapi import database
+from XSUI.webapp.fastapi.models import ImageBase, ImageIndex, MaskBase
+
+
+@pytest.fixture
+def engines(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        database, "DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path / 'test.db'}"
+    )
+    for name in ("_engine", "_async_engine", "_async_sessions"):
+        monkeypatch.setattr(database, name, None)
+    yield
+    if database._engine is not None:
+        database._engine.dispose()
+    if database._async_engine is not None:
+        asyncio.run(database._async_engine.dispose())
+
+
+def index_row(i: int) -> dict:
+    return {
+        "image_table": "waxs_images",
+        "image_id": i,
+        "filename": f"{i}.edf",
+        "digest": f"{i:032x}",
+        "rows": 10,
+        "cols": 10,
+        "dtype": "<i4",
+    }
+
+
+def test_sync_url():
+    assert database.sync_url("sqlite+aiosqlite:///a.db") == "sqlite:///a.db"
+    assert (
+        database.sync_url("postgresql+asyncpg://host/db")
+        == "postgresql+psycopg://host/db"
+    )
+
+
+@pytest.mark.parametrize(
+    "echo, level",
+    [
+        ("debug", logging.DEBUG),
+        ("true", logging.INFO),
+        (True, logging.INFO),
+        ("", logging.WARNING),
+    ],
+)
+def test_configure_logging(echo, level):
+    logger = logging.getLogger("sqlalchemy.engine")
+    previous = logger.level
+    try:
+        database.configure_logging(echo)
+        assert logger.level == level
+    finally:
+        logger.setLevel(previous)
+
+
+def test_engines(engines):
+    engine = database.get_engine()
+    assert database.get_engine() is engine
+    with engine.connect() as connection:
+        pragma = connection.exec_driver_sql("PRAGMA journal_mode").scalar()
+        assert pragma == "wal"
+        assert connection.exec_driver_sql("PRAGMA foreign_keys").scalar() == 1
+
+    async def async_pragmas():
+        async_engine = database.get_async_engine()
+        assert database.get_async_engine() is async_engine
+        async with async_engine.connect() as connection:
+            result = await connection.exec_driver_sql("PRAGMA busy_timeout")
+            return result.scalar()
+
+    assert asyncio.run(async_pragmas()) == database.SQLITE_PRAGMAS["busy_timeout"]
+
+
+def test_create_all(engines):
+    tables = asyncio.run(database.create_all([ImageBase, MaskBase]))
+    assert {"waxs_images", "image_index", "detector_masks"} <= set(tables)
+    assert set(tables) <= set(sa.inspect(database.get_engine()).get_table_names())
+
+
+def test_bulk_insert(engines):
+    asyncio.run(database.create_all([ImageBase]))
+    statements = []
+    sa.event.listen(
+        database.get_async_engine().sync_engine,
+        "before_cursor_execute",
+        lambda *args: statements.append(args[2]),
+    )
+    rows = [index_row(i) for i in range(25)]
+
+    async def insert() -> int:
+        async for session in database.get_session():
+            count = await database.bulk_insert(session, ImageIndex, rows, 10)
+            await session.commit()
+            return count
+
+    assert asyncio.run(insert()) == 25
+    assert sum("INSERT" in statement for statement in statements) == 3
+    with database.get_engine().connect() as connection:
+        total = connection.execute(sa.text("SELECT count(*) FROM image_index"))
+        assert total.scalar() == 25
+
+
+def test_session_rollback(engines):
+    asyncio.run(database.create_all([ImageBase]))
+
+    async def failing_request():
+        sessions = database.get_session()
+        session = await anext(sessions)
+        await session.execute(sa.insert(ImageIndex), [index_row(0)])
+        with pytest.raises(RuntimeError):
+            await sessions.athrow(RuntimeError("request failed"))
+
+    asyncio.run(failing_request())
+    with database.get_engine().connect() as connection:
+        total = connection.execute(sa.text("SELECT count(*) FROM image_index"))
+        assert total.scalar() == 0
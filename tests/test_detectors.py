@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from pyFAI.detectors import Pilatus2M
+
+from XSUI.detectors import (
+    detector_digest,
+    get_detector,
+    get_detector_mask,
+    precompute_detector_masks,
+    registry,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(registry, "MASK_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(registry, "_detectors", {})
+    monkeypatch.setattr(registry, "_masks", {})
+
+
+def test_detectors_are_shared():
+    assert get_detector("SAXS_WAXS") is get_detector("SAXS_WAXS")
+    assert get_detector("Pilatus1M") is get_detector("Pilatus1M")
+
+
+def test_beamline_mask():
+    mask = get_detector_mask("SAXS_WAXS")
+    np.testing.assert_array_equal(mask, Pilatus2M().mask)
+    assert mask is get_detector_mask("SAXS_WAXS")
+    assert not mask.flags.writeable
+    # The mask of the shared detector is left writeable.
+    assert get_detector("SAXS_WAXS").mask.flags.writeable
+
+
+def test_persisted_mask(tmp_path):
+    paths = precompute_detector_masks(["SAXS_WAXS"])
+    registry._masks.clear()
+    mask = get_detector_mask("SAXS_WAXS")
+    assert isinstance(mask, np.memmap)
+    assert paths["SAXS_WAXS"].startswith(str(tmp_path))
+    np.testing.assert_array_equal(mask, Pilatus2M().mask)
+
+
+def test_detector_digest():
+    assert detector_digest(Pilatus2M()) == detector_digest(Pilatus2M())
+    assert detector_digest(Pilatus2M()) != detector_digest(get_detector("Pilatus1M"))
+    binned = Pilatus2M()
+    binned.set_binning((2, 2))
+    assert detector_digest(binned) != detector_digest(Pilatus2M())
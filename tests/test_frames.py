@@ -0,0 +1,131 @@
+import fabio
+import h5py
+import numpy as np
+import pytest
+
+from XSUI.storage import open_frames
+from XSUI.storage.frames import FabioFrameSource, HDF5FrameSource, NpyFrameSource
+
+
+def stack(n: int = 5, dtype=np.int32) -> np.ndarray:
+    rng = np.random.default_rng(n)
+    return rng.integers(0, 1000, (n, 16, 24)).astype(dtype)
+
+
+def write_edf(path, frames: np.ndarray) -> str:
+    image = fabio.edfimage.EdfImage(data=frames[0], header={"Time": "12:00"})
+    for frame in frames[1:]:
+        image.append_frame(data=frame)
+    image.write(str(path))
+    return str(path)
+
+
+def check_frames(source, frames: np.ndarray, mapped: bool) -> None:
+    assert len(source) == len(frames)
+    assert source.shape == frames.shape[1:]
+    assert source.dtype == frames.dtype
+    for i in (0, len(frames) - 1, len(frames) // 2, -1):
+        frame = source[i]
+        np.testing.assert_array_equal(frame, frames[i])
+        assert not frame.flags.writeable
+        assert isinstance(frame, np.memmap) == mapped
+    np.testing.assert_array_equal(np.stack(list(source)), frames)
+    with pytest.raises(IndexError):
+        source[len(frames)]
+
+
+@pytest.mark.parametrize("dtype", [np.int32, np.uint16, np.float32])
+def test_npy(tmp_path, dtype):
+    frames = stack(dtype=dtype)
+    np.save(tmp_path / "stack.npy", frames)
+    with open_frames(str(tmp_path / "stack.npy")) as source:
+        assert isinstance(source, NpyFrameSource)
+        check_frames(source, frames, mapped=True)
+
+    np.save(tmp_path / "single.npy", frames[0])
+    with open_frames(str(tmp_path / "single.npy")) as source:
+        check_frames(source, frames[:1], mapped=True)
+
+
+@pytest.mark.parametrize("dtype", [np.int32, np.uint16, np.float32])
+def test_edf(tmp_path, dtype):
+    frames = stack(dtype=dtype)
+    with open_frames(write_edf(tmp_path / "stack.edf", frames)) as source:
+        assert isinstance(source, FabioFrameSource)
+        check_frames(source, frames, mapped=True)
+        assert source.header["Time"] == "12:00"
+
+    with open_frames(write_edf(tmp_path / "single.edf", frames[:1])) as source:
+        check_frames(source, frames[:1], mapped=True)
+
+
+def test_compressed_edf(tmp_path):
+    frames = stack(1)
+    path = str(tmp_path / "single.edf.gz")
+    fabio.edfimage.EdfImage(data=frames[0]).write(path)
+    with open_frames(path) as source:
+        check_frames(source, frames, mapped=False)
+
+
+def test_hdf5(tmp_path):
+    frames = stack(6)
+    with h5py.File(tmp_path / "contiguous.h5", "w") as f:
+        f["entry/instrument/detector/mask"] = np.zeros((16, 24), np.uint8)
+        f["scan/images"] = frames
+    with open_frames(str(tmp_path / "contiguous.h5")) as source:
+        assert isinstance(source, HDF5FrameSource)
+        check_frames(source, frames, mapped=True)
+
+    with h5py.File(tmp_path / "compressed.h5", "w") as f:
+        f.create_dataset("images", data=frames, chunks=(1, 16, 24), compression="gzip")
+    with open_frames(str(tmp_path / "compressed.h5")) as source:
+        check_frames(source, frames, mapped=False)
+
+
+def test_eiger_master(tmp_path):
+    # A master file linking to data files, one of which is missing. The linked
+    # datasets are contiguous, so are memory-mapped from the data files.
+    frames = stack(7)
+    for i, part in enumerate((frames[:4], frames[4:])):
+        with h5py.File(tmp_path / f"scan_data_00000{i + 1}.h5", "w") as f:
+            f["entry/data/data"] = part
+    with h5py.File(tmp_path / "scan_master.h5", "w") as f:
+        for i in (1, 2, 3):
+            f[f"entry/data/data_00000{i}"] = h5py.ExternalLink(
+                f"scan_data_00000{i}.h5", "entry/data/data"
+            )
+    with open_frames(str(tmp_path / "scan_master.h5")) as source:
+        check_frames(source, frames, mapped=True)
+    with open_frames(
+        str(tmp_path / "scan_master.h5"), dataset="entry/data/data_000002"
+    ) as source:
+        check_frames(source, frames[4:], mapped=True)
+
+
+def test_no_datasets(tmp_path):
+    with h5py.File(tmp_path / "empty.h5", "w") as f:
+        f["values"] = np.arange(10)
+    with pytest.raises(ValueError, match="No image datasets"):
+        open_frames(str(tmp_path / "empty.h5"))
+
+
+def test_decoded_frame_cache(tmp_path):
+    frames = stack(6)
+    with h5py.File(tmp_path / "compressed.h5", "w") as f:
+        f.create_dataset("images", data=frames, chunks=(1, 16, 24), compression="gzip")
+    with open_frames(str(tmp_path / "compressed.h5"), cache_size=2) as source:
+        first = source[0]
+        assert source[0] is first
+        source[1]
+        source[0]
+        source[2]
+        # The least recently used frame (1) is evicted.
+        assert list(source._cache) == [0, 2]
+        assert source[0] is first
+        source[1]
+        assert list(source._cache) == [0, 1]
+    assert source._cache == {}
+
+    with open_frames(str(tmp_path / "compressed.h5"), cache_size=0) as source:
+        source[0]
+        assert not source._cache
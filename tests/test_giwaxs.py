@@ -0,0 +1,177 @@
+import numpy as np
+import pyFAI.detectors
+import pyFAI.units
+import pytest
+from pyFAI.integrator.azimuthal import AzimuthalIntegrator
+from pyFAI.io.ponifile import PoniFile
+
+from XSUI.experiment.config_giwaxs import ConfigGIWAXS
+from XSUI.geometry.giwaxs import (
+    GIWAXSRemapper,
+    RemapperCache,
+    get_remapper,
+    q_sample,
+)
+
+SHAPE = (60, 80)
+
+
+def detector() -> pyFAI.detectors.Detector:
+    return pyFAI.detectors.Detector(pixel1=1e-4, pixel2=1e-4, max_shape=SHAPE)
+
+
+def poni() -> PoniFile:
+    return PoniFile(
+        {
+            "dist": 0.05,
+            "poni1": 0.002,
+            "poni2": 0.003,
+            "rot1": 0.05,
+            "rot2": -0.03,
+            "wavelength": 1e-10,
+            "detector": detector(),
+        }
+    )
+
+
+def integrator() -> AzimuthalIntegrator:
+    return AzimuthalIntegrator(
+        dist=0.05,
+        poni1=0.002,
+        poni2=0.003,
+        rot1=0.05,
+        rot2=-0.03,
+        detector=detector(),
+        wavelength=1e-10,
+    )
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+@pytest.mark.parametrize("incidence, tilt", [(0.2, 0.0), (2.0, 5.0)])
+def test_q_sample(orientation, incidence, tilt):
+    q_ip, q_oop = q_sample(integrator(), incidence, tilt, orientation)
+    assert q_ip.shape == q_oop.shape == SHAPE
+    for name, values in (("qip_nm^-1", q_ip), ("qoop_nm^-1", q_oop)):
+        unit = pyFAI.units.get_unit_fiber(
+            name,
+            incident_angle=np.radians(incidence),
+            tilt_angle=np.radians(tilt),
+            sample_orientation=orientation,
+        )
+        # pyFAI caches the arrays by unit name, so each unit needs a new geometry.
+        expected = integrator().array_from_unit(unit=unit, typ="center", scale=True)
+        np.testing.assert_allclose(values, expected, atol=1e-12)
+    with pytest.raises(ValueError):
+        q_sample(integrator(), incidence, tilt, 9)
+
+
+@pytest.mark.parametrize("split", ["none", "bilinear"])
+def test_remap_uniform(split):
+    ai = integrator()
+    solid_angle = ai.solidAngleArray()
+    remapper = GIWAXSRemapper(
+        *q_sample(ai, 0.2), solid_angle, npt=(20, 30), split=split
+    )
+    assert remapper.matrix.shape == (600, 60 * 80)
+    # A solid-angle scaled uniform scatterer remaps to a uniform intensity.
+    result = remapper.remap(7.0 * solid_angle)
+    assert result.intensity.shape == (20, 30)
+    assert result.q_oop.shape == (20,) and result.q_ip.shape == (30,)
+    filled = np.isfinite(result.intensity)
+    assert filled.mean() > 0.5
+    np.testing.assert_allclose(result.intensity[filled], 7.0, rtol=1e-5)
+    assert result.extent == (
+        result.q_ip[0],
+        result.q_ip[-1],
+        result.q_oop[0],
+        result.q_oop[-1],
+    )
+
+
+def test_remap_split():
+    q_map = q_sample(integrator(), 0.2)
+    none = GIWAXSRemapper(*q_map, None, npt=(20, 30), split="none")
+    bilinear = GIWAXSRemapper(*q_map, None, npt=(20, 30), split="bilinear")
+    # Each pixel is added to one bin, or split between four.
+    assert none.matrix.nnz <= 60 * 80 < bilinear.matrix.nnz
+    np.testing.assert_allclose(none.matrix.sum(axis=0), 1.0)
+    np.testing.assert_allclose(bilinear.matrix.sum(axis=0), 1.0, rtol=1e-6)
+    frame = np.random.default_rng(0).random(SHAPE)
+    for remapper in (none, bilinear):
+        intensity = remapper.remap(frame).intensity
+        filled = np.isfinite(intensity)
+        assert frame.min() <= intensity[filled].min()
+        assert intensity[filled].max() <= frame.max()
+    with pytest.raises(ValueError):
+        GIWAXSRemapper(*q_map, None, split="full")
+
+
+def test_remap_stack():
+    ai = integrator()
+    remapper = GIWAXSRemapper(*q_sample(ai, 0.5), ai.solidAngleArray(), npt=(15, 25))
+    frames = np.random.default_rng(0).integers(0, 1000, (3, *SHAPE), dtype=np.int32)
+    stacked = remapper.remap(frames).intensity
+    assert stacked.shape == (3, 15, 25)
+    for frame, intensity in zip(frames, stacked):
+        np.testing.assert_allclose(
+            remapper.remap(frame).intensity, intensity, rtol=1e-6, equal_nan=True
+        )
+    with pytest.raises(ValueError, match="do not match"):
+        remapper.remap(frames[:, :50])
+
+
+def test_remap_mask():
+    q_map = q_sample(integrator(), 0.2)
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[:, :40] = True
+    remapper = GIWAXSRemapper(*q_map, None, mask, npt=(20, 30), split="none")
+    assert remapper.matrix[:, np.flatnonzero(mask)].nnz == 0
+    # Masked pixels do not contribute, even when they are NaN.
+    frame = np.ones(SHAPE)
+    frame[mask] = np.nan
+    intensity = remapper.remap(frame).intensity
+    filled = np.isfinite(intensity)
+    assert filled.any()
+    np.testing.assert_allclose(intensity[filled], 1.0, rtol=1e-6)
+
+
+def test_remap_ranges():
+    q_map = q_sample(integrator(), 0.2)
+    remapper = GIWAXSRemapper(
+        *q_map, None, npt=(11, 21), q_ip_range=(-1, 1), q_oop_range=(0, 1)
+    )
+    np.testing.assert_allclose(remapper.q_ip, np.linspace(-1, 1, 21))
+    np.testing.assert_allclose(remapper.q_oop, np.linspace(0, 1, 11))
+
+
+def test_remapper_cache(monkeypatch):
+    cache = RemapperCache(maxsize=2)
+    remapper = cache.get(poni(), detector(), 0.2, npt=(20, 30))
+    assert cache.get(poni(), detector(), 0.2, npt=(20, 30)) is remapper
+    assert len(cache) == 1
+
+    # Remappers of other grids and masks share the pixel q maps of the geometry.
+    calls = []
+    monkeypatch.setattr(
+        "XSUI.geometry.giwaxs.q_sample", lambda *args: calls.append(args)
+    )
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[0] = True
+    masked = cache.get(poni(), detector(), 0.2, mask=mask, npt=(20, 30))
+    assert masked is not remapper and calls == []
+    assert cache.get(poni(), detector(), 0.2, split="none") is not remapper
+    assert calls == [] and len(cache) == 2
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_get_remapper():
+    cache = RemapperCache()
+    config = ConfigGIWAXS(poni=poni(), angle_incidence=0.3, orientation=2)
+    remapper = get_remapper(config, npt=(10, 10), cache=cache)
+    assert get_remapper(config, npt=(10, 10), cache=cache) is remapper
+    q_ip, q_oop = q_sample(integrator(), 0.3, 0.0, 2)
+    assert remapper.q_ip_range == (q_ip.min(), q_ip.max())
+    assert remapper.q_oop_range == (q_oop.min(), q_oop.max())
+    with pytest.raises(ValueError, match="PONI"):
+        get_remapper(ConfigGIWAXS(), cache=cache)
@@ -0,0 +1,140 @@
+import h5py
+import numpy as np
+import pyFAI.detectors
+import pytest
+from pyFAI.io.ponifile import PoniFile
+
+from XSUI.experiment.config_giwaxs import ConfigGIWAXS
+from XSUI.experiment.giwaxs_series import (
+    GIWAXSSeries,
+    SeriesFrame,
+    remap_series,
+    snap,
+)
+from XSUI.geometry.giwaxs import RemapperCache, get_remapper
+
+SHAPE = (40, 50)
+
+
+@pytest.fixture
+def config() -> ConfigGIWAXS:
+    detector = pyFAI.detectors.Detector(pixel1=1e-4, pixel2=1e-4, max_shape=SHAPE)
+    poni = PoniFile(
+        {
+            "dist": 0.05,
+            "poni1": 0.001,
+            "poni2": 0.002,
+            "wavelength": 1e-10,
+            "detector": detector,
+        }
+    )
+    return ConfigGIWAXS(poni=poni)
+
+
+def frame(incidence: float, seed: int, **kwargs) -> SeriesFrame:
+    data = np.random.default_rng(seed).integers(0, 1000, SHAPE).astype(np.float32)
+    return SeriesFrame(incidence, data=data, path=f"{seed}.edf", **kwargs)
+
+
+def test_snap():
+    assert snap(0.12049, 1e-3) == 0.12
+    assert snap(0.20001, 1e-3) == snap(0.19999, 1e-3) == 0.2
+    assert snap(-0.3004, 1e-3) == -0.3
+    assert snap(0.123456, 0) == 0.123456
+
+
+def test_groups(config):
+    frames = [
+        frame(0.3, 0),
+        frame(0.1, 1),
+        frame(0.1002, 2),
+        frame(0.1, 3, angle_tilt=0.5),
+        frame(0.1, 4, orientation=2),
+        frame(0.2998, 5),
+    ]
+    series = GIWAXSSeries(config, frames, batch_size=2)
+    # Frames are snapped within the tolerance, and sorted by their snapped angles.
+    assert [f.path for f in series.frames] == [
+        "1.edf",
+        "2.edf",
+        "4.edf",
+        "3.edf",
+        "0.edf",
+        "5.edf",
+    ]
+    assert series.groups() == {
+        (0.1, 0.0, 1): [0, 1],
+        (0.1, 0.0, 2): [2],
+        (0.1, 0.5, 1): [3],
+        (0.3, 0.0, 1): [4, 5],
+    }
+    assert len(GIWAXSSeries(config, frames, tolerance=0).groups()) == 6
+    assert len(GIWAXSSeries(config, frames, tolerance=0.1).groups()) == 4
+    series = GIWAXSSeries(config, frames * 3, batch_size=4)
+    assert [len(indices) for _, indices in series.batches()] == [4, 2, 3, 3, 4, 2]
+
+
+def test_grid_ranges(config):
+    frames = [frame(i / 10, i) for i in range(1, 6)]
+    series = GIWAXSSeries(config, frames, npt=(20, 30))
+    q_ip_range, q_oop_range = series.grid_ranges()
+    for f in frames:
+        remapper = get_remapper(
+            ConfigGIWAXS(poni=config.poni, angle_incidence=f.angle_incidence),
+            npt=(20, 30),
+            cache=RemapperCache(),
+        )
+        assert q_ip_range[0] <= remapper.q_ip_range[0] + 1e-9
+        assert remapper.q_ip_range[1] <= q_ip_range[1] + 1e-9
+        assert q_oop_range[0] <= remapper.q_oop_range[0] + 1e-9
+        assert remapper.q_oop_range[1] <= q_oop_range[1] + 1e-9
+    fixed = GIWAXSSeries(config, frames, q_ip_range=(-1, 1), q_oop_range=(0, 2))
+    assert fixed.grid_ranges() == ((-1, 1), (0, 2))
+
+
+def test_run(config, tmp_path):
+    frames = [frame(0.1, 0), frame(0.3, 1), frame(0.1001, 2), frame(0.2, 3)]
+    frames.append(SeriesFrame(0.2, path=str(tmp_path / "missing.edf")))
+    reports = []
+    series = GIWAXSSeries(config, frames, npt=(20, 30), batch_size=1, workers=2)
+    progress = series.run(str(tmp_path / "series.h5"), reports.append)
+    assert progress.frames_total == 5 and progress.frames_done == 4
+    assert progress.groups == 3
+    assert list(progress.errors) == [str(tmp_path / "missing.edf")]
+    assert reports[-1] is progress
+
+    q_ip_range, q_oop_range = series.grid_ranges()
+    with h5py.File(tmp_path / "series.h5") as f:
+        intensity = f["intensity"][()]
+        assert intensity.shape == (5, 20, 30)
+        np.testing.assert_allclose(
+            f["angle_incidence"][()], [0.1, 0.1001, 0.2, 0.2, 0.3]
+        )
+        assert f["source"].asstr()[0] == "0.edf"
+        np.testing.assert_allclose(f["q_ip"][()], np.linspace(*q_ip_range, 30))
+    # Each frame is remapped at its snapped angles, onto the common grid.
+    for i, f in enumerate(series.frames):
+        if f.data is None:
+            assert np.isnan(intensity[i]).all()
+            continue
+        remapper = get_remapper(
+            ConfigGIWAXS(poni=config.poni, angle_incidence=round(f.angle_incidence, 3)),
+            npt=(20, 30),
+            q_ip_range=q_ip_range,
+            q_oop_range=q_oop_range,
+            cache=RemapperCache(),
+        )
+        np.testing.assert_allclose(
+            intensity[i], remapper.remap(f.data).intensity, rtol=1e-5, equal_nan=True
+        )
+
+
+def test_remap_series(config, tmp_path):
+    frames = [frame(0.1, 0), frame(0.2, 1)]
+    progress = remap_series(
+        config, frames, str(tmp_path / "series.h5"), None, npt=(10, 10), workers=1
+    )
+    assert progress.frames_done == 2 and not progress.errors
+    assert "2/2 frames, 2 angles" in str(progress)
+    with h5py.File(tmp_path / "series.h5") as f:
+        assert f["intensity"].shape == (2, 10, 10)
@@ -0,0 +1,143 @@
+import io
+
+import fabio
+import numpy as np
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+
+from XSUI.webapp.fastapi.models import (
+    ImageBase,
+    ImageCalibrant,
+    ImageGIWAXS,
+    ImageWAXS,
+    index_missing_images,
+    ingest_image,
+    migrate_image_tables,
+    page_index,
+)
+
+BASELINE_SCHEMA = (
+    """
+    CREATE TABLE waxs_images (
+        id INTEGER NOT NULL,
+        filename VARCHAR(255) NOT NULL,
+        image_data BLOB NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (filename)
+    )
+    """,
+    """
+    CREATE TABLE calibrant_images (
+        id INTEGER NOT NULL,
+        filename VARCHAR(255) NOT NULL,
+        image_data BLOB NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (filename)
+    )
+    """,
+    """
+    CREATE TABLE giwaxs_images (
+        id INTEGER NOT NULL,
+        filename VARCHAR(255) NOT NULL,
+        angle_incidence FLOAT NOT NULL,
+        angle_tilt FLOAT NOT NULL,
+        orientation INTEGER,
+        image_data BLOB NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (filename)
+    )
+    """,
+)
+"""The image tables as created by releases before the blob store."""
+
+
+def frame(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 1000, (16, 24), dtype=np.int32)
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    npy = io.BytesIO()
+    np.save(npy, frame(1))
+    fabio.edfimage.EdfImage(data=frame(2)).write(str(tmp_path / "c.edf"))
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.execute(sa.text(statement))
+        insert = "INSERT INTO {} (id, filename, image_data) VALUES (1, :name, :data)"
+        connection.execute(
+            sa.text(insert.format("waxs_images")),
+            {"name": "a.edf", "data": frame(0).dumps()},
+        )
+        connection.execute(
+            sa.text(insert.format("calibrant_images")),
+            {"name": "b.npy", "data": npy.getvalue()},
+        )
+        connection.execute(
+            sa.text(
+                "INSERT INTO giwaxs_images (id, filename, angle_incidence, "
+                "angle_tilt, image_data) VALUES (1, 'c.edf', 0.2, 0.0, :data)"
+            ),
+            {"data": (tmp_path / "c.edf").read_bytes()},
+        )
+    yield engine
+    engine.dispose()
+
+
+def test_migrate_image_tables(legacy_engine):
+    with legacy_engine.begin() as connection:
+        migrated = migrate_image_tables(connection)
+        ImageBase.metadata.create_all(connection)
+    assert sorted(migrated) == ["calibrant_images", "giwaxs_images", "waxs_images"]
+
+    with orm.Session(legacy_engine) as session:
+        for model, seed in ((ImageWAXS, 0), (ImageCalibrant, 1), (ImageGIWAXS, 2)):
+            image = session.get(model, 1)
+            np.testing.assert_array_equal(image.image, frame(seed))
+            assert image.image_compression == model.default_compression
+        assert session.get(ImageGIWAXS, 1).angle_incidence == 0.2
+
+        # New images can be added once `image_data` is dropped.
+        session.add(ImageWAXS("d.edf", frame(3)))
+        session.commit()
+
+    columns = sa.inspect(legacy_engine).get_columns("waxs_images")
+    assert "image_data" not in {column["name"] for column in columns}
+    with legacy_engine.begin() as connection:
+        assert migrate_image_tables(connection) == []
+
+
+def test_migrated_images_are_indexed(legacy_engine):
+    with legacy_engine.begin() as connection:
+        migrate_image_tables(connection)
+        ImageBase.metadata.create_all(connection)
+        assert index_missing_images(connection) == 3
+        assert index_missing_images(connection) == 0
+
+    with orm.Session(legacy_engine) as session:
+        entries, total = page_index(session, ImageCalibrant.__tablename__)
+        assert total == 1
+        assert (entries[0].filename, entries[0].image_id) == ("b.npy", 1)
+        # Re-uploading a migrated image finds the stored image.
+        entry = ingest_image(session, ImageCalibrant("b2.npy", frame(1)), frame(1))
+        assert entry.id == entries[0].id
+        session.commit()
+        assert session.scalar(sa.select(sa.func.count(ImageCalibrant.id))) == 1
+
+
+def test_migrate_unreadable_image(legacy_engine):
+    with legacy_engine.begin() as connection:
+        connection.execute(
+            sa.text(
+                "INSERT INTO waxs_images (id, filename, image_data) "
+                "VALUES (2, 'e.edf', :data)"
+            ),
+            {"data": b"not an image"},
+        )
+    with pytest.raises(ValueError, match="e.edf"):
+        with legacy_engine.begin() as connection:
+            migrate_image_tables(connection)
+    # The failed migration is rolled back.
+    columns = sa.inspect(legacy_engine).get_columns("waxs_images")
+    assert "image_data" in {column["name"] for column in columns}
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from XSUI.storage import ImageStore, image_digest
+
+
+def image(seed: int, shape=(32, 32)) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 1000, shape, dtype=np.int32)
+
+
+def test_digest():
+    data = image(0)
+    assert image_digest(data) == image_digest(data.copy())
+    assert image_digest(data) != image_digest(data.astype(np.int64))
+    assert image_digest(data) != image_digest(data.reshape(16, 64))
+    # Non-contiguous arrays hash by their contents.
+    assert image_digest(data.T) == image_digest(np.ascontiguousarray(data.T))
+
+
+def test_put_get():
+    store = ImageStore()
+    data = image(0)
+    key = store.put(data)
+    stored = store.get(key)
+    assert np.shares_memory(stored, data)
+    assert not stored.flags.writeable
+    # The caller's array stays writeable.
+    assert data.flags.writeable
+    assert store.put(data.copy()) == key
+    assert len(store) == 1
+    with pytest.raises(KeyError):
+        store.get("missing")
+
+
+def test_eviction_by_bytes():
+    nbytes = image(0).nbytes
+    store = ImageStore(max_bytes=2 * nbytes)
+    keys = [store.put(image(i)) for i in range(3)]
+    assert keys[0] not in store
+    assert store.nbytes == 2 * nbytes
+    # Getting an image marks it as recently used.
+    store.get(keys[1])
+    store.put(image(3))
+    assert keys[1] in store and keys[2] not in store
+
+
+def test_eviction_keeps_oversized_image():
+    store = ImageStore(max_bytes=16)
+    key = store.put(image(0))
+    np.testing.assert_array_equal(store.get(key), image(0))
+
+
+def test_spill(tmp_path):
+    nbytes = image(0).nbytes
+    store = ImageStore(max_bytes=nbytes, spill_dir=str(tmp_path))
+    first = store.put(image(0))
+    store.put(image(1))
+    assert store.nbytes == nbytes
+    assert first in store
+    spilled = store.get(first)
+    assert isinstance(spilled, np.memmap)
+    np.testing.assert_array_equal(spilled, image(0))
+    store.discard(first)
+    assert first not in store
+    assert not (tmp_path / f"{first}.npy").exists()
@@ -0,0 +1,104 @@
+import threading
+
+import numpy as np
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+
+from XSUI.webapp.fastapi.models import index
+from XSUI.webapp.fastapi.models.images import ImageBase, ImageWAXS
+from XSUI.webapp.fastapi.models.index import (
+    FrameIndexer,
+    ImageIndex,
+    ingest_image,
+    page_index,
+)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'index.db'}")
+    ImageBase.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def frame(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 1000, (16, 24), dtype=np.int32)
+
+
+def test_ingest_image_is_paged(engine):
+    data = frame(0)
+    with orm.Session(engine, expire_on_commit=False) as session:
+        entry = ingest_image(session, ImageWAXS("a.edf", data), data)
+        session.commit()
+
+    with orm.Session(engine) as session:
+        entries, total = page_index(session, ImageWAXS.__tablename__)
+        assert total == 1
+        assert entries[0].id == entry.id
+        assert entries[0].filename == "a.edf"
+        assert (entries[0].rows, entries[0].cols) == data.shape
+        assert entries[0].maximum == data.max()
+        assert session.get(ImageWAXS, entries[0].image_id).filename == "a.edf"
+
+
+def test_ingest_image_deduplicates(engine):
+    first, second = frame(0), frame(1)
+    with orm.Session(engine, expire_on_commit=False) as session:
+        entry = ingest_image(session, ImageWAXS("a.edf", first), first)
+        again = ingest_image(session, ImageWAXS("b.edf", first), first)
+        renamed = ingest_image(session, ImageWAXS("a.edf", second), second)
+        session.commit()
+
+    assert again.id == entry.id
+    assert renamed.filename.startswith("a.edf (")
+    with orm.Session(engine) as session:
+        assert session.scalar(sa.select(sa.func.count(ImageWAXS.id))) == 2
+        _, total = page_index(session, ImageWAXS.__tablename__)
+        assert total == 2
+
+
+def test_concurrent_ingests(engine):
+    # Both ingests find no stored image, then insert it at the same time.
+    barrier = threading.Barrier(2, timeout=5)
+
+    @sa.event.listens_for(engine, "before_cursor_execute")
+    def wait_for_insert(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO waxs_images"):
+            barrier.wait()
+
+    data = frame(0)
+    entries = []
+
+    def ingest(filename: str) -> None:
+        with orm.Session(engine, expire_on_commit=False) as session:
+            entries.append(ingest_image(session, ImageWAXS(filename, data), data))
+            session.commit()
+
+    threads = [threading.Thread(target=ingest, args=(f"{i}.edf",)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(entries) == 2
+    assert entries[0].id == entries[1].id
+    with orm.Session(engine) as session:
+        assert session.scalar(sa.select(sa.func.count(ImageWAXS.id))) == 1
+        assert session.scalar(sa.select(sa.func.count(ImageIndex.id))) == 1
+
+
+def test_frame_indexer(engine, monkeypatch):
+    monkeypatch.setattr(index, "get_engine", lambda: engine)
+    indexer = FrameIndexer(ImageWAXS)
+    indexer("series.h5", 0, 2, frame(0))
+    indexer("series.h5", 1, 2, frame(1))
+
+    with orm.Session(engine) as session:
+        entries, total = page_index(
+            session, ImageWAXS.__tablename__, filters=[("filename", "contains", ":1")]
+        )
+        assert total == 1
+        assert entries[0].filename == "series.h5:1"
+        assert session.scalar(sa.select(sa.func.count(ImageIndex.id))) == 2
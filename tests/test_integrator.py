@@ -0,0 +1,154 @@
+import os
+
+import numpy as np
+import pyFAI.detectors
+import pytest
+from pyFAI.integrator.azimuthal import AzimuthalIntegrator
+from pyFAI.io.ponifile import PoniFile
+
+from XSUI.experiment.config_base import ConfigBase
+from XSUI.geometry import IntegratorCache, get_integrator
+from XSUI.geometry.integrator import (
+    _worker_environment,
+    detector_key,
+    geometry_key,
+    mask_digest,
+)
+
+SHAPE = (64, 48)
+
+
+def make_poni(dist: float = 0.1, **kwargs) -> PoniFile:
+    detector = pyFAI.detectors.Detector(pixel1=1e-4, pixel2=1e-4, max_shape=SHAPE)
+    config = {"dist": dist, "poni1": 0.003, "poni2": 0.002, "wavelength": 1e-10}
+    return PoniFile({**config, **kwargs, "detector": detector})
+
+
+@pytest.fixture
+def poni() -> PoniFile:
+    return make_poni()
+
+
+@pytest.fixture
+def frame() -> np.ndarray:
+    return np.random.default_rng(0).random(SHAPE, dtype=np.float32) * 100
+
+
+def test_keys(poni):
+    assert geometry_key(poni) == geometry_key(make_poni())
+    assert geometry_key(poni) != geometry_key(make_poni(dist=0.2))
+    assert geometry_key(poni) != geometry_key(make_poni(rot1=0.01))
+    assert detector_key(poni.detector) == detector_key(make_poni().detector)
+    assert detector_key(poni.detector) != detector_key(pyFAI.detectors.Pilatus1M())
+
+    mask = np.zeros(SHAPE, dtype=bool)
+    assert mask_digest(None) is None
+    assert mask_digest(mask) == mask_digest(mask.astype(np.int8))
+    assert mask_digest(mask) != mask_digest(mask.ravel())
+    mask[3, 4] = True
+    assert mask_digest(mask) != mask_digest(np.zeros(SHAPE, dtype=bool))
+
+
+def test_reuse(poni):
+    cache = IntegratorCache()
+    integrator = cache.get(poni, poni.detector, npt=100)
+    assert cache.get(make_poni(), poni.detector, npt=100) is integrator
+    mask = np.zeros(SHAPE, dtype=bool)
+    masked = cache.get(poni, poni.detector, mask, npt=100)
+    assert masked is not integrator
+    assert cache.get(poni, poni.detector, mask.copy(), npt=100) is masked
+    for kwargs in ({"npt": 200}, {"unit": "2th_deg"}, {"npt_azim": 90}):
+        other = cache.get(poni, poni.detector, **{"npt": 100, **kwargs})
+        assert other is not integrator
+    assert cache.get(make_poni(dist=0.2), poni.detector, npt=100) is not integrator
+    assert len(cache) == 6
+
+
+def test_separate_engines(poni, frame):
+    cache = IntegratorCache()
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[:10] = True
+    plain = cache.get(poni, poni.detector, npt=100)
+    masked = cache.get(poni, poni.detector, mask, npt=100)
+    # Each integrator has its own engines, sharing the pixel positions.
+    assert plain.ai is not masked.ai
+    assert plain.ai._cached_array is masked.ai._cached_array
+
+    plain.integrate1d(frame)
+    engines = dict(plain.ai.engines)
+    masked.integrate1d(frame)
+    plain.integrate1d(frame)
+    assert dict(plain.ai.engines) == engines
+    for key, engine in engines.items():
+        assert plain.ai.engines[key] is engine
+
+
+def test_matches_pyfai(poni, frame):
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[20:30, 10:20] = True
+    integrator = IntegratorCache().get(poni, poni.detector, mask, npt=100, npt_azim=36)
+    ai = AzimuthalIntegrator(
+        dist=0.1, poni1=0.003, poni2=0.002, detector=poni.detector, wavelength=1e-10
+    )
+    expected = ai.integrate1d(
+        frame, 100, mask=mask, unit="q_nm^-1", method=("bbox", "csr", "cython")
+    )
+    result = integrator.integrate1d(frame)
+    np.testing.assert_allclose(result.radial, expected.radial)
+    np.testing.assert_allclose(result.intensity, expected.intensity, rtol=1e-5)
+
+    expected = ai.integrate2d(
+        frame, 100, 36, mask=mask, unit="q_nm^-1", method=("bbox", "csr", "cython")
+    )
+    result = integrator.integrate2d(frame)
+    np.testing.assert_allclose(result.intensity, expected.intensity, rtol=1e-5)
+
+
+def test_read_only_frame(poni, frame):
+    integrator = IntegratorCache().get(poni, poni.detector, npt=100)
+    expected = integrator.integrate1d(frame).intensity
+    frame.flags.writeable = False
+    np.testing.assert_array_equal(integrator.integrate1d(frame).intensity, expected)
+
+
+def test_warm(poni):
+    integrator = IntegratorCache().get(poni, poni.detector, npt=100, npt_azim=36)
+    assert integrator.warm(3) is integrator
+    assert len(integrator.ai.engines) == 2
+
+
+def test_lru(poni):
+    cache = IntegratorCache(maxsize=2)
+    first = cache.get(poni, poni.detector, npt=10)
+    second = cache.get(poni, poni.detector, npt=20)
+    assert cache.get(poni, poni.detector, npt=10) is first
+    cache.get(poni, poni.detector, npt=30)
+    assert len(cache) == 2
+    assert cache.get(poni, poni.detector, npt=10) is first
+    assert cache.get(poni, poni.detector, npt=20) is not second
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_get_integrator(poni):
+    cache = IntegratorCache()
+    integrator = get_integrator(ConfigBase(poni=poni), npt=100, cache=cache)
+    assert integrator.ai.detector is poni.detector
+    config = ConfigBase(detector=poni.detector, poni=poni)
+    assert get_integrator(config, npt=100, cache=cache) is integrator
+    with pytest.raises(ValueError, match="PONI"):
+        get_integrator(ConfigBase(detector=poni.detector), cache=cache)
+
+
+def test_worker_environment(monkeypatch):
+    monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+    with _worker_environment():
+        with _worker_environment():
+            assert os.environ["OMP_NUM_THREADS"] == "1"
+        assert os.environ["OMP_NUM_THREADS"] == "1"
+    assert "OMP_NUM_THREADS" not in os.environ
+
+    monkeypatch.setenv("OMP_NUM_THREADS", "4")
+    with _worker_environment():
+        assert os.environ["OMP_NUM_THREADS"] == "4"
+    assert os.environ["OMP_NUM_THREADS"] == "4"
@@ -0,0 +1,158 @@
+import numpy as np
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+
+from XSUI.masks.algebra import (
+    MaskCache,
+    MaskDifference,
+    MaskIntersection,
+    MaskLeaf,
+    MaskUnion,
+)
+from XSUI.webapp.fastapi.models import (
+    CompositeMask,
+    CustomMask,
+    DetectorMask,
+    MaskBase,
+)
+
+
+def random_mask(seed: int, shape=(20, 30)) -> np.ndarray:
+    return np.random.default_rng(seed).random(shape) < 0.3
+
+
+def counting_leaf(key, mask: np.ndarray, calls: list) -> MaskLeaf:
+    def loader():
+        calls.append(key)
+        return mask
+
+    return MaskLeaf(key, loader)
+
+
+@pytest.fixture
+def cache():
+    return MaskCache()
+
+
+def test_operators(cache):
+    a, b, c = (random_mask(seed) for seed in range(3))
+    la, lb, lc = (MaskLeaf.from_array(m) for m in (a, b, c))
+    np.testing.assert_array_equal((la | lb | lc).materialize(cache), a | b | c)
+    np.testing.assert_array_equal((la & lb).materialize(cache), a & b)
+    np.testing.assert_array_equal((la - lb).materialize(cache), a & ~b)
+    np.testing.assert_array_equal(((la | lb) - lc).materialize(cache), (a | b) & ~c)
+    np.testing.assert_array_equal(
+        MaskIntersection(la | lb, lc).materialize(cache), (a | b) & c
+    )
+
+
+def test_keys():
+    la, lb, lc = (MaskLeaf(name, None) for name in "abc")
+    # Nested unions are flattened, and operand order is irrelevant.
+    assert (la | (lb | lc)).key == MaskUnion(lc, lb, la).key
+    assert len((la | lb | lc).operands) == 3
+    assert (la & lb).key == (lb & la).key
+    assert (la | lb).key != (la & lb).key
+    assert (la - lb).key != (lb - la).key
+    with pytest.raises(ValueError):
+        MaskUnion()
+
+
+def test_materialize_once(cache):
+    calls = []
+    a = counting_leaf("a", random_mask(0), calls)
+    b = counting_leaf("b", random_mask(1), calls)
+    first = MaskUnion(a, b).materialize(cache)
+    assert not first.flags.writeable
+    for _ in range(100):
+        assert MaskUnion(b, a).materialize(cache) is first
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_cached_operands_reused(cache):
+    calls = []
+    a = counting_leaf("a", random_mask(0), calls)
+    b = counting_leaf("b", random_mask(1), calls)
+    a.materialize(cache)
+    MaskDifference(a, b).materialize(cache)
+    assert calls == ["a", "b"]
+    # Operands evaluated within an expression are not cached themselves.
+    assert "b" not in cache
+
+
+def test_caller_array_untouched(cache):
+    mask = random_mask(0)
+    result = MaskLeaf.from_array(mask).materialize(cache)
+    assert not result.flags.writeable
+    assert mask.flags.writeable
+
+
+def test_shape_mismatch(cache):
+    a = MaskLeaf.from_array(random_mask(0, (4, 4)))
+    b = MaskLeaf.from_array(random_mask(1, (4, 5)))
+    for expr in (a | b, a & b, a - b):
+        with pytest.raises(ValueError, match="shape"):
+            expr.materialize(cache)
+
+
+def test_cache_bounded():
+    cache = MaskCache(max_bytes=1000)
+    for i in range(5):
+        cache[i] = np.zeros(400, dtype=bool)
+    assert len(cache) == 2
+    assert 3 in cache and 4 in cache
+    cache.get(3)
+    cache[5] = np.zeros(400, dtype=bool)
+    assert 3 in cache and 4 not in cache
+    # A single mask larger than the budget is still kept.
+    cache["large"] = np.zeros(2000, dtype=bool)
+    assert list(cache._masks) == ["large"]
+    cache.clear()
+    assert len(cache) == 0
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'masks.db'}")
+    MaskBase.metadata.create_all(engine)
+    with orm.Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def test_from_model_keys(session):
+    detector = DetectorMask("Pilatus2M", random_mask(0))
+    custom = CustomMask(random_mask(1))
+    pending = MaskLeaf.from_model(custom).key
+    assert pending == MaskLeaf.from_model(CustomMask(random_mask(1))).key
+    assert pending != MaskLeaf.from_model(CustomMask(random_mask(2))).key
+    assert MaskLeaf.from_model(detector).key[0] == "detector_masks"
+
+    session.add_all([detector, custom])
+    session.commit()
+    assert MaskLeaf.from_model(custom).key == ("custom_masks", custom.id, 1)
+    custom.mask_data = CustomMask(random_mask(2)).mask_data
+    session.commit()
+    assert MaskLeaf.from_model(custom).key == ("custom_masks", custom.id, 2)
+
+
+def test_composite_mask(session, monkeypatch):
+    cache = MaskCache()
+    monkeypatch.setattr("XSUI.masks.algebra.mask_cache", cache)
+    masks = [random_mask(seed) for seed in range(4)]
+    composite = CompositeMask(
+        DetectorMask("Pilatus2M", masks[0]), [CustomMask(m) for m in masks[1:]]
+    )
+    session.add(composite)
+    session.commit()
+
+    expected = np.logical_or.reduce(masks)
+    np.testing.assert_array_equal(composite.mask, expected)
+    assert composite.mask is composite.mask
+
+    # Updating a member mask changes the key, so the composite is re-evaluated.
+    composite.cust_masks[0].mask_data = CustomMask(~masks[1]).mask_data
+    session.commit()
+    updated = composite.mask
+    np.testing.assert_array_equal(updated, masks[0] | ~masks[1] | masks[2] | masks[3])
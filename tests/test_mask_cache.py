@@ -0,0 +1,100 @@
+import threading
+
+import numpy as np
+
+from XSUI.masks import IncrementalMask, LRUCache, ShapeRasterCache, shapes_mask
+
+SHAPE = (60, 80)
+
+RECT = {"type": "rect", "x0": 5, "y0": 5, "x1": 30, "y1": 20}
+CIRCLE = {"type": "circle", "x0": 20, "y0": 10, "x1": 50, "y1": 40}
+PATH = {"type": "path", "path": "M10,40L70,45L40,58Z"}
+
+
+def base_mask() -> np.ndarray:
+    base = np.zeros(SHAPE, dtype=bool)
+    base[:, -3:] = True
+    return base
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache["a"], cache["b"] = 1, 2
+    assert cache.get("a") == 1
+    cache["c"] = 3
+    assert list(cache) == ["a", "c"]
+    assert cache.get("b", "missing") == "missing"
+
+
+def test_lru_cache_threads():
+    cache = LRUCache(maxsize=8)
+    errors = []
+
+    def work(offset: int) -> None:
+        try:
+            for i in range(2000):
+                key = (offset + i) % 32
+                cache[key] = i
+                cache.get((key + 7) % 32)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(cache) == 8
+    assert all(cache.get(key) is not None for key in list(cache))
+
+
+def test_incremental_mask_matches_full_composition():
+    base = base_mask()
+    composite = IncrementalMask(base)
+    for shapes in ([RECT], [RECT, CIRCLE], [CIRCLE, PATH], [PATH, PATH], [], [RECT]):
+        mask = composite.update(shapes)
+        np.testing.assert_array_equal(mask, shapes_mask(shapes, SHAPE, base.copy()))
+
+
+def test_incremental_mask_overlapping_shapes():
+    composite = IncrementalMask(np.zeros(SHAPE, dtype=bool))
+    composite.update([RECT, CIRCLE])
+    # Removing one of two overlapping shapes keeps the pixels of the other.
+    mask = composite.update([CIRCLE])
+    np.testing.assert_array_equal(mask, shapes_mask([CIRCLE], SHAPE))
+
+
+def test_incremental_mask_relayout():
+    composite = IncrementalMask(np.zeros(SHAPE, dtype=bool))
+    composite.update_from_relayout({"shapes": [RECT, CIRCLE]})
+    mask = composite.update_from_relayout({"shapes[0].x1": 10, "shapes[0].y1": 10})
+    moved = dict(RECT, x1=10, y1=10)
+    np.testing.assert_array_equal(mask, shapes_mask([moved, CIRCLE], SHAPE))
+    # Zooming does not change the mask.
+    zoomed = composite.update_from_relayout({"xaxis.range[0]": 3})
+    np.testing.assert_array_equal(zoomed, mask)
+
+
+def test_incremental_mask_rebase_and_clear():
+    composite = IncrementalMask(np.zeros(SHAPE, dtype=bool))
+    composite.update([RECT])
+    base = base_mask()
+    mask = composite.rebase(base, "base")
+    np.testing.assert_array_equal(mask, shapes_mask([RECT], SHAPE, base.copy()))
+    assert composite.base_key == "base"
+    np.testing.assert_array_equal(composite.clear(), base)
+    assert composite.shapes == []
+
+
+def test_shape_raster_cache():
+    cache = ShapeRasterCache(maxsize=4)
+    key, raster = cache.get(RECT, SHAPE)
+    # Styling does not change the geometry key.
+    styled_key, styled = cache.get(dict(RECT, line={"color": "red"}), SHAPE)
+    assert styled_key == key and styled is raster
+    assert not raster[1].flags.writeable
+    # Shapes outside the image are cached as empty.
+    outside = {"type": "rect", "x0": 200, "y0": 200, "x1": 300, "y1": 300}
+    assert cache.get(outside, SHAPE)[1] is None
+    assert len(cache) == 2
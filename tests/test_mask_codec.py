@@ -0,0 +1,139 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+
+from XSUI.masks.codec import MASK_CODEC_VERSION, decode_mask, encode_mask
+from XSUI.webapp.fastapi.models import (
+    CustomMask,
+    DetectorMask,
+    MaskBase,
+    migrate_mask_tables,
+)
+from XSUI.webapp.fastapi.models.masks import load_legacy_mask
+
+BASELINE_SCHEMA = (
+    """
+    CREATE TABLE detector_masks (
+        id INTEGER NOT NULL,
+        detector_mask BLOB NOT NULL,
+        detector_name VARCHAR(50) NOT NULL,
+        PRIMARY KEY (id)
+    )
+    """,
+    """
+    CREATE TABLE custom_masks (
+        id INTEGER NOT NULL,
+        mask_data BLOB NOT NULL,
+        PRIMARY KEY (id)
+    )
+    """,
+)
+"""The mask tables as created by releases before the mask codec."""
+
+
+def random_mask(shape=(37, 53), dtype=bool, seed=0) -> np.ndarray:
+    return (np.random.default_rng(seed).random(shape) < 0.3).astype(dtype)
+
+
+@pytest.mark.parametrize("shape", [(37, 53), (1, 1), (8, 8), (0, 4), (3, 5, 7)])
+@pytest.mark.parametrize("dtype", [bool, np.uint8, np.int32])
+def test_round_trip(shape, dtype):
+    mask = random_mask(shape, dtype)
+    data, stored_shape, stored_dtype = encode_mask(mask)
+    decoded = decode_mask(data, list(stored_shape), stored_dtype)
+    assert decoded.dtype == np.dtype(dtype)
+    np.testing.assert_array_equal(decoded, mask)
+
+
+def test_nonzero_is_masked():
+    data, shape, _ = encode_mask(np.array([[0, 2], [-1, 0]]))
+    np.testing.assert_array_equal(decode_mask(data, shape), [[0, 1], [1, 0]])
+
+
+def test_compact():
+    # A Pilatus 2M sized mask of module gaps.
+    mask = np.zeros((1679, 1475), dtype=bool)
+    mask[:, 487::494] = True
+    mask[195::212, :] = True
+    data, _, _ = encode_mask(mask)
+    assert len(data) < 50_000
+
+
+def test_invalid():
+    data, shape, dtype = encode_mask(random_mask())
+    with pytest.raises(ValueError, match="version"):
+        decode_mask(data, shape, dtype, MASK_CODEC_VERSION + 1)
+    with pytest.raises(ValueError, match="does not match"):
+        decode_mask(data, (64, 64), dtype)
+
+
+def test_load_legacy_mask():
+    mask = random_mask()
+    np.testing.assert_array_equal(load_legacy_mask(mask.dumps()), mask)
+
+
+@pytest.mark.parametrize("value", [{"mask": 1}, [1, 2], os.system])
+def test_legacy_mask_refuses_other_objects(value):
+    with pytest.raises(pickle.UnpicklingError):
+        load_legacy_mask(pickle.dumps(value))
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.execute(sa.text(statement))
+        connection.execute(
+            sa.text(
+                "INSERT INTO detector_masks (id, detector_mask, detector_name) "
+                "VALUES (1, :data, 'Pilatus2M')"
+            ),
+            {"data": random_mask(seed=1).dumps()},
+        )
+        connection.execute(
+            sa.text("INSERT INTO custom_masks (id, mask_data) VALUES (:id, :data)"),
+            [{"id": i, "data": random_mask(seed=i).dumps()} for i in (2, 3)],
+        )
+    yield engine
+    engine.dispose()
+
+
+def test_migrate(legacy_engine):
+    with legacy_engine.begin() as connection:
+        migrated = migrate_mask_tables(connection)
+        MaskBase.metadata.create_all(connection)
+    assert migrated == ["detector_masks", "custom_masks"]
+    with orm.Session(legacy_engine) as session:
+        detector = session.get(DetectorMask, 1)
+        assert detector.detector_name == "Pilatus2M"
+        np.testing.assert_array_equal(detector.mask, random_mask(seed=1))
+        for i in (2, 3):
+            np.testing.assert_array_equal(
+                session.get(CustomMask, i).mask, random_mask(seed=i)
+            )
+        # Migrated masks remain updatable under the version counter.
+        detector.detector_name = "Pilatus1M"
+        session.commit()
+        assert detector.version == 2
+
+    with legacy_engine.begin() as connection:
+        assert migrate_mask_tables(connection) == []
+
+
+def test_migrate_refuses_pickled_objects(legacy_engine):
+    with legacy_engine.begin() as connection:
+        connection.execute(
+            sa.text("UPDATE custom_masks SET mask_data = :data WHERE id = 3"),
+            {"data": pickle.dumps(os.system)},
+        )
+    with pytest.raises(pickle.UnpicklingError):
+        with legacy_engine.begin() as connection:
+            migrate_mask_tables(connection)
+    # The failed migration leaves the legacy tables unchanged.
+    columns = {c["name"] for c in sa.inspect(legacy_engine).get_columns("custom_masks")}
+    assert "mask_codec" not in columns
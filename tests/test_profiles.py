@@ -0,0 +1,227 @@
+import base64
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from XSUI.webapp.profiles import (
+    MAX_NAMED_CURVES,
+    MAX_PLOT_POINTS,
+    MIN_CURVE_POINTS,
+    TRACE_GROUPS,
+    CurveCache,
+    CurveSet,
+    curve_points,
+    decimate,
+    filter_table,
+    list_reductions,
+    lttb_indices,
+    minmax_indices,
+    typed_array,
+)
+
+
+def profiles(ncurves: int = 5, n: int = 3000) -> tuple[np.ndarray, np.ndarray]:
+    # Noisy decaying backgrounds with a narrow Bragg peak at a different q.
+    rng = np.random.default_rng(0)
+    x = np.linspace(0.1, 30, n)
+    y = 100 * np.exp(-x / 10) + rng.random((ncurves, n))
+    y[np.arange(ncurves), np.linspace(n // 6, n - n // 6, ncurves).astype(int)] += 1000
+    return x, y
+
+
+def lttb_reference(x: np.ndarray, y: np.ndarray, n_points: int) -> list[int]:
+    # A direct, point by point, largest-triangle-three-buckets of one curve.
+    n = len(y)
+    edges = np.linspace(0, n - 2, n_points - 1).astype(int) + 1
+    edges[-1] = n - 1
+    kept = [0]
+    for i in range(n_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        mean_x, mean_y = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        a = kept[-1]
+        areas = [
+            abs((x[a] - mean_x) * (y[j] - y[a]) - (x[a] - x[j]) * (mean_y - y[a]))
+            for j in range(lo, hi)
+        ]
+        kept.append(lo + int(np.argmax(areas)))
+    return kept + [n - 1]
+
+
+def test_typed_array():
+    data = np.array([1.5, np.nan, -2.0])
+    encoded = typed_array(data)
+    assert encoded["dtype"] == "f4"
+    decoded = np.frombuffer(base64.b64decode(encoded["bdata"]), dtype="<f4")
+    np.testing.assert_array_equal(decoded, data.astype(np.float32))
+
+
+def test_minmax():
+    x, y = profiles()
+    indices = minmax_indices(y, 200)
+    assert indices.shape == (5, 202)
+    assert (indices[:, 0] == 0).all() and (indices[:, -1] == 2999).all()
+    assert (np.diff(indices, axis=1) >= 0).all()
+    # Every peak and dip of each bucket is kept.
+    for curve, kept in zip(y, indices):
+        for bucket in np.array_split(np.arange(3000), 100):
+            assert curve[bucket].max() in curve[kept]
+            assert curve[bucket].min() in curve[kept]
+    _, decimated = decimate(x, y, 200)
+    np.testing.assert_array_equal(decimated.max(axis=1), y.max(axis=1))
+    np.testing.assert_array_equal(decimated.min(axis=1), y.min(axis=1))
+
+
+def test_minmax_nan():
+    y = np.arange(10.0)[None].repeat(2, axis=0)
+    y[0, 4:] = np.nan
+    indices = minmax_indices(y, 4)
+    assert (indices < 10).all()
+    assert 3 in indices[0] and 9 in indices[1]
+
+
+@pytest.mark.parametrize("n_points", [3, 10, 257])
+def test_lttb(n_points):
+    x, y = profiles(3, 1000)
+    indices = lttb_indices(x, y, n_points)
+    assert indices.shape == (3, n_points)
+    for curve, kept in zip(y, indices):
+        assert kept.tolist() == lttb_reference(x, curve, n_points)
+    # The Bragg peaks survive decimation to a few hundred points.
+    _, decimated = decimate(x, y, 257, "lttb")
+    np.testing.assert_array_equal(decimated.max(axis=1), y.max(axis=1))
+
+
+def test_lttb_nan():
+    x, y = profiles(2, 500)
+    y[0, 100:200] = np.nan
+    y[1] = np.nan
+    indices = lttb_indices(x, y, 50)
+    assert (np.diff(indices, axis=1) > 0).all()
+    # Only buckets without a finite point keep a NaN point.
+    kept_nan = indices[0][np.isnan(y[0, indices[0]])]
+    assert ((kept_nan >= 100) & (kept_nan < 200)).all()
+
+
+def test_decimate_short():
+    x, y = profiles(2, 50)
+    for method in ("minmax", "lttb"):
+        x_kept, y_kept = decimate(x, y, 100, method)
+        np.testing.assert_array_equal(y_kept, y)
+        np.testing.assert_array_equal(x_kept[1], x)
+    with pytest.raises(ValueError):
+        decimate(x, y, 10, "every-nth")
+
+
+def test_curve_points():
+    assert curve_points(1, 800) == 1600
+    assert curve_points(1) == 2000
+    assert curve_points(2000, 800) == MAX_PLOT_POINTS // 2000
+    assert curve_points(100_000, 800) == MIN_CURVE_POINTS
+
+
+@pytest.fixture
+def curves() -> CurveSet:
+    x, y = profiles(40)
+    y[7] = np.nan
+    source = [f"/data/{'ab'[i % 2]}.h5" for i in range(40)]
+    return CurveSet(x, y, source, np.arange(40) // 2)
+
+
+def test_select(curves):
+    table = curves.table
+    assert list(table.columns) == ["curve", "source", "frame", "maximum", "mean"]
+    assert table.source[0] == "a.h5"
+    assert np.isnan(table.maximum[7])
+    assert filter_table(table, [("source", "contains", "b")]).curve.tolist() == list(
+        range(1, 40, 2)
+    )
+    selected = curves.select([("frame", "ge", 15), ("source", "eq", "a.h5")])
+    assert selected.curve.tolist() == [30, 32, 34, 36, 38]
+    selected = curves.select(sort_by=[("frame", False), ("source", True)])
+    assert selected.curve.tolist()[:4] == [38, 39, 36, 37]
+    for filters in ([("missing", "eq", 1)], [("frame", "like", 1)]):
+        with pytest.raises(ValueError):
+            curves.select(filters)
+    with pytest.raises(ValueError):
+        curves.select(sort_by=[("missing", True)])
+
+
+def decode(trace: dict, axis: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(trace[axis]["bdata"]), dtype="<f4")
+
+
+def test_traces(curves):
+    assert curves.traces([]) == []
+    traces = curves.traces([3, 1], width=100)
+    assert [t["name"] for t in traces] == ["b.h5 #1", "b.h5 #0"]
+    assert all(t["type"] == "scattergl" for t in traces)
+    np.testing.assert_array_equal(
+        decode(traces[0], "y"),
+        decimate(curves.radial, curves.intensity[[3]], 200)[1][0],
+    )
+
+    # Many curves are concatenated into a few traces, separated by NaN gaps.
+    traces = curves.traces(np.arange(40), width=100)
+    assert len(traces) == TRACE_GROUPS > 40 // MAX_NAMED_CURVES
+    assert traces[0]["name"] == "curves 0-3"
+    y = decode(traces[0], "y")
+    assert np.isnan(y).sum() == 3 and len(y) == 4 * 202 + 3
+
+
+def test_traces_zoomed(curves):
+    traces = curves.traces([0], width=100, x_range=(20.0, 10.0))
+    x = decode(traces[0], "x")
+    # The points just outside the range are kept, so the curve reaches the edges.
+    assert x.min() < 10.0 and x.max() > 20.0
+    assert np.count_nonzero((x > 10) & (x < 20)) > 150
+    np.testing.assert_array_equal(x, np.sort(x))
+
+
+def write_reduction(path, ncurves: int = 3):
+    x, y = profiles(ncurves, 100)
+    with h5py.File(path, "w") as f:
+        f["radial"] = x
+        f["intensity"] = y
+        f["source"] = [b"a.edf"] * ncurves
+        f["frame"] = np.arange(ncurves)
+
+
+def test_from_hdf5(tmp_path):
+    write_reduction(tmp_path / "a.h5")
+    curves = CurveSet.from_hdf5(str(tmp_path / "a.h5"))
+    assert len(curves) == 3 and curves.radial.size == 100
+    assert curves.table.frame.tolist() == [0, 1, 2]
+    with h5py.File(tmp_path / "b.h5", "w") as f:
+        f["radial"] = np.arange(10)
+        f["intensity"] = np.zeros((2, 10, 10))
+    with pytest.raises(KeyError):
+        CurveSet.from_hdf5(str(tmp_path / "b.h5"))
+
+
+def test_curve_cache(tmp_path):
+    path = str(tmp_path / "a.h5")
+    write_reduction(path)
+    cache = CurveCache(maxsize=2)
+    curves = cache.get(path)
+    assert cache.get(path) is curves
+    # A live reduction output is read again when it is written to.
+    write_reduction(path, 5)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    assert len(cache.get(path)) == 5
+    assert len(cache) == 2
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_list_reductions(tmp_path):
+    for i, name in enumerate(["a.h5", "b.hdf5", "c.txt", "d.h5"]):
+        (tmp_path / name).touch()
+        os.utime(tmp_path / name, (i, i))
+    assert [os.path.basename(p) for p in list_reductions(str(tmp_path))] == [
+        "d.h5",
+        "b.hdf5",
+        "a.h5",
+    ]
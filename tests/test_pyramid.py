@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from XSUI.storage import image_store
+from XSUI.webapp.pyramid import (
+    TILE_SIZE,
+    ImagePyramid,
+    PyramidCache,
+    downsample,
+)
+from XSUI.webapp.rendering import render_image
+
+
+def image(shape=(600, 1000)) -> np.ndarray:
+    return np.random.default_rng(0).integers(1, 10_000, shape).astype(np.int32)
+
+
+@pytest.mark.parametrize("shape", [(6, 8), (7, 9), (1, 1), (5, 2)])
+def test_downsample(shape):
+    data = image(shape)
+    padded = np.pad(data, ((0, shape[0] % 2), (0, shape[1] % 2)), mode="edge")
+    expected_shape = (-(-shape[0] // 2), -(-shape[1] // 2))
+    for how, reduce in (("max", np.max), ("mean", np.mean)):
+        result = downsample(data, how)
+        assert result.shape == expected_shape
+        for r, c in np.ndindex(*expected_shape):
+            block = padded[2 * r : 2 * r + 2, 2 * c : 2 * c + 2]
+            assert result[r, c] == pytest.approx(reduce(block))
+    with pytest.raises(ValueError):
+        downsample(data, "median")
+
+
+def test_levels():
+    data = image()
+    pyramid = ImagePyramid(data)
+    # The coarsest level of 1000 columns fits in a single 256 pixel tile.
+    assert pyramid.nlevels == 3
+    assert pyramid.shape == (600, 1000)
+    assert pyramid.level(0) is data
+    assert len(pyramid._levels) == 1
+    assert pyramid.level(2).shape == (150, 250)
+    np.testing.assert_array_equal(pyramid.level(1), downsample(data))
+    assert len(pyramid._levels) == 3
+    with pytest.raises(IndexError):
+        pyramid.level(3)
+    assert ImagePyramid(image((100, 200))).nlevels == 1
+
+
+def test_choose_level():
+    pyramid = ImagePyramid(image((4096, 4096)))
+    assert pyramid.nlevels == 5
+    assert pyramid.choose_level(1024, 500) == 0
+    assert pyramid.choose_level(1025, 500) == 1
+    assert pyramid.choose_level(500, 4096) == 2
+    assert pyramid.choose_level(4096, 4096, max_pixels=100) == 4
+
+
+def test_render_region():
+    data = image()
+    pyramid = ImagePyramid(data)
+    # The whole image fits in the display at full resolution.
+    rgba, placement = pyramid.render_region()
+    expected, _ = render_image(data, limits=pyramid.limits)
+    np.testing.assert_array_equal(rgba, expected)
+    assert placement == {"x0": 0, "y0": 0, "dx": 1, "dy": 1, "level": 0}
+
+    rgba, placement = pyramid.render_region(max_pixels=300)
+    assert placement["level"] == 2
+    assert rgba.shape == (150, 250, 4)
+    # Level pixels are centred on the full resolution pixels they cover.
+    assert (placement["x0"], placement["dx"]) == (1.5, 4)
+
+    rgba, placement = pyramid.render_region((120.2, 10.7), (50, 99.5), 300)
+    assert placement["level"] == 0
+    expected, _ = render_image(data[50:100, 11:121], limits=pyramid.limits)
+    np.testing.assert_array_equal(rgba, expected)
+    assert (placement["x0"], placement["y0"]) == (11, 50)
+
+    # Regions outside the image still render a pixel at its edge.
+    rgba, placement = pyramid.render_region((2000, 2100), (-50, -20))
+    assert rgba.shape[:2] == (1, 1)
+    assert (placement["x0"], placement["y0"]) == (999, 0)
+
+
+def test_render_tile():
+    data = image()
+    pyramid = ImagePyramid(data)
+    tile = pyramid.render_tile(0, 1, 3)
+    assert tile.shape == (256, 1000 - 3 * TILE_SIZE, 4)
+    expected, _ = render_image(data[256:512, 768:], limits=pyramid.limits)
+    np.testing.assert_array_equal(tile, expected)
+    assert pyramid.render_tile(2, 0, 0).shape == (150, 250, 4)
+    for n, row, col in [(0, 3, 0), (0, 0, 4), (2, 0, 1), (0, -1, 0)]:
+        with pytest.raises(IndexError):
+            pyramid.render_tile(n, row, col)
+
+
+def test_pyramid_cache():
+    cache = PyramidCache(maxsize=2)
+    key = image_store.put(image((40, 60)))
+    pyramid = cache.get(key)
+    assert cache.get(key) is pyramid
+    assert cache.get(key, "mean") is not pyramid
+    assert len(cache) == 2
+    cache.clear()
+    assert cache.get(key) is not pyramid
+    with pytest.raises(KeyError):
+        cache.get("missing")
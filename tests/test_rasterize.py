@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+from matplotlib.path import Path
+
+from XSUI.masks import (
+    flatten_path,
+    path_mask,
+    polygon_mask,
+    rasterize_ellipse,
+    rasterize_polygons,
+    rasterize_rectangle,
+    shapes_mask,
+)
+
+SHAPE = (90, 120)
+
+
+def reference_mask(polygons: list[np.ndarray], shape: tuple[int, int]) -> np.ndarray:
+    """The pixel centres inside polygons by `matplotlib`, with the even-odd rule."""
+    rows, cols = np.indices(shape)
+    points = np.column_stack([cols.ravel(), rows.ravel()])
+    inside = np.zeros(points.shape[0], dtype=bool)
+    for polygon in polygons:
+        inside ^= Path(polygon).contains_points(points)
+    return inside.reshape(shape)
+
+
+def random_polygon(rng: np.random.Generator, n: int) -> np.ndarray:
+    """A star-shaped polygon, with vertices off the pixel centres."""
+    angles = np.sort(rng.uniform(0, 2 * np.pi, n))
+    radii = rng.uniform(5, 45, n)
+    centre = rng.uniform([20, 20], [100, 70])
+    vertices = (
+        centre + np.column_stack([np.cos(angles), np.sin(angles)]) * radii[:, None]
+    )
+    return vertices + 0.0137
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_polygon_parity(seed):
+    rng = np.random.default_rng(seed)
+    polygon = random_polygon(rng, rng.integers(3, 40))
+    np.testing.assert_array_equal(
+        polygon_mask(polygon, SHAPE), reference_mask([polygon], SHAPE)
+    )
+
+
+def test_self_intersecting_polygon():
+    # A pentagram, whose centre is outside by the even-odd rule.
+    angles = np.pi / 2 + np.arange(5) * 4 * np.pi / 5
+    star = np.column_stack([60 + 40 * np.cos(angles), 45 + 40 * np.sin(angles)]) + 0.01
+    mask = polygon_mask(star, SHAPE)
+    assert not mask[45, 60]
+    np.testing.assert_array_equal(mask, reference_mask([star], SHAPE))
+
+
+def test_polygons_even_odd():
+    outer = np.array([[10.5, 10.5], [80.5, 10.5], [80.5, 70.5], [10.5, 70.5]])
+    hole = np.array([[30.5, 30.5], [50.5, 30.5], [50.5, 50.5], [30.5, 50.5]])
+    mask = polygon_mask([outer, hole], SHAPE)
+    assert mask[20, 20] and not mask[40, 40]
+    np.testing.assert_array_equal(mask, reference_mask([outer, hole], SHAPE))
+
+
+def test_clipped_polygon():
+    polygon = np.array([[-20.3, -10.7], [150.2, 40.1], [30.9, 130.6]])
+    np.testing.assert_array_equal(
+        polygon_mask(polygon, SHAPE), reference_mask([polygon], SHAPE)
+    )
+    outside = np.array([[200.5, 200.5], [220.5, 200.5], [210.5, 230.5]])
+    assert rasterize_polygons([outside], SHAPE) is None
+
+
+def test_bounding_box():
+    polygon = np.array([[20.5, 30.5], [40.5, 30.5], [30.5, 50.5]])
+    (rows, cols), sub_mask = rasterize_polygons([polygon], SHAPE)
+    assert (rows, cols) == (slice(31, 51), slice(21, 41))
+    assert sub_mask.shape == (20, 20)
+
+
+def test_path_parity():
+    path = "M10.3,10.2L100.7,20.1L60.4,80.9Z"
+    polygons = flatten_path(path)
+    assert len(polygons) == 1
+    np.testing.assert_array_equal(
+        path_mask(path, SHAPE), reference_mask(polygons, SHAPE)
+    )
+
+
+def test_curved_path():
+    # A circle of two arcs, flattened to within the tolerance of the curve.
+    path = "M30.5,45.5A30,30 0 0 1 90.5,45.5A30,30 0 0 1 30.5,45.5Z"
+    (polygon,) = flatten_path(path, tolerance=0.25)
+    radii = np.hypot(polygon[:, 0] - 60.5, polygon[:, 1] - 45.5)
+    np.testing.assert_allclose(radii, 30, atol=1e-6)
+    np.testing.assert_array_equal(
+        path_mask(path, SHAPE), reference_mask([polygon], SHAPE)
+    )
+    rows, cols = np.indices(SHAPE)
+    disc = np.hypot(cols - 60.5, rows - 45.5) <= 29.9
+    assert np.all(path_mask(path, SHAPE)[disc])
+
+
+def full_image_rectangle(x0, y0, x1, y1, shape):
+    rows, cols = np.indices(shape)
+    return (
+        (rows >= min(y0, y1))
+        & (rows <= max(y0, y1))
+        & (cols >= min(x0, x1))
+        & (cols <= max(x0, x1))
+    )
+
+
+def full_image_ellipse(x0, y0, x1, y1, shape):
+    rows, cols = np.indices(shape)
+    rx, ry = abs(x1 - x0) / 2, abs(y1 - y0) / 2
+    dx = (cols - (x0 + x1) / 2) / rx
+    dy = (rows - (y0 + y1) / 2) / ry
+    return dx**2 + dy**2 <= 1
+
+
+CORNERS = [
+    (10, 20, 40, 60),
+    (40.5, 60.2, 10.7, 20.1),
+    (-15, -5, 30, 25),
+    (100, 70, 150, 120),
+    (33.3, 12.9, 34.1, 13.2),
+]
+
+
+@pytest.mark.parametrize("corners", CORNERS)
+def test_rectangle_parity(corners):
+    mask = shapes_mask(
+        [dict(zip(("x0", "y0", "x1", "y1"), corners), type="rect")], SHAPE
+    )
+    np.testing.assert_array_equal(mask, full_image_rectangle(*corners, SHAPE))
+
+
+@pytest.mark.parametrize("corners", CORNERS)
+def test_ellipse_parity(corners):
+    shape = dict(zip(("x0", "y0", "x1", "y1"), corners), type="circle")
+    np.testing.assert_array_equal(
+        shapes_mask([shape], SHAPE), full_image_ellipse(*corners, SHAPE)
+    )
+
+
+def test_shapes_outside_the_image():
+    assert rasterize_rectangle(200, 200, 300, 300, SHAPE) is None
+    assert rasterize_ellipse(-50, -50, -10, -10, SHAPE) is None
+    # Degenerate ellipses cover no pixels.
+    assert rasterize_ellipse(10, 10, 10, 40, SHAPE) is None
+    (rows, cols), sub_mask = rasterize_rectangle(10.5, 20.5, 15.5, 22.5, SHAPE)
+    assert (rows, cols) == (slice(21, 23), slice(11, 16))
+    assert sub_mask.all()
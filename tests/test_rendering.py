@@ -0,0 +1,124 @@
+import base64
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from XSUI.webapp.rendering import (
+    colour_limits,
+    colour_lut,
+    encode_image,
+    encode_mask_image,
+    image_data_uri,
+    mask_data_uri,
+    pixel_value,
+    render_image,
+    scale_values,
+)
+
+
+def decode(data: bytes) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(data)))
+
+
+def test_colour_lut():
+    lut = colour_lut("inferno")
+    assert lut.shape == (256, 3) and lut.dtype == np.uint8
+    assert not lut.flags.writeable
+    np.testing.assert_array_equal(lut[0], [0, 0, 4])
+    np.testing.assert_array_equal(lut[-1], [252, 255, 164])
+    assert colour_lut("inferno") is lut
+    assert colour_lut("viridis", 16).shape == (16, 3)
+
+
+def test_scale_values():
+    data = np.array([[100, 10], [0, -5]])
+    with np.errstate(all="raise"):
+        scaled = scale_values(data)
+    np.testing.assert_allclose(scaled, [[2, 1], [np.nan, np.nan]], rtol=1e-6)
+    assert scaled.dtype == np.float32
+    np.testing.assert_array_equal(scale_values(data, log=False), data)
+
+
+def test_colour_limits():
+    values = np.arange(1001, dtype=np.float32)
+    values[:10] = np.nan
+    assert colour_limits(values, (0, 100)) == (10.0, 1000.0)
+    vmin, vmax = colour_limits(values, (10, 90))
+    assert vmin == pytest.approx(109) and vmax == pytest.approx(901)
+    # Large images are sampled, giving nearly the same limits.
+    large = np.random.default_rng(0).random(4_000_000, dtype=np.float32)
+    vmin, vmax = colour_limits(large, max_samples=1000)
+    assert vmin == pytest.approx(0.01, abs=0.01)
+    assert vmax == pytest.approx(0.998, abs=0.01)
+    assert colour_limits(np.full(4, np.nan)) == (0.0, 1.0)
+    assert colour_limits(np.ones(4, np.float32)) == (1.0, 2.0)
+
+
+def test_render_image():
+    data = np.random.default_rng(0).integers(-10, 10_000, (30, 40))
+    rgba, (vmin, vmax) = render_image(data)
+    assert rgba.shape == (30, 40, 4) and rgba.dtype == np.uint8
+
+    # A direct (unvectorized) colour-mapping of the valid pixels.
+    lut = colour_lut()
+    valid = data > 0
+    indices = (np.log10(data[valid]) - vmin) * 255 / (vmax - vmin)
+    indices = np.rint(np.clip(indices, 0, 255)).astype(int)
+    np.testing.assert_array_equal(rgba[valid, :3], lut[indices])
+    assert (rgba[valid, 3] == 255).all()
+    assert (rgba[~valid] == 0).all()
+
+
+def test_render_limits():
+    data = np.array([[1.0, 10.0, 100.0, 1000.0]])
+    rgba, limits = render_image(data, limits=(1.0, 2.0))
+    assert limits == (1.0, 2.0)
+    lut = colour_lut()
+    np.testing.assert_array_equal(rgba[0, :, :3], lut[[0, 0, 255, 255]])
+    rgba, _ = render_image(data, log=False, limits=(0.0, 1000.0))
+    np.testing.assert_array_equal(rgba[0, :, :3], lut[[0, 3, 26, 255]])
+
+
+@pytest.mark.parametrize("fmt", ["png", "webp"])
+def test_encode_image(fmt):
+    rgba, _ = render_image(np.random.default_rng(0).integers(0, 100, (30, 40)))
+    np.testing.assert_array_equal(decode(encode_image(rgba, fmt)), rgba)
+    uri = image_data_uri(rgba, fmt)
+    prefix = f"data:image/{fmt};base64,"
+    assert uri.startswith(prefix)
+    np.testing.assert_array_equal(decode(base64.b64decode(uri[len(prefix) :])), rgba)
+    with pytest.raises(ValueError):
+        encode_image(rgba, "gif")
+
+
+def test_pixel_value():
+    data = np.arange(12).reshape(3, 4)
+    assert pixel_value(data, 2, 1) == 6
+    assert pixel_value(data, 2.4, 0.6) == 6
+    assert pixel_value(data, 3.4, 2.4) == 11
+    for x, y in [(-1, 0), (4, 0), (0, 3), (0, -0.6)]:
+        assert pixel_value(data, x, y) is None
+
+
+@pytest.mark.parametrize("shape", [(30, 40), (7, 13), (1, 1)])
+def test_encode_mask_image(shape):
+    mask = np.random.default_rng(0).random(shape) < 0.3
+    image = Image.open(io.BytesIO(encode_mask_image(mask, (10, 20, 30))))
+    assert image.mode in ("1", "P")
+    rgba = np.asarray(image.convert("RGBA"))
+    np.testing.assert_array_equal(rgba[..., 3] == 255, mask)
+    assert (rgba[..., 3][~mask] == 0).all()
+    assert (rgba[mask, :3] == (10, 20, 30)).all()
+
+
+def test_mask_image_compact():
+    # A Pilatus 2M sized mask of module gaps encodes to a few kilobytes.
+    mask = np.zeros((1679, 1475), dtype=bool)
+    mask[:, 487::494] = True
+    mask[195::212, :] = True
+    assert len(encode_mask_image(mask)) < 10_000
+    uri = mask_data_uri(mask.astype(np.uint8))
+    assert uri.startswith("data:image/png;base64,")
+    assert base64.b64decode(uri[22:]) == encode_mask_image(mask)
@@ -0,0 +1,113 @@
+import os
+import shutil
+
+import pytest
+
+from XSUI.experiment.watch import INOTIFY_AVAILABLE, DirectoryWatcher, SeenFiles
+
+OLD = 946684800
+"""A modification time well before the watcher starts (2000-01-01)."""
+
+MODES = [
+    True,
+    pytest.param(
+        False, marks=pytest.mark.skipif(not INOTIFY_AVAILABLE, reason="no inotify")
+    ),
+]
+
+
+def write(path, data: bytes = b"frame", mtime: int | None = None) -> str:
+    with open(path, "wb") as f:
+        f.write(data)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def collect(watcher: DirectoryWatcher, n: int, timeout: float = 5.0) -> set[str]:
+    paths = set()
+    while len(paths) < n:
+        path = watcher.get(timeout=timeout)
+        if path is None:
+            break
+        paths.add(path)
+    return paths
+
+
+@pytest.mark.parametrize("poll", MODES)
+def test_existing_files_are_skipped(tmp_path, poll):
+    write(tmp_path / "old.edf", mtime=OLD)
+    with DirectoryWatcher(
+        str(tmp_path), poll=poll, poll_interval=0.05, settle=0.05
+    ) as w:
+        new = write(tmp_path / "new.edf")
+        assert collect(w, 2, timeout=1.0) == {new}
+
+
+@pytest.mark.parametrize("poll", MODES)
+def test_existing_files_are_processed(tmp_path, poll):
+    old = write(tmp_path / "old.edf", mtime=OLD)
+    with DirectoryWatcher(
+        str(tmp_path),
+        poll=poll,
+        poll_interval=0.05,
+        settle=0.05,
+        process_existing=True,
+    ) as w:
+        assert collect(w, 1) == {old}
+
+
+@pytest.mark.parametrize("poll", MODES)
+def test_preserved_modification_times(tmp_path, poll):
+    staging = tmp_path / "staging"
+    staging.mkdir()
+    watched = tmp_path / "watched"
+    watched.mkdir()
+    source = write(staging / "source.edf", mtime=OLD)
+    moved = write(staging / "moved.edf", mtime=OLD)
+    with DirectoryWatcher(
+        str(watched), pattern="*.edf", poll=poll, poll_interval=0.05, settle=0.05
+    ) as w:
+        # As `cp -p`/`rsync -a`, and `mv` from a staging directory.
+        copied = shutil.copy2(source, watched / "copied.edf")
+        os.replace(moved, watched / "moved.edf")
+        # As detector software setting the time of a written file.
+        written = write(watched / "written.edf", mtime=OLD)
+        expected = {str(copied), str(watched / "moved.edf"), written}
+        assert collect(w, 3) == expected
+
+
+@pytest.mark.parametrize("poll", MODES)
+def test_files_are_queued_once(tmp_path, poll):
+    with DirectoryWatcher(
+        str(tmp_path), poll=poll, poll_interval=0.05, settle=0.05
+    ) as w:
+        path = write(tmp_path / "a.edf")
+        assert collect(w, 1) == {path}
+        assert w.get(timeout=0.3) is None
+        # Rewritten files are queued again.
+        write(tmp_path / "a.edf", b"rewritten frame")
+        assert collect(w, 1) == {path}
+
+
+def test_ignored_files(tmp_path):
+    with DirectoryWatcher(
+        str(tmp_path), pattern="*.edf", poll=True, poll_interval=0.05, settle=0.05
+    ) as w:
+        write(tmp_path / "a.edf.part")
+        write(tmp_path / ".a.edf")
+        write(tmp_path / "a.txt")
+        assert w.get(timeout=0.3) is None
+
+
+def test_seen_files_eviction():
+    seen = SeenFiles(maxsize=2)
+    for i in range(3):
+        seen.add(f"{i}.edf", (i, 10, 100 + i))
+    assert len(seen) == 2
+    assert seen.watermark == 100
+    # Evicted files are still seen unless they changed since.
+    assert ("0.edf", (0, 10, 100)) in seen
+    assert ("0.edf", (0, 10, 150)) not in seen
+    assert ("2.edf", (2, 10, 102)) in seen
+    assert ("2.edf", (2, 20, 102)) not in seen